@@ -167,6 +167,60 @@ def create_app(config_class=None):
     csrf.init_app(app)
     if cache is not None:
         cache.init_app(app)
+    # وضع أداء SQLite (WAL وغيره) عند SQLITE_PERFORMANCE=1
+    try:
+        from app.sqlite_tuning import register_sqlite_tuning
+        register_sqlite_tuning(app)
+    except Exception:
+        pass
+    # إبطال لقطات إقرار الضريبة عند تعديل فاتورة في ربع منتهٍ
+    try:
+        from services.vat_return import register_snapshot_listeners
+        register_snapshot_listeners()
+    except Exception:
+        pass
+    # إبطال خريطة الوصفات (استهلاك المخزون عند البيع) عند تعديل الوجبات
+    try:
+        from services.recipe_depletion import register_recipe_listeners
+        register_recipe_listeners()
+    except Exception:
+        pass
+    # فهرس سداد الفواتير: تحديث المسدد/المتبقي عند commit الدفعات والقيود المرتبطة بفواتير
+    try:
+        from services.invoice_settlement import register_settlement_listeners
+        register_settlement_listeners()
+    except Exception:
+        pass
+    # سجل الحسابات لبُناة القيود: إبطال عند تعديل الحسابات أو خريطة الاستخدام
+    try:
+        from services.account_registry import register_account_registry_listeners
+        register_account_registry_listeners()
+    except Exception:
+        pass
+    # LRU مخزن AppKV: إبطال عند أي تعديل على app_kv
+    try:
+        from services.kv_store import register_kv_listeners
+        register_kv_listeners()
+    except Exception:
+        pass
+    # وسوم كاش التقارير (gl, coa, settings, ...): رفع الإصدار عند commit
+    try:
+        from services.cache_tags import register_cache_tag_listeners
+        register_cache_tag_listeners()
+    except Exception:
+        pass
+    # كاش أعمار الذمم: إبطال عند تغيّر فهرس السداد
+    try:
+        from services.aging import register_aging_listeners
+        register_aging_listeners()
+    except Exception:
+        pass
+    # ملخص الرواتب الشهري: تحديث الاستحقاق/المدفوع عند commit المسيرات ودفعات الرواتب
+    try:
+        from services.payroll_summary import register_payroll_summary_listeners
+        register_payroll_summary_listeners()
+    except Exception:
+        pass
     # Exempt API routes from CSRF
     csrf.exempt('main.api_table_layout')
     # Exempt bulk salary receipt print (HTML POST not sensitive)
@@ -305,132 +359,29 @@ def create_app(config_class=None):
     except Exception:
         pass
 
-    # Ensure tables exist on startup (SQLite only)
-    try:
-        with app.app_context():
-            db.create_all()
-            try:
-                from sqlalchemy import text
-                with db.engine.connect() as conn:
-                    cols = conn.execute(text("PRAGMA table_info('suppliers')")).fetchall()
-                    col_names = {str(c[1]).lower() for c in cols}
-                    if 'payment_method' not in col_names:
-                        conn.execute(text("ALTER TABLE suppliers ADD COLUMN payment_method VARCHAR(20) DEFAULT 'CASH'"))
-                        conn.commit()
-                    cols_pi = conn.execute(text("PRAGMA table_info('purchase_invoices')")).fetchall()
-                    col_names_pi = {str(c[1]).lower() for c in cols_pi}
-                    if 'supplier_invoice_number' not in col_names_pi:
-                        conn.execute(text("ALTER TABLE purchase_invoices ADD COLUMN supplier_invoice_number VARCHAR(100)"))
-                        conn.commit()
-                    if 'notes' not in col_names_pi:
-                        conn.execute(text("ALTER TABLE purchase_invoices ADD COLUMN notes TEXT"))
-                        conn.commit()
-            except Exception:
-                pass
-            # Lightweight auto-migration for SQLite: add missing columns and indexes
+    # المخطط: الجداول والأعمدة القديمة تُصلَح بأمر لمرة واحدة (flask ensure-schema / run_migrations.py)
+    # وليس مع بدء كل عامل؛ محلياً يمكن تفعيلها عند البدء بـ ENSURE_SCHEMA_ON_STARTUP=1
+    from app.schema_fixups import ensure_schema, register_schema_command
+    register_schema_command(app)
+    if app.config.get('ENSURE_SCHEMA_ON_STARTUP'):
         try:
-            from sqlalchemy import text
-            with db.engine.connect() as conn:
-                # Check if supplier_invoice_number column exists
-                try:
-                    rows = conn.execute(text("PRAGMA table_info(purchase_invoices)")).fetchall()
-                    names = {str(r[1]).lower() for r in rows}
-                    if 'supplier_invoice_number' not in names:
-                        conn.execute(text("ALTER TABLE purchase_invoices ADD COLUMN supplier_invoice_number TEXT"))
-                        conn.commit()
-                except Exception:
-                    pass
-                # Create indexes for SQLite
-                try:
-                    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_payments_type_invoice ON payments (invoice_type, invoice_id)"))
-                    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales_invoices (created_at)"))
-                    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_purchases_created_at ON purchase_invoices (created_at)"))
-                    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_expenses_created_at ON expense_invoices (created_at)"))
-                    conn.commit()
-                except Exception:
-                    pass
-                # Ensure settings table has all model columns (fix "no such column" on save)
-                try:
-                    from models import Settings
-                    existing = set()
-                    try:
-                        ri = conn.execute(text("PRAGMA table_info(settings)")).fetchall()
-                        existing = {str(r[1]).lower() for r in ri}
-                    except Exception:
-                        pass
-                    for col in Settings.__table__.c:
-                        c = col.key
-                        if c.lower() in existing:
-                            continue
-                        t = type(col.type).__name__
-                        if "Int" in t or "Bool" in t:
-                            sqltyp = "INTEGER"
-                        elif "Numeric" in t or "Float" in t or "Real" in t:
-                            sqltyp = "REAL"
-                        else:
-                            sqltyp = "TEXT"
-                        try:
-                            conn.execute(text("ALTER TABLE settings ADD COLUMN %s %s" % (c, sqltyp)))
-                            conn.commit()
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
+            with app.app_context():
+                ensure_schema()
         except Exception:
             pass
-            if ext_db is not None:
-                try:
-                    ext_db.create_all()
-                except Exception:
-                    pass
-            # Ensure customers table has required columns on PostgreSQL (e.g. Render when migration didn't run)
-            try:
-                from sqlalchemy import text
-                conn = db.session.connection()
-                if conn.dialect.name == 'postgresql':
-                    for stmt in [
-                        "ALTER TABLE customers ADD COLUMN IF NOT EXISTS customer_type VARCHAR(20) DEFAULT 'cash'",
-                        "ALTER TABLE customers ADD COLUMN IF NOT EXISTS discount_percent NUMERIC(5,2) DEFAULT 0",
-                        "ALTER TABLE customers ADD COLUMN IF NOT EXISTS active BOOLEAN DEFAULT true",
-                        "ALTER TABLE customers ADD COLUMN IF NOT EXISTS created_at TIMESTAMP",
-                    ]:
-                        try:
-                            db.session.execute(text(stmt))
-                            db.session.commit()
-                        except Exception:
-                            db.session.rollback()
-                    # Ensure journal_lines has columns required by JournalLine model (cash_flow, etc.)
-                    for stmt in [
-                        "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS line_date DATE DEFAULT CURRENT_DATE",
-                        "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS employee_id INTEGER",
-                        "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS invoice_id INTEGER",
-                        "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS invoice_type VARCHAR(20)",
-                    ]:
-                        try:
-                            db.session.execute(text(stmt))
-                            db.session.commit()
-                        except Exception:
-                            db.session.rollback()
-                    # Ensure accounts has name_ar/name_en for seed_official and COA
-                    for stmt in [
-                        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS name_ar VARCHAR(200)",
-                        "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS name_en VARCHAR(200)",
-                    ]:
-                        try:
-                            db.session.execute(text(stmt))
-                            db.session.commit()
-                        except Exception:
-                            db.session.rollback()
-            except Exception:
-                pass
-    except Exception:
-        pass
-    try:
-        with app.app_context():
+    # أسماء/أنواع الحسابات من القاعدة: مرة واحدة لكل عامل عند أول طلب (لا اتصال بالقاعدة أثناء البدء)
+    _chart_state = {'loaded': False}
+
+    @app.before_request
+    def _load_chart_once():
+        if _chart_state['loaded']:
+            return
+        _chart_state['loaded'] = True
+        try:
             from app.routes import refresh_chart_from_db
             refresh_chart_from_db()
-    except Exception:
-        pass
+        except Exception:
+            pass
     try:
         from logging_setup import setup_logging
         setup_logging(app)
@@ -448,5 +399,20 @@ def create_app(config_class=None):
 
     return app
 
-# Export a ready-to-use app instance for test clients and simple scripts
-app = create_app()
+
+# نسخة جاهزة (from app import app / gunicorn app:app) تُنشأ عند أول وصول فقط وليس عند استيراد الحزمة،
+# فاستيراد app.routes أو app.models من السكربتات والعمال لا يبني تطبيقاً إضافياً
+_default_app = None
+
+
+def get_app():
+    global _default_app
+    if _default_app is None:
+        _default_app = create_app()
+    return _default_app
+
+
+def __getattr__(name):
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -195,69 +195,9 @@ def api_employee_pay_salary_bulk():
             emp_ids = [int(e.id) for e in Employee.query.all()]
         else:
             emp_ids = [int(x) for x in ids_raw.split(',') if x.strip().isdigit()]
-        success = 0; failed = 0
-        for emp_id in emp_ids:
-            try:
-                with db.session.begin_nested():
-                    sal = _ensure_salary(emp_id, year, month)
-                    if not sal:
-                        failed += 1
-                        continue
-                    already = float(db.session.query(db.func.coalesce(db.func.sum(Payment.amount_paid), 0))
-                                    .filter(Payment.invoice_type=='salary', Payment.invoice_id==sal.id).scalar() or 0.0)
-                    remaining = max(0.0, float(sal.total_salary or 0.0) - already)
-                    pay_val = amount_per if remaining <= 0 or amount_per <= remaining else remaining
-                    if pay_val <= 0:
-                        failed += 1; continue
-                    p = Payment(invoice_id=sal.id, invoice_type='salary', amount_paid=pay_val,
-                                payment_method=method, payment_date=get_saudi_now())
-                    db.session.add(p); db.session.flush()
-                    cash_acc = _pm_account(method)
-                    try:
-                        from app.routes import SHORT_TO_NUMERIC, CHART_OF_ACCOUNTS
-                        liab_code = SHORT_TO_NUMERIC['PAYROLL_LIAB'][0]
-                        _post_ledger_safe(get_saudi_now().date(), liab_code, CHART_OF_ACCOUNTS[liab_code]['name'], 'liability', pay_val, 0.0, f'PAY SAL {year}-{month} EMP {emp_id}')
-                        if cash_acc:
-                            _post_ledger_safe(get_saudi_now().date(), cash_acc.code, cash_acc.name, 'asset', 0.0, pay_val, f'PAY SAL {year}-{month} EMP {emp_id}')
-                    except Exception:
-                        pass
-                    try:
-                        from app.routes import SHORT_TO_NUMERIC
-                        liab_code = SHORT_TO_NUMERIC['PAYROLL_LIAB'][0]
-                        liab_acc = Account.query.filter_by(code=liab_code).first()
-                        if liab_acc and cash_acc:
-                            je = JournalEntry(
-                                entry_number=f"JE-SALPAY-{int(sal.id)}",
-                                date=get_saudi_now().date(),
-                                branch_code=None,
-                                description=f"Salary payment {year}-{month} EMP {emp_id}",
-                                status='posted',
-                                total_debit=pay_val,
-                                total_credit=pay_val,
-                                created_by=getattr(current_user, 'id', None),
-                                posted_by=getattr(current_user, 'id', None),
-                                salary_id=int(sal.id)
-                            )
-                            db.session.add(je); db.session.flush()
-                            db.session.add(JournalLine(journal_id=je.id, line_no=1, account_id=int(liab_acc.id), debit=pay_val, credit=0.0, description='Payroll liability', line_date=get_saudi_now().date(), employee_id=int(emp_id)))
-                            db.session.add(JournalLine(journal_id=je.id, line_no=2, account_id=int(cash_acc.id), debit=0.0, credit=pay_val, description='Cash/Bank', line_date=get_saudi_now().date(), employee_id=int(emp_id)))
-                    except Exception:
-                        try:
-                            db.session.rollback()
-                        except Exception:
-                            pass
-                    # Update status for bulk item
-                    already += pay_val
-                    total = float(sal.total_salary or 0.0)
-                    if total > 0 and already >= total:
-                        sal.status = 'paid'
-                    elif already > 0:
-                        sal.status = 'partial'
-                    else:
-                        sal.status = 'due'
-                    success += 1
-            except Exception:
-                failed += 1
+        from services.payroll_engine import pay_month_bulk
+        res = pay_month_bulk(emp_ids, year, month, amount_per, method, user_id=getattr(current_user, 'id', None))
+        success = res['success_count']; failed = res['failed_count']
         db.session.commit()
         current_app.logger.info(f"Bulk salary paid: month={year}-{month} success={success} failed={failed}")
         return jsonify({'ok': True, 'success_count': success, 'failed_count': failed})
@@ -19,6 +19,7 @@ from models import User
 from models import OrderInvoice
 from models import MenuCategory, MenuItem, SalesInvoice, SalesInvoiceItem, Customer, PurchaseInvoice, PurchaseInvoiceItem, ExpenseInvoice, ExpenseInvoiceItem, Settings, Meal, MealIngredient, RawMaterial, Supplier, Employee, Salary, Payment, EmployeeSalaryDefault, DepartmentRate, EmployeeHours, Account, AccountUsageMap, LedgerEntry, JournalEntry, JournalLine, JournalAudit
 from models import get_saudi_now, KSA_TZ
+from utils.request_context import current_settings
 from forms import SalesInvoiceForm, EmployeeForm, ExpenseInvoiceForm, PurchaseInvoiceForm, MealForm, RawMaterialForm
 
 main = Blueprint('main', __name__)
@@ -46,7 +47,7 @@ def payroll_detailed():
 
 
 # Phase 2: shared helpers from routes.common (no accounts/settings/permissions here)
-from routes.common import kv_get, kv_set, BRANCH_LABELS, safe_table_number, user_can
+from routes.common import kv_get, kv_get_many, kv_set, BRANCH_LABELS, safe_table_number, user_can
 
 # Safe helper: current time in Saudi Arabia timezone
 try:
@@ -759,23 +760,33 @@ def api_jobs_monthly_reconcile():
         return jsonify({'ok': False, 'error': str(e)}), 500
 
 
-# Warmup DB only once per process to avoid heavy create_all/seed on hot paths
+# Set by schema_fixups.warmup() (gunicorn master / flask warmup / POST /admin/warmup); workers inherit it
 _DB_WARMED_UP = False
 
 def warmup_db_once():
+    """شاشات الإدارة فقط: فحص علَم لا يلمس القاعدة. المخطط وترحيل البيانات من flask ensure-schema/warmup
+    أو run_migrations.py أو /admin/warmup — وإن لم تُشغَّل في هذا العامل يُسجَّل تنبيه مرة واحدة فقط.
+    طلبات نقطة البيع لا تستدعيها."""
     global _DB_WARMED_UP
     if _DB_WARMED_UP:
         return
+    _DB_WARMED_UP = True
     try:
-        ensure_tables()
-        ensure_purchaseinvoice_compat_columns()
-        seed_menu_if_empty()
-        seed_chart_of_accounts()
+        current_app.logger.info("warmup not run in this worker; use 'flask warmup' or POST /admin/warmup after deploy")
     except Exception:
-        # ignore errors to avoid blocking requests
         pass
-    finally:
-        _DB_WARMED_UP = True
+
+
+@main.route('/admin/warmup', methods=['POST'], endpoint='admin_warmup')
+@login_required
+def admin_warmup():
+    """تحضير القاعدة يدوياً بعد النشر: المخطط + القائمة وشجرة الحسابات الافتراضية (للمدير)."""
+    u = current_user
+    if not ((getattr(u, 'username', '') == 'admin') or (getattr(u, 'id', None) == 1) or (getattr(u, 'role', '') == 'admin')):
+        return jsonify({'ok': False, 'error': 'forbidden'}), 403
+    from app.schema_fixups import warmup
+    steps = warmup()
+    return jsonify({'ok': not any('failed' in s for s in steps), 'steps': steps})
 
 @main.route('/')
 @login_required
@@ -1135,7 +1146,10 @@ def invoices_delete():
             if scope == 'selected' and ids:
                 q = q.filter(SalesInvoice.id.in_(ids))
             rows = q.all()
+            from services.recipe_depletion import reverse_depletion
             for inv in rows:
+                # إعادة المواد المستهلكة للمخزون قبل حذف الفاتورة
+                reverse_depletion(inv.id, user_id=getattr(current_user, 'id', None))
                 try:
                     SalesInvoiceItem.query.filter_by(invoice_id=inv.id).delete(synchronize_session=False)
                 except Exception:
@@ -1287,6 +1301,8 @@ def employee_delete(eid=None):
             except Exception:
                 pass
             Salary.query.filter(Salary.id.in_(sal_ids)).delete(synchronize_session=False)
+            from services.payroll_summary import mark_payroll_dirty
+            mark_payroll_dirty(sal_ids)
         try:
             EmployeeSalaryDefault.query.filter_by(employee_id=eid).delete(synchronize_session=False)
         except Exception:
@@ -1432,186 +1448,10 @@ def salaries_pay():
             else:
                 employee_ids = [int(emp_id_raw)]
 
-            created_payment_ids = []
-
-            # FIFO distribute payment across arrears -> current -> advance
-            if amount > 0:
-                # Build ordered list of months from hire date up to current month
-                def _start_from(emp_id: int):
-                    try:
-                        emp_obj = Employee.query.get(emp_id)
-                    except Exception:
-                        emp_obj = None
-                    sy, sm = year, month
-                    try:
-                        if getattr(emp_obj, 'hire_date', None):
-                            sy = int(emp_obj.hire_date.year)
-                            sm = int(emp_obj.hire_date.month)
-                    except Exception:
-                        pass
-                    return sy, sm
-                # helper iterate months
-                def month_iter(y0, m0, y1, m1):
-                    y, m = y0, m0
-                    cnt = 0
-                    while (y < y1) or (y == y1 and m <= m1):
-                        yield y, m
-                        m += 1
-                        if m > 12:
-                            m = 1; y += 1
-                        cnt += 1
-                        if cnt > 240:
-                            break
-                for _emp_id in employee_ids:
-                    remaining_payment = float(amount or 0)
-                    start_y, start_m = _start_from(_emp_id)
-                    for yy, mm in month_iter(start_y, start_m, year, month):
-                        row = Salary.query.filter_by(employee_id=_emp_id, year=yy, month=mm).first()
-                        if not row:
-                            base = allow = ded = 0.0
-                            try:
-                                from models import EmployeeSalaryDefault, DepartmentRate, EmployeeHours
-                                d = EmployeeSalaryDefault.query.filter_by(employee_id=_emp_id).first()
-                                allow = float(getattr(d, 'allowances', 0) or 0)
-                                ded = float(getattr(d, 'deductions', 0) or 0)
-                                hrs_row = EmployeeHours.query.filter_by(employee_id=_emp_id, year=yy, month=mm).first()
-                                emp_o = Employee.query.get(_emp_id)
-                                dept_name = (getattr(emp_o, 'department', '') or '').lower()
-                                rate_row = DepartmentRate.query.filter(DepartmentRate.name == dept_name).first()
-                                hourly_rate = float(getattr(rate_row, 'hourly_rate', 0) or 0)
-                                try:
-                                    from app.models import AppKV
-                                    kv = AppKV.get(f"emp_settings:{int(_emp_id)}") or {}
-                                    kv_type = str(kv.get('salary_type','') or '').lower()
-                                    kv_rate = float(kv.get('hourly_rate') or 0.0)
-                                    if kv_rate > 0:
-                                        hourly_rate = kv_rate
-                                    if kv_type == 'hourly':
-                                        hour_based_base = float(getattr(hrs_row, 'hours', 0) or 0) * hourly_rate if hrs_row else 0.0
-                                        base = float(hour_based_base or 0.0)
-                                    else:
-                                        base = float(getattr(d, 'base_salary', 0) or 0)
-                                except Exception:
-                                    hour_based_base = float(getattr(hrs_row, 'hours', 0) or 0) * hourly_rate if hrs_row else 0.0
-                                    default_base = float(getattr(d, 'base_salary', 0) or 0)
-                                    base = hour_based_base if hour_based_base > 0 else default_base
-                            except Exception:
-                                pass
-                            prev_component = 0.0
-                            total_amount = max(0.0, base + allow - ded + prev_component)
-                            row = Salary(employee_id=_emp_id, year=yy, month=mm,
-                                         basic_salary=base, allowances=allow, deductions=ded,
-                                         previous_salary_due=prev_component, total_salary=total_amount,
-                                         status='due')
-                            db.session.add(row)
-                            db.session.flush()
-                        already_paid = float(db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).
-                            filter(Payment.invoice_type=='salary', Payment.invoice_id==row.id).scalar() or 0.0)
-                        month_due = max(0.0, float(row.total_salary or 0) - already_paid)
-                        if month_due <= 0:
-                            row.status = 'paid'
-                            continue
-                        if remaining_payment <= 0:
-                            break
-                        pay_amount = remaining_payment if remaining_payment < month_due else month_due
-                        if pay_amount > 0:
-                            p = Payment(invoice_id=row.id, invoice_type='salary', amount_paid=pay_amount, payment_method=method)
-                            db.session.add(p)
-                            db.session.flush()
-                            try:
-                                from models import JournalEntry, JournalLine
-                                cash_acc = _pm_account(method)
-                                pay_liab = _account(*SHORT_TO_NUMERIC['PAYROLL_LIAB'])
-                                je = JournalEntry(entry_number=f"JE-SALPAY-{row.id}", date=get_saudi_now().date(), branch_code=None, description=f"Salary payment {row.year}-{row.month} EMP {row.employee_id}", status='posted', total_debit=pay_amount, total_credit=pay_amount, created_by=getattr(current_user,'id',None), posted_by=getattr(current_user,'id',None), salary_id=row.id)
-                                db.session.add(je); db.session.flush()
-                                db.session.add(JournalLine(journal_id=je.id, line_no=1, account_id=pay_liab.id, debit=pay_amount, credit=0, description='Payroll liability', line_date=get_saudi_now().date(), employee_id=row.employee_id))
-                                if cash_acc:
-                                    db.session.add(JournalLine(journal_id=je.id, line_no=2, account_id=cash_acc.id, debit=0, credit=pay_amount, description='Cash/Bank', line_date=get_saudi_now().date(), employee_id=row.employee_id))
-                                db.session.commit()
-                            except Exception:
-                                db.session.rollback()
-                            try:
-                                cash_acc = _pm_account(method)
-                                # Clear liability on payment: DR Payroll Liabilities, CR Cash/Bank
-                                _post_ledger(get_saudi_now().date(), 'PAYROLL_LIAB', 'مستحقات رواتب الموظفين', 'liability', pay_amount, 0.0, f'PAY SAL {row.year}-{row.month} EMP {row.employee_id}')
-                                if cash_acc:
-                                    _post_ledger(get_saudi_now().date(), cash_acc.code, cash_acc.name, 'asset', 0.0, pay_amount, f'PAY SAL {row.year}-{row.month} EMP {row.employee_id}')
-                            except Exception:
-                                pass
-                            try:
-                                created_payment_ids.append(int(p.id))
-                            except Exception:
-                                pass
-                            remaining_payment -= pay_amount
-                            already_paid += pay_amount
-                            if already_paid >= float(row.total_salary or 0) and float(row.total_salary or 0) > 0:
-                                row.status = 'paid'
-                            else:
-                                row.status = 'partial'
-                    if remaining_payment > 0:
-                        adv_y = year + (1 if month == 12 else 0)
-                        adv_m = 1 if month == 12 else month + 1
-                        adv_row = Salary.query.filter_by(employee_id=_emp_id, year=adv_y, month=adv_m).first()
-                        if not adv_row:
-                            base = allow = ded = 0.0
-                            try:
-                                from models import EmployeeSalaryDefault
-                                d = EmployeeSalaryDefault.query.filter_by(employee_id=_emp_id).first()
-                                if d:
-                                    base = float(d.base_salary or 0)
-                                    allow = float(d.allowances or 0)
-                                    ded = float(d.deductions or 0)
-                            except Exception:
-                                pass
-                            adv_row = Salary(employee_id=_emp_id, year=adv_y, month=adv_m,
-                                             basic_salary=base, allowances=allow, deductions=ded,
-                                             previous_salary_due=0.0,
-                                             total_salary=max(0.0, base + allow - ded), status='partial')
-                            db.session.add(adv_row)
-                            db.session.flush()
-                        p2 = Payment(invoice_id=adv_row.id, invoice_type='salary', amount_paid=remaining_payment, payment_method=method)
-                        db.session.add(p2)
-                        db.session.flush()
-                        try:
-                            cash_acc = _pm_account(method)
-                            # Record employee advance: DR Employee Advances (asset), CR Cash/Bank
-                            _post_ledger(get_saudi_now().date(), 'EMP_ADV', 'سلف للموظفين', 'asset', remaining_payment, 0.0, f'ADV EMP {adv_row.employee_id} {adv_row.year}-{adv_row.month}')
-                            if cash_acc:
-                                _post_ledger(get_saudi_now().date(), cash_acc.code, cash_acc.name, 'asset', 0.0, remaining_payment, f'ADV EMP {adv_row.employee_id} {adv_row.year}-{adv_row.month}')
-                            try:
-                                from models import JournalEntry, JournalLine
-                                emp_adv_acc = _account(*SHORT_TO_NUMERIC['EMP_ADV'])
-                                je2 = JournalEntry(entry_number=f"JE-ADV-{adv_row.employee_id}-{adv_row.year}{adv_row.month:02d}", date=get_saudi_now().date(), branch_code=None, description=f"Employee advance {adv_row.employee_id} {adv_row.year}-{adv_row.month}", status='posted', total_debit=remaining_payment, total_credit=remaining_payment, created_by=getattr(current_user,'id',None), posted_by=getattr(current_user,'id',None), salary_id=adv_row.id)
-                                db.session.add(je2); db.session.flush()
-                                db.session.add(JournalLine(journal_id=je2.id, line_no=1, account_id=emp_adv_acc.id, debit=remaining_payment, credit=0, description='Employee advance', line_date=get_saudi_now().date(), employee_id=adv_row.employee_id))
-                                if cash_acc:
-                                    db.session.add(JournalLine(journal_id=je2.id, line_no=2, account_id=cash_acc.id, debit=0, credit=remaining_payment, description='Cash/Bank', line_date=get_saudi_now().date(), employee_id=adv_row.employee_id))
-                                db.session.commit()
-                            except Exception:
-                                db.session.rollback()
-                        except Exception:
-                            pass
-                        try:
-                            created_payment_ids.append(int(p2.id))
-                        except Exception:
-                            pass
-
-            # Recompute current month sal status for immediate UI feedback
-            # Recompute status for the current salary of the first employee (for UI feedback)
-            try:
-                first_emp = employee_ids[0]
-                sal = Salary.query.filter_by(employee_id=first_emp, year=year, month=month).first() or _ensure_salary_for(first_emp)
-                paid_sum = float(db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).
-                    filter(Payment.invoice_type == 'salary', Payment.invoice_id == sal.id).scalar() or 0)
-                total_due = float(sal.total_salary or 0)
-                if paid_sum >= total_due and total_due > 0:
-                    sal.status = 'paid'
-                elif paid_sum > 0:
-                    sal.status = 'partial'
-                else:
-                    sal.status = 'due'
-            except Exception:
-                pass
+            # FIFO distribute payment across arrears -> current -> advance (grouped loads, one commit)
+            from services.payroll_engine import pay_fifo
+            payments = pay_fifo(employee_ids, year, month, amount, method, user_id=getattr(current_user, 'id', None))
+            created_payment_ids = [int(p.id) for p in payments]
 
             db.session.commit()
             success_msg = _('تم تسجيل السداد')
@@ -1837,138 +1677,19 @@ def salaries_statements():
         year = request.args.get('year', type=int) or get_saudi_now().year
         month = request.args.get('month', type=int) or get_saudi_now().month
 
-    from sqlalchemy import func
+    from services.payroll_summary import ensure_payroll_summaries, salary_statement_rows, statement_totals
     rows = []
-    totals = {'basic': 0.0, 'allow': 0.0, 'ded': 0.0, 'prev': 0.0, 'total': 0.0, 'paid': 0.0, 'remaining': 0.0}
-
     try:
-        # Load all employees to always show everyone
-        employees = Employee.query.order_by(Employee.full_name.asc()).all()
-
-        # Defaults map
-        try:
-            from models import EmployeeSalaryDefault
-            defaults_map = {d.employee_id: d for d in EmployeeSalaryDefault.query.all()}
-        except Exception:
-            defaults_map = {}
-
-        # Helper month iterator
-        def month_iter(y0, m0, y1, m1):
-            y, m = y0, m0
-            cnt = 0
-            while (y < y1) or (y == y1 and m <= m1):
-                yield y, m
-                m += 1
-                if m > 12:
-                    m = 1; y += 1
-                cnt += 1
-                if cnt > 240:
-                    break
-
-        for emp in (employees or []):
-            # Determine start month
-            if getattr(emp, 'hire_date', None):
-                y0, m0 = int(emp.hire_date.year), int(emp.hire_date.month)
-            else:
-                y0, m0 = year, month
-
-            # Build dues per month from hire date to current
-            dues_map = {}
-            month_keys = []
-            sal_ids = []
-            for yy, mm in month_iter(y0, m0, year, month):
-                month_keys.append((yy, mm))
-                srow = Salary.query.filter_by(employee_id=emp.id, year=yy, month=mm).first()
-                if srow:
-                    base = float(srow.basic_salary or 0.0)
-                    allow = float(srow.allowances or 0.0)
-                    ded = float(srow.deductions or 0.0)
-                    due_amt = max(0.0, base + allow - ded)
-                    sal_ids.append(int(srow.id))
-                else:
-                    d = defaults_map.get(int(emp.id))
-                    base = float(getattr(d, 'base_salary', 0.0) or 0.0)
-                    allow = float(getattr(d, 'allowances', 0.0) or 0.0)
-                    ded = float(getattr(d, 'deductions', 0.0) or 0.0)
-                    due_amt = max(0.0, base + allow - ded)
-                dues_map[(yy, mm)] = {'base': base, 'allow': allow, 'ded': ded, 'due': due_amt}
-
-            # Total payments recorded across all months for this employee
-            total_paid_all = 0.0
-            if sal_ids:
-                total_paid_all = float(db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0))
-                                       .filter(Payment.invoice_type == 'salary', Payment.invoice_id.in_(sal_ids))
-                                       .scalar() or 0.0)
-
-            # FIFO allocation: previous months first, then current
-            remaining_payment = total_paid_all
-            # previous months
-            prev_due_sum = 0.0
-            prev_paid_alloc = 0.0
-            for yy, mm in month_keys[:-1]:
-                due_amt = float(dues_map[(yy, mm)]['due'] or 0.0)
-                prev_due_sum += due_amt
-                if remaining_payment <= 0:
-                    continue
-                pay = due_amt if remaining_payment >= due_amt else remaining_payment
-                prev_paid_alloc += pay
-                remaining_payment -= pay
-
-            # current month
-            c_base = float(dues_map[(year, month)]['base'] or 0.0)
-            c_allow = float(dues_map[(year, month)]['allow'] or 0.0)
-            c_ded = float(dues_map[(year, month)]['ded'] or 0.0)
-            c_due = float(dues_map[(year, month)]['due'] or 0.0)
-            c_paid_alloc = 0.0
-            if remaining_payment > 0 and c_due > 0:
-                c_paid_alloc = c_due if remaining_payment >= c_due else remaining_payment
-                remaining_payment -= c_paid_alloc
-
-            prev_remaining = max(0.0, prev_due_sum - prev_paid_alloc)
-            total = max(0.0, c_due + prev_remaining)
-            paid_display = c_paid_alloc
-            remaining_total = max(0.0, total - paid_display)
-
-            status = 'paid' if (total > 0 and remaining_total <= 0.01) else ('partial' if paid_display > 0 else ('paid' if total == 0 else 'due'))
-
-            rows.append({
-                'employee_id': int(emp.id),
-                'employee_name': emp.full_name,
-                'basic': c_base,
-                'allow': c_allow,
-                'ded': c_ded,
-                'prev': prev_remaining,
-                'total': total,
-                'paid': paid_display,
-                'remaining': remaining_total,
-                'status': status,
-                'prev_details': []
-            })
-            totals['basic'] += c_base
-            totals['allow'] += c_allow
-            totals['ded'] += c_ded
-            totals['prev'] += prev_remaining
-            totals['total'] += total
-            totals['paid'] += paid_display
-            totals['remaining'] += remaining_total
+        if ensure_payroll_summaries():
+            db.session.commit()
+        rows = salary_statement_rows(year, month)
+        for r in rows:
+            r['prev_details'] = []
     except Exception:
         pass
-
-    # Apply optional status filter after computing per-employee rows
     if status_f in ('paid','due','partial'):
-        try:
-            rows = [r for r in rows if (str(r.get('status') or '').lower() == status_f)]
-            totals = {
-                'basic': sum(float(r.get('basic') or 0) for r in rows),
-                'allow': sum(float(r.get('allow') or 0) for r in rows),
-                'ded': sum(float(r.get('ded') or 0) for r in rows),
-                'prev': sum(float(r.get('prev') or 0) for r in rows),
-                'total': sum(float(r.get('total') or 0) for r in rows),
-                'paid': sum(float(r.get('paid') or 0) for r in rows),
-                'remaining': sum(float(r.get('remaining') or 0) for r in rows),
-            }
-        except Exception:
-            pass
+        rows = [r for r in rows if (str(r.get('status') or '').lower() == status_f)]
+    totals = statement_totals(rows)
 
     return ('', 404)
 
@@ -1990,124 +1711,17 @@ def api_salaries_statements():
     else:
         year = request.args.get('year', type=int) or get_saudi_now().year
         month = request.args.get('month', type=int) or get_saudi_now().month
-    from sqlalchemy import func
+    from services.payroll_summary import ensure_payroll_summaries, salary_statement_rows, statement_totals
     rows = []
-    totals = {'basic': 0.0, 'allow': 0.0, 'ded': 0.0, 'prev': 0.0, 'total': 0.0, 'paid': 0.0, 'remaining': 0.0}
     try:
-        employees_q = Employee.query.order_by(Employee.full_name.asc())
-        if dept_f:
-            employees_q = employees_q.filter(func.lower(Employee.department) == dept_f.lower())
-        employees = employees_q.all()
-        try:
-            from models import EmployeeSalaryDefault
-            defaults_map = {d.employee_id: d for d in EmployeeSalaryDefault.query.all()}
-        except Exception:
-            defaults_map = {}
-        def month_iter(y0, m0, y1, m1):
-            y, m = y0, m0
-            cnt = 0
-            while (y < y1) or (y == y1 and m <= m1):
-                yield y, m
-                m += 1
-                if m > 12:
-                    m = 1; y += 1
-                cnt += 1
-                if cnt > 240:
-                    break
-        for emp in (employees or []):
-            if emp_id_f and int(emp.id) != int(emp_id_f):
-                continue
-            if getattr(emp, 'hire_date', None):
-                y0, m0 = int(emp.hire_date.year), int(emp.hire_date.month)
-            else:
-                y0, m0 = year, month
-            dues_map = {}
-            month_keys = []
-            sal_ids = []
-            for yy, mm in month_iter(y0, m0, year, month):
-                month_keys.append((yy, mm))
-                srow = Salary.query.filter_by(employee_id=emp.id, year=yy, month=mm).first()
-                if srow:
-                    base = float(srow.basic_salary or 0.0)
-                    allow = float(srow.allowances or 0.0)
-                    ded = float(srow.deductions or 0.0)
-                    due_amt = max(0.0, base + allow - ded)
-                    sal_ids.append(int(srow.id))
-                else:
-                    d = defaults_map.get(int(emp.id))
-                    base = float(getattr(d, 'base_salary', 0.0) or 0.0)
-                    allow = float(getattr(d, 'allowances', 0.0) or 0.0)
-                    ded = float(getattr(d, 'deductions', 0.0) or 0.0)
-                    due_amt = max(0.0, base + allow - ded)
-                dues_map[(yy, mm)] = {'base': base, 'allow': allow, 'ded': ded, 'due': due_amt}
-            total_paid_all = 0.0
-            if sal_ids:
-                total_paid_all = float(db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0))
-                                       .filter(Payment.invoice_type == 'salary', Payment.invoice_id.in_(sal_ids))
-                                       .scalar() or 0.0)
-            remaining_payment = total_paid_all
-            prev_due_sum = 0.0
-            prev_paid_alloc = 0.0
-            for yy, mm in month_keys[:-1]:
-                due_amt = float(dues_map[(yy, mm)]['due'] or 0.0)
-                prev_due_sum += due_amt
-                if remaining_payment <= 0:
-                    continue
-                pay = due_amt if remaining_payment >= due_amt else remaining_payment
-                prev_paid_alloc += pay
-                remaining_payment -= pay
-            c_base = float(dues_map[(year, month)]['base'] or 0.0)
-            c_allow = float(dues_map[(year, month)]['allow'] or 0.0)
-            c_ded = float(dues_map[(year, month)]['ded'] or 0.0)
-            c_due = float(dues_map[(year, month)]['due'] or 0.0)
-            c_paid_alloc = 0.0
-            if remaining_payment > 0 and c_due > 0:
-                c_paid_alloc = c_due if remaining_payment >= c_due else remaining_payment
-                remaining_payment -= c_paid_alloc
-            prev_remaining = max(0.0, prev_due_sum - prev_paid_alloc)
-            total = max(0.0, c_due + prev_remaining)
-            paid_display = c_paid_alloc
-            remaining_total = max(0.0, total - paid_display)
-            status = 'paid' if (total > 0 and remaining_total <= 0.01) else ('partial' if paid_display > 0 else ('paid' if total == 0 else 'due'))
-            row = {
-                'employee_id': int(emp.id),
-                'employee_name': emp.full_name,
-                'month_label': f"{year:04d}-{month:02d}",
-                'year': year,
-                'month': month,
-                'basic': c_base,
-                'allow': c_allow,
-                'ded': c_ded,
-                'prev': prev_remaining,
-                'total': total,
-                'paid': paid_display,
-                'remaining': remaining_total,
-                'status': status
-            }
-            rows.append(row)
-            totals['basic'] += c_base
-            totals['allow'] += c_allow
-            totals['ded'] += c_ded
-            totals['prev'] += prev_remaining
-            totals['total'] += total
-            totals['paid'] += paid_display
-            totals['remaining'] += remaining_total
+        if ensure_payroll_summaries():
+            db.session.commit()
+        rows = salary_statement_rows(year, month, department=dept_f, employee_id=emp_id_f)
     except Exception:
         pass
     if status_f in ('paid','due','partial'):
-        try:
-            rows = [r for r in rows if (str(r.get('status') or '').lower() == status_f)]
-            totals = {
-                'basic': sum(float(r.get('basic') or 0) for r in rows),
-                'allow': sum(float(r.get('allow') or 0) for r in rows),
-                'ded': sum(float(r.get('ded') or 0) for r in rows),
-                'prev': sum(float(r.get('prev') or 0) for r in rows),
-                'total': sum(float(r.get('total') or 0) for r in rows),
-                'paid': sum(float(r.get('paid') or 0) for r in rows),
-                'remaining': sum(float(r.get('remaining') or 0) for r in rows),
-            }
-        except Exception:
-            pass
+        rows = [r for r in rows if (str(r.get('status') or '').lower() == status_f)]
+    totals = statement_totals(rows)
     return jsonify({'ok': True, 'year': year, 'month': month, 'rows': rows, 'totals': totals})
 
 @main.route('/api/salaries/upsert', methods=['POST'], endpoint='api_salaries_upsert')
@@ -3068,9 +2682,10 @@ def api_dept_rates_get():
     try:
         rows = DepartmentRate.query.order_by(DepartmentRate.name.asc()).all()
         data = []
+        hours_kv = kv_get_many(f"dept_hours:{(r.name or '').strip().lower()}" for r in rows)
         for r in rows:
             name = (r.name or '').strip().lower()
-            mh_raw = kv_get(f"dept_hours:{name}", None)
+            mh_raw = hours_kv.get(f"dept_hours:{name}")
             mh = 0.0
             try:
                 if isinstance(mh_raw, dict):
@@ -3944,6 +3559,8 @@ def settings():
                 _set_acc('REV_CT', 'acc_rev_ct')
                 _set_acc('REV_PI', 'acc_rev_pi')
                 kv_set('acc_map', acc_map)
+                from services.platform_config import invalidate_platform_config
+                invalidate_platform_config()
             except Exception:
                 pass
 
@@ -3972,6 +3589,10 @@ def settings():
                     else:
                         platforms.append(entry)
                     kv_set('platforms_map', platforms)
+                    from services.platform_config import invalidate_platform_config
+                    invalidate_platform_config()
+                    from services.sales_channel import reclassify_channels
+                    reclassify_channels()
             except Exception:
                 pass
 
@@ -4033,9 +3654,13 @@ def users():
     except Exception:
         users_list = []
     # Populate 'active' per user from AppKV (default True)
+    try:
+        active_kv = kv_get_many(f"user_active:{u.id}" for u in users_list)
+    except Exception:
+        active_kv = {}
     for u in users_list:
         try:
-            info = kv_get(f"user_active:{u.id}", {'active': True}) or {}
+            info = active_kv.get(f"user_active:{u.id}", {'active': True}) or {}
             setattr(u, 'active', bool(info.get('active', True)))
         except Exception:
             setattr(u, 'active', True)
@@ -4099,192 +3724,28 @@ def vat_dashboard():
 
     # VAT rate and header info from Settings
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
     vat_rate = float(getattr(s, 'vat_rate', 15) or 15) / 100.0
 
-    # SALES: category breakdown (based on tax_amount presence)
-    sales_standard_base = sales_standard_vat = sales_standard_total = 0.0
-    sales_zero_base = sales_zero_vat = sales_zero_total = 0.0
-    sales_exempt_base = sales_exempt_vat = sales_exempt_total = 0.0
-    sales_exports_base = sales_exports_vat = sales_exports_total = 0.0
-
-    if hasattr(SalesInvoice, 'total_before_tax') and hasattr(SalesInvoice, 'tax_amount') and hasattr(SalesInvoice, 'total_after_tax_discount') and hasattr(SalesInvoice, 'date'):
-        q_sales = db.session.query(SalesInvoice).filter(SalesInvoice.date.between(start_date, end_date))
-        if hasattr(SalesInvoice, 'branch') and branch in ('place_india', 'china_town'):
-            q_sales = q_sales.filter(SalesInvoice.branch == branch)
-
-        # Standard rated: tax_amount > 0
-        sales_standard_base = float((db.session
-            .query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0))
-            .filter(SalesInvoice.date.between(start_date, end_date))
-            .filter((SalesInvoice.tax_amount > 0))
-            .filter((SalesInvoice.branch == branch) if hasattr(SalesInvoice, 'branch') and branch in ('place_india','china_town') else True)
-            .scalar() or 0.0))
-        sales_standard_vat = float((db.session
-            .query(func.coalesce(func.sum(SalesInvoice.tax_amount), 0))
-            .filter(SalesInvoice.date.between(start_date, end_date))
-            .filter((SalesInvoice.tax_amount > 0))
-            .filter((SalesInvoice.branch == branch) if hasattr(SalesInvoice, 'branch') and branch in ('place_india','china_town') else True)
-            .scalar() or 0.0))
-        sales_standard_total = float((db.session
-            .query(func.coalesce(func.sum(SalesInvoice.total_after_tax_discount), 0))
-            .filter(SalesInvoice.date.between(start_date, end_date))
-            .filter((SalesInvoice.tax_amount > 0))
-            .filter((SalesInvoice.branch == branch) if hasattr(SalesInvoice, 'branch') and branch in ('place_india','china_town') else True)
-            .scalar() or 0.0))
-
-        # Zero rated: tax_amount == 0 (we cannot distinguish exempt/exports without extra fields)
-        sales_zero_base = float((db.session
-            .query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0))
-            .filter(SalesInvoice.date.between(start_date, end_date))
-            .filter((SalesInvoice.tax_amount == 0))
-            .filter((SalesInvoice.branch == branch) if hasattr(SalesInvoice, 'branch') and branch in ('place_india','china_town') else True)
-            .scalar() or 0.0))
-        sales_zero_vat = 0.0
-        sales_zero_total = float((db.session
-            .query(func.coalesce(func.sum(SalesInvoice.total_after_tax_discount), 0))
-            .filter(SalesInvoice.date.between(start_date, end_date))
-            .filter((SalesInvoice.tax_amount == 0))
-            .filter((SalesInvoice.branch == branch) if hasattr(SalesInvoice, 'branch') and branch in ('place_india','china_town') else True)
-            .scalar() or 0.0))
-
-        # Optional split of zero-tax sales into exempt vs exports using keyword mapping (AppKV)
-        try:
-            m = kv_get('vat_category_map', {}) or {}
-            exempt_kw = [str(x).strip().lower() for x in (m.get('exempt_keywords') or []) if str(x).strip()]
-            export_kw = [str(x).strip().lower() for x in (m.get('exports_keywords') or []) if str(x).strip()]
-            zero_kw = [str(x).strip().lower() for x in (m.get('zero_keywords') or []) if str(x).strip()]
-            q_items = (
-                db.session.query(SalesInvoiceItem, SalesInvoice)
-                .join(SalesInvoice, SalesInvoiceItem.invoice_id == SalesInvoice.id)
-                .filter(SalesInvoice.date.between(start_date, end_date))
-            )
-            if hasattr(SalesInvoice, 'branch') and branch in ('place_india','china_town'):
-                q_items = q_items.filter(SalesInvoice.branch == branch)
-            for it, inv_row in q_items.all():
-                name = (getattr(it, 'product_name', '') or '').strip().lower()
-                qty = float(getattr(it, 'quantity', 0) or 0)
-                price = float(getattr(it, 'price_before_tax', 0) or 0)
-                disc = float(getattr(it, 'discount', 0) or 0)
-                tax = float(getattr(it, 'tax', 0) or 0)
-                base = max(0.0, (price * qty) - disc)
-                if tax > 0:
-                    sales_standard_base += base
-                    sales_standard_vat += tax
-                    sales_standard_total += (base + tax)
-                else:
-                    cat = 'zero'
-                    if name and export_kw and any(kw in name for kw in export_kw):
-                        cat = 'exports'
-                    elif name and exempt_kw and any(kw in name for kw in exempt_kw):
-                        cat = 'exempt'
-                    elif name and zero_kw and any(kw in name for kw in zero_kw):
-                        cat = 'zero'
-                    if cat == 'exports':
-                        sales_exports_base += base
-                        sales_exports_vat += 0.0
-                        sales_exports_total += base
-                    elif cat == 'exempt':
-                        sales_exempt_base += base
-                        sales_exempt_vat += 0.0
-                        sales_exempt_total += base
-                    else:
-                        sales_zero_base += base
-                        sales_zero_vat += 0.0
-                        sales_zero_total += base
-        except Exception:
-            pass
+    # كل خانات الإقرار بمرور واحد لكل جدول؛ الأرباع المنتهية من اللقطة المحفوظة
+    from services.vat_return import get_vat_return
+    boxes = get_vat_return(start_date, end_date, branch)
 
-    # PURCHASES & EXPENSES: combine into deductible vs non-deductible
-    purchases_deductible_base = purchases_deductible_vat = purchases_deductible_total = 0.0
-    purchases_non_deductible_base = purchases_non_deductible_vat = purchases_non_deductible_total = 0.0
-
-    try:
-        # Purchases (items)
-        # Deductible: items with tax > 0
-        p_ded_base = db.session.query(func.coalesce(func.sum(PurchaseInvoiceItem.total_price - PurchaseInvoiceItem.tax), 0)) \
-            .join(PurchaseInvoice, PurchaseInvoiceItem.invoice_id == PurchaseInvoice.id) \
-            .filter(PurchaseInvoice.date.between(start_date, end_date)) \
-            .filter(PurchaseInvoiceItem.tax > 0).scalar() or 0.0
-        p_ded_vat = db.session.query(func.coalesce(func.sum(PurchaseInvoiceItem.tax), 0)) \
-            .join(PurchaseInvoice, PurchaseInvoiceItem.invoice_id == PurchaseInvoice.id) \
-            .filter(PurchaseInvoice.date.between(start_date, end_date)) \
-            .filter(PurchaseInvoiceItem.tax > 0).scalar() or 0.0
-        # Non-deductible: items with tax == 0
-        p_nd_base = db.session.query(func.coalesce(func.sum(PurchaseInvoiceItem.total_price), 0)) \
-            .join(PurchaseInvoice, PurchaseInvoiceItem.invoice_id == PurchaseInvoice.id) \
-            .filter(PurchaseInvoice.date.between(start_date, end_date)) \
-            .filter(PurchaseInvoiceItem.tax == 0).scalar() or 0.0
-
-        # Expenses
-        e_ded_base = db.session.query(func.coalesce(func.sum(ExpenseInvoice.total_before_tax), 0)) \
-            .filter(ExpenseInvoice.date.between(start_date, end_date)) \
-            .filter(ExpenseInvoice.tax_amount > 0).scalar() or 0.0
-        e_ded_vat = db.session.query(func.coalesce(func.sum(ExpenseInvoice.tax_amount), 0)) \
-            .filter(ExpenseInvoice.date.between(start_date, end_date)) \
-            .filter(ExpenseInvoice.tax_amount > 0).scalar() or 0.0
-        e_nd_base = db.session.query(func.coalesce(func.sum(ExpenseInvoice.total_before_tax), 0)) \
-            .filter(ExpenseInvoice.date.between(start_date, end_date)) \
-            .filter(ExpenseInvoice.tax_amount == 0).scalar() or 0.0
-
-        purchases_deductible_base = float(p_ded_base or 0.0) + float(e_ded_base or 0.0)
-        purchases_deductible_vat = float(p_ded_vat or 0.0) + float(e_ded_vat or 0.0)
-        purchases_deductible_total = purchases_deductible_base + purchases_deductible_vat
-
-        purchases_non_deductible_base = float(p_nd_base or 0.0) + float(e_nd_base or 0.0)
-        purchases_non_deductible_vat = 0.0
-        purchases_non_deductible_total = purchases_non_deductible_base
-    except Exception:
-        purchases_deductible_base = purchases_deductible_vat = purchases_deductible_total = 0.0
-        purchases_non_deductible_base = purchases_non_deductible_vat = purchases_non_deductible_total = 0.0
-
-    # Summary
-    output_vat = float(sales_standard_vat or 0.0)
-    # Include deductible expenses VAT in input VAT
-    input_vat = float(purchases_deductible_vat or 0.0)
-    net_vat = output_vat - input_vat
-
-    data = {
+    data = dict(boxes)
+    data.update({
         'period': period,
         'year': y,
         'quarter': q,
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat(),
         'branch': branch,
-        # Sales breakdown
-        'sales_standard_base': float(sales_standard_base or 0.0),
-        'sales_standard_vat': float(sales_standard_vat or 0.0),
-        'sales_standard_total': float(sales_standard_total or 0.0),
-        'sales_zero_base': float(sales_zero_base or 0.0),
-        'sales_zero_vat': float(sales_zero_vat or 0.0),
-        'sales_zero_total': float(sales_zero_total or 0.0),
-        'sales_exempt_base': float(sales_exempt_base or 0.0),
-        'sales_exempt_vat': float(sales_exempt_vat or 0.0),
-        'sales_exempt_total': float(sales_exempt_total or 0.0),
-        'sales_exports_base': float(sales_exports_base or 0.0),
-        'sales_exports_vat': float(sales_exports_vat or 0.0),
-        'sales_exports_total': float(sales_exports_total or 0.0),
-        # Purchases/Expenses breakdown (combined)
-        'purchases_deductible_base': float(purchases_deductible_base or 0.0),
-        'purchases_deductible_vat': float(purchases_deductible_vat or 0.0),
-        'purchases_deductible_total': float(purchases_deductible_total or 0.0),
-        'purchases_non_deductible_base': float(purchases_non_deductible_base or 0.0),
-        'purchases_non_deductible_total': float(purchases_non_deductible_total or 0.0),
-        # Expenses breakdown (explicit rows)
-        'expenses_deductible_base': float(e_ded_base or 0.0),
-        'expenses_deductible_vat': float(e_ded_vat or 0.0),
-        'expenses_non_deductible_base': float(e_nd_base or 0.0),
-        # Summary
-        'output_vat': float(output_vat or 0.0),
-        'input_vat': float(input_vat or 0.0),
-        'net_vat': float(net_vat or 0.0),
         # Header info
         'company_name': (getattr(s, 'company_name', '') or ''),
         'tax_number': (getattr(s, 'tax_number', '') or ''),
         'vat_rate': vat_rate,
-    }
+    })
 
     return render_template('vat/vat_dashboard.html', data=data)
 
@@ -4312,30 +3773,11 @@ def vat_print():
     from datetime import timedelta as _td
     end_date = end_date - _td(days=1)
 
-    # Aggregate totals safely across possible model variants
-    sales_place_india = 0
-    sales_china_town = 0
-
-    try:
-        if hasattr(SalesInvoice, 'total_amount') and hasattr(SalesInvoice, 'created_at') and hasattr(SalesInvoice, 'branch_code'):
-            # Simplified POS model (app.models)
-            sales_place_india = db.session.query(func.coalesce(func.sum(SalesInvoice.total_amount), 0)) \
-                .filter(SalesInvoice.branch_code == 'place_india') \
-                .filter(SalesInvoice.created_at.between(start_date, end_date)).scalar()
-            sales_china_town = db.session.query(func.coalesce(func.sum(SalesInvoice.total_amount), 0)) \
-                .filter(SalesInvoice.branch_code == 'china_town') \
-                .filter(SalesInvoice.created_at.between(start_date, end_date)).scalar()
-        elif hasattr(SalesInvoice, 'total_before_tax') and hasattr(SalesInvoice, 'date') and hasattr(SalesInvoice, 'branch'):
-            # Rich model (models.py)
-            sales_place_india = db.session.query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0)) \
-                .filter(SalesInvoice.branch == 'place_india') \
-                .filter(SalesInvoice.date.between(start_date, end_date)).scalar()
-            sales_china_town = db.session.query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0)) \
-                .filter(SalesInvoice.branch == 'china_town') \
-                .filter(SalesInvoice.date.between(start_date, end_date)).scalar()
-    except Exception:
-        sales_place_india = 0
-        sales_china_town = 0
+    # Aggregate totals in one pass per invoice table (closed quarters come from the snapshot)
+    from services.vat_return import get_vat_return
+    boxes = get_vat_return(start_date, end_date, 'all')
+    sales_place_india = boxes['sales_place_india_base']
+    sales_china_town = boxes['sales_china_town_base']
 
     # Branch filter for sales total
     branch = (request.args.get('branch') or 'all').strip()
@@ -4346,41 +3788,18 @@ def vat_print():
     else:
         sales_total = float(sales_place_india or 0) + float(sales_china_town or 0)
 
-    # Aggregate purchases and expenses within the period
-    try:
-        purchases_total = float(db.session.query(func.coalesce(func.sum(PurchaseInvoiceItem.total_price), 0))
-            .join(PurchaseInvoice, PurchaseInvoiceItem.invoice_id == PurchaseInvoice.id)
-            .filter(PurchaseInvoice.date.between(start_date, end_date)).scalar() or 0.0)
-    except Exception:
-        purchases_total = 0.0
-    try:
-        expenses_total = float(db.session.query(func.coalesce(func.sum(ExpenseInvoice.total_after_tax_discount), 0))
-            .filter(ExpenseInvoice.date.between(start_date, end_date)).scalar() or 0.0)
-    except Exception:
-        expenses_total = 0.0
+    purchases_total = boxes['purchases_total']
+    expenses_total = boxes['expenses_total']
 
     s = None
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
     vat_rate = float(getattr(s, 'vat_rate', 15) or 15)/100.0
 
-    try:
-        output_vat = float(db.session.query(func.coalesce(func.sum(SalesInvoice.tax_amount), 0))
-            .filter(SalesInvoice.date.between(start_date, end_date))
-            .scalar() or 0.0)
-    except Exception:
-        output_vat = float(sales_total or 0) * vat_rate
-    try:
-        input_vat = float(db.session.query(func.coalesce(func.sum(PurchaseInvoiceItem.tax), 0))
-            .join(PurchaseInvoice, PurchaseInvoiceItem.invoice_id == PurchaseInvoice.id)
-            .filter(PurchaseInvoice.date.between(start_date, end_date))
-            .scalar() or 0.0) + float(db.session.query(func.coalesce(func.sum(ExpenseInvoice.tax_amount), 0))
-            .filter(ExpenseInvoice.date.between(start_date, end_date))
-            .scalar() or 0.0)
-    except Exception:
-        input_vat = float((purchases_total or 0) + (expenses_total or 0)) * vat_rate
+    output_vat = boxes['output_vat']
+    input_vat = boxes['input_vat']
     net_vat = output_vat - input_vat
 
     # CSV export
@@ -4668,7 +4087,7 @@ def print_income_statement():
 
     # Settings for header
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
 
@@ -4933,7 +4352,7 @@ def print_balance_sheet():
     liabilities = 0.0
     equity = float(assets - liabilities)
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
     columns = ['Metric', 'Amount']
@@ -4981,7 +4400,7 @@ def print_trial_balance():
     total_debit = float(sum([float(r.get('Debit') or 0.0) for r in rows]))
     total_credit = float(sum([float(r.get('Credit') or 0.0) for r in rows]))
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
     columns = ['Code', 'Account', 'Debit', 'Credit']
@@ -5268,6 +4687,11 @@ def api_vat_categories_map():
             'exports_keywords': [str(x).strip() for x in (data.get('exports_keywords') or []) if str(x).strip()],
         }
         kv_set('vat_category_map', out)
+        try:
+            from services.vat_return import invalidate_vat_snapshots
+            invalidate_vat_snapshots()
+        except Exception:
+            pass
         return jsonify({'ok': True})
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 400
@@ -5323,7 +4747,7 @@ def _archive_invoice_pdf(inv):
             items_ctx.append({'product_name': getattr(it, 'product_name', '') or '', 'quantity': float(getattr(it, 'quantity', 0) or 0), 'total_price': line})
         s = None
         try:
-            s = Settings.query.first()
+            s = current_settings()
         except Exception:
             s = None
         dt_str = get_saudi_now().strftime('%Y-%m-%d %H:%M:%S')
@@ -5428,28 +4852,14 @@ def api_archive_list():
                 pass
         q = q.order_by(SalesInvoice.date.desc(), SalesInvoice.created_at.desc())
         rows = q.offset((page - 1) * page_size).limit(page_size).all()
-        keys = [f"pdf_path:sales:{r[0]}" for r in rows]
-        meta_rows = AppKV.query.filter(AppKV.k.in_(keys)).all() if keys else []
-        log_keys = [f"print_log:{r[0]}" for r in rows]
-        log_rows = AppKV.query.filter(AppKV.k.in_(log_keys)).all() if log_keys else []
-        meta_map = {}
-        for kv in meta_rows:
-            try:
-                meta_map[kv.k] = json.loads(kv.v) if kv.v else {}
-            except Exception:
-                meta_map[kv.k] = {}
-        logs_map = {}
-        for kv in log_rows:
-            try:
-                logs_map[kv.k] = json.loads(kv.v) if kv.v else []
-            except Exception:
-                logs_map[kv.k] = []
+        # مسار PDF وسجل الطباعة لكل الفواتير باستعلام واحد
+        kv_map = kv_get_many([f"pdf_path:sales:{r[0]}" for r in rows] + [f"print_log:{r[0]}" for r in rows])
         out = []
         for r in rows:
             inv_no, created_at, date_f, pm, total_amt, branch_code = r
             # Use saved print timestamp if available
-            meta = meta_map.get(f"pdf_path:sales:{inv_no}", {}) or {}
-            logs = logs_map.get(f"print_log:{inv_no}", []) or []
+            meta = kv_map.get(f"pdf_path:sales:{inv_no}") or {}
+            logs = kv_map.get(f"print_log:{inv_no}") or []
             dt_print = None
             try:
                 if logs:
@@ -5592,26 +5002,12 @@ def archive_download():
             q = q.filter(SalesInvoice.date.between(start_date.date(), end_date.date()))
         rows = q.order_by(SalesInvoice.date.desc(), SalesInvoice.created_at.desc()).limit(2000).all()
         items = []
-        keys = [f"pdf_path:sales:{r[0]}" for r in rows]
-        meta_rows = AppKV.query.filter(AppKV.k.in_(keys)).all() if keys else []
-        log_keys = [f"print_log:{r[0]}" for r in rows]
-        log_rows = AppKV.query.filter(AppKV.k.in_(log_keys)).all() if log_keys else []
-        meta_map = {}
-        for kv in meta_rows:
-            try:
-                meta_map[kv.k] = json.loads(kv.v) if kv.v else {}
-            except Exception:
-                meta_map[kv.k] = {}
-        logs_map = {}
-        for kv in log_rows:
-            try:
-                logs_map[kv.k] = json.loads(kv.v) if kv.v else []
-            except Exception:
-                logs_map[kv.k] = []
+        # مسار PDF وسجل الطباعة لكل الفواتير باستعلام واحد
+        kv_map = kv_get_many([f"pdf_path:sales:{r[0]}" for r in rows] + [f"print_log:{r[0]}" for r in rows])
         for r in rows:
             inv_no, created_at, date_f, pm, total_amt, branch_code = r
-            meta = meta_map.get(f"pdf_path:sales:{inv_no}", {}) or {}
-            logs = logs_map.get(f"print_log:{inv_no}", []) or []
+            meta = kv_map.get(f"pdf_path:sales:{inv_no}") or {}
+            logs = kv_map.get(f"print_log:{inv_no}") or []
             dt_print = None
             try:
                 if logs:
@@ -5698,6 +5094,14 @@ def archive_download():
         return jsonify({'ok': False, 'error': str(e)}), 400
 def _account(code, name, kind):
     try:
+        # سجل الحسابات داخل العملية: بلا استعلام للحسابات الموجودة (services/account_registry)
+        try:
+            from services.account_registry import account_ref
+            ref = account_ref(code)
+            if ref is not None:
+                return ref
+        except Exception:
+            pass
         a = Account.query.filter(func.lower(Account.code) == code.lower()).first()
         if not a:
             a = Account(code=code.upper(), name=name, type=kind)
@@ -5711,8 +5115,18 @@ def _pm_account(pm):
     """حساب الدفع: يُحدد من إعدادات الحسابات (account_usage_map) إن وُجد، وإلا من SHORT_TO_NUMERIC."""
     p = (pm or 'CASH').strip().upper()
     usage_group = 'Cash' if p == 'CASH' else 'Bank'
+    registry = False
+    try:
+        # السجل يعرف خريطة الدفع كاملة: غياب الربط يعني الرجوع مباشرة إلى SHORT_TO_NUMERIC
+        from services.account_registry import pay_account_ref
+        ref = pay_account_ref(usage_group)
+        if ref is not None:
+            return ref
+        registry = True
+    except Exception:
+        pass
     try:
-        acc = (
+        acc = None if registry else (
             db.session.query(Account)
             .join(AccountUsageMap, AccountUsageMap.account_id == Account.id)
             .filter(
@@ -5740,32 +5154,16 @@ def _pm_account(pm):
 
 def _acc_override(name: str, default_code: str) -> str:
     try:
-        m = kv_get('acc_map', {}) or {}
-        code = (m.get(name) or '').strip()
-        if code:
-            return code
+        from services.platform_config import acc_override
+        return acc_override(name, default_code)
     except Exception:
-        pass
-    return default_code
+        return default_code
 
 def _platform_group(name: str) -> str:
     try:
-        s = (name or '').strip().lower()
-        # Configured platforms from settings (AppKV)
-        platforms = kv_get('platforms_map', []) or []
-        for p in platforms:
-            key = (p.get('key') or '').strip().lower()
-            kws = p.get('keywords') or []
-            for kw in kws:
-                k = (kw or '').strip().lower()
-                if k and (k in s):
-                    return key
-        # Built-in fallback for known platforms
-        if ('hunger' in s) or ('هنقر' in s) or ('هونقر' in s):
-            return 'hunger'
-        if ('keeta' in s) or ('كيتا' in s) or ('كيت' in s):
-            return 'keeta'
-        return ''
+        # Configured platforms from settings (cached AppKV, precompiled), then built-in keeta/hunger keywords
+        from services.platform_config import classify
+        return classify(name)
     except Exception:
         return ''
 
@@ -7026,9 +6424,8 @@ def api_employees_delete(eid: int):
         db.session.delete(emp)
         # Remove KV settings/notes for this employee
         try:
-            from app.models import AppKV
-            AppKV.query.filter(AppKV.k.in_([f"emp_settings:{int(eid)}", f"emp_note:{int(eid)}"]))\
-                .delete(synchronize_session=False)
+            from services import kv_store
+            kv_store.delete([f"emp_settings:{int(eid)}", f"emp_note:{int(eid)}"], commit=False)
         except Exception:
             pass
         db.session.commit()
@@ -7178,38 +6575,8 @@ def api_payroll_run():
             details.append({'employee_id': eid, 'basic': basic, 'extra': extra, 'absence': absence, 'incentive': incentive, 'allowances': allow, 'deductions': ded, 'salary': round(max(0, sal), 2)})
         if not selected_ids:
             return jsonify({'ok': False, 'error': 'select_at_least_one'}), 400
-        for d in details:
-            eid = int(d['employee_id'])
-            basic = round(float(d.get('basic') or 0), 2)
-            extra = round(float(d.get('extra') or 0), 2)
-            absence = round(float(d.get('absence') or 0), 2)
-            incentive = round(float(d.get('incentive') or 0), 2)
-            allow = round(float(d.get('allowances') or 0), 2)
-            ded = round(float(d.get('deductions') or 0), 2)
-            sal = round(float(d.get('salary') or 0), 2)
-            if sal <= 0:
-                sal = max(0, basic + extra - absence + incentive + allow - ded)
-            s = Salary.query.filter_by(employee_id=eid, year=year, month=mon).first()
-            if not s:
-                s = Salary(employee_id=eid, year=year, month=mon, basic_salary=basic, extra=extra, absence=absence, incentive=incentive, allowances=allow, deductions=ded, previous_salary_due=0.0, total_salary=sal, status='due')
-                db.session.add(s)
-            else:
-                s.basic_salary = basic
-                s.extra = extra
-                s.absence = absence
-                s.incentive = incentive
-                s.allowances = allow
-                s.deductions = ded
-                s.previous_salary_due = 0.0
-                s.total_salary = sal
-            db.session.flush()
-        all_per = Salary.query.filter_by(year=year, month=mon).all()
-        for s in all_per:
-            if (s.employee_id or 0) in selected_ids:
-                continue
-            paid = db.session.query(Payment).filter(Payment.invoice_type == 'salary', Payment.invoice_id == s.id).first()
-            if not paid:
-                db.session.delete(s)
+        from services.payroll_engine import apply_payroll_run
+        apply_payroll_run(year, mon, details)
         ok_acc, acc_data, acc_entry = _create_payroll_accrual_je(year, mon)
         if not ok_acc and acc_data != 'already_posted':
             try:
@@ -7587,61 +6954,41 @@ def api_payroll_history_list():
         dept = (request.args.get('department') or '').strip().lower()
         status = (request.args.get('status') or '').strip().lower()
         pay_method = (request.args.get('payment_method') or '').strip().upper()
+        from sqlalchemy import func
+        from flask import url_for
+        from models import PayrollMonthSummary
+        from services.payroll_summary import ensure_payroll_summaries, period_of
+        if ensure_payroll_summaries():
+            db.session.commit()
+        q = (db.session.query(PayrollMonthSummary, Employee.full_name)
+             .outerjoin(Employee, Employee.id == PayrollMonthSummary.employee_id))
         if month:
             y, m = month.split('-')
-            y = int(y); m = int(m)
-            q = Salary.query.filter_by(year=y, month=m)
-        else:
-            q = Salary.query
-        rows = q.all()
+            q = q.filter(PayrollMonthSummary.period == period_of(int(y), int(m)))
+        if dept:
+            q = q.filter(func.lower(Employee.department).contains(dept))
+        if status:
+            q = q.filter(func.lower(PayrollMonthSummary.status).contains(status))
+        def _norm(m):
+            m = (m or '').upper()
+            return 'BANK' if m in ('BANK','TRANSFER') else ('CASH' if m=='CASH' else m)
+        receipt_base = url_for('main.salary_receipt')
         data = []
-        for s in rows:
-            try:
-                e = Employee.query.get(int(s.employee_id))
-            except Exception:
-                e = None
-            dep = (getattr(e, 'department', '') or '')
-            if dept and dept not in dep.lower():
+        for s, emp_name in q.order_by(PayrollMonthSummary.period.asc(), PayrollMonthSummary.employee_id.asc()).all():
+            pm_display = s.last_payment_method or ''
+            if pay_method and _norm(pm_display) != _norm(pay_method):
                 continue
-            st = (getattr(s, 'status', '') or '').strip().lower()
-            if status and status not in st:
-                continue
-            pm_display = ''
-            receipt_url = ''
-            try:
-                from flask import url_for
-                pay_rows = Payment.query.filter(Payment.invoice_type=='salary', Payment.invoice_id==int(s.id)).order_by(Payment.payment_date.asc()).all()
-                pids = []
-                last_method = None
-                for p in (pay_rows or []):
-                    try:
-                        pids.append(str(int(p.id)))
-                        last_method = (getattr(p,'payment_method','') or '').strip().upper()
-                    except Exception:
-                        continue
-                if pids:
-                    receipt_url = url_for('main.salary_receipt') + '?pids=' + ','.join(pids)
-                pm_display = last_method or ''
-            except Exception:
-                pm_display = ''
-                receipt_url = ''
-            if pay_method:
-                def _norm(m):
-                    m = (m or '').upper()
-                    return 'BANK' if m in ('BANK','TRANSFER') else ('CASH' if m=='CASH' else m)
-                if _norm(pm_display) != _norm(pay_method):
-                    continue
             data.append({
-                'employee_id': int(getattr(s, 'employee_id', 0) or 0),
-                'employee_name': getattr(e, 'full_name', '') if e else '',
-                'month_label': f"{int(getattr(s,'month',0)):02d}/{int(getattr(s,'year',0))}",
-                'basic': float(getattr(s, 'basic_salary', 0) or 0),
+                'employee_id': int(s.employee_id),
+                'employee_name': emp_name or '',
+                'month_label': f"{int(s.month):02d}/{int(s.year)}",
+                'basic': float(s.basic or 0),
                 'ot': 0.0,
                 'bonus': 0.0,
-                'total': float(getattr(s, 'total_salary', 0) or 0),
-                'status': getattr(s, 'status', '') or 'due',
+                'total': float(s.gross or 0),
+                'status': s.status or 'due',
                 'payment_method': pm_display,
-                'receipt_url': receipt_url,
+                'receipt_url': (receipt_base + '?pids=' + s.payment_ids) if s.payment_ids else '',
             })
         return jsonify({'ok': True, 'rows': data})
     except Exception as e:
@@ -8143,6 +7490,14 @@ def api_chart_add():
                 else:
                     platforms.append(entry)
                 kv_set('platforms_map', platforms)
+                try:
+                    from services.platform_config import invalidate_platform_config
+                    invalidate_platform_config()
+                    from services.sales_channel import reclassify_channels
+                    reclassify_channels()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
         elif role in ('branch_rev_ct','branch_rev_pi','default_ar'):
             acc_map = kv_get('acc_map', {}) or {}
             if role == 'branch_rev_ct':
@@ -8152,6 +7507,8 @@ def api_chart_add():
             elif role == 'default_ar':
                 acc_map['AR'] = code
             kv_set('acc_map', acc_map)
+            from services.platform_config import invalidate_platform_config
+            invalidate_platform_config()
         return jsonify({'ok': True, 'code': code})
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 400
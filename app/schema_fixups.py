@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+إصلاحات المخطط لمرة واحدة (خارج create_app): إنشاء الجداول الناقصة، أعمدة SQLite القديمة، فهارس،
+وأعمدة PostgreSQL الناقصة عند تخطي ترحيل (ensure_schema — DDL فقط).
+ترحيل البيانات منفصل (backfill_data): تصنيف قناة البيع للفواتير السابقة، وصفوف فهرس السداد
+(invoice_settlements) للفواتير التي ليس لها صف بعد.
+
+تُشغَّل قبل بدء الخادم وليس مع كل عامل:
+    flask --app app:create_app ensure-schema     (المخطط فقط)
+    flask --app app:create_app backfill-data     (ترحيل البيانات فقط)
+    flask --app app:create_app warmup            (الاثنان + القائمة وشجرة الحسابات الافتراضية)
+    python run_migrations.py            (بعد alembic upgrade: المخطط ثم ترحيل البيانات)
+    POST /admin/warmup                  (للمدير، دون إعادة نشر)
+أو تلقائياً عند البدء محلياً مع ENSURE_SCHEMA_ON_STARTUP=1 (المخطط فقط)، أو في gunicorn مع WARMUP_ON_START=1.
+كل خطوة مستقلة، وكل عبارة DDL في SQLite مستقلة: فشلها يُسجَّل ولا يوقف البقية.
+"""
+from __future__ import annotations
+
+from typing import List
+
+_SQLITE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_payments_type_invoice ON payments (invoice_type, invoice_id)",
+    "CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales_invoices (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_purchases_created_at ON purchase_invoices (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_expenses_created_at ON expense_invoices (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_journal_lines_account_date ON journal_lines (account_id, line_date, id)",
+)
+
+_POSTGRES_COLUMNS = (
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS customer_type VARCHAR(20) DEFAULT 'cash'",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS discount_percent NUMERIC(5,2) DEFAULT 0",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS active BOOLEAN DEFAULT true",
+    "ALTER TABLE customers ADD COLUMN IF NOT EXISTS created_at TIMESTAMP",
+    "ALTER TABLE sales_invoices ADD COLUMN IF NOT EXISTS channel VARCHAR(30)",
+    "CREATE INDEX IF NOT EXISTS ix_sales_invoices_channel ON sales_invoices (channel)",
+    # أعمدة JournalLine (cash_flow وغيره)
+    "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS line_date DATE DEFAULT CURRENT_DATE",
+    "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS employee_id INTEGER",
+    "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS invoice_id INTEGER",
+    "ALTER TABLE journal_lines ADD COLUMN IF NOT EXISTS invoice_type VARCHAR(20)",
+    # name_ar/name_en لـ seed_official والشجرة
+    "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS name_ar VARCHAR(200)",
+    "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS name_en VARCHAR(200)",
+)
+
+
+def _sqlite_columns(conn, table: str) -> set:
+    from sqlalchemy import text
+    return {str(r[1]).lower() for r in conn.execute(text(f"PRAGMA table_info('{table}')")).fetchall()}
+
+
+def _create_tables(done: List[str]) -> None:
+    from extensions import db
+    db.create_all()
+    done.append('create_all')
+
+
+def _legacy_columns(done: List[str]) -> None:
+    # أعمدة توافق قديمة للقوائم والحسابات والقيود والمستخدمين (كل دالة تفحص قبل ALTER)
+    from app.routes import (
+        ensure_account_extended_columns, ensure_journal_opening_columns, ensure_menu_sort_order_column,
+        ensure_menuitem_compat_columns, ensure_user_2fa_columns,
+    )
+    for fn in (ensure_menu_sort_order_column, ensure_menuitem_compat_columns, ensure_account_extended_columns,
+               ensure_journal_opening_columns, ensure_user_2fa_columns):
+        fn()
+    done.append('legacy columns')
+
+
+def _try_exec(conn, stmt: str, done: List[str], label: str = '') -> bool:
+    """عبارة DDL واحدة: فشلها (قفل، جدول غير موجود بعد) يُسجَّل ولا يوقف بقية العبارات."""
+    from sqlalchemy import text
+    try:
+        conn.execute(text(stmt))
+    except Exception as e:
+        done.append(f'{label or stmt[:60]} failed: {e}')
+        return False
+    if label:
+        done.append(label)
+    return True
+
+
+def _sqlite_fixups(done: List[str]) -> None:
+    from extensions import db
+    from models import Settings
+
+    with db.engine.connect() as conn:
+        sup_cols = _sqlite_columns(conn, 'suppliers')
+        if sup_cols and 'payment_method' not in sup_cols:
+            _try_exec(conn, "ALTER TABLE suppliers ADD COLUMN payment_method VARCHAR(20) DEFAULT 'CASH'",
+                      done, 'suppliers.payment_method')
+        pi_cols = _sqlite_columns(conn, 'purchase_invoices')
+        if pi_cols and 'supplier_invoice_number' not in pi_cols:
+            _try_exec(conn, "ALTER TABLE purchase_invoices ADD COLUMN supplier_invoice_number VARCHAR(100)",
+                      done, 'purchase_invoices.supplier_invoice_number')
+        if pi_cols and 'notes' not in pi_cols:
+            _try_exec(conn, "ALTER TABLE purchase_invoices ADD COLUMN notes TEXT", done, 'purchase_invoices.notes')
+        si_cols = _sqlite_columns(conn, 'sales_invoices')
+        if si_cols and 'channel' not in si_cols:
+            _try_exec(conn, "ALTER TABLE sales_invoices ADD COLUMN channel VARCHAR(30)", done, 'sales_invoices.channel')
+        for stmt in _SQLITE_INDEXES + ("CREATE INDEX IF NOT EXISTS ix_sales_invoices_channel ON sales_invoices (channel)",):
+            _try_exec(conn, stmt, done)
+        # جدول الإعدادات: كل أعمدة النموذج (تجنّب "no such column" عند الحفظ)
+        existing = _sqlite_columns(conn, 'settings')
+        for col in Settings.__table__.c:
+            if not existing or col.key.lower() in existing:
+                continue
+            t = type(col.type).__name__
+            if "Int" in t or "Bool" in t:
+                sqltyp = "INTEGER"
+            elif "Numeric" in t or "Float" in t or "Real" in t:
+                sqltyp = "REAL"
+            else:
+                sqltyp = "TEXT"
+            _try_exec(conn, "ALTER TABLE settings ADD COLUMN %s %s" % (col.key, sqltyp), done, f'settings.{col.key}')
+        conn.commit()
+
+
+def _postgres_fixups(done: List[str]) -> None:
+    from sqlalchemy import text
+    from extensions import db
+
+    for stmt in _POSTGRES_COLUMNS:
+        try:
+            db.session.execute(text(stmt))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+    done.append('postgres columns')
+
+
+def _reclassify_sales_channels(done: List[str]) -> None:
+    from extensions import db
+    from models import SalesInvoice
+
+    if db.session.query(SalesInvoice.id).filter(SalesInvoice.channel.is_(None)).first() is None:
+        return
+    from services.sales_channel import reclassify_channels
+    reclassify_channels(only_missing=True)
+    db.session.commit()
+    done.append('sales channels')
+
+
+def _backfill_settlements(done: List[str]) -> None:
+    from extensions import db
+    from services.invoice_settlement import SETTLEMENT_TYPES, ensure_settlements
+
+    n = sum(ensure_settlements(t) for t in SETTLEMENT_TYPES)
+    db.session.commit()
+    if n:
+        done.append(f'invoice settlements: {n}')
+
+
+def _run_steps(steps, done: List[str]) -> List[str]:
+    from extensions import db
+
+    for name, step in steps:
+        try:
+            step(done)
+        except Exception as e:
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+            done.append(f'{name} failed: {e}')
+    return done
+
+
+def ensure_schema() -> List[str]:
+    """تشغيل كل إصلاحات المخطط (DDL فقط) داخل سياق التطبيق. تعيد قائمة بما نُفِّذ (للطباعة في السجل)."""
+    from extensions import db
+
+    dialect = db.engine.dialect.name
+    steps = [('create_all', _create_tables)]
+    if dialect == 'sqlite':
+        steps.append(('sqlite', _sqlite_fixups))
+    elif dialect == 'postgresql':
+        steps.append(('postgresql', _postgres_fixups))
+    steps.append(('legacy_columns', _legacy_columns))
+    return _run_steps(steps, [])
+
+
+def backfill_data() -> List[str]:
+    """
+    ترحيل البيانات لمرة واحدة بعد ensure_schema: قناة البيع للفواتير السابقة وصفوف فهرس السداد الناقصة.
+    منفصلة عن المخطط لأنها تقرأ الفواتير كلها؛ تُشغَّل من run_migrations.py أو flask backfill-data أو warmup.
+    """
+    steps = [('sales_channel', _reclassify_sales_channels), ('invoice_settlements', _backfill_settlements)]
+    return _run_steps(steps, [])
+
+
+def _seed_defaults(done: List[str]) -> None:
+    from app.routes import seed_chart_of_accounts, seed_menu_if_empty
+    seed_menu_if_empty()
+    seed_chart_of_accounts()
+    done.append('seeds')
+
+
+def warmup() -> List[str]:
+    """
+    التحضير الكامل قبل استقبال الطلبات: ensure_schema + backfill_data + زرع القائمة الافتراضية وشجرة الحسابات.
+    يُستدعى من /admin/warmup أو خطاف gunicorn (WARMUP_ON_START=1) أو flask warmup فقط.
+    """
+    from extensions import db
+
+    done = ensure_schema()
+    done.extend(backfill_data())
+    try:
+        _seed_defaults(done)
+    except Exception as e:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        done.append(f'seeds failed: {e}')
+    try:
+        import app.routes as _routes
+        _routes._DB_WARMED_UP = True
+    except Exception:
+        pass
+    return done
+
+
+def register_schema_command(app) -> None:
+    """أوامر CLI: flask ensure-schema (المخطط فقط)، flask backfill-data (ترحيل البيانات)، flask warmup (الكل + البيانات الافتراضية)."""
+    import click
+
+    @app.cli.command('ensure-schema')
+    def ensure_schema_command():
+        """Create missing tables and apply legacy column fix-ups (run once per deploy)."""
+        for item in ensure_schema():
+            click.echo(item)
+
+    @app.cli.command('backfill-data')
+    def backfill_data_command():
+        """Backfill sales channels and missing invoice settlement rows (run once per deploy)."""
+        for item in backfill_data():
+            click.echo(item)
+
+    @app.cli.command('warmup')
+    def warmup_command():
+        """ensure-schema and backfill-data plus default menu and chart-of-accounts seeds."""
+        for item in warmup():
+            click.echo(item)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+وضع أداء SQLite (SQLITE_PERFORMANCE=1): PRAGMAs عند كل اتصال جديد في الـ pool.
+
+    journal_mode=WAL        القرّاء لا يُحجبون أثناء الكتابة، والكتابة إلحاق بدل نسخ الصفحات
+    synchronous=NORMAL      fsync عند نقاط الفحص فقط (آمن مع WAL ضد تلف القاعدة)
+    busy_timeout            انتظار القفل بدل "database is locked" فوراً
+    cache_size / mmap_size  ذاكرة صفحات أكبر وقراءة عبر mmap
+    temp_store=MEMORY       جداول الفرز والتجميع المؤقتة في الذاكرة
+
+القيم من config._sqlite_pragmas (SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE).
+"""
+from __future__ import annotations
+
+from typing import Dict
+
+_PRAGMA_ORDER = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store')
+
+
+def apply_sqlite_pragmas(dbapi_conn, pragmas: Dict[str, object]) -> None:
+    """تطبيق PRAGMAs على اتصال sqlite3 خام (خارج أي معاملة)."""
+    cur = dbapi_conn.cursor()
+    try:
+        for name in _PRAGMA_ORDER:
+            if name in pragmas and pragmas[name] is not None:
+                cur.execute(f"PRAGMA {name}={pragmas[name]}")
+    finally:
+        cur.close()
+
+
+def register_sqlite_tuning(app) -> bool:
+    """ربط PRAGMAs بمحرك التطبيق إن كان SQLite ووضع الأداء مفعّلاً. لا يفتح اتصالاً."""
+    if not app.config.get('SQLITE_PERFORMANCE'):
+        return False
+    from sqlalchemy import event
+    from extensions import db
+
+    pragmas = dict(app.config.get('SQLITE_PRAGMAS') or {})
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+            return False
+        if getattr(engine, '_sqlite_tuning_registered', False):
+            return True
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_conn, _record):
+            apply_sqlite_pragmas(dbapi_conn, pragmas)
+
+        engine._sqlite_tuning_registered = True
+    return True
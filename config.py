@@ -1,5 +1,5 @@
 import os
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool
 
 # ─── إعداد قاعدة ذكي حسب البيئة (الحل المثالي) ───
 # ✔ تطوير محلي: SQLite (سريع، لا إعداد)
@@ -34,9 +34,66 @@ else:
 LOCAL_SQLITE_PATH_FOR_SCRIPTS = os.getenv("LOCAL_SQLITE_PATH") or os.path.join(_instance_dir, "accounting_app.db")
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+def _pool_sizing():
+    """
+    حجم pool لكل عامل من عدد عمال gunicorn: ميزانية اتصالات القاعدة (DB_MAX_CONNECTIONS) تُقسَّم على العمال،
+    وpool_size يكفي خيوط العامل والباقي overflow. DB_POOL_SIZE / DB_MAX_OVERFLOW يتجاوزان الحساب.
+    """
+    workers = max(1, _env_int("WEB_CONCURRENCY", 1))
+    threads = max(1, _env_int("GUNICORN_THREADS", 1))
+    per_worker = max(2, _env_int("DB_MAX_CONNECTIONS", 20) // workers)
+    pool_size = _env_int("DB_POOL_SIZE", min(per_worker, max(2, threads)))
+    max_overflow = _env_int("DB_MAX_OVERFLOW", max(0, per_worker - pool_size))
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+    }
+
+
+def _sqlite_performance_enabled() -> bool:
+    return os.getenv("SQLITE_PERFORMANCE", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _sqlite_pragmas():
+    """PRAGMAs وضع الأداء (تُطبَّق عند كل اتصال من app/sqlite_tuning.py)."""
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),
+        # سالب = بالكيلوبايت
+        "cache_size": -_env_int("SQLITE_CACHE_SIZE_KB", 65536),
+        "mmap_size": _env_int("SQLITE_MMAP_SIZE", 268435456),
+        "temp_store": "MEMORY",
+    }
+
+
 def _engine_options_for(db_uri: str):
-    """خيارات المحرك: SQLite (NullPool, check_same_thread) أو PostgreSQL (pool_pre_ping)."""
+    """
+    خيارات المحرك: SQLite (NullPool, check_same_thread) أو PostgreSQL (pool_pre_ping + pool حسب عدد العمال).
+    SQLITE_PERFORMANCE=1: SQLite بـ pool قابل لإعادة الاستخدام (الـ PRAGMAs تبقى على الاتصال) + WAL وبقية _sqlite_pragmas.
+    """
     if db_uri and "sqlite" in db_uri:
+        if _sqlite_performance_enabled() and ":memory:" not in db_uri:
+            threads = max(1, _env_int("GUNICORN_THREADS", 1))
+            return {
+                "poolclass": QueuePool,
+                "pool_size": _env_int("DB_POOL_SIZE", max(2, threads)),
+                "max_overflow": _env_int("DB_MAX_OVERFLOW", threads),
+                "connect_args": {
+                    "check_same_thread": False,
+                    "timeout": _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000.0,
+                },
+                "echo": False,
+            }
         return {
             "poolclass": NullPool,
             "connect_args": {"check_same_thread": False},
@@ -45,6 +102,7 @@ def _engine_options_for(db_uri: str):
     return {
         "pool_pre_ping": True,
         "echo": False,
+        **_pool_sizing(),
     }
 
 
@@ -78,6 +136,12 @@ class Config:
 
     SQLALCHEMY_DATABASE_URI = _database_uri
     SQLALCHEMY_ENGINE_OPTIONS = _engine_options_for(SQLALCHEMY_DATABASE_URI)
+    # وضع أداء SQLite (اختياري؛ للتطوير ومواقع الفرع الواحد): WAL + synchronous=NORMAL + cache/mmap + pool
+    SQLITE_PERFORMANCE = _sqlite_performance_enabled()
+    SQLITE_PRAGMAS = _sqlite_pragmas()
+
+    # إصلاحات المخطط عند البدء (create_all + أعمدة قديمة): معطلة افتراضياً؛ النشر يشغّل flask ensure-schema مرة واحدة
+    ENSURE_SCHEMA_ON_STARTUP = os.getenv('ENSURE_SCHEMA_ON_STARTUP', '0').strip().lower() in ('1', 'true', 'yes', 'on')
 
     # Babel / i18n
     BABEL_DEFAULT_LOCALE = os.getenv('BABEL_DEFAULT_LOCALE', 'ar')
@@ -291,6 +291,10 @@ def build_coa_dict():
         }
     return d
 
+# كود → الاسم العربي؛ يُبنى مرة عند التحميل (get_account_display_name تُستدعى لكل سطر في التقارير)
+_TREE_NAMES = {row[0]: row[1] for row in NEW_COA_TREE}
+
+
 def leaf_coa_dict():
     """فقط الحسابات الورقية (للاستخدام في القيود)."""
     full = build_coa_dict()
@@ -305,11 +309,7 @@ def get_account_display_name(code, name_from_db=None):
         n = (name_from_db if isinstance(name_from_db, str) else str(name_from_db)).strip()
         if n and n != code:
             return n
-    try:
-        coa = build_coa_dict()
-        return (coa.get(code) or {}).get('name') or name_from_db or code or ''
-    except Exception:
-        return name_from_db or code or ''
+    return _TREE_NAMES.get(code) or name_from_db or code or ''
 
 
 def get_short_to_numeric(coa=None):
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+إعداد gunicorn للإنتاج (يُقرأ تلقائياً من مجلد التشغيل، أو صراحةً: gunicorn -c gunicorn.conf.py wsgi:application).
+
+العمال والخيوط من عدد المعالجات والبيئة:
+    WEB_CONCURRENCY        عدد العمال (افتراضي: 2 × المعالجات + 1، بحد أقصى GUNICORN_MAX_WORKERS=4)
+    GUNICORN_THREADS       خيوط كل عامل (افتراضي 4 → gthread؛ 1 → sync)
+    GUNICORN_WORKER_CLASS  يتجاوز نوع العامل (مثلاً gevent على Render)
+    GUNICORN_PRELOAD       تحميل التطبيق في العملية الأم (افتراضي 1 لـ sync/gthread، 0 لـ gevent/eventlet)
+    PORT / GUNICORN_TIMEOUT
+
+يُصدَّر WEB_CONCURRENCY و GUNICORN_THREADS قبل تحميل التطبيق فيحسب config._engine_options_for حجم pool لكل عامل.
+مع preload_app يُتخلَّص من اتصالات المحرك بعد fork فلا يتشارك العمال مقابس العملية الأم.
+
+التحضير (المخطط + القائمة وشجرة الحسابات الافتراضية) مرة واحدة في العملية الأم قبل إنشاء العمال
+عند WARMUP_ON_START=1، بدلاً من أول طلب بيع في كل عامل.
+"""
+import multiprocessing
+import os
+
+
+def _truthy(name, default='0'):
+    return (os.getenv(name, default) or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _int_env(name, default):
+    try:
+        return int(os.getenv(name) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+_cpus = multiprocessing.cpu_count() or 1
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = max(1, _int_env('WEB_CONCURRENCY', min(2 * _cpus + 1, _int_env('GUNICORN_MAX_WORKERS', 4))))
+threads = max(1, _int_env('GUNICORN_THREADS', 4))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS') or ('gthread' if threads > 1 else 'sync')
+# gevent/eventlet يرقّعان المكتبات بعد fork: تحميل التطبيق قبلها غير آمن ما لم يُطلب صراحةً
+preload_app = _truthy('GUNICORN_PRELOAD', '0' if worker_class in ('gevent', 'eventlet') else '1')
+timeout = _int_env('GUNICORN_TIMEOUT', 120)
+graceful_timeout = 30
+keepalive = 5
+accesslog = os.getenv('GUNICORN_ACCESSLOG') or None
+
+# حجم pool في config._engine_options_for يُشتق من هذه القيم
+os.environ['WEB_CONCURRENCY'] = str(workers)
+os.environ['GUNICORN_THREADS'] = str(threads)
+
+
+def _dispose_engines(app):
+    from extensions import db
+    with app.app_context():
+        # close=False: لا نغلق مقابس العملية الأم من داخل العامل، فقط نتركها ونبدأ pool جديداً
+        db.engine.dispose(close=False)
+
+
+def on_starting(server):
+    if not _truthy('WARMUP_ON_START'):
+        return
+    try:
+        from app import create_app
+        from app.schema_fixups import warmup
+        from extensions import db
+        app = create_app()
+        with app.app_context():
+            for item in warmup():
+                server.log.info("warmup: %s", item)
+            # لا نورّث اتصالات العملية الأم للعمال
+            db.engine.dispose()
+    except Exception as e:
+        server.log.warning("warmup skipped: %s", e)
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    try:
+        import app as app_pkg
+        if app_pkg._default_app is not None:
+            _dispose_engines(app_pkg._default_app)
+    except Exception as e:
+        server.log.warning("post_fork engine dispose failed: %s", e)
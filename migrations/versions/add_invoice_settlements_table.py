@@ -0,0 +1,52 @@
+"""فهرس سداد الفواتير invoice_settlements (المسدد/المتبقي لكل فاتورة)
+
+Revision ID: inv_settle_01
+Revises: sales_channel_01
+Create Date: 2026-10-19
+
+بعد الترقية: python scripts/rebuild_invoice_settlements.py لتعبئة الفواتير الحالية
+(الصفوف الناقصة تُحسب أيضاً عند أول قراءة).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'inv_settle_01'
+down_revision = 'sales_channel_01'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, name):
+    if conn.dialect.name == 'sqlite':
+        r = conn.execute(sa.text(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{name}'"))
+        return r.scalar() is not None
+    from sqlalchemy import inspect
+    return name in inspect(conn).get_table_names()
+
+
+def upgrade():
+    conn = op.get_bind()
+    if not _table_exists(conn, 'invoice_settlements'):
+        op.create_table(
+            'invoice_settlements',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('invoice_type', sa.String(length=20), nullable=False),
+            sa.Column('invoice_id', sa.Integer(), nullable=False),
+            sa.Column('total', sa.Numeric(12, 2), nullable=False),
+            sa.Column('paid_from_gl', sa.Numeric(12, 2), nullable=False),
+            sa.Column('paid_legacy', sa.Numeric(12, 2), nullable=False),
+            sa.Column('remaining', sa.Numeric(12, 2), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('invoice_type', 'invoice_id', name='uq_invoice_settlement'),
+        )
+        op.create_index('ix_invoice_settlements_type_status', 'invoice_settlements', ['invoice_type', 'status'])
+
+
+def downgrade():
+    conn = op.get_bind()
+    if _table_exists(conn, 'invoice_settlements'):
+        op.drop_index('ix_invoice_settlements_type_status', 'invoice_settlements')
+        op.drop_table('invoice_settlements')
@@ -0,0 +1,25 @@
+"""Add index on journal_lines (account_id, line_date, id) for account statements
+
+Revision ID: jl_acc_date_idx_01
+Revises: payroll_summary_01
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+
+revision = 'jl_acc_date_idx_01'
+down_revision = 'payroll_summary_01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_journal_lines_account_date ON journal_lines (account_id, line_date, id)"
+    ))
+
+
+def downgrade():
+    op.execute(text("DROP INDEX IF EXISTS ix_journal_lines_account_date"))
@@ -0,0 +1,25 @@
+"""Add index on meal_ingredients.raw_material_id (material → dependent meals for recosting)
+
+Revision ID: meal_ing_rm_idx_01
+Revises: stock_mov_01
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+
+revision = 'meal_ing_rm_idx_01'
+down_revision = 'stock_mov_01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_meal_ingredients_raw_material_id ON meal_ingredients (raw_material_id)"
+    ))
+
+
+def downgrade():
+    op.execute(text("DROP INDEX IF EXISTS ix_meal_ingredients_raw_material_id"))
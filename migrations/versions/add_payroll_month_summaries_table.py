@@ -0,0 +1,67 @@
+"""ملخص الرواتب الشهري payroll_month_summaries (الاستحقاق/المدفوع/المتبقي لكل موظف وشهر)
+
+Revision ID: payroll_summary_01
+Revises: inv_settle_01
+Create Date: 2026-10-19
+
+بعد الترقية: python scripts/rebuild_payroll_summaries.py لتعبئة المسيرات الحالية
+(الصفوف الناقصة تُحسب أيضاً عند أول قراءة).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'payroll_summary_01'
+down_revision = 'inv_settle_01'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, name):
+    if conn.dialect.name == 'sqlite':
+        r = conn.execute(sa.text(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{name}'"))
+        return r.scalar() is not None
+    from sqlalchemy import inspect
+    return name in inspect(conn).get_table_names()
+
+
+def upgrade():
+    conn = op.get_bind()
+    if not _table_exists(conn, 'payroll_month_summaries'):
+        op.create_table(
+            'payroll_month_summaries',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('employee_id', sa.Integer(), nullable=False),
+            sa.Column('year', sa.Integer(), nullable=False),
+            sa.Column('month', sa.Integer(), nullable=False),
+            sa.Column('period', sa.Integer(), nullable=False),
+            sa.Column('salary_id', sa.Integer(), nullable=True),
+            sa.Column('basic', sa.Numeric(12, 2), nullable=False),
+            sa.Column('extra', sa.Numeric(12, 2), nullable=False),
+            sa.Column('absence', sa.Numeric(12, 2), nullable=False),
+            sa.Column('incentive', sa.Numeric(12, 2), nullable=False),
+            sa.Column('allowances', sa.Numeric(12, 2), nullable=False),
+            sa.Column('deductions', sa.Numeric(12, 2), nullable=False),
+            sa.Column('prev_due', sa.Numeric(12, 2), nullable=False),
+            sa.Column('gross', sa.Numeric(12, 2), nullable=False),
+            sa.Column('paid', sa.Numeric(12, 2), nullable=False),
+            sa.Column('remaining', sa.Numeric(12, 2), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('payment_ids', sa.Text(), nullable=True),
+            sa.Column('last_payment_method', sa.String(length=20), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('employee_id', 'year', 'month', name='uq_payroll_summary_period'),
+        )
+        op.create_index('ix_payroll_summaries_employee_period', 'payroll_month_summaries', ['employee_id', 'period'])
+        op.create_index('ix_payroll_summaries_period_employee', 'payroll_month_summaries', ['period', 'employee_id'])
+        op.create_index('ix_payroll_month_summaries_salary_id', 'payroll_month_summaries', ['salary_id'])
+
+
+def downgrade():
+    conn = op.get_bind()
+    if _table_exists(conn, 'payroll_month_summaries'):
+        op.drop_index('ix_payroll_month_summaries_salary_id', 'payroll_month_summaries')
+        op.drop_index('ix_payroll_summaries_period_employee', 'payroll_month_summaries')
+        op.drop_index('ix_payroll_summaries_employee_period', 'payroll_month_summaries')
+        op.drop_table('payroll_month_summaries')
@@ -0,0 +1,78 @@
+"""قناة البيع sales_invoices.channel (مفهرس) مع تعبئة الفواتير الحالية
+
+Revision ID: sales_channel_01
+Revises: meal_ing_rm_idx_01
+Create Date: 2026-10-19
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'sales_channel_01'
+down_revision = 'meal_ing_rm_idx_01'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, name):
+    if conn.dialect.name == 'sqlite':
+        r = conn.execute(sa.text(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{name}'"))
+        return r.scalar() is not None
+    from sqlalchemy import inspect
+    return name in inspect(conn).get_table_names()
+
+
+def _column_exists(conn, table, column):
+    from sqlalchemy import inspect
+    return column in [c['name'] for c in inspect(conn).get_columns(table)]
+
+
+def _classify(name, platforms):
+    # Same rules as services.sales_channel.classify_channel (kept inline so the migration is self-contained)
+    s = (name or '').strip().lower()
+    for p in platforms:
+        key = (p.get('key') or '').strip().lower()
+        for kw in p.get('keywords') or []:
+            k = (kw or '').strip().lower()
+            if key and k and (k in s):
+                return key
+    if ('hunger' in s) or ('هنقر' in s) or ('هونقر' in s):
+        return 'hunger'
+    if ('keeta' in s) or ('كيتا' in s) or ('كيت' in s):
+        return 'keeta'
+    return ''
+
+
+def upgrade():
+    conn = op.get_bind()
+    if not _table_exists(conn, 'sales_invoices'):
+        return
+    if not _column_exists(conn, 'sales_invoices', 'channel'):
+        op.add_column('sales_invoices', sa.Column('channel', sa.String(length=30), nullable=True))
+        op.create_index('ix_sales_invoices_channel', 'sales_invoices', ['channel'])
+
+    platforms = []
+    if _table_exists(conn, 'app_kv'):
+        raw = conn.execute(sa.text("SELECT v FROM app_kv WHERE k = 'platforms_map'")).scalar()
+        try:
+            platforms = json.loads(raw) if raw else []
+        except Exception:
+            platforms = []
+    # تحديث واحد لكل اسم عميل مميز بدل المرور على كل فاتورة
+    names = conn.execute(sa.text("SELECT DISTINCT customer_name FROM sales_invoices WHERE channel IS NULL")).fetchall()
+    for (name,) in names:
+        ch = _classify(name, platforms)
+        if name is None:
+            conn.execute(sa.text("UPDATE sales_invoices SET channel = :ch WHERE customer_name IS NULL AND channel IS NULL"), {'ch': ch})
+        else:
+            conn.execute(sa.text("UPDATE sales_invoices SET channel = :ch WHERE customer_name = :n AND channel IS NULL"), {'ch': ch, 'n': name})
+
+
+def downgrade():
+    conn = op.get_bind()
+    if _table_exists(conn, 'sales_invoices') and _column_exists(conn, 'sales_invoices', 'channel'):
+        op.drop_index('ix_sales_invoices_channel', 'sales_invoices')
+        op.drop_column('sales_invoices', 'channel')
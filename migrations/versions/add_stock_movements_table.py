@@ -0,0 +1,58 @@
+"""دفتر حركة المخزون stock_movements مع فهرس (raw_material_id, date)
+
+Revision ID: stock_mov_01
+Revises: vat_snap_01
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'stock_mov_01'
+down_revision = 'vat_snap_01'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, name):
+    if conn.dialect.name == 'sqlite':
+        r = conn.execute(sa.text(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{name}'"))
+        return r.scalar() is not None
+    from sqlalchemy import inspect
+    return name in inspect(conn).get_table_names()
+
+
+def upgrade():
+    conn = op.get_bind()
+    if not _table_exists(conn, 'stock_movements'):
+        op.create_table(
+            'stock_movements',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('raw_material_id', sa.Integer(), nullable=False),
+            sa.Column('date', sa.Date(), nullable=False),
+            sa.Column('movement_type', sa.String(length=20), nullable=False),
+            sa.Column('quantity', sa.Numeric(14, 4), nullable=False),
+            sa.Column('unit_cost', sa.Numeric(12, 4), nullable=False),
+            sa.Column('total_cost', sa.Numeric(14, 4), nullable=False),
+            sa.Column('balance_qty', sa.Numeric(14, 4), nullable=False),
+            sa.Column('avg_cost', sa.Numeric(12, 4), nullable=False),
+            sa.Column('ref_type', sa.String(length=20), nullable=True),
+            sa.Column('ref_id', sa.Integer(), nullable=True),
+            sa.Column('notes', sa.String(length=300), nullable=True),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.ForeignKeyConstraint(['raw_material_id'], ['raw_materials.id']),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        )
+        op.create_index('ix_stock_movements_rm_date', 'stock_movements', ['raw_material_id', 'date'])
+        op.create_index('ix_stock_movements_ref_id', 'stock_movements', ['ref_id'])
+
+
+def downgrade():
+    conn = op.get_bind()
+    if _table_exists(conn, 'stock_movements'):
+        op.drop_index('ix_stock_movements_ref_id', 'stock_movements')
+        op.drop_index('ix_stock_movements_rm_date', 'stock_movements')
+        op.drop_table('stock_movements')
@@ -0,0 +1,45 @@
+"""جدول لقطات إقرار الضريبة vat_return_snapshots
+
+Revision ID: vat_snap_01
+Revises: idx_journal_audit_01
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'vat_snap_01'
+down_revision = 'idx_journal_audit_01'
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, name):
+    if conn.dialect.name == 'sqlite':
+        r = conn.execute(sa.text(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{name}'"))
+        return r.scalar() is not None
+    from sqlalchemy import inspect
+    return name in inspect(conn).get_table_names()
+
+
+def upgrade():
+    conn = op.get_bind()
+    if not _table_exists(conn, 'vat_return_snapshots'):
+        op.create_table(
+            'vat_return_snapshots',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('year', sa.Integer(), nullable=False),
+            sa.Column('quarter', sa.Integer(), nullable=False),
+            sa.Column('branch', sa.String(length=50), nullable=False),
+            sa.Column('data_json', sa.Text(), nullable=False),
+            sa.Column('computed_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('year', 'quarter', 'branch', name='uq_vat_snapshot_period'),
+        )
+
+
+def downgrade():
+    conn = op.get_bind()
+    if _table_exists(conn, 'vat_return_snapshots'):
+        op.drop_table('vat_return_snapshots')
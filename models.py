@@ -99,6 +99,7 @@ class SalesInvoice(db.Model):
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=True)  # Customer reference
     customer_name = db.Column(db.String(100), nullable=True)
     customer_phone = db.Column(db.String(30), nullable=True)
+    channel = db.Column(db.String(30), nullable=True, index=True)  # keeta, hunger, configured platform key; '' = direct
     total_before_tax = db.Column(db.Numeric(12, 2), nullable=False)
     tax_amount = db.Column(db.Numeric(12, 2), nullable=False)
     discount_amount = db.Column(db.Numeric(12, 2), nullable=False, default=0)
@@ -262,7 +263,7 @@ class MealIngredient(db.Model):
     __tablename__ = 'meal_ingredients'
     id = db.Column(db.Integer, primary_key=True)
     meal_id = db.Column(db.Integer, db.ForeignKey('meals.id'), nullable=False)
-    raw_material_id = db.Column(db.Integer, db.ForeignKey('raw_materials.id'), nullable=False)
+    raw_material_id = db.Column(db.Integer, db.ForeignKey('raw_materials.id'), nullable=False, index=True)
     quantity = db.Column(db.Numeric(10, 4), nullable=False)  # Quantity needed
     total_cost = db.Column(db.Numeric(12, 4), nullable=False)  # quantity * cost_per_unit
 
@@ -970,6 +971,10 @@ class JournalEntry(db.Model):
 
 class JournalLine(db.Model):
     __tablename__ = 'journal_lines'
+    __table_args__ = (
+        # كشف الحساب: أسطر الحساب بترتيب (line_date, id) للرصيد المتراكم والترقيم بالمفتاح
+        db.Index('ix_journal_lines_account_date', 'account_id', 'line_date', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     journal_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id'), nullable=False, index=True)
     line_no = db.Column(db.Integer, nullable=False)
@@ -1086,3 +1091,114 @@ class AuditSnapshot(db.Model):
     run_at = db.Column(db.DateTime, nullable=False, default=get_saudi_now, index=True)
 
     fiscal_year = db.relationship('FiscalYear', backref='audit_snapshots')
+
+
+class VatReturnSnapshot(db.Model):
+    """لقطة إقرار ضريبة القيمة المضافة لربع مُقفل — تُحذف عند تعديل أي فاتورة في الربع وتُعاد عند أول طلب."""
+    __tablename__ = 'vat_return_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('year', 'quarter', 'branch', name='uq_vat_snapshot_period'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    quarter = db.Column(db.Integer, nullable=False)
+    branch = db.Column(db.String(50), nullable=False, default='all')
+    data_json = db.Column(db.Text, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False, default=get_saudi_now)
+
+    def __repr__(self):
+        return f'<VatReturnSnapshot {self.year}Q{self.quarter} {self.branch}>'
+
+
+class StockMovement(db.Model):
+    """دفتر حركة المخزون (إلحاق فقط): استلام مشتريات، استهلاك مبيعات، تسويات.
+    الكمية موجبة للوارد وسالبة للصادر؛ balance_qty و avg_cost = حالة المادة بعد الحركة.
+    """
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_rm_date', 'raw_material_id', 'date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    raw_material_id = db.Column(db.Integer, db.ForeignKey('raw_materials.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False, default=lambda: get_saudi_now().date())
+    movement_type = db.Column(db.String(20), nullable=False)  # opening, purchase, sale, adjustment, revaluation
+    quantity = db.Column(db.Numeric(14, 4), nullable=False)
+    unit_cost = db.Column(db.Numeric(12, 4), nullable=False, default=0)
+    total_cost = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    balance_qty = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    avg_cost = db.Column(db.Numeric(12, 4), nullable=False, default=0)
+    ref_type = db.Column(db.String(20), nullable=True)  # purchase, sales, manual
+    ref_id = db.Column(db.Integer, nullable=True, index=True)
+    notes = db.Column(db.String(300), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=get_saudi_now)
+
+    raw_material = db.relationship('RawMaterial', backref='stock_movements')
+
+    def __repr__(self):
+        return f'<StockMovement rm={self.raw_material_id} {self.movement_type} {self.quantity}>'
+
+
+class InvoiceSettlement(db.Model):
+    """حالة سداد الفاتورة (فهرس مشتق): الإجمالي، المسدد من القيود المنشورة، المسدد من جدول الدفعات القديم، المتبقي.
+    يُحدَّث عند ترحيل القيود وتسجيل الدفعات، ويُعاد بناؤه بالكامل عبر scripts/rebuild_invoice_settlements.py.
+    """
+    __tablename__ = 'invoice_settlements'
+    __table_args__ = (
+        db.UniqueConstraint('invoice_type', 'invoice_id', name='uq_invoice_settlement'),
+        db.Index('ix_invoice_settlements_type_status', 'invoice_type', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_type = db.Column(db.String(20), nullable=False)  # sales, purchase, expense
+    invoice_id = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    paid_from_gl = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    paid_legacy = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    remaining = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='unpaid')  # paid, partial, unpaid
+    updated_at = db.Column(db.DateTime, default=get_saudi_now, onupdate=get_saudi_now)
+
+    @property
+    def paid(self):
+        # القيود المنشورة مصدر الحقيقة؛ جدول الدفعات للقديم فقط (لا يُجمع الاثنان)
+        gl = float(self.paid_from_gl or 0)
+        return gl if gl >= 0.01 else float(self.paid_legacy or 0)
+
+    def __repr__(self):
+        return f'<InvoiceSettlement {self.invoice_type} #{self.invoice_id} remaining={self.remaining}>'
+
+
+class PayrollMonthSummary(db.Model):
+    """ملخص الراتب الشهري لكل موظف (فهرس مشتق من المسيرات والدفعات): الاستحقاق، المدفوع، المتبقي.
+    period = YYYYMM لقراءات الفترات كمسح مدى على الفهرس المركّب. يُحدَّث عند commit المسيرات ودفعات الرواتب،
+    ويُعاد بناؤه بالكامل عبر scripts/rebuild_payroll_summaries.py.
+    """
+    __tablename__ = 'payroll_month_summaries'
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'year', 'month', name='uq_payroll_summary_period'),
+        db.Index('ix_payroll_summaries_employee_period', 'employee_id', 'period'),
+        db.Index('ix_payroll_summaries_period_employee', 'period', 'employee_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    period = db.Column(db.Integer, nullable=False)  # year * 100 + month
+    salary_id = db.Column(db.Integer, nullable=True, index=True)
+    basic = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    extra = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    absence = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    incentive = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    allowances = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    deductions = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    prev_due = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    gross = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    paid = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    remaining = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='due')  # paid, partial, due
+    payment_ids = db.Column(db.Text, nullable=True)  # "12,15" لرابط الإيصال
+    last_payment_method = db.Column(db.String(20), nullable=True)
+    updated_at = db.Column(db.DateTime, default=get_saudi_now, onupdate=get_saudi_now)
+
+    def __repr__(self):
+        return f'<PayrollMonthSummary emp={self.employee_id} {self.year}-{self.month} remaining={self.remaining}>'
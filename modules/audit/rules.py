@@ -414,8 +414,8 @@ def rule_journal_account_not_in_coa(from_date: Optional[date], to_date: Optional
     out: List[Dict[str, Any]] = []
     try:
         try:
-            from data.coa_new_tree import build_coa_dict
-            coa = build_coa_dict()
+            from services.coa_index import coa_dict
+            coa = coa_dict()
             allowed_codes = {str(k).strip().upper() for k in (coa.keys() if coa else [])}
         except Exception:
             allowed_codes = set()
@@ -612,9 +612,8 @@ def rule_closed_period_entries(from_date: Optional[date], to_date: Optional[date
 
 def rule_supplier_overpayment(from_date: Optional[date], to_date: Optional[date]) -> List[Dict[str, Any]]:
     """مدفوعات مورد تتجاوز إجمالي فواتيره (ربط خاطئ أو دفعات مكررة)."""
-    from extensions import db
-    from models import PurchaseInvoice, Payment, Account, JournalEntry, JournalLine
-    from sqlalchemy import func
+    from models import PurchaseInvoice
+    from services.invoice_settlement import paid_map
 
     out: List[Dict[str, Any]] = []
     try:
@@ -629,34 +628,11 @@ def rule_supplier_overpayment(from_date: Optional[date], to_date: Optional[date]
         for inv in invs:
             key = (inv.supplier_id, (inv.supplier_name or "").strip())
             by_supplier.setdefault(key, []).append(inv)
-        acc_2111 = Account.query.filter_by(code="2111").first()
+        # مصدر الحقيقة ككشف المورد: قيد 2111 مرتبط بالفاتورة، وإلا جدول الدفعات (لا نجمع الاثنين) — من فهرس السداد
+        paid_all = paid_map("purchase", [inv.id for inv in invs])
         for (sid, sname), list_inv in by_supplier.items():
-            inv_ids = [i.id for i in list_inv]
             total_inv = sum(float(i.total_after_tax_discount or 0) for i in list_inv)
-            # مصدر الحقيقة ككشف المورد: قيد 2111 مرتبط بالفاتورة، وإلا جدول الدفعات (لا نجمع الاثنين)
-            paid_per_inv = {}
-            for inv in list_inv:
-                p_je = 0.0
-                if acc_2111:
-                    p_je = float(
-                        db.session.query(func.coalesce(func.sum(JournalLine.debit), 0))
-                        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-                        .filter(
-                            JournalLine.account_id == acc_2111.id,
-                            JournalLine.invoice_id == inv.id,
-                            JournalLine.invoice_type == "purchase",
-                            JournalEntry.status == "posted",
-                        )
-                        .scalar() or 0
-                    )
-                if p_je < 0.01:
-                    p_je = float(
-                        db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
-                            Payment.invoice_type == "purchase", Payment.invoice_id == inv.id
-                        ).scalar() or 0
-                    )
-                paid_per_inv[inv.id] = round(p_je, 2)
-            total_paid = round(sum(paid_per_inv.values()), 2)
+            total_paid = round(sum(paid_all.get(i.id, 0.0) for i in list_inv), 2)
             total_inv_r = round(total_inv, 2)
             if total_paid > total_inv_r + 0.01:
                 label = sname or (f"supplier_id:{sid}" if sid else "?")
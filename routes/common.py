@@ -23,26 +23,19 @@ def safe_table_number(table_number) -> int:
 
 
 def kv_get(key, default=None):
-    from app.models import AppKV
-    rec = AppKV.query.filter_by(k=key).first()
-    if not rec:
-        return default
-    try:
-        return json.loads(rec.v)
-    except Exception:
-        return default
-
-
-def kv_set(key, value):
-    from app.models import AppKV
-    data = json.dumps(value or {})
-    rec = AppKV.query.filter_by(k=key).first()
-    if rec:
-        rec.v = data
-    else:
-        rec = AppKV(k=key, v=data)
-        db.session.add(rec)
-    db.session.commit()
+    from services import kv_store
+    return kv_store.get(key, default)
+
+
+def kv_get_many(keys):
+    """{key: value} for the keys that exist, in one query (see services.kv_store)."""
+    from services import kv_store
+    return kv_store.get_many(keys)
+
+
+def kv_set(key, value, commit=True):
+    from services import kv_store
+    kv_store.put(key, value or {}, commit=commit)
 
 
 def _normalize_scope(s: str) -> str:
@@ -9,6 +9,7 @@ from sqlalchemy import func
 
 from app import db, csrf
 from models import Customer, SalesInvoice, Payment, Account, JournalEntry, JournalLine
+from utils.request_context import current_settings
 
 bp = Blueprint('customers', __name__)
 
@@ -30,8 +31,7 @@ def _ui_to_db_customer_type(ui_value):
 def _report_header_context():
     """ترويسة موحدة للتقارير: اسم الشركة، الرقم الضريبي، البيانات الرسمية."""
     try:
-        from models import Settings
-        s = Settings.query.first()
+        s = current_settings()
         if not s:
             return {"company_name": "Company", "tax_number": "", "address": "", "phone": "", "email": "", "logo_url": None, "show_logo": False}
         return {
@@ -270,38 +270,25 @@ def customer_statement(cid):
     ).order_by(SalesInvoice.date.asc()).all()
     inv_ids = [int(i.id) for i in invs]
 
-    opening = 0.0
-    for inv in SalesInvoice.query.filter(SalesInvoice.customer_id == cid, SalesInvoice.date < start_dt).all():
-        opening += float(inv.total_after_tax_discount or 0)
-    for p in Payment.query.filter(Payment.invoice_type == 'sales').join(SalesInvoice, Payment.invoice_id == SalesInvoice.id).filter(
-        SalesInvoice.customer_id == cid
-    ).all():
-        pd = getattr(p, 'payment_date', None)
-        pdate = (pd.date() if hasattr(pd, 'date') else pd) if pd else None
-        if pdate is None or pdate >= start_dt:
-            continue
-        opening -= float(p.amount_paid or 0)
+    # الرصيد الافتتاحي بمجموعين في SQL بدل تحميل كل الفواتير والدفعات السابقة
+    from datetime import datetime as _dt, time as _time
+    start_ts = _dt.combine(start_dt, _time.min)
+    opening_inv = db.session.query(func.coalesce(func.sum(SalesInvoice.total_after_tax_discount), 0)).filter(
+        SalesInvoice.customer_id == cid, SalesInvoice.date < start_dt
+    ).scalar() or 0
+    opening_paid = db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).join(
+        SalesInvoice, Payment.invoice_id == SalesInvoice.id
+    ).filter(
+        Payment.invoice_type == 'sales',
+        SalesInvoice.customer_id == cid,
+        Payment.payment_date < start_ts
+    ).scalar() or 0
+    opening = float(opening_inv) - float(opening_paid)
 
     acc_1141 = Account.query.filter_by(code='1141').first()
-    paid_per_inv = {}
-    for inv in invs:
-        paid = 0.0
-        if acc_1141:
-            s = db.session.query(func.coalesce(func.sum(JournalLine.credit), 0)).join(
-                JournalEntry, JournalLine.journal_id == JournalEntry.id
-            ).filter(
-                JournalLine.account_id == acc_1141.id,
-                JournalLine.invoice_id == inv.id,
-                JournalLine.invoice_type == 'sales',
-                JournalEntry.status == 'posted'
-            ).scalar() or 0
-            paid = round(float(s), 2)
-        if paid < 0.01:
-            leg = db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
-                Payment.invoice_type == 'sales', Payment.invoice_id == inv.id
-            ).scalar() or 0
-            paid = round(float(leg), 2)
-        paid_per_inv[inv.id] = paid
+    # المسدد لكل فاتورة من فهرس السداد (قيود 1141 المنشورة وإلا جدول الدفعات)
+    from services.invoice_settlement import paid_map
+    paid_per_inv = paid_map('sales', inv_ids)
 
     if acc_1141:
         unalloc = db.session.query(func.coalesce(func.sum(JournalLine.credit), 0)).join(
@@ -381,14 +368,18 @@ def customer_statement(cid):
                 JournalLine.account_id == acc_1141.id,
                 JournalLine.credit > 0
             ).order_by(JournalEntry.date.asc(), JournalEntry.id.asc(), JournalLine.id.asc()).all()
-            inv_by_id = {inv.id: inv for inv in invs}
+            # أرقام الفواتير المرجعية باستعلام واحد (سطور قد تشير لفواتير خارج الفترة)
+            inv_numbers = {inv.id: inv.invoice_number for inv in invs}
+            other_ids = {int(jl.invoice_id) for jl, _ in lines if jl.invoice_id and jl.invoice_id not in inv_numbers}
+            if other_ids:
+                inv_numbers.update(db.session.query(SalesInvoice.id, SalesInvoice.invoice_number).filter(
+                    SalesInvoice.id.in_(other_ids)
+                ).all())
             for jl, je in lines:
                 dt = getattr(je, 'created_at', None) or getattr(je, 'date', None)
                 ref = ''
                 if getattr(jl, 'invoice_id', None):
-                    si = inv_by_id.get(jl.invoice_id) or SalesInvoice.query.get(jl.invoice_id)
-                    if si:
-                        ref = si.invoice_number or ''
+                    ref = inv_numbers.get(jl.invoice_id) or ''
                 pay_rows.append({
                     'date': dt,
                     'date_display': _date_display(dt),
@@ -399,8 +390,9 @@ def customer_statement(cid):
                     'balance': None
                 })
     if not pay_rows and inv_ids:
+        inv_by_id = {inv.id: inv for inv in invs}
         for p in Payment.query.filter(Payment.invoice_type == 'sales', Payment.invoice_id.in_(inv_ids)).order_by(Payment.payment_date.asc()).all():
-            inv = SalesInvoice.query.get(p.invoice_id)
+            inv = inv_by_id.get(p.invoice_id)
             pd = getattr(p, 'payment_date', None)
             pdate = (pd.date() if hasattr(pd, 'date') else pd) if pd else None
             pd_str = (pdate.strftime('%Y-%m-%d') if pdate and hasattr(pdate, 'strftime') else str(pd or '')[:10])
@@ -21,10 +21,15 @@ from extensions import db, cache
 from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from types import SimpleNamespace
 
-# Cache TTL for trial balance and income statement (5 min)
-TB_CACHE_TTL = 300
+# Computed statements are cached once per (statement, period, branch) and shared by the view, print, export
+# and JSON routes. Trial balance / balance sheet go through services.coa_rollup.gl_rollup; the income
+# statement through _income_statement_result. Entries are tagged (utils.cache_helpers) and dropped on posting,
+# so with a shared cache they live for TAGGED_TTL; 5 min fallback otherwise.
 IS_CACHE_TTL = 300
-from models import Account, AccountUsageMap, JournalEntry, JournalLine, SalesInvoice, PurchaseInvoice, ExpenseInvoice, Salary, Payment, LedgerEntry, Settings, Employee
+IS_CACHE_TAGS = ('gl', 'coa', 'inv:sales', 'inv:purchases')
+from models import Account, AccountUsageMap, JournalEntry, JournalLine, SalesInvoice, PurchaseInvoice, ExpenseInvoice, Salary, Payment, LedgerEntry, Employee
+from utils.request_context import current_settings
+from services.invoice_settlement import paid_map
 
 bp = Blueprint('financials', __name__, url_prefix='/financials')
 
@@ -41,8 +46,8 @@ except Exception:
 def _new_coa_codes():
     """رموز الشجرة الجديدة فقط – للتصفية في ميزان المراجعة وغيره. لا يُرجع أبداً قائمة فارغة."""
     try:
-        from data.coa_new_tree import build_coa_dict
-        return list(build_coa_dict().keys())
+        from services.coa_index import coa_codes
+        return list(coa_codes())
     except Exception:
         try:
             from data.coa_new_tree import NEW_COA_TREE
@@ -54,12 +59,27 @@ def _new_coa_codes():
 def _leaf_coa_codes():
     """رموز الحسابات الورقية فقط (بدون حسابات تجميعية) – لأرقام المدين/الدائن في التقارير. القاعدة: الحساب الذي له أبناء لا يحمل أرقاماً."""
     try:
-        from data.coa_new_tree import LEAF_CODES
-        return list(LEAF_CODES) if LEAF_CODES else _new_coa_codes()
+        from services.coa_index import leaf_codes
+        leaves = leaf_codes()
+        return list(leaves) if leaves else _new_coa_codes()
     except Exception:
         return _new_coa_codes()
 
 
+def _leaf_scope():
+    """(شرط SQL، مجموعة الأوراق) للتقارير: نطاقات BETWEEN من فهرس الشجرة بدل IN بكل رموز الأوراق.
+    المجموعة تصفّي ما قد يلتقطه نطاق من رمز أُضيف بعد بناء الفهرس."""
+    try:
+        from services.coa_index import leaf_codes, leaf_filter
+        leaves = leaf_codes()
+        if leaves:
+            return leaf_filter(Account.code), leaves
+    except Exception:
+        pass
+    codes = _leaf_coa_codes()
+    return Account.code.in_(codes), frozenset(codes)
+
+
 def _normalize_short_aliases():
     try:
         from app.routes import SHORT_TO_NUMERIC
@@ -325,51 +345,177 @@ _REV_OP_CODES = ['4111', '4112', '4120']
 _OTHER_REV_CODES = ['4210', '4211', '4212', '4310']
 
 
-def _jl_sum_by_type(account_types, debit_minus_credit, start_date, end_date, branch):
-    """مجموع من القيود المنشورة فقط حسب نوع الحساب (REVENUE, COGS, EXPENSE). لا اعتماد على رموز ثابتة."""
-    if not account_types:
-        return 0.0
-    sign = (JournalLine.debit - JournalLine.credit) if debit_minus_credit else (JournalLine.credit - JournalLine.debit)
-    q = (
-        db.session.query(func.coalesce(func.sum(sign), 0))
-        .join(Account, JournalLine.account_id == Account.id)
-        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-        .filter(
-            Account.type.in_(account_types),
-            JournalLine.line_date.between(start_date, end_date),
-            JournalEntry.status == 'posted',
-        )
-    )
-    if branch and branch != 'all' and branch in ('china_town', 'place_india'):
-        q = q.filter(JournalEntry.branch_code == branch)
-    return float(q.scalar() or 0)
+def _statement_period():
+    """(period, start_date, end_date) من معاملات الطلب — نفس القاعدة لعرض القائمة وطباعتها وتصديرها."""
+    period = request.args.get('period', 'this_month')
+    start_arg = request.args.get('start_date')
+    end_arg = request.args.get('end_date')
+    start_date, end_date = period_range(period)
+    try:
+        if (period or '') == 'custom':
+            if start_arg and end_arg:
+                start_date = datetime.strptime(start_arg, '%Y-%m-%d').date()
+                end_date = datetime.strptime(end_arg, '%Y-%m-%d').date()
+            else:
+                start_date = datetime(2025, 10, 1).date()
+                end_date = get_saudi_now().date()
+    except Exception:
+        pass
+    return period, start_date, end_date
 
 
-def _jl_detail_by_type(account_types, debit_minus_credit, start_date, end_date, branch):
-    """تفصيل حسب نوع الحساب (للعرض في التقرير). قيود منشورة فقط."""
-    if not account_types:
-        return []
-    sign = (JournalLine.debit - JournalLine.credit) if debit_minus_credit else (JournalLine.credit - JournalLine.debit)
+def _compute_income_statement(start_date, end_date, branch):
+    """قائمة الدخل من القيود المنشورة: استعلام واحد لكل حساب في الفترة تُشتق منه المجاميع والتفاصيل وضريبة
+    القيمة المضافة، ثم المخزون (افتتاحي/ختامي) والمشتريات وملخص الفروع. النتيجة قابلة للتخزين (تواريخ نصية)."""
+    br = branch if branch in ('china_town', 'place_india') else None
     q = (
         db.session.query(
-            Account.code,
-            Account.name,
-            func.coalesce(func.sum(sign), 0).label('amt'),
+            Account.code, Account.name, Account.type,
+            func.coalesce(func.sum(JournalLine.debit), 0),
+            func.coalesce(func.sum(JournalLine.credit), 0),
         )
         .join(Account, JournalLine.account_id == Account.id)
         .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-        .filter(
-            Account.type.in_(account_types),
-            JournalLine.line_date.between(start_date, end_date),
-            JournalEntry.status == 'posted',
-        )
-        .group_by(Account.id)
+        .filter(JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted')
     )
-    if branch and branch != 'all' and branch in ('china_town', 'place_india'):
-        q = q.filter(JournalEntry.branch_code == branch)
-    rows = q.all()
-    return [(r.code, r.name or '', float(r.amt or 0)) for r in rows if abs(float(r.amt or 0)) >= 0.005]
+    if br:
+        q = q.filter(JournalEntry.branch_code == br)
+    revenue_total = cogs_raw = opex_raw = other_exp_raw = tax_raw = 0.0
+    vat_out = vat_in = 0.0
+    rev_detail, cogs_lines, opex_lines = [], [], []
+    # ---------- P&L from POSTED journals only. By Account.type (لا اعتماد على رموز ثابتة). ----------
+    for code, name, atype, d, c in q.group_by(Account.id).order_by(Account.code.asc()).all():
+        d, c = float(d or 0), float(c or 0)
+        t = (atype or '').upper()
+        if t in ('REVENUE', 'OTHER_INCOME'):
+            revenue_total += c - d
+            if abs(c - d) >= 0.005:
+                rev_detail.append((code, name or '', c - d))
+        elif t == 'COGS':
+            cogs_raw += d - c
+            if abs(d - c) >= 0.005:
+                cogs_lines.append((code, name or '', abs(d - c)))
+        elif t == 'EXPENSE':
+            opex_raw += d - c
+            if abs(d - c) >= 0.005:
+                opex_lines.append((code, name or '', abs(d - c)))
+        elif t == 'OTHER_EXPENSE':
+            other_exp_raw += d - c
+        elif t == 'TAX':
+            tax_raw += d - c
+        # Single Source of Truth: VAT from journal only. No fallback to SalesInvoice/PurchaseInvoice.
+        if code == '2141':
+            vat_out += c - d
+        elif code == '1170':
+            vat_in += d - c
+    # عرض تكلفة المبيعات والمصروفات موجبة (مدين)، والطرح في المعادلة: Gross = Revenue - COGS, Operating = Gross - OPEX
+    cogs_total = abs(cogs_raw)
+    opex_total = abs(opex_raw)
 
+    try:
+        from sqlalchemy import case
+        opening_dt = start_date - timedelta(days=1)
+        net = JournalLine.debit - JournalLine.credit
+        opening_inv, closing_inv = db.session.query(
+            func.coalesce(func.sum(case((JournalLine.line_date <= opening_dt, net), else_=0)), 0),
+            func.coalesce(func.sum(net), 0),
+        ).join(Account, JournalLine.account_id == Account.id) \
+         .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
+         .filter(Account.code.in_(['1161', '1162', '1163']), JournalLine.line_date <= end_date,
+                 JournalEntry.status == 'posted').one()
+        opening_inv, closing_inv = float(opening_inv or 0), float(closing_inv or 0)
+    except Exception:
+        opening_inv = closing_inv = 0.0
+
+    try:
+        purch_q = db.session.query(
+            func.coalesce(func.sum(PurchaseInvoice.total_before_tax - PurchaseInvoice.discount_amount), 0)
+        ).filter(PurchaseInvoice.date.between(start_date, end_date))
+        if br:
+            purch_q = purch_q.filter(PurchaseInvoice.branch == br)
+        purchases_amt = float(purch_q.scalar() or 0)
+    except Exception:
+        purchases_amt = 0.0
+
+    waste_amt = 0.0
+    cogs_computed = max(0.0, opening_inv + purchases_amt - closing_inv) + max(0.0, waste_amt)
+
+    gross_profit = revenue_total - cogs_total
+    operating_profit = gross_profit - opex_total
+    vat_net = vat_out - vat_in
+
+    branch_totals = {}
+    branch_channels = {}
+    try:
+        # تجميع واحد على عمود القناة المخزّن؛ القنوات غير المعروفة (عميل مباشر أو غير مصنّفة) = offline
+        from services.sales_channel import channel_keys
+        keys = set(channel_keys())
+        ch_col = func.coalesce(SalesInvoice.channel, '')
+        q_si = db.session.query(
+            SalesInvoice.branch, ch_col,
+            func.coalesce(func.sum(SalesInvoice.total_before_tax), 0),
+            func.coalesce(func.sum(SalesInvoice.discount_amount), 0),
+            func.coalesce(func.sum(SalesInvoice.tax_amount), 0),
+            func.coalesce(func.sum(SalesInvoice.total_after_tax_discount), 0),
+            func.count(SalesInvoice.id),
+        ).filter(SalesInvoice.date.between(start_date, end_date))
+        if br:
+            q_si = q_si.filter(SalesInvoice.branch == br)
+        for b_name, ch, gross, disc, vat, net, cnt in q_si.group_by(SalesInvoice.branch, ch_col).all():
+            b = (b_name or '').strip() or 'unknown'
+            ch = ch if ch in keys else 'offline'
+            for row in (branch_totals.setdefault(b, {'gross': 0.0, 'discount': 0.0, 'vat': 0.0, 'net': 0.0}),
+                        branch_channels.setdefault(b, {}).setdefault(
+                            ch, {'gross': 0.0, 'discount': 0.0, 'vat': 0.0, 'net': 0.0, 'count': 0})):
+                row['gross'] += float(gross or 0)
+                row['discount'] += float(disc or 0)
+                row['vat'] += float(vat or 0)
+                row['net'] += float(net or 0)
+            branch_channels[b][ch]['count'] += int(cnt or 0)
+    except Exception:
+        pass
+
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'branch': branch,
+        'revenue': revenue_total,
+        'cogs': cogs_total,
+        'gross_profit': gross_profit,
+        'operating_expenses': opex_total,
+        'operating_profit': operating_profit,
+        # حسابات OTHER_EXPENSE و TAX (تستخدمها الطباعة والتصدير)
+        'other_expense_accounts': abs(other_exp_raw),
+        'tax_accounts': abs(tax_raw),
+        'vat_out': vat_out,
+        'vat_in': vat_in,
+        'vat_net': vat_net,
+        'cogs_breakdown': {
+            'opening': opening_inv,
+            'purchases': purchases_amt,
+            'closing': closing_inv,
+            'waste': waste_amt,
+            'computed': cogs_computed,
+            'journal': cogs_raw,
+            'used': 'journal',
+        },
+        'cogs_lines': cogs_lines,
+        'opex_lines': opex_lines,
+        'rev_detail': rev_detail,
+        'branch_totals': branch_totals,
+        'branch_channels': branch_channels,
+    }
+
+
+def _income_statement_result(start_date, end_date, branch):
+    """نتيجة قائمة الدخل المشتركة بين العرض والطباعة والتصدير، مخزنة بمفتاح (الفترة، الفرع) وموسومة بإصدار
+    القيود (IS_CACHE_TAGS) فتسقط عند أي ترحيل."""
+    key = f"stmt:income_statement:{start_date.isoformat()}:{end_date.isoformat()}:{branch or 'all'}"
+    if not cache:
+        return _compute_income_statement(start_date, end_date, branch)
+    from utils.cache_helpers import cached_tagged, tagged_ttl
+    return cached_tagged(key, IS_CACHE_TAGS, lambda: _compute_income_statement(start_date, end_date, branch),
+                         tagged_ttl(IS_CACHE_TTL))
 
 def _jl_sum_codes(codes, credit_minus_debit, start_date, end_date, branch):
     """Sum JournalLine by account codes. POSTED entries only (Single Source of Truth). credit_minus_debit=True for revenue."""
@@ -415,195 +561,30 @@ def income_statement():
     if not request.args.get('embed'):
         qs = request.query_string.decode() if request.query_string else ''
         return redirect(url_for('financials.print_income_statement') + ('?' + qs if qs else ''))
-    period = request.args.get('period', 'this_month')
-    start_arg = request.args.get('start_date')
-    end_arg = request.args.get('end_date')
     branch = (request.args.get('branch') or 'all').strip()
     detail = request.args.get('detail', '0').strip() in ('1', 'true', 'on', 'yes')
-    start_date, end_date = period_range(period)
-    try:
-        if (period or '') == 'custom':
-            if start_arg and end_arg:
-                start_date = datetime.strptime(start_arg, '%Y-%m-%d').date()
-                end_date = datetime.strptime(end_arg, '%Y-%m-%d').date()
-            else:
-                start_date = datetime(2025, 10, 1).date()
-                end_date = get_saudi_now().date()
-    except Exception:
-        pass
-
-    if cache:
-        is_key = f"income_statement:{start_date.isoformat()}:{end_date.isoformat()}:{branch}"
-        cached_is = cache.get(is_key)
-        if cached_is is not None:
-            from datetime import datetime as _dt
-            data = dict(cached_is)
-            data['start_date'] = _dt.strptime(cached_is['start_date'], '%Y-%m-%d').date()
-            data['end_date'] = _dt.strptime(cached_is['end_date'], '%Y-%m-%d').date()
-            if request.args.get('embed'):
-                return render_template('financials/income_statement_embed.html', data=data)
-            return render_template('financials/income_statement.html', data=data)
+    period, start_date, end_date = _statement_period()
+    res = _income_statement_result(start_date, end_date, branch)
 
-    # ---------- P&L from POSTED journals only. By Account.type (لا اعتماد على رموز ثابتة). ----------
-    revenue_total = _jl_sum_by_type(['REVENUE', 'OTHER_INCOME'], False, start_date, end_date, branch)
-    cogs_raw = _jl_sum_by_type(['COGS'], True, start_date, end_date, branch)
-    opex_raw = _jl_sum_by_type(['EXPENSE'], True, start_date, end_date, branch)
-    # عرض تكلفة المبيعات والمصروفات موجبة (مدين)، والطرح في المعادلة: Gross = Revenue - COGS, Operating = Gross - OPEX
-    cogs_total = abs(cogs_raw)
-    opex_total = abs(opex_raw)
     other_rev = 0.0
-    other_exp_raw = 0.0
     other_exp = 0.0
-
-    rev_detail = _jl_detail_by_type(['REVENUE', 'OTHER_INCOME'], False, start_date, end_date, branch)
-    cogs_lines = [(code, name, abs(amt)) for code, name, amt in _jl_detail_by_type(['COGS'], True, start_date, end_date, branch)]
-    opex_lines = [(code, name, abs(amt)) for code, name, amt in _jl_detail_by_type(['EXPENSE'], True, start_date, end_date, branch)]
-    other_rev_lines = []
-    other_exp_lines = []
-
-    cogs_j = cogs_raw
-
-    def inv_balance(code, end_dt):
-        q = db.session.query(func.coalesce(func.sum(JournalLine.debit - JournalLine.credit), 0)).join(
-            Account, JournalLine.account_id == Account.id
-        ).join(JournalEntry, JournalLine.journal_id == JournalEntry.id).filter(
-            Account.code == code, JournalLine.line_date <= end_dt, JournalEntry.status == 'posted'
-        )
-        return float(q.scalar() or 0)
-
-    try:
-        opening_dt = start_date - timedelta(days=1)
-        inv_codes = ['1161', '1162', '1163']
-        opening_inv = sum(inv_balance(c, opening_dt) for c in inv_codes)
-        closing_inv = sum(inv_balance(c, end_date) for c in inv_codes)
-    except Exception:
-        opening_inv = closing_inv = 0.0
-
-    try:
-        purch_q = db.session.query(
-            func.coalesce(func.sum(PurchaseInvoice.total_before_tax - PurchaseInvoice.discount_amount), 0)
-        ).filter(PurchaseInvoice.date.between(start_date, end_date))
-        if branch in ('china_town', 'place_india'):
-            purch_q = purch_q.filter(PurchaseInvoice.branch == branch)
-        purchases_amt = float(purch_q.scalar() or 0)
-    except Exception:
-        purchases_amt = 0.0
-
-    waste_amt = 0.0
-
-    cogs_computed = max(0.0, opening_inv + purchases_amt - closing_inv) + max(0.0, waste_amt)
-    # Single Source of Truth: P&L uses journal only. cogs_total/opex_total = |مجموع القيود| (موجب للعرض والطرح).
-
-    gross_profit = revenue_total - cogs_total
-    operating_profit = gross_profit - opex_total
-    net_before_other = operating_profit + other_rev - other_exp
-
-    vat_out = float(
-        db.session.query(func.coalesce(func.sum(JournalLine.credit - JournalLine.debit), 0))
-        .join(Account, JournalLine.account_id == Account.id)
-        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-        .filter(Account.code == '2141', JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted')
-        .scalar() or 0
-    )
-    vat_in = float(
-        db.session.query(func.coalesce(func.sum(JournalLine.debit - JournalLine.credit), 0))
-        .join(Account, JournalLine.account_id == Account.id)
-        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-        .filter(Account.code == '1170', JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted')
-        .scalar() or 0
-    )
-    if branch in ('china_town', 'place_india'):
-        voq = db.session.query(func.coalesce(func.sum(JournalLine.credit - JournalLine.debit), 0)).join(
-            Account, JournalLine.account_id == Account.id
-        ).join(JournalEntry, JournalLine.journal_id == JournalEntry.id).filter(
-            Account.code == '2141', JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted', JournalEntry.branch_code == branch
-        ).scalar() or 0
-        viq = db.session.query(func.coalesce(func.sum(JournalLine.debit - JournalLine.credit), 0)).join(
-            Account, JournalLine.account_id == Account.id
-        ).join(JournalEntry, JournalLine.journal_id == JournalEntry.id).filter(
-            Account.code == '1170', JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted', JournalEntry.branch_code == branch
-        ).scalar() or 0
-        vat_out = float(voq)
-        vat_in = float(viq)
-    # Single Source of Truth: VAT from journal only. No fallback to SalesInvoice/PurchaseInvoice.
-    vat_net = vat_out - vat_in
-    tax = max(vat_net, 0.0)
-    net_profit_after_tax = net_before_other - tax
-
-    cogs_breakdown = {
-        'opening': opening_inv,
-        'purchases': purchases_amt,
-        'closing': closing_inv,
-        'waste': waste_amt,
-        'computed': cogs_computed,
-        'journal': cogs_j,
-        'used': 'journal',
-    }
-
-    branch_totals = {}
-    branch_channels = {}
-    try:
-        q_si = db.session.query(SalesInvoice).filter(SalesInvoice.date.between(start_date, end_date))
-        if branch in ('china_town', 'place_india'):
-            q_si = q_si.filter(SalesInvoice.branch == branch)
-        for inv in q_si.all():
-            br = (getattr(inv, 'branch', '') or '').strip() or 'unknown'
-            s = (getattr(inv, 'customer_name', '') or '').lower()
-            ch = 'hunger' if any(x in s for x in ('hunger', 'هنقر', 'هونقر')) else (
-                'keeta' if any(x in s for x in ('keeta', 'كيتا', 'كيت')) else 'offline'
-            )
-            bt = branch_totals.setdefault(br, {'gross': 0.0, 'discount': 0.0, 'vat': 0.0, 'net': 0.0})
-            bt['gross'] += float(inv.total_before_tax or 0)
-            bt['discount'] += float(inv.discount_amount or 0)
-            bt['vat'] += float(inv.tax_amount or 0)
-            bt['net'] += float(inv.total_after_tax_discount or 0)
-            bc = branch_channels.setdefault(br, {})
-            row = bc.setdefault(ch, {'gross': 0.0, 'discount': 0.0, 'vat': 0.0, 'net': 0.0, 'count': 0})
-            row['gross'] += float(inv.total_before_tax or 0)
-            row['discount'] += float(inv.discount_amount or 0)
-            row['vat'] += float(inv.tax_amount or 0)
-            row['net'] += float(inv.total_after_tax_discount or 0)
-            row['count'] += 1
-    except Exception:
-        pass
-
+    net_before_other = res['operating_profit'] + other_rev - other_exp
+    tax = max(res['vat_net'], 0.0)
     data = {
+        **res,
         'period': period,
         'start_date': start_date,
         'end_date': end_date,
         'branch': branch,
         'detail': detail,
-        'revenue': revenue_total,
-        'cogs': cogs_total,
-        'gross_profit': gross_profit,
-        'operating_expenses': opex_total,
-        'operating_profit': operating_profit,
         'other_income': other_rev,
         'other_expenses': other_exp,
         'net_profit_before_tax': net_before_other,
-        'net_profit_after_tax': net_profit_after_tax,
+        'net_profit_after_tax': net_before_other - tax,
         'tax': tax,
-        'vat_out': vat_out,
-        'vat_in': vat_in,
-        'vat_net': vat_net,
-        'cogs_breakdown': cogs_breakdown,
-        'cogs_lines': cogs_lines,
-        'opex_lines': opex_lines,
-        'rev_detail': rev_detail,
-        'other_rev_lines': other_rev_lines,
-        'other_exp_lines': other_exp_lines,
-        'branch_totals': branch_totals,
-        'branch_channels': branch_channels,
+        'other_rev_lines': [],
+        'other_exp_lines': [],
     }
-    if cache:
-        try:
-            cache.set(
-                f"income_statement:{start_date.isoformat()}:{end_date.isoformat()}:{branch}",
-                {**data, 'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()},
-                timeout=IS_CACHE_TTL,
-            )
-        except Exception:
-            pass
     if request.args.get('embed'):
         return render_template('financials/income_statement_embed.html', data=data)
     return render_template('financials/income_statement.html', data=data)
@@ -662,12 +643,26 @@ _BS_EXCLUDE_CODES = frozenset({'0006', '1000', '2000', '3000'})  # نظامية
 _BS_ALWAYS_SHOW_CODES = frozenset({'2111', '2113', '2114', '2121', '3210', '3220'})
 
 
+def _bs_class(code):
+    try:
+        from services.coa_index import bs_class
+        return bs_class(code)
+    except Exception:
+        return None
+
+
 def _is_current_asset(code):
+    cls = _bs_class(code)
+    if cls is not None:
+        return cls == 'current'
     c = (code or '').strip()
     return any(c.startswith(p) for p in _BS_CURRENT_ASSET_PREFIX) and not c.startswith('12')
 
 
 def _is_current_liab(code):
+    cls = _bs_class(code)
+    if cls is not None:
+        return cls == 'current'
     c = (code or '').strip()
     return any(c.startswith(p) for p in _BS_CURRENT_LIAB_PREFIX) and not c.startswith('22')
 
@@ -718,6 +713,93 @@ def _tb_show(row, exclude=None, hide_zero_balance=False):
     return True
 
 
+# مجموعات ميزان المراجعة بالترتيب المعروض: (النوع، المفتاح، الاسم)
+_TB_GROUPS = (
+    ('ASSET', 'ASSET_C', 'أصول متداولة'),
+    ('ASSET', 'ASSET_NC', 'أصول غير متداولة'),
+    ('LIABILITY', 'LIAB_C', 'التزامات متداولة'),
+    ('LIABILITY', 'LIAB_NC', 'التزامات غير متداولة'),
+    ('EQUITY', 'EQUITY', 'حقوق الملكية'),
+    ('REVENUE', 'REVENUE', 'الإيرادات'),
+    ('EXPENSE', 'EXPENSE', 'المصروفات'),
+    ('COGS', 'COGS', 'تكلفة المبيعات'),
+    ('TAX', 'TAX', 'ضرائب'),
+)
+_TB_ORDER = ['ASSET', 'LIABILITY', 'EQUITY', 'REVENUE', 'EXPENSE', 'COGS', 'TAX']
+
+
+def _tb_group_key(r):
+    if r.type == 'ASSET':
+        return 'ASSET_C' if _is_current_asset(r.code) else 'ASSET_NC'
+    if r.type == 'LIABILITY':
+        return 'LIAB_C' if _is_current_liab(r.code) else 'LIAB_NC'
+    return r.type
+
+
+def _tb_leaf_rows(asof):
+    """أوراق ميزان المراجعة من gl_rollup (نفس النتيجة للعرض والطباعة والتصدير و JSON)، مرتبة بالرمز.
+    الحسابات الموجودة في الجدول تُعاد حتى بلا حركة؛ التصفية على المستدعي."""
+    from services.coa_rollup import gl_rollup
+    out = [
+        SimpleNamespace(code=r['code'], name=r['name'], type=r['type'],
+                        debit=r['own_debit'], credit=r['own_credit'])
+        for r in gl_rollup(asof)['rows']
+        if r['is_leaf'] and (r['has_account'] or _tb_has_movement(r['own_debit'], r['own_credit']))
+    ]
+    out.sort(key=lambda r: r.code)
+    return out
+
+
+
+def _bs_branch(branch):
+    return branch if branch in ('china_town', 'place_india') else None
+
+
+def _balance_sheet_figures(asof, branch=None):
+    """أرقام الميزانية في مرور واحد على gl_rollup (العرض والطباعة والتصدير): المجاميع متداول/غير متداول،
+    صفوف التفاصيل المعروضة لكل قسم، مجاميع الأنواع، وصفوف الحسابات (أرقام كل حساب الخاصة)."""
+    from services.coa_rollup import gl_rollup
+    fig = {
+        'current_assets': 0.0, 'noncurrent_assets': 0.0,
+        'current_liabilities': 0.0, 'noncurrent_liabilities': 0.0,
+        'detail': {'asset_current': [], 'asset_noncurrent': [], 'liab_current': [], 'liab_noncurrent': [], 'equity': []},
+        'type_totals': {}, 'accounts': [],
+    }
+    for r in gl_rollup(asof, _bs_branch(branch))['rows']:
+        d, c = r['own_debit'], r['own_credit']
+        if not (r['has_account'] or _tb_has_movement(d, c)):
+            continue
+        t = r['type']
+        fig['accounts'].append(r)
+        tt = fig['type_totals'].setdefault(t, {'debit': 0.0, 'credit': 0.0})
+        tt['debit'] += d
+        tt['credit'] += c
+        if t == 'ASSET':
+            if r['code'] == '0006':
+                continue
+            bal = d - c
+            curr = _is_current_asset(r['code'])
+            fig['current_assets' if curr else 'noncurrent_assets'] += bal
+            row = {'code': r['code'], 'name': r['name'], 'balance': bal, 'class': 'Current' if curr else 'Non-current'}
+            section = 'asset_current' if curr else 'asset_noncurrent'
+        elif t == 'LIABILITY':
+            bal = c - d
+            curr = _is_current_liab(r['code'])
+            fig['current_liabilities' if curr else 'noncurrent_liabilities'] += bal
+            row = {'code': r['code'], 'name': r['name'], 'balance': bal, 'class': 'Current' if curr else 'Non-current'}
+            section = 'liab_current' if curr else 'liab_noncurrent'
+        elif t == 'EQUITY':
+            row = {'code': r['code'], 'name': r['name'], 'balance': c - d}
+            section = 'equity'
+        else:
+            continue
+        if _bs_show_in_detail(row):
+            fig['detail'][section].append(row)
+    fig['assets'] = fig['current_assets'] + fig['noncurrent_assets']
+    fig['liabilities'] = fig['current_liabilities'] + fig['noncurrent_liabilities']
+    fig['equity'] = fig['assets'] - fig['liabilities']
+    return fig
+
 @bp.route('/balance_sheet')
 def balance_sheet():
     # فتح قالب الطباعة مباشرة دون توجيه المستخدم لشاشة أخرى
@@ -731,87 +813,28 @@ def balance_sheet():
         asof = datetime.strptime(asof_str, '%Y-%m-%d').date() if asof_str else today
     except Exception:
         asof = today
-    new_codes = _new_coa_codes()
-    q = (
-        db.session.query(
-            Account.code.label('code'),
-            Account.name.label('name'),
-            Account.type.label('type'),
-            func.coalesce(func.sum(JournalLine.debit), 0).label('debit'),
-            func.coalesce(func.sum(JournalLine.credit), 0).label('credit'),
-        )
-        .outerjoin(JournalLine, JournalLine.account_id == Account.id)
-        .outerjoin(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-        .filter(or_(JournalLine.id.is_(None), and_(JournalLine.line_date <= asof, JournalEntry.status == 'posted')))
-        .filter(Account.code.in_(new_codes))
-    )
-    if branch and branch != 'all' and branch in ('china_town', 'place_india'):
-        q = q.filter(or_(JournalEntry.id.is_(None), JournalEntry.branch_code == branch))
-    rows = q.group_by(Account.id).order_by(Account.type.asc(), Account.code.asc()).all()
-    current_assets = 0.0
-    noncurrent_assets = 0.0
-    current_liabilities = 0.0
-    noncurrent_liabilities = 0.0
-    asset_rows_detail = []
-    liability_rows_detail = []
-    equity_rows_detail = []
-    for r in rows:
-        if r.type == 'ASSET':
-            if (r.code or '').strip() == '0006':
-                continue
-            bal = float(r.debit or 0) - float(r.credit or 0)
-            curr = _is_current_asset(r.code)
-            if curr:
-                current_assets += bal
-            else:
-                noncurrent_assets += bal
-            asset_rows_detail.append({
-                'code': r.code, 'name': r.name, 'balance': bal,
-                'class': 'Current' if curr else 'Non-current',
-            })
-        elif r.type == 'LIABILITY':
-            bal = float(r.credit or 0) - float(r.debit or 0)
-            curr = _is_current_liab(r.code)
-            if curr:
-                current_liabilities += bal
-            else:
-                noncurrent_liabilities += bal
-            liability_rows_detail.append({
-                'code': r.code, 'name': r.name, 'balance': bal,
-                'class': 'Current' if curr else 'Non-current',
-            })
-        elif r.type == 'EQUITY':
-            bal = float(r.credit or 0) - float(r.debit or 0)
-            equity_rows_detail.append({'code': r.code, 'name': r.name, 'balance': bal})
-    assets = current_assets + noncurrent_assets
-    liabilities = current_liabilities + noncurrent_liabilities
-    equity = assets - liabilities
-    type_totals = {}
-    for r in rows:
-        t = (getattr(r, 'type', None) or '').upper()
-        d, c = float(r.debit or 0), float(r.credit or 0)
-        if t not in type_totals:
-            type_totals[t] = {'debit': 0.0, 'credit': 0.0}
-        type_totals[t]['debit'] += d
-        type_totals[t]['credit'] += c
-    try:
-        settings = Settings.query.first()
+    fig = _balance_sheet_figures(asof, branch)
+    current_assets = fig['current_assets']
+    noncurrent_assets = fig['noncurrent_assets']
+    current_liabilities = fig['current_liabilities']
+    noncurrent_liabilities = fig['noncurrent_liabilities']
+    assets = fig['assets']
+    liabilities = fig['liabilities']
+    equity = fig['equity']
+    type_totals = fig['type_totals']
+    try:
+        settings = current_settings()
     except Exception:
         settings = None
     company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
     branch_label = 'الكل' if not branch or branch == 'all' else ('China Town' if branch == 'china_town' else 'Place India')
 
-    def _filter_movement(lst, class_name=None):
-        out = [x for x in lst if _bs_show_in_detail(x)]
-        if class_name:
-            out = [x for x in out if x.get('class') == class_name]
-        return out
-
-    asset_current_active = _filter_movement(asset_rows_detail, 'Current')
-    asset_noncurrent_active = _filter_movement(asset_rows_detail, 'Non-current')
-    liab_current_active = _filter_movement(liability_rows_detail, 'Current')
-    liab_noncurrent_active = _filter_movement(liability_rows_detail, 'Non-current')
-    equity_active = [x for x in equity_rows_detail if _bs_show_in_detail(x)]
+    detail = fig['detail']
+    asset_current_active = detail['asset_current']
+    asset_noncurrent_active = detail['asset_noncurrent']
+    liab_current_active = detail['liab_current']
+    liab_noncurrent_active = detail['liab_noncurrent']
+    equity_active = detail['equity']
 
     n_ca = len(asset_current_active)
     n_nca = len(asset_noncurrent_active)
@@ -849,17 +872,6 @@ def balance_sheet():
     return render_template('financials/balance_sheet.html', data=data, settings=settings, logo_url=logo_url)
 
 
-def _trial_balance_from_cache(cached):
-    """Restore trial balance data from cache (dates + object-like access for template)."""
-    from datetime import datetime as _dt
-    out = dict(cached)
-    out['date'] = _dt.strptime(cached['date'], '%Y-%m-%d').date()
-    out['rows'] = [SimpleNamespace(**r) for r in cached['rows']]
-    for g in out['tb_groups']:
-        g['accounts'] = [SimpleNamespace(**a) for a in g.get('accounts', [])]
-    return out
-
-
 @bp.route('/trial_balance')
 def trial_balance():
     # فتح قالب الطباعة مباشرة دون توجيه المستخدم لشاشة أخرى
@@ -873,91 +885,35 @@ def trial_balance():
     except Exception:
         asof = today
     hide_zero = (request.args.get('hide_zero') or '1').strip().lower() in ('1', 'true', 'yes', 'on')
-    cache_key = f"trial_balance:{asof.isoformat()}:{hide_zero}"
-    if cache:
-        cached = cache.get(cache_key)
-        if cached is not None:
-            tb_data = _trial_balance_from_cache(cached)
-            if request.args.get('embed'):
-                return render_template('financials/trial_balance_embed.html', data=tb_data)
-            return render_template('financials/trial_balance.html', data=tb_data)
 
     # فقط الحسابات الورقية (Leaf) — الحساب التجميعي لا يظهر له مدين/دائن/رصيد
-    leaf_codes = _leaf_coa_codes()
-    q = db.session.query(
-        Account.code.label('code'),
-        func.max(Account.name).label('name'),
-        func.max(Account.type).label('type'),
-        func.coalesce(func.sum(JournalLine.debit), 0).label('debit'),
-        func.coalesce(func.sum(JournalLine.credit), 0).label('credit'),
-    ).outerjoin(JournalLine, JournalLine.account_id == Account.id) \
-     .outerjoin(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
-     .filter(or_(JournalLine.id.is_(None), and_(JournalLine.line_date <= asof, JournalEntry.status == 'posted'))) \
-     .filter(Account.code.in_(leaf_codes))
-    raw = q.group_by(Account.code).order_by(func.max(Account.type).asc(), Account.code.asc()).all()
-    rows = [r for r in raw if _tb_show(r, hide_zero_balance=hide_zero)]
+    rows = [r for r in _tb_leaf_rows(asof) if _tb_show(r, hide_zero_balance=hide_zero)]
 
-    total_debit = float(sum([float(r.debit or 0) for r in rows]))
-    total_credit = float(sum([float(r.credit or 0) for r in rows]))
+    total_debit = 0.0
+    total_credit = 0.0
     type_totals = {}
+    buckets = {}
     for r in rows:
-        t = (getattr(r, 'type', None) or '').upper()
-        if t not in type_totals:
-            type_totals[t] = {'debit': 0.0, 'credit': 0.0}
-        type_totals[t]['debit'] += float(r.debit or 0)
-        type_totals[t]['credit'] += float(r.credit or 0)
-
-    from data.coa_new_tree import get_account_display_name
-    def _row_dict(r):
-        return {'code': r.code, 'name': get_account_display_name(r.code, r.name), 'debit': float(r.debit or 0), 'credit': float(r.credit or 0)}
+        total_debit += r.debit
+        total_credit += r.credit
+        tt = type_totals.setdefault(r.type, {'debit': 0.0, 'credit': 0.0})
+        tt['debit'] += r.debit
+        tt['credit'] += r.credit
+        buckets.setdefault(_tb_group_key(r), []).append(
+            {'code': r.code, 'name': r.name, 'debit': r.debit, 'credit': r.credit})
 
     tb_groups = []
-    order = ['ASSET', 'LIABILITY', 'EQUITY', 'REVENUE', 'EXPENSE', 'COGS', 'TAX']
-    for t in order:
-        accs = [_row_dict(r) for r in rows if (getattr(r, 'type', None) or '').upper() == t]
-        if not accs:
-            continue
-        if t == 'ASSET':
-            cur = [a for a in accs if _is_current_asset(a['code'])]
-            ncur = [a for a in accs if not _is_current_asset(a['code'])]
-            if cur:
-                tb_groups.append({
-                    'type': t, 'group_name': 'أصول متداولة', 'group_key': 'ASSET_C',
-                    'accounts': cur,
-                    'debit': sum(a['debit'] for a in cur), 'credit': sum(a['credit'] for a in cur),
-                })
-            if ncur:
-                tb_groups.append({
-                    'type': t, 'group_name': 'أصول غير متداولة', 'group_key': 'ASSET_NC',
-                    'accounts': ncur,
-                    'debit': sum(a['debit'] for a in ncur), 'credit': sum(a['credit'] for a in ncur),
-                })
-        elif t == 'LIABILITY':
-            cur = [a for a in accs if _is_current_liab(a['code'])]
-            ncur = [a for a in accs if not _is_current_liab(a['code'])]
-            if cur:
-                tb_groups.append({
-                    'type': t, 'group_name': 'التزامات متداولة', 'group_key': 'LIAB_C',
-                    'accounts': cur,
-                    'debit': sum(a['debit'] for a in cur), 'credit': sum(a['credit'] for a in cur),
-                })
-            if ncur:
-                tb_groups.append({
-                    'type': t, 'group_name': 'التزامات غير متداولة', 'group_key': 'LIAB_NC',
-                    'accounts': ncur,
-                    'debit': sum(a['debit'] for a in ncur), 'credit': sum(a['credit'] for a in ncur),
-                })
-        else:
+    for t, key, label in _TB_GROUPS:
+        accs = buckets.get(key)
+        if accs:
             tb_groups.append({
-                'type': t,
-                'group_name': {'EQUITY': 'حقوق الملكية', 'REVENUE': 'الإيرادات', 'EXPENSE': 'المصروفات', 'COGS': 'تكلفة المبيعات', 'TAX': 'ضرائب'}.get(t, t),
-                'group_key': t,
-                'accounts': accs,
+                'type': t, 'group_name': label, 'group_key': key, 'accounts': accs,
                 'debit': sum(a['debit'] for a in accs), 'credit': sum(a['credit'] for a in accs),
             })
+    order = list(_TB_ORDER)
 
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
     except Exception:
         company_name = 'Company'
@@ -973,22 +929,6 @@ def trial_balance():
         'order': order,
         'hide_zero': hide_zero,
     }
-    if cache:
-        cache_data = {
-            'date': asof.isoformat(),
-            'company_name': company_name,
-            'rows': [_row_dict(r) for r in rows],
-            'total_debit': total_debit,
-            'total_credit': total_credit,
-            'type_totals': type_totals,
-            'tb_groups': tb_groups,
-            'order': order,
-            'hide_zero': hide_zero,
-        }
-        try:
-            cache.set(cache_key, cache_data, timeout=TB_CACHE_TTL)
-        except Exception:
-            pass
     if request.args.get('embed'):
         return render_template('financials/trial_balance_embed.html', data=tb_data)
     return render_template('financials/trial_balance.html', data=tb_data)
@@ -1003,20 +943,8 @@ def print_trial_balance():
     except Exception:
         asof = today
     hide_zero = (request.args.get('hide_zero') or '1').strip().lower() in ('1', 'true', 'yes', 'on')
-    leaf_codes = _leaf_coa_codes()
-    q = db.session.query(
-        Account.code.label('code'),
-        func.max(Account.name).label('name'),
-        func.max(Account.type).label('type'),
-        func.coalesce(func.sum(JournalLine.debit), 0).label('debit'),
-        func.coalesce(func.sum(JournalLine.credit), 0).label('credit'),
-    ).join(JournalLine, JournalLine.account_id == Account.id) \
-     .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
-     .filter(JournalLine.line_date <= asof, JournalEntry.status == 'posted') \
-     .filter(Account.code.in_(leaf_codes))
-    rows = q.group_by(Account.code).order_by(Account.code.asc()).all()
+    rows = [r for r in _tb_leaf_rows(asof) if _tb_has_movement(r.debit, r.credit)]
 
-    from data.coa_new_tree import get_account_display_name
     columns = ["Code", "Account", "Debit", "Credit"]
     data = []
     total_debit = 0.0
@@ -1030,7 +958,7 @@ def print_trial_balance():
         total_credit += c
         data.append({
             "Code": r.code,
-            "Account": get_account_display_name(r.code, r.name),
+            "Account": r.name,
             "Debit": d,
             "Credit": c
         })
@@ -1038,7 +966,7 @@ def print_trial_balance():
 
     from datetime import datetime as _dt
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
         tax_number = (settings.tax_number or '').strip() if settings else ''
         address = (getattr(settings, 'address', None) or '').strip() if settings else ''
@@ -1068,51 +996,21 @@ def print_trial_balance():
 
 @bp.route('/print/income_statement')
 def print_income_statement():
-    period = request.args.get('period', 'this_month')
-    start_arg = request.args.get('start_date')
-    end_arg = request.args.get('end_date')
-    start_date, end_date = period_range(period)
-    if period == 'custom' and start_arg and end_arg:
-        try:
-            start_date = datetime.strptime(start_arg, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_arg, '%Y-%m-%d').date()
-        except Exception:
-            pass
-
+    branch = (request.args.get('branch') or 'all').strip()
+    _period, start_date, end_date = _statement_period()
     # Single Source of Truth: POSTED journal entries only. No fallback to invoices.
-    def sum_revenue():
-        return float(db.session.query(func.coalesce(func.sum(JournalLine.credit - JournalLine.debit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-            .filter(Account.type.in_(['REVENUE', 'OTHER_INCOME']))
-            .filter(JournalLine.line_date.between(start_date, end_date))
-            .filter(JournalEntry.status == 'posted')
-            .scalar() or 0)
-
-    def sum_expense(types):
-        return float(db.session.query(func.coalesce(func.sum(JournalLine.debit - JournalLine.credit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-            .filter(Account.type.in_(types))
-            .filter(JournalLine.line_date.between(start_date, end_date))
-            .filter(JournalEntry.status == 'posted')
-            .scalar() or 0)
-
-    revenue = sum_revenue()
-    cogs_raw = sum_expense(['COGS'])
-    operating_expenses_raw = sum_expense(['EXPENSE'])
-    other_income = 0.0
-    other_expenses_raw = sum_expense(['OTHER_EXPENSE'])
-    tax_raw = sum_expense(['TAX'])
+    res = _income_statement_result(start_date, end_date, branch)
+    revenue = res['revenue']
     # عرض تكلفة المبيعات والمصروفات موجبة (مدين)، والطرح في المعادلة.
-    cogs = abs(cogs_raw)
-    operating_expenses = abs(operating_expenses_raw)
-    other_expenses = abs(other_expenses_raw)
-    tax = abs(tax_raw)
+    cogs = res['cogs']
+    operating_expenses = res['operating_expenses']
+    other_income = 0.0
+    other_expenses = res['other_expense_accounts']
+    tax = res['tax_accounts']
     # No fallback to SalesInvoice/PurchaseInvoice/ExpenseInvoice. If journal says 0, report shows 0 (or loss).
 
-    gross_profit = revenue - cogs
-    operating_profit = gross_profit - operating_expenses
+    gross_profit = res['gross_profit']
+    operating_profit = res['operating_profit']
     net_profit_before_tax = operating_profit + other_income - other_expenses
     net_profit_after_tax = net_profit_before_tax - tax
 
@@ -1133,7 +1031,7 @@ def print_income_statement():
 
     from datetime import datetime as _dt
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
         tax_number = (settings.tax_number or '').strip() if settings else ''
         address = (getattr(settings, 'address', None) or '').strip() if settings else ''
@@ -1166,19 +1064,7 @@ def export_trial_balance():
     except Exception:
         asof = today
     hide_zero = (request.args.get('hide_zero') or '1').strip().lower() in ('1', 'true', 'yes', 'on')
-    leaf_codes = _leaf_coa_codes()
-    q = db.session.query(
-        Account.code.label('code'),
-        func.max(Account.name).label('name'),
-        func.max(Account.type).label('type'),
-        func.coalesce(func.sum(JournalLine.debit), 0).label('debit'),
-        func.coalesce(func.sum(JournalLine.credit), 0).label('credit'),
-    ).outerjoin(JournalLine, JournalLine.account_id == Account.id) \
-     .outerjoin(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
-     .filter(or_(JournalLine.id.is_(None), and_(JournalLine.line_date <= asof, JournalEntry.status == 'posted'))) \
-     .filter(Account.code.in_(leaf_codes))
-    rows = q.group_by(Account.code).order_by(Account.code.asc()).all()
-    from data.coa_new_tree import get_account_display_name
+    rows = _tb_leaf_rows(asof)
     import csv
     from io import StringIO
     buf = StringIO()
@@ -1190,43 +1076,24 @@ def export_trial_balance():
             continue
         d = float(r.debit or 0); c = float(r.credit or 0);
         td += d; tc += c
-        w.writerow([r.code, get_account_display_name(r.code, r.name), f"{d:.2f}", f"{c:.2f}"])
+        w.writerow([r.code, r.name, f"{d:.2f}", f"{c:.2f}"])
     w.writerow(['TOTAL','','{:.2f}'.format(td), '{:.2f}'.format(tc)])
     from flask import Response
     return Response(buf.getvalue(), mimetype='text/csv', headers={'Content-Disposition': f'attachment; filename=trial_balance_{asof}.csv'})
 
 @bp.route('/export/income_statement')
 def export_income_statement():
-    period = request.args.get('period', 'this_month')
-    start_arg = request.args.get('start_date')
-    end_arg = request.args.get('end_date')
-    start_date, end_date = period_range(period)
-    if period == 'custom' and start_arg and end_arg:
-        try:
-            start_date = datetime.strptime(start_arg, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_arg, '%Y-%m-%d').date()
-        except Exception:
-            pass
-    def sum_revenue():
-        return float(db.session.query(func.coalesce(func.sum(JournalLine.credit - JournalLine.debit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-            .filter(Account.type.in_(['REVENUE', 'OTHER_INCOME']), JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted')
-            .scalar() or 0)
-    def sum_expense(types):
-        return float(db.session.query(func.coalesce(func.sum(JournalLine.debit - JournalLine.credit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-            .filter(Account.type.in_(types), JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted')
-            .scalar() or 0)
-    revenue = sum_revenue()
-    cogs = abs(sum_expense(['COGS']))
-    operating_expenses = abs(sum_expense(['EXPENSE']))
+    branch = (request.args.get('branch') or 'all').strip()
+    _period, start_date, end_date = _statement_period()
+    res = _income_statement_result(start_date, end_date, branch)
+    revenue = res['revenue']
+    cogs = res['cogs']
+    operating_expenses = res['operating_expenses']
     other_income = 0.0
-    other_expenses = abs(sum_expense(['OTHER_EXPENSE']))
-    tax = abs(sum_expense(['TAX']))
-    gross_profit = revenue - cogs
-    operating_profit = gross_profit - operating_expenses
+    other_expenses = res['other_expense_accounts']
+    tax = res['tax_accounts']
+    gross_profit = res['gross_profit']
+    operating_profit = res['operating_profit']
     net_profit_before_tax = operating_profit + other_income - other_expenses
     net_profit_after_tax = net_profit_before_tax - tax
     import csv
@@ -1248,47 +1115,14 @@ def print_balance_sheet():
         asof = datetime.strptime(asof_str, '%Y-%m-%d').date() if asof_str else today
     except Exception:
         asof = today
-    new_codes = _new_coa_codes()
-    q = (
-        db.session.query(
-            Account.code.label('code'),
-            Account.name.label('name'),
-            Account.type.label('type'),
-            func.coalesce(func.sum(JournalLine.debit), 0).label('debit'),
-            func.coalesce(func.sum(JournalLine.credit), 0).label('credit'),
-        )
-        .outerjoin(JournalLine, JournalLine.account_id == Account.id)
-        .outerjoin(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-        .filter(or_(JournalLine.id.is_(None), and_(JournalLine.line_date <= asof, JournalEntry.status == 'posted')))
-        .filter(Account.code.in_(new_codes))
-    )
-    if branch and branch != 'all' and branch in ('china_town', 'place_india'):
-        q = q.filter(or_(JournalEntry.id.is_(None), JournalEntry.branch_code == branch))
-    rows = q.group_by(Account.id).order_by(Account.type.asc(), Account.code.asc()).all()
-
-    current_assets = 0.0
-    noncurrent_assets = 0.0
-    current_liabilities = 0.0
-    noncurrent_liabilities = 0.0
-    for r in rows:
-        if (r.code or '').strip() == '0006':
-            continue
-        if r.type == 'ASSET':
-            bal = float(r.debit or 0) - float(r.credit or 0)
-            if _is_current_asset(r.code):
-                current_assets += bal
-            else:
-                noncurrent_assets += bal
-        elif r.type == 'LIABILITY':
-            bal = float(r.credit or 0) - float(r.debit or 0)
-            if _is_current_liab(r.code):
-                current_liabilities += bal
-            else:
-                noncurrent_liabilities += bal
-
-    assets = current_assets + noncurrent_assets
-    liabilities = current_liabilities + noncurrent_liabilities
-    equity = assets - liabilities
+    fig = _balance_sheet_figures(asof, branch)
+    current_assets = fig['current_assets']
+    noncurrent_assets = fig['noncurrent_assets']
+    current_liabilities = fig['current_liabilities']
+    noncurrent_liabilities = fig['noncurrent_liabilities']
+    assets = fig['assets']
+    liabilities = fig['liabilities']
+    equity = fig['equity']
 
     data = [
         {"Section": "Assets", "Current": current_assets, "Non-current": noncurrent_assets, "Total": assets},
@@ -1298,7 +1132,7 @@ def print_balance_sheet():
 
     from datetime import datetime as _dt
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
         tax_number = (settings.tax_number or '').strip() if settings else ''
         address = (getattr(settings, 'address', None) or '').strip() if settings else ''
@@ -1331,33 +1165,16 @@ def export_balance_sheet():
         asof = datetime.strptime(asof_str, '%Y-%m-%d').date() if asof_str else today
     except Exception:
         asof = today
-    new_codes = _new_coa_codes()
-    q = (
-        db.session.query(
-            Account.code, Account.name, Account.type,
-            func.coalesce(func.sum(JournalLine.debit), 0).label('debit'),
-            func.coalesce(func.sum(JournalLine.credit), 0).label('credit'),
-        )
-        .outerjoin(JournalLine, JournalLine.account_id == Account.id)
-        .outerjoin(JournalEntry, JournalLine.journal_id == JournalEntry.id)
-        .filter(or_(JournalLine.id.is_(None), and_(JournalLine.line_date <= asof, JournalEntry.status == 'posted')))
-        .filter(Account.code.in_(new_codes))
-    )
-    if branch and branch != 'all' and branch in ('china_town', 'place_india'):
-        q = q.filter(or_(JournalEntry.id.is_(None), JournalEntry.branch_code == branch))
-    rows = q.group_by(Account.id).order_by(Account.type.asc(), Account.code.asc()).all()
+    rows = sorted(_balance_sheet_figures(asof, branch)['accounts'], key=lambda r: (r['type'] or '', r['code']))
     import csv
     from io import StringIO
     buf = StringIO()
     w = csv.writer(buf)
     w.writerow(['Code', 'Name', 'Type', 'Debit', 'Credit', 'Balance'])
     for r in rows:
-        d, c = float(r.debit or 0), float(r.credit or 0)
-        if (r.type or '') == 'ASSET':
-            bal = d - c
-        else:
-            bal = c - d
-        w.writerow([r.code, r.name or '', r.type or '', f'{d:.2f}', f'{c:.2f}', f'{bal:.2f}'])
+        d, c = r['own_debit'], r['own_credit']
+        bal = d - c if r['type'] == 'ASSET' else c - d
+        w.writerow([r['code'], r['name'] or '', r['type'] or '', f'{d:.2f}', f'{c:.2f}', f'{bal:.2f}'])
     return Response(
         buf.getvalue(),
         mimetype='text/csv',
@@ -1381,7 +1198,7 @@ def accounts():
     # فقط الحسابات الورقية — الحساب التجميعي لا يظهر له أرقام
     from data.coa_new_tree import build_coa_dict
     new_coa = build_coa_dict()
-    leaf_codes = _leaf_coa_codes()
+    leaf_scope, leaf_codes = _leaf_scope()
 
     raw = db.session.query(
         Account.id.label('id'), Account.code.label('code'), Account.name.label('name'), Account.type.label('type'),
@@ -1390,7 +1207,7 @@ def accounts():
         func.coalesce(func.sum(JournalLine.credit), 0).label('credit')
     ).outerjoin(JournalLine, JournalLine.account_id == Account.id) \
      .outerjoin(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
-     .filter(Account.code.in_(leaf_codes)) \
+     .filter(leaf_scope) \
      .filter(or_(JournalLine.id.is_(None), and_(JournalLine.line_date.between(start_date, end_date), JournalEntry.status == 'posted'))) \
      .group_by(Account.id, Account.code, Account.name, Account.type, Account.active, Account.allow_posting) \
      .order_by(Account.code.asc()).all()
@@ -1414,6 +1231,8 @@ def accounts():
     section_order = ['ASSET', 'LIABILITY', 'EQUITY', 'REVENUE', 'EXPENSE', 'COGS', 'TAX']
     rows = []
     for r in raw:
+        if r.code not in leaf_codes:
+            continue
         acc_type = (r.type or (new_coa.get(r.code) or {}).get('type') or 'EXPENSE')
         active = getattr(r, 'active', True) if hasattr(r, 'active') else True
         allow_posting = getattr(r, 'allow_posting', True) if hasattr(r, 'allow_posting') else True
@@ -1437,9 +1256,9 @@ def accounts():
 
     return render_template('financials/accounts.html', rows=rows, start_date=start_date, end_date=end_date)
 
-@bp.route('/account_statement')
-def account_statement():
-    code = request.args.get('code')
+def _statement_account_args():
+    """(acc, start_date, end_date) لكشف الحساب من معاملات الطلب؛ acc=None إن لم يكن الحساب في الشجرة."""
+    code = (request.args.get('code') or '').strip()
     start_arg = request.args.get('start_date')
     end_arg = request.args.get('end_date')
     today = get_saudi_now().date()
@@ -1449,50 +1268,108 @@ def account_statement():
     except Exception:
         start_date = datetime(2025,10,1).date()
         end_date = today
+    acc = Account.query.filter_by(code=code).first() if code else None
+    if acc is not None and code not in _new_coa_codes():
+        acc = None
+    return acc, start_date, end_date
 
-    acc = Account.query.filter_by(code=code).first()
+
+@bp.route('/account_statement')
+def account_statement():
+    from services.account_statement import count_lines, opening_balance, parse_cursor, statement_page
+    acc, start_date, end_date = _statement_account_args()
     if not acc:
         return render_template('financials/account_statement.html', acc=None, entries=[], start_date=start_date, end_date=end_date, opening_balance=0.0, pagination=None)
-    if code and str(code).strip() not in _new_coa_codes():
-        return render_template('financials/account_statement.html', acc=None, entries=[], start_date=start_date, end_date=end_date, opening_balance=0.0, pagination=None)
-
-    rows_raw = db.session.query(JournalLine, JournalEntry.entry_number, JournalEntry.description) \
-        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
-        .filter(JournalEntry.status == 'posted') \
-        .filter(JournalLine.account_id == acc.id) \
-        .filter(JournalLine.line_date.between(start_date, end_date)) \
-        .order_by(JournalLine.line_date.asc(), JournalLine.id.asc()).all()
-
-    opening_debit = float(db.session.query(func.coalesce(func.sum(JournalLine.debit), 0))
-        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id).filter(JournalEntry.status == 'posted')
-        .filter(JournalLine.account_id == acc.id).filter(JournalLine.line_date < start_date).scalar() or 0)
-    opening_credit = float(db.session.query(func.coalesce(func.sum(JournalLine.credit), 0))
-        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id).filter(JournalEntry.status == 'posted')
-        .filter(JournalLine.account_id == acc.id).filter(JournalLine.line_date < start_date).scalar() or 0)
-    opening_balance = opening_debit - opening_credit if (getattr(acc, 'type', None) or '').upper() != 'LIABILITY' else opening_credit - opening_debit
-
-    # رصيد متراكم لكل صف ثم ترقيم الصفحات
-    running = float(opening_balance)
-    entries_with_balance = []
-    for ln, entry_number, desc in rows_raw:
-        change = (float(ln.debit or 0) - float(ln.credit or 0)) if (getattr(acc, 'type', None) or '').upper() != 'LIABILITY' else (float(ln.credit or 0) - float(ln.debit or 0))
-        running += change
-        entries_with_balance.append((ln, entry_number, desc, round(running, 2)))
 
+    # الرصيد المتراكم من دالة نافذة، والصفحة بالمفتاح (line_date, id) — لا تُحمَّل أسطر الفترة كلها
+    opening = opening_balance(acc, start_date)
     per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
-    total_rows = len(entries_with_balance)
-    page = max(request.args.get('page', 1, type=int), 1)
-    total_pages = max(1, (total_rows + per_page - 1) // per_page) if total_rows else 1
-    page = min(page, total_pages)
-    offset = (page - 1) * per_page
-    entries = entries_with_balance[offset:offset + per_page]
-    pagination = {'page': page, 'per_page': per_page, 'total': total_rows, 'total_pages': total_pages,
-                  'has_prev': page > 1, 'has_next': page < total_pages, 'prev_num': page - 1 if page > 1 else None, 'next_num': page + 1 if page < total_pages else None} if total_pages > 1 else None
+    page = statement_page(acc, start_date, end_date, opening, after=parse_cursor(request.args.get('after')),
+                          before=parse_cursor(request.args.get('before')), limit=per_page)
+    pagination = None
+    if page['next'] or page['prev']:
+        pagination = {'per_page': per_page, 'total': count_lines(acc, start_date, end_date),
+                      'has_prev': bool(page['prev']), 'has_next': bool(page['next']),
+                      'prev_cursor': page['prev'], 'next_cursor': page['next']}
 
     from data.coa_new_tree import get_account_display_name
     account_display_name = get_account_display_name(acc.code, acc.name)
-    return render_template('financials/account_statement.html', acc=acc, account_display_name=account_display_name, entries=entries,
-                           start_date=start_date, end_date=end_date, opening_balance=opening_balance, pagination=pagination)
+    return render_template('financials/account_statement.html', acc=acc, account_display_name=account_display_name, entries=page['lines'],
+                           start_date=start_date, end_date=end_date, opening_balance=opening, pagination=pagination)
+
+
+@bp.route('/export/account_statement')
+def export_account_statement():
+    """CSV متدفق: الأسطر تُكتب على دفعات كما تصل من القاعدة."""
+    from services.account_statement import iter_statement, opening_balance
+    acc, start_date, end_date = _statement_account_args()
+    if not acc:
+        return jsonify({'ok': False, 'error': 'account_not_found'}), 404
+    opening = opening_balance(acc, start_date)
+    lines = iter_statement(acc, start_date, end_date, opening)
+
+    def generate():
+        import csv
+        from io import StringIO
+        buf = StringIO()
+        w = csv.writer(buf)
+        w.writerow(['Date', 'Entry', 'Description', 'Debit', 'Credit', 'Balance'])
+        w.writerow([start_date.isoformat(), '', 'Opening Balance', '', '', f"{opening:.2f}"])
+        for i, r in enumerate(lines, 1):
+            w.writerow([r['line_date'], r['entry_number'], r['description'] or '',
+                        f"{r['debit']:.2f}", f"{r['credit']:.2f}", f"{r['balance']:.2f}"])
+            if i % 500 == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate(0)
+        yield buf.getvalue()
+
+    from flask import Response, stream_with_context
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=account_statement_{acc.code}_{start_date}_{end_date}.csv'})
+
+
+@bp.route('/print/account_statement')
+def print_account_statement():
+    """طباعة متدفقة: القالب يُرسل أثناء المرور على الأسطر (المجاميع في ذيل الجدول)."""
+    from services.account_statement import iter_statement, opening_balance
+    acc, start_date, end_date = _statement_account_args()
+    if not acc:
+        return jsonify({'ok': False, 'error': 'account_not_found'}), 404
+    opening = opening_balance(acc, start_date)
+
+    from datetime import datetime as _dt
+    try:
+        settings = current_settings()
+        company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
+        tax_number = (settings.tax_number or '').strip() if settings else ''
+        address = (getattr(settings, 'address', None) or '').strip() if settings else ''
+        logo_url = getattr(settings, 'logo_url', None) if settings else None
+        show_logo = bool(getattr(settings, 'receipt_show_logo', False)) if settings else False
+    except Exception:
+        company_name = 'Company'
+        tax_number = address = ''
+        logo_url = None
+        show_logo = False
+    from data.coa_new_tree import get_account_display_name
+    from flask import Response, stream_template
+    return Response(stream_template(
+        'financials/account_statement_print.html',
+        report_title='Account Statement',
+        report_title_ar='كشف حساب',
+        company_name=company_name,
+        tax_number=tax_number,
+        address=address,
+        logo_url=logo_url,
+        show_logo=show_logo,
+        generated_at=_dt.now().strftime('%Y-%m-%d %H:%M'),
+        account_code=acc.code,
+        account_name=get_account_display_name(acc.code, acc.name),
+        start_date=start_date.strftime('%Y-%m-%d'),
+        end_date=end_date.strftime('%Y-%m-%d'),
+        opening_balance=opening,
+        rows=iter_statement(acc, start_date, end_date, opening),
+    ))
 @bp.route('/backfill_journals', methods=['GET','POST'])
 def backfill_journals():
     if request.method == 'GET':
@@ -1730,7 +1607,7 @@ def print_cash_flow():
     data = _build_cash_flow_data(start_date, end_date)
     data['rows'] = data['rows'][:500]
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
         tax_number = (settings.tax_number or '').strip() if settings else ''
         address = (getattr(settings, 'address', None) or '').strip() if settings else ''
@@ -1777,172 +1654,69 @@ def api_trial_balance_json():
     except Exception:
         asof = today
     hide_zero = (request.args.get('hide_zero') or '1').strip().lower() in ('1', 'true', 'yes', 'on')
-    try:
-        from data.coa_new_tree import build_coa_dict, LEAF_CODES
-        coa = build_coa_dict()
-        LEAF_CODES = set(LEAF_CODES) if LEAF_CODES else set(coa.keys())
-    except Exception:
-        coa = {}
-        LEAF_CODES = set()
-    leaf_codes = list(LEAF_CODES) if LEAF_CODES else _new_coa_codes()
-    # فقط الحسابات الورقية تحمل أرقاماً — التجميعية تُجمّع من الأبناء فقط
-    q = db.session.query(
-        Account.code.label('code'),
-        func.max(Account.name).label('name'),
-        Account.type.label('type'),
-        func.coalesce(func.sum(JournalLine.debit), 0).label('debit'),
-        func.coalesce(func.sum(JournalLine.credit), 0).label('credit')
-    ).outerjoin(JournalLine, JournalLine.account_id == Account.id) \
-     .outerjoin(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
-     .filter(or_(JournalLine.id.is_(None), and_(JournalLine.line_date <= asof, JournalEntry.status == 'posted'))) \
-     .filter(Account.code.in_(leaf_codes))
-    rows = q.group_by(Account.code, Account.type).order_by(Account.type.asc(), Account.code.asc()).all()
-    leaf_balances = {}
-    try:
-        from data.coa_new_tree import OLD_TO_NEW_MAP
-        def _norm_code(c):
-            return OLD_TO_NEW_MAP.get(str(c), str(c))
-    except Exception:
-        def _norm_code(c):
-            return str(c)
-    for r in rows:
-        code_norm = _norm_code(r.code)
-        if code_norm not in LEAF_CODES:
-            continue
-        t = (getattr(r, 'type', None) or '').upper()
-        d = float(r.debit or 0)
-        c = float(r.credit or 0)
-        if code_norm in leaf_balances:
-            leaf_balances[code_norm]['debit'] += d
-            leaf_balances[code_norm]['credit'] += c
-        else:
-            leaf_balances[code_norm] = {'debit': d, 'credit': c, 'type': t}
-        b = leaf_balances[code_norm]
-        bt = (b.get('type') or t or 'ASSET').upper()
-        b['balance'] = (b['debit'] - b['credit']) if bt not in ('LIABILITY', 'EQUITY') else (b['credit'] - b['debit'])
-    try:
-        from data.coa_new_tree import NEW_COA_TREE
-    except Exception:
-        NEW_COA_TREE = []
-    # Aggregate: group balance = sum of all descendant leaf balances
-    def descendants(code):
-        out = []
-        for c, info in coa.items():
-            if info.get('parent_account_code') == code:
-                out.append(c)
-                out.extend(descendants(c))
-        return out
-    def all_descendant_leaves(code):
-        kids = []
-        for c, info in coa.items():
-            if info.get('parent_account_code') == code:
-                if c in LEAF_CODES:
-                    kids.append(c)
-                else:
-                    kids.extend(all_descendant_leaves(c))
-        return kids
-    def agg_balance(code):
-        if code in leaf_balances:
-            return leaf_balances[code]
-        leaves = all_descendant_leaves(code)
-        d = sum(leaf_balances.get(c, {}).get('debit', 0) for c in leaves)
-        c = sum(leaf_balances.get(c, {}).get('credit', 0) for c in leaves)
-        t = coa.get(code, {}).get('type', 'ASSET')
-        bal = (d - c) if t not in ('LIABILITY', 'EQUITY') else (c - d)
-        return {'debit': d, 'credit': c, 'balance': bal, 'type': t}
-    # Build tree order: root -> children depth-first, grouped by type
-    order = ['ASSET', 'LIABILITY', 'EQUITY', 'REVENUE', 'EXPENSE', 'COGS', 'TAX']
-    type_order_map = {t: i for i, t in enumerate(order)}
-    def tree_walk(code, parent_code, level, acc_type):
-        info = coa.get(code, {})
-        name = info.get('name', code)
-        t = (info.get('type') or 'ASSET').upper()
-        if acc_type and t != acc_type:
-            return []
-        data = agg_balance(code)
-        leaves = all_descendant_leaves(code)
-        has_children = len(leaves) > 0 if code not in LEAF_CODES else False
-        if not has_children and code not in LEAF_CODES:
-            direct = [c for c, inf in coa.items() if inf.get('parent_account_code') == code]
-            has_children = len(direct) > 0
-        # الحساب الذي له أبناء → لا يحمل أرقاماً (عرض عنوان فقط)
-        if has_children:
-            data = {'debit': 0, 'credit': 0, 'balance': 0}
-        row = {
-            'code': code, 'name': name, 'debit': data['debit'], 'credit': data['credit'],
-            'balance': data['balance'], 'type': t, 'parent': parent_code, 'level': level,
-            'has_children': has_children
-        }
-        out = [row]
-        children = sorted([c for c, inf in coa.items() if inf.get('parent_account_code') == code],
-                         key=lambda x: (x not in LEAF_CODES, x))
-        for c in children:
-            if not acc_type or coa.get(c, {}).get('type', '') == acc_type:
-                out.extend(tree_walk(c, code, level + 1, None))
-        return out
-    grouped = {}
+    from services.coa_rollup import gl_rollup, subtree
+    # نفس نتيجة التجميع التي يستخدمها العرض والطباعة والتصدير: كل مستوى يحمل مجموع ما تحته
+    result = gl_rollup(asof)
+    rows = result['rows']
+    node_type = {r['code']: r['type'] for r in rows}
+    order = list(_TB_ORDER)
+    grouped = {t: [] for t in order}
     top_level = []
-    for t in order:
-        roots = [r[0] for r in NEW_COA_TREE if (r[3] or '').upper() == t and (r[4] is None or (coa.get(r[4], {}).get('type', '') or '').upper() != t)]
-        roots.sort(key=lambda c: (c in LEAF_CODES, c))
+    for i, r in enumerate(rows):
+        t = r['type']
+        # جذر النوع: بلا أب أو أبوه من نوع آخر (فرع تكلفة المبيعات تحت المصروفات يظهر في النوعين)
+        if t not in grouped or (r['parent'] and node_type.get(r['parent']) == t):
+            continue
+        base = r['level'] - 1
         arr = []
-        for code in roots:
-            arr.extend(tree_walk(code, None, 1, None))
-            info = coa.get(code, {})
-            data = agg_balance(code)
-            top_level.append({
-                'code': code, 'name': info.get('name', code),
-                'debit': round(data['debit'], 2), 'credit': round(data['credit'], 2),
-                'balance': round(data['balance'], 2), 'type': t
+        for x in subtree(rows, i):
+            arr.append({
+                'code': x['code'], 'name': x['name'], 'debit': x['debit'], 'credit': x['credit'],
+                'balance': x['balance'], 'type': x['type'], 'parent': x['parent'] if x is not r else None,
+                'level': x['level'] - base, 'has_children': x['children'] > 0,
             })
-        grouped[t] = arr
-    if hide_zero:
-        for t in grouped:
-            grouped[t] = [r for r in grouped[t] if abs(float(r.get('balance') or 0)) >= 0.005]
-    total_debit = sum(v['debit'] for v in leaf_balances.values())
-    total_credit = sum(v['credit'] for v in leaf_balances.values())
-    return jsonify({'ok': True, 'date': str(asof), 'total_debit': total_debit, 'total_credit': total_credit, 'grouped': grouped, 'order': order, 'top_level': top_level, 'hide_zero': hide_zero})
+        if hide_zero:
+            arr = _tb_json_drop_zero(arr)
+        grouped[t].extend(arr)
+        top_level.append({
+            'code': r['code'], 'name': r['name'],
+            'debit': round(r['debit'], 2), 'credit': round(r['credit'], 2),
+            'balance': round(r['balance'], 2), 'type': t,
+        })
+    return jsonify({'ok': True, 'date': str(asof), 'total_debit': result['total_debit'], 'total_credit': result['total_credit'], 'grouped': grouped, 'order': order, 'top_level': top_level, 'hide_zero': hide_zero})
+
+
+def _tb_json_drop_zero(arr):
+    """إخفاء الصفوف ذات الرصيد الصفري مع إبقاء آباء أي صف ظاهر (حتى لا يفقد الفرع عنوانه)."""
+    keep = [abs(float(x.get('balance') or 0)) >= 0.005 for x in arr]
+    for i in range(len(arr) - 1, -1, -1):
+        if not keep[i]:
+            continue
+        lvl = arr[i]['level']
+        for j in range(i - 1, -1, -1):
+            if arr[j]['level'] < lvl:
+                keep[j] = True
+                lvl = arr[j]['level']
+                if lvl <= 1:
+                    break
+    return [x for x, k in zip(arr, keep) if k]
 
 @bp.route('/api/account_ledger_json')
 def api_account_ledger_json():
+    from services.account_statement import opening_balance, parse_cursor, statement_page
     code = (request.args.get('code') or '').strip()
-    start_arg = request.args.get('start_date')
-    end_arg = request.args.get('end_date')
     limit_ledger = min(500, max(50, request.args.get('per_page', 100, type=int)))
-    today = get_saudi_now().date()
-    try:
-        start_date = datetime.strptime(start_arg, '%Y-%m-%d').date() if start_arg else datetime(2025,10,1).date()
-        end_date = datetime.strptime(end_arg, '%Y-%m-%d').date() if end_arg else today
-    except Exception:
-        start_date = datetime(2025,10,1).date()
-        end_date = today
-    acc = Account.query.filter_by(code=code).first()
+    acc, start_date, end_date = _statement_account_args()
     if not acc:
-        from flask import jsonify
-        return jsonify({'ok': False, 'error': 'account_not_found'}), 404
-    if code and str(code).strip() not in _new_coa_codes():
-        from flask import jsonify
-        return jsonify({'ok': False, 'error': 'account_not_in_coa'}), 404
-    q = db.session.query(JournalLine, JournalEntry.entry_number) \
-        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
-        .filter(JournalEntry.status == 'posted') \
-        .filter(JournalLine.account_id == acc.id) \
-        .filter(JournalLine.line_date.between(start_date, end_date)) \
-        .order_by(JournalLine.line_date.asc(), JournalLine.id.asc()).limit(limit_ledger)
-    rows = []
-    opening_debit = float(db.session.query(func.coalesce(func.sum(JournalLine.debit), 0)).join(JournalEntry, JournalLine.journal_id == JournalEntry.id).filter(JournalEntry.status == 'posted').filter(JournalLine.account_id == acc.id).filter(JournalLine.line_date < start_date).scalar() or 0)
-    opening_credit = float(db.session.query(func.coalesce(func.sum(JournalLine.credit), 0)).join(JournalEntry, JournalLine.journal_id == JournalEntry.id).filter(JournalEntry.status == 'posted').filter(JournalLine.account_id == acc.id).filter(JournalLine.line_date < start_date).scalar() or 0)
-    opening_balance = opening_debit - opening_credit if acc.type != 'LIABILITY' else opening_credit - opening_debit
-    bal = opening_balance
-    for ln, entry_no in q.all():
-        d = float(getattr(ln,'debit',0) or 0); c = float(getattr(ln,'credit',0) or 0)
-        if acc.type in ('LIABILITY','EQUITY'):
-            bal += (c - d)
-        else:
-            bal += (d - c)
-        rows.append({'date': str(getattr(ln,'line_date',None) or ''), 'entry_number': entry_no, 'description': getattr(ln,'description',''), 'debit': d, 'credit': c, 'balance': bal})
-    from flask import jsonify
-    return jsonify({'ok': True, 'account': {'code': acc.code, 'name': acc.name, 'name_ar': getattr(acc, 'name_ar', acc.name), 'name_en': getattr(acc, 'name_en', acc.name), 'type': acc.type}, 'start_date': str(start_date), 'end_date': str(end_date), 'opening_balance': opening_balance, 'final_balance': bal, 'lines': rows})
+        error = 'account_not_in_coa' if code and Account.query.filter_by(code=code).first() else 'account_not_found'
+        return jsonify({'ok': False, 'error': error}), 404
+    opening = opening_balance(acc, start_date)
+    page = statement_page(acc, start_date, end_date, opening, after=parse_cursor(request.args.get('after')),
+                          limit=limit_ledger)
+    rows = [{'date': str(r['line_date'] or ''), 'entry_number': r['entry_number'], 'description': r['line_description'] or '',
+             'debit': r['debit'], 'credit': r['credit'], 'balance': r['balance']} for r in page['lines']]
+    final_balance = rows[-1]['balance'] if rows else opening
+    return jsonify({'ok': True, 'account': {'code': acc.code, 'name': acc.name, 'name_ar': getattr(acc, 'name_ar', acc.name), 'name_en': getattr(acc, 'name_en', acc.name), 'type': acc.type}, 'start_date': str(start_date), 'end_date': str(end_date), 'opening_balance': opening, 'final_balance': final_balance, 'lines': rows, 'next_cursor': page['next']})
 
 @bp.route('/api/accounts/list')
 def api_accounts_list():
@@ -2198,15 +1972,7 @@ def api_operations_outstanding():
                     pass
             p_ids = [inv.id for inv in p_rows]
             # المدفوع من القيود المنشورة (سطور مرتبطة بفاتورة) + استكمال من Payment للقديم
-            p_paid = {}
-            for inv in p_rows:
-                paid = _paid_from_journal(inv.id, 'purchase', '2111')
-                if paid < 0.01:
-                    leg = db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
-                        Payment.invoice_type == 'purchase', Payment.invoice_id == inv.id
-                    ).scalar() or 0
-                    paid = round(float(leg), 2)
-                p_paid[inv.id] = paid
+            p_paid = paid_map('purchase', p_ids)
             # تخصيص مدفوعات القيود القديمة (2111 مدين بدون invoice_id) FIFO
             acc_2111 = Account.query.filter_by(code='2111').first()
             if acc_2111:
@@ -2252,7 +2018,7 @@ def api_operations_outstanding():
             except Exception:
                 e_rows = []
             e_ids = [inv.id for inv in e_rows]
-            e_paid = {inv.id: _paid_from_journal(inv.id, 'expense', '2111') for inv in e_rows}
+            e_paid = paid_map('expense', e_ids, source='gl')
             for inv in e_rows:
                 total = float(inv.total_after_tax_discount or 0)
                 paid = float(e_paid.get(inv.id, 0))
@@ -2315,12 +2081,7 @@ def api_operations_outstanding():
                 except Exception:
                     pass
             s_ids = [inv.id for inv in s_rows]
-            s_paid = {}
-            if s_ids:
-                for i, s in db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
-                    Payment.invoice_type == 'sales', Payment.invoice_id.in_(s_ids)
-                ).group_by(Payment.invoice_id).all():
-                    s_paid[int(i)] = float(s or 0)
+            s_paid = paid_map('sales', s_ids, source='legacy')
             for inv in s_rows:
                 total = float(inv.total_after_tax_discount or 0)
                 paid = float(s_paid.get(inv.id, 0))
@@ -2426,24 +2187,6 @@ def api_operations_outstanding():
         return jsonify({'ok': False, 'error': str(e)}), 500
 
 
-def _paid_from_journal(invoice_id, invoice_type, account_code='2111'):
-    """المدفوع لفاتورة من القيود المنشورة فقط (مصدر الحقيقة الوحيد). مجموع مدين سطور الحساب 2111 المرتبطة بالفاتورة."""
-    if invoice_id is None or not invoice_type:
-        return 0.0
-    acc = Account.query.filter_by(code=(account_code or '2111').strip()).first()
-    if not acc:
-        return 0.0
-    s = db.session.query(func.coalesce(func.sum(JournalLine.debit), 0)).join(
-        JournalEntry, JournalLine.journal_id == JournalEntry.id
-    ).filter(
-        JournalLine.account_id == acc.id,
-        JournalLine.invoice_id == invoice_id,
-        JournalLine.invoice_type == (invoice_type or 'purchase'),
-        JournalEntry.status == 'posted'
-    ).scalar() or 0
-    return round(float(s), 2)
-
-
 def _account_balance_as_of(account_code, asof_date):
     """رصيد حساب حتى تاريخ معين (قيود مرحّلة فقط). للحسابات الدائنة: رصيد = دائن - مدين؛ للأصول: مدين - دائن."""
     acc = Account.query.filter_by(code=(account_code or '').strip()).first()
@@ -2642,15 +2385,7 @@ def api_quick_txn():
             p_ids = [inv.id for inv in p_rows]
             e_ids = [inv.id for inv in e_rows]
             # المدفوع من القيود (مرتبط بفاتورة) + استكمال من Payment + تخصيص قيود قديمة بدون invoice_id
-            p_paid = {}
-            for inv in p_rows:
-                paid = _paid_from_journal(inv.id, 'purchase', '2111')
-                if paid < 0.01:
-                    leg = db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
-                        Payment.invoice_type == 'purchase', Payment.invoice_id == inv.id
-                    ).scalar() or 0
-                    paid = round(float(leg), 2)
-                p_paid[inv.id] = paid
+            p_paid = paid_map('purchase', p_ids)
             acc_2111 = Account.query.filter_by(code='2111').first()
             if acc_2111:
                 unalloc = db.session.query(func.coalesce(func.sum(JournalLine.debit), 0)).join(
@@ -2674,7 +2409,7 @@ def api_quick_txn():
                         alloc = min(unalloc, rem_inv)
                         p_paid[inv.id] = already + alloc
                         unalloc -= alloc
-            e_paid = {i: _paid_from_journal(i, 'expense', '2111') for i in e_ids}
+            e_paid = paid_map('expense', e_ids, source='gl')
             total_remaining = 0.0
             for inv in p_rows:
                 total_remaining += max(0.0, float(inv.total_after_tax_discount or 0) - float(p_paid.get(inv.id, 0)))
@@ -3070,8 +2805,8 @@ def api_accounts_add_sub():
         name_en = (payload.get('name_en') or '').strip()
         if not parent_code or not name_ar:
             return jsonify({'ok': False, 'error': 'parent_code و name_ar مطلوبان'}), 400
-        from data.coa_new_tree import build_coa_dict
-        coa = build_coa_dict()
+        from services.coa_index import coa_dict, node as coa_node, refresh_coa_index
+        coa = coa_dict()
         parent_info = coa.get(parent_code)
         if not parent_info:
             parent_acc = Account.query.filter(Account.code == parent_code).first()
@@ -3080,12 +2815,11 @@ def api_accounts_add_sub():
             parent_type = (parent_acc.type or 'EXPENSE').strip().upper()
         else:
             parent_type = (parent_info.get('type') or 'EXPENSE').strip().upper()
-        # بناء قائمة الحسابات المدمجة لاستخراج الأشقاء
-        all_codes = set(coa.keys())
-        db_accounts = Account.query.filter(~Account.code.in_(all_codes)).all() if hasattr(Account, 'parent_account_code') else []
-        siblings = [a.code for a in db_accounts if getattr(a, 'parent_account_code', None) == parent_code]
-        for code, info in coa.items():
-            if info.get('parent_account_code') == parent_code:
+        # الأشقاء: أبناء الأب في فهرس الشجرة + الحسابات الفرعية في الجدول (فهرس parent_account_code)
+        parent_node = coa_node(parent_code)
+        siblings = list(parent_node.children) if parent_node is not None else []
+        for (code,) in db.session.query(Account.code).filter(Account.parent_account_code == parent_code).all():
+            if code not in siblings:
                 siblings.append(code)
         # توليد الكود التالي (نفس طول أشقاء أو 4 أرقام)
         def next_code(sibs):
@@ -3115,6 +2849,7 @@ def api_accounts_add_sub():
             a.name_en = name_en or ''
         db.session.add(a)
         db.session.commit()
+        refresh_coa_index()
         return jsonify({'ok': True, 'code': new_code})
     except Exception as e:
         from flask import jsonify
@@ -5,7 +5,7 @@ import json
 import math
 import re
 import unicodedata
-from datetime import datetime
+from datetime import datetime, timedelta
 from difflib import SequenceMatcher
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
@@ -24,6 +24,8 @@ from models import (
     get_saudi_now,
 )
 from routes.common import BRANCH_LABELS
+from services.inventory_valuation import material_cost_stats, unit_cost_of, last_purchase_date_of
+from services.stock_ledger import cogs_between, inventory_value, quantities_as_of
 
 bp = Blueprint("inventory", __name__)
 
@@ -34,41 +36,15 @@ def inventory_intelligence():
     try:
         today = get_saudi_now().date()
         start_month = today.replace(day=1)
+        # Latest cost / average / last purchase date for every material in one window query
+        cost_stats = material_cost_stats()
         def latest_cost_per_unit(rm_id: int):
-            try:
-                row = (
-                    db.session.query(PurchaseInvoiceItem.price_before_tax, PurchaseInvoice.date)
-                    .join(PurchaseInvoice, PurchaseInvoice.id == PurchaseInvoiceItem.invoice_id)
-                    .filter(PurchaseInvoiceItem.raw_material_id == rm_id)
-                    .order_by(PurchaseInvoice.date.desc(), PurchaseInvoiceItem.id.desc())
-                    .first()
-                )
-                if row and row[0] is not None:
-                    return float(row[0])
-            except Exception:
-                pass
-            try:
-                avg = (
-                    db.session.query(func.coalesce(func.avg(PurchaseInvoiceItem.price_before_tax), 0))
-                    .filter(PurchaseInvoiceItem.raw_material_id == rm_id)
-                    .scalar()
-                ) or 0
-                if float(avg) > 0:
-                    return float(avg)
-            except Exception:
-                pass
-            try:
-                rm = RawMaterial.query.get(int(rm_id))
-                return float(getattr(rm, 'cost_per_unit', 0) or 0)
-            except Exception:
-                return 0.0
+            return unit_cost_of(cost_stats, rm_id)
 
         raw_materials = RawMaterial.query.filter_by(active=True).all()
-        total_inventory_cost = 0.0
-        for rm in (raw_materials or []):
-            unit_cost = latest_cost_per_unit(int(getattr(rm, 'id', 0) or 0))
-            qty = float(getattr(rm, 'stock_quantity', 0) or 0)
-            total_inventory_cost += unit_cost * qty
+        # Valuation and COGS from the perpetual stock ledger (running quantity x weighted average)
+        total_inventory_cost = inventory_value()
+        cogs_month = cogs_between(start_month, today)
 
         try:
             total_purchases_month = float(
@@ -117,17 +93,7 @@ def inventory_intelligence():
         meals_analysis = []
         outdated_meals = []
         def latest_purchase_date(rm_id: int):
-            try:
-                d = (
-                    db.session.query(PurchaseInvoice.date)
-                    .join(PurchaseInvoiceItem, PurchaseInvoice.id == PurchaseInvoiceItem.invoice_id)
-                    .filter(PurchaseInvoiceItem.raw_material_id == rm_id)
-                    .order_by(PurchaseInvoice.date.desc(), PurchaseInvoiceItem.id.desc())
-                    .first()
-                )
-                return d[0] if d and d[0] else None
-            except Exception:
-                return None
+            return last_purchase_date_of(cost_stats, rm_id)
         OUTDATED_DAYS = 60
         for m_name, sold_qty in sales_qty_by_meal.items():
             meal = meal_by_name.get(m_name)
@@ -231,9 +197,10 @@ def inventory_intelligence():
                 ingrs = MealIngredient.query.filter_by(meal_id=int(m.id)).all()
                 for ing in (ingrs or []):
                     usage_map[int(getattr(ing, 'raw_material_id', 0) or 0)] = usage_map.get(int(getattr(ing, 'raw_material_id', 0) or 0), 0.0) + (float(getattr(ing, 'quantity', 0) or 0) * sold)
+            opening_map = quantities_as_of(start_month - timedelta(days=1), raw_materials)
             for rm in (raw_materials or []):
                 rid = int(getattr(rm, 'id', 0) or 0)
-                opening_qty = float(getattr(rm, 'stock_quantity', 0) or 0)
+                opening_qty = float(opening_map.get(rid, 0) or 0)
                 purchases_qty = float(p_qty_map.get(rid, 0) or 0)
                 estimated_usage = float(usage_map.get(rid, 0) or 0)
                 expected_stock = max(opening_qty + purchases_qty - estimated_usage, 0.0)
@@ -253,6 +220,7 @@ def inventory_intelligence():
             'inventory_intelligence.html',
             kpi={
                 'total_inventory_cost': float(total_inventory_cost or 0),
+                'cogs_month': float(cogs_month or 0),
                 'total_purchases_month': float(total_purchases_month or 0),
                 'total_meals_sold_month': float(total_meals_sold_month or 0),
                 'estimated_total_meal_cost': float(estimated_total_meal_cost or 0),
@@ -297,8 +265,9 @@ def inventory():
             qty = float(r.qty or 0)
             total_cost = float(r.total_cost or 0)
             avg_cost = (total_cost / qty) if qty else 0.0
-            # Current stock equals cumulative purchased quantity (no consumption tracking here)
-            current_stock = qty
+            # Current stock and value from the perpetual ledger's running columns
+            current_stock = float(getattr(rm, 'stock_quantity', 0) or 0) if rm else 0.0
+            avg_cost = float(getattr(rm, 'cost_per_unit', 0) or 0) if rm else avg_cost
             stock_value = current_stock * avg_cost
             ledger_rows.append({
                 'material': name,
@@ -393,40 +362,13 @@ def inventory():
                 return None
         start_period = _parse_date(start_arg) or start_month
         end_period = _parse_date(end_arg) or today
+        # Latest cost / average / last purchase date for every material in one window query
+        cost_stats = material_cost_stats()
         def latest_cost_per_unit(rm_id: int):
-            try:
-                row = (
-                    db.session.query(PurchaseInvoiceItem.price_before_tax, PurchaseInvoice.date)
-                    .join(PurchaseInvoice, PurchaseInvoice.id == PurchaseInvoiceItem.invoice_id)
-                    .filter(PurchaseInvoiceItem.raw_material_id == rm_id)
-                    .order_by(PurchaseInvoice.date.desc(), PurchaseInvoiceItem.id.desc())
-                    .first()
-                )
-                if row and row[0] is not None:
-                    return float(row[0])
-            except Exception:
-                pass
-            try:
-                avg = (
-                    db.session.query(func.coalesce(func.avg(PurchaseInvoiceItem.price_before_tax), 0))
-                    .filter(PurchaseInvoiceItem.raw_material_id == rm_id)
-                    .scalar()
-                ) or 0
-                if float(avg) > 0:
-                    return float(avg)
-            except Exception:
-                pass
-            try:
-                rm = RawMaterial.query.get(int(rm_id))
-                return float(getattr(rm, 'cost_per_unit', 0) or 0)
-            except Exception:
-                return 0.0
+            return unit_cost_of(cost_stats, rm_id)
 
-        total_inventory_cost = 0.0
-        for rm in (raw_materials or []):
-            unit_cost = latest_cost_per_unit(int(getattr(rm, 'id', 0) or 0))
-            qty = float(getattr(rm, 'stock_quantity', 0) or 0)
-            total_inventory_cost += unit_cost * qty
+        total_inventory_cost = inventory_value()
+        cogs_month = cogs_between(start_period, end_period)
 
         try:
             total_purchases_month = float(
@@ -478,17 +420,7 @@ def inventory():
         outdated_meals = []
         sold_details_map = {}
         def latest_purchase_date(rm_id: int):
-            try:
-                d = (
-                    db.session.query(PurchaseInvoice.date)
-                    .join(PurchaseInvoiceItem, PurchaseInvoice.id == PurchaseInvoiceItem.invoice_id)
-                    .filter(PurchaseInvoiceItem.raw_material_id == rm_id)
-                    .order_by(PurchaseInvoice.date.desc(), PurchaseInvoiceItem.id.desc())
-                    .first()
-                )
-                return d[0] if d and d[0] else None
-            except Exception:
-                return None
+            return last_purchase_date_of(cost_stats, rm_id)
         OUTDATED_DAYS = 60
         for m_name, sold_qty in sales_qty_by_meal.items():
             meal = meal_by_name.get(m_name)
@@ -628,9 +560,10 @@ def inventory():
                 ingrs = MealIngredient.query.filter_by(meal_id=int(m.id)).all()
                 for ing in (ingrs or []):
                     usage_map[int(getattr(ing, 'raw_material_id', 0) or 0)] = usage_map.get(int(getattr(ing, 'raw_material_id', 0) or 0), 0.0) + (float(getattr(ing, 'quantity', 0) or 0) * sold)
+            opening_map = quantities_as_of(start_period - timedelta(days=1), raw_materials)
             for rm in (raw_materials or []):
                 rid = int(getattr(rm, 'id', 0) or 0)
-                opening_qty = float(getattr(rm, 'stock_quantity', 0) or 0)
+                opening_qty = float(opening_map.get(rid, 0) or 0)
                 purchases_qty = float(p_qty_map.get(rid, 0) or 0)
                 estimated_usage = float(usage_map.get(rid, 0) or 0)
                 expected_stock = max(opening_qty + purchases_qty - estimated_usage, 0.0)
@@ -659,6 +592,7 @@ def inventory():
             _=(lambda s, **kw: s),
             kpi={
                 'total_inventory_cost': float(total_inventory_cost or 0),
+                'cogs_month': float(cogs_month or 0),
                 'total_purchases_month': float(total_purchases_month or 0),
                 'total_meals_sold_month': float(total_meals_sold_month or 0),
                 'estimated_total_meal_cost': float(estimated_total_meal_cost or 0),
@@ -694,6 +628,7 @@ def inventory():
             _=(lambda s, **kw: s),
             kpi={
                 'total_inventory_cost': 0.0,
+                'cogs_month': 0.0,
                 'total_purchases_month': 0.0,
                 'total_meals_sold_month': 0.0,
                 'estimated_total_meal_cost': 0.0,
@@ -768,7 +703,8 @@ def api_inventory_intelligence():
             except Exception:
                 meals_sold = 0.0
             kpi = {
-                'total_inventory_value': 0.0,
+                'total_inventory_value': inventory_value(),
+                'cogs': cogs_between(start_date, end_date),
                 'month_purchases_total': month_purchases_total,
                 'meals_sold': meals_sold,
                 'estimated_production_cost': 0.0,
@@ -785,38 +721,6 @@ def api_inventory_intelligence():
                 'alerts': []
             })
 
-        def latest_unit_cost_map():
-            rows = (
-                db.session.query(PurchaseInvoiceItem.raw_material_id, PurchaseInvoiceItem.price_before_tax, PurchaseInvoice.date)
-                .join(PurchaseInvoice, PurchaseInvoice.id == PurchaseInvoiceItem.invoice_id)
-                .order_by(PurchaseInvoiceItem.raw_material_id.asc(), PurchaseInvoice.date.desc(), PurchaseInvoiceItem.id.desc())
-                .all()
-            )
-            m = {}
-            seen = set()
-            for rid, price, dt in rows:
-                if rid is None:
-                    continue
-                if rid in seen:
-                    continue
-                m[int(rid)] = float(price or 0)
-                seen.add(int(rid))
-            return m
-
-        def avg_unit_cost_map():
-            rows = (
-                db.session.query(PurchaseInvoiceItem.raw_material_id, func.coalesce(func.sum(PurchaseInvoiceItem.quantity * PurchaseInvoiceItem.price_before_tax), 0), func.coalesce(func.sum(PurchaseInvoiceItem.quantity), 0))
-                .group_by(PurchaseInvoiceItem.raw_material_id)
-                .all()
-            )
-            m = {}
-            for rid, total_cost, total_qty in rows:
-                if rid is None:
-                    continue
-                denom = float(total_qty or 0)
-                m[int(rid)] = (float(total_cost or 0) / denom) if denom > 0 else 0.0
-            return m
-
         def get_purchase_lots(rm_id: int):
             lots = (
                 db.session.query(PurchaseInvoiceItem.quantity, PurchaseInvoiceItem.price_before_tax)
@@ -838,8 +742,9 @@ def api_inventory_intelligence():
                 remaining -= take
             return cost
 
-        latest_cost = latest_unit_cost_map()
-        avg_cost = avg_unit_cost_map()
+        cost_stats = material_cost_stats()
+        latest_cost = {rid: float(st['latest_cost'] or 0) for rid, st in cost_stats.items() if st['has_purchases']}
+        avg_cost = {rid: st['avg_cost'] for rid, st in cost_stats.items() if st['has_purchases']}
         cost_map = avg_cost if cost_method == 'fifo' and not avg_cost else (avg_cost if cost_method == 'avg' else latest_cost)
 
         invs = (
@@ -978,7 +883,7 @@ def api_inventory_intelligence():
                 rid = int(getattr(ing, 'raw_material_id', 0) or 0)
                 usage_map[rid] = usage_map.get(rid, 0.0) + (float(s['qty_sold'] or 0) * float(getattr(ing, 'quantity', 0) or 0))
 
-        opening_map = {int(getattr(rm, 'id', 0) or 0): float(getattr(rm, 'stock_quantity', 0) or 0) for rm in RawMaterial.query.filter_by(active=True).all()}
+        opening_map = quantities_as_of(start_date - timedelta(days=1), RawMaterial.query.filter_by(active=True).all())
         p_qty_rows = (
             db.session.query(PurchaseInvoiceItem.raw_material_id, func.coalesce(func.sum(PurchaseInvoiceItem.quantity), 0))
             .join(PurchaseInvoice, PurchaseInvoice.id == PurchaseInvoiceItem.invoice_id)
@@ -1027,14 +932,9 @@ def api_inventory_intelligence():
                 'label_ar': 'تحليل المخزون',
             })
 
-        total_inventory_value = 0.0
-        for s in stock_analysis:
-            rid = int(s.get('ingredient_id') or 0)
-            unit_cost = float(latest_cost.get(rid, avg_cost.get(rid, 0)) or 0)
-            total_inventory_value += max(float(s.get('expected_stock') or 0), 0.0) * unit_cost
-
         kpi = {
-            'total_inventory_value': float(total_inventory_value or 0),
+            'total_inventory_value': inventory_value(),
+            'cogs': cogs_between(start_date, end_date),
             'month_purchases_total': float(sum([ps['final_total'] for ps in purchases_summary]) or 0),
             'meals_sold': float(sum([s['qty_sold'] for s in name_qty_rev.values()]) or 0),
             'estimated_production_cost': float(sum([m['consumption_cost'] for m in meal_analysis]) or 0),
@@ -10,6 +10,7 @@ from flask_login import login_required, current_user
 from sqlalchemy.orm import selectinload, joinedload
 from extensions import db, csrf
 from models import Account, LedgerEntry, Employee, JournalEntry, JournalLine, JournalAudit, get_saudi_now
+from utils.request_context import current_settings
 from services.gl_truth import is_period_open_for_date, can_mutate_journal, validate_journal_gates
 from services.account_validation import is_leaf_account
 
@@ -236,6 +237,8 @@ def delete_journal_entry_and_linked_invoice(je):
     if itype and iid is not None:
         Payment.query.filter(Payment.invoice_type == itype, Payment.invoice_id == iid).delete(synchronize_session=False)
         if itype == 'sales':
+            from services.recipe_depletion import reverse_depletion
+            reverse_depletion(iid, user_id=getattr(current_user, 'id', None))
             SalesInvoiceItem.query.filter_by(invoice_id=iid).delete(synchronize_session=False)
             inv = SalesInvoice.query.get(iid)
             if inv:
@@ -1018,7 +1021,6 @@ def audit_print():
         return _redirect_accounts_hub()
     from services.audit_engine import run_audit
     from datetime import datetime as _dt
-    from models import Settings
     from_date = to_date = None
     if request.args.get('from_date'):
         try:
@@ -1033,7 +1035,7 @@ def audit_print():
     report = run_audit(from_date=from_date, to_date=to_date)
     _audit_report_with_ref_urls(report)
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (getattr(settings, 'company_name', None) or 'Company').strip() if settings else 'Company'
     except Exception:
         company_name = 'Company'
@@ -1091,7 +1093,6 @@ def audit_pdf():
         return _redirect_accounts_hub()
     from modules.audit.engine import run_audit
     from datetime import datetime as _dt
-    from models import Settings
     from_date, to_date = _parse_audit_dates_from_request()
     fiscal_year_id = request.args.get('fiscal_year_id', type=int)
     # عند وجود سنة مالية نستخدم حدودها إن لم تُحدد تواريخ
@@ -1110,7 +1111,7 @@ def audit_pdf():
     report = run_audit(from_date=from_date, to_date=to_date, fiscal_year_id=fiscal_year_id, persist_findings=False)
     _audit_report_with_ref_urls(report)
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (getattr(settings, 'company_name', None) or 'Company').strip() if settings else 'Company'
         tax_number = (getattr(settings, 'tax_number', None) or '').strip() if settings else ''
         logo_url = (getattr(settings, 'logo_url', None) or '').strip() if settings else ''
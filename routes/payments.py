@@ -25,6 +25,7 @@ from models import (
     get_saudi_now,
 )
 from routes.common import BRANCH_LABELS, kv_get
+from services.invoice_settlement import paid_map
 from app.routes import (
     _post_ledger,
     _pm_account,
@@ -124,30 +125,15 @@ def api_payments_pay_all():
     else:
         kinds = ['purchase','expense']
 
-    from decimal import Decimal, ROUND_HALF_UP
-    def to_cents(value):
-        try:
-            return Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        except Exception:
-            return Decimal('0.00')
-
+    from services.batch_settlement import settle_invoices
     affected = []
     try:
+        # Grouped paid query, bulk payment insert and status update per kind; one commit for everything
         for k in kinds:
-            if k == 'purchase':
-                rows = PurchaseInvoice.query.order_by(PurchaseInvoice.created_at.desc()).all()
-            else:
-                rows = ExpenseInvoice.query.order_by(ExpenseInvoice.created_at.desc()).all()
-            for inv in rows:
-                total = to_cents(float(getattr(inv, 'total_after_tax_discount', 0) or 0))
-                paid = to_cents(float(db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0))
-                          .filter(Payment.invoice_id == inv.id, Payment.invoice_type == k).scalar() or 0.0))
-                remaining = total - paid
-                if remaining > Decimal('0.01'):
-                    amt = float(remaining)
-                    db.session.add(Payment(invoice_id=inv.id, invoice_type=k, amount_paid=amt, payment_method=method))
-                    inv.status = 'paid'
-                    affected.append({'id': inv.id, 'type': k, 'amount': amt})
+            model = PurchaseInvoice if k == 'purchase' else ExpenseInvoice
+            rows = model.query.order_by(model.created_at.desc()).all()
+            res = settle_invoices(k, rows, method)
+            affected.extend(res['items'])
         db.session.commit()
         return jsonify({'status':'success', 'count': len(affected), 'items': affected})
     except Exception as e:
@@ -598,10 +584,7 @@ def payments_json():
             pass
         p_rows = q.order_by(PurchaseInvoice.created_at.desc()).limit(1000).all()
         p_ids = [int(inv.id) for inv in p_rows]
-        p_paid = {}
-        if p_ids:
-            for i, s in db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0)).filter(Payment.invoice_type == 'purchase', Payment.invoice_id.in_(p_ids)).group_by(Payment.invoice_id).all():
-                p_paid[int(i)] = float(s or 0.0)
+        p_paid = paid_map('purchase', p_ids, source='legacy')
         p_total_from_items = {}
         if p_ids:
             for iid, s in db.session.query(PurchaseInvoiceItem.invoice_id, func.coalesce(func.sum(PurchaseInvoiceItem.total_price), 0)).filter(PurchaseInvoiceItem.invoice_id.in_(p_ids)).group_by(PurchaseInvoiceItem.invoice_id).all():
@@ -622,10 +605,7 @@ def payments_json():
             pass
         e_rows = q.order_by(ExpenseInvoice.created_at.desc()).limit(1000).all()
         e_ids = [int(inv.id) for inv in e_rows]
-        e_paid = {}
-        if e_ids:
-            for i, s in db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0)).filter(Payment.invoice_type == 'expense', Payment.invoice_id.in_(e_ids)).group_by(Payment.invoice_id).all():
-                e_paid[int(i)] = float(s or 0.0)
+        e_paid = paid_map('expense', e_ids, source='legacy')
         for inv in e_rows:
             total = float(inv.total_after_tax_discount or 0.0)
             paid = float(e_paid.get(int(inv.id), 0.0))
@@ -653,10 +633,7 @@ def payments_json():
             pass
         s_rows = q.order_by(SalesInvoice.created_at.desc()).limit(1000).all()
         s_ids = [int(inv.id) for inv in s_rows]
-        s_paid = {}
-        if s_ids:
-            for i, s in db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0)).filter(Payment.invoice_type == 'sales', Payment.invoice_id.in_(s_ids)).group_by(Payment.invoice_id).all():
-                s_paid[int(i)] = float(s or 0.0)
+        s_paid = paid_map('sales', s_ids, source='legacy')
         for inv in s_rows:
             total = float(inv.total_after_tax_discount or 0.0)
             paid = float(s_paid.get(int(inv.id), 0.0))
@@ -738,14 +715,7 @@ def payments():
             pass
         p_rows = q.order_by(PurchaseInvoice.created_at.desc()).limit(1000).all()
         p_ids = [int(inv.id) for inv in p_rows]
-        p_paid = {}
-        if p_ids:
-            _rows = (db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
-                     .filter(Payment.invoice_type == 'purchase', Payment.invoice_id.in_(p_ids))
-                     .group_by(Payment.invoice_id)
-                     .all())
-            for i, s in _rows:
-                p_paid[int(i)] = float(s or 0.0)
+        p_paid = paid_map('purchase', p_ids, source='legacy')
         # Fallback: when header total is 0 (e.g. Render/sync), use sum of items so amounts display correctly
         p_total_from_items = {}
         if p_ids:
@@ -774,14 +744,7 @@ def payments():
             pass
         e_rows = q.order_by(ExpenseInvoice.created_at.desc()).limit(1000).all()
         e_ids = [int(inv.id) for inv in e_rows]
-        e_paid = {}
-        if e_ids:
-            _rows = (db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
-                     .filter(Payment.invoice_type == 'expense', Payment.invoice_id.in_(e_ids))
-                     .group_by(Payment.invoice_id)
-                     .all())
-            for i, s in _rows:
-                e_paid[int(i)] = float(s or 0.0)
+        e_paid = paid_map('expense', e_ids, source='legacy')
         for inv in e_rows:
             total = float(inv.total_after_tax_discount or 0.0)
             paid = float(e_paid.get(int(inv.id), 0.0))
@@ -812,14 +775,7 @@ def payments():
             pass
         s_rows = q.order_by(SalesInvoice.created_at.desc()).limit(1000).all()
         s_ids = [int(inv.id) for inv in s_rows]
-        s_paid = {}
-        if s_ids:
-            _rows = (db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
-                     .filter(Payment.invoice_type == 'sales', Payment.invoice_id.in_(s_ids))
-                     .group_by(Payment.invoice_id)
-                     .all())
-            for i, s in _rows:
-                s_paid[int(i)] = float(s or 0.0)
+        s_paid = paid_map('sales', s_ids, source='legacy')
         for inv in s_rows:
             total = float(inv.total_after_tax_discount or 0.0)
             paid = float(s_paid.get(int(inv.id), 0.0))
@@ -847,20 +803,13 @@ def payments():
         q = q.order_by(PurchaseInvoice.created_at.desc()).limit(2000)
         invs = q.all()
         ids = [int(inv.id) for inv in invs]
-        paid_map = {}
-        if ids:
-            _rows = (db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
-                     .filter(Payment.invoice_type == 'purchase', Payment.invoice_id.in_(ids))
-                     .group_by(Payment.invoice_id)
-                     .all())
-            for i, s in _rows:
-                paid_map[int(i)] = float(s or 0.0)
+        paid_by_inv = paid_map('purchase', ids, source='legacy')
         for inv in invs:
             name = (inv.supplier_name or (getattr(inv, 'supplier', None).name if getattr(inv, 'supplier', None) else '') or 'Supplier').strip()
             if supplier_f and (name.lower().find(supplier_f) == -1):
                 continue
             total = float(inv.total_after_tax_discount or 0.0)
-            paid = float(paid_map.get(int(inv.id), 0.0))
+            paid = float(paid_by_inv.get(int(inv.id), 0.0))
             remaining = max(0.0, total - paid)
             status_calc = compute_status(total, paid)
             if status_f in ('due','unpaid') and status_calc == 'paid':
@@ -921,14 +870,7 @@ def payments():
         q = q.order_by(SalesInvoice.created_at.desc()).limit(2000)
         invs = q.all()
         ids = [int(inv.id) for inv in invs]
-        paid_map = {}
-        if ids:
-            _rows = (db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
-                     .filter(Payment.invoice_type == 'sales', Payment.invoice_id.in_(ids))
-                     .group_by(Payment.invoice_id)
-                     .all())
-            for i, s in _rows:
-                paid_map[int(i)] = float(s or 0.0)
+        paid_by_inv = paid_map('sales', ids, source='legacy')
         for inv in invs:
             grp = normalize_group(inv.customer_name or '')
             if grp not in by_group:
@@ -936,7 +878,7 @@ def payments():
             if group_f in ('keeta','hunger') and grp != group_f:
                 continue
             total = float(inv.total_after_tax_discount or 0.0)
-            paid = float(paid_map.get(int(inv.id), 0.0))
+            paid = float(paid_by_inv.get(int(inv.id), 0.0))
             remaining = max(0.0, total - paid)
             status_calc = compute_status(total, paid)
             by_group[grp]['invoices'].append({
@@ -985,17 +927,10 @@ def payments():
                 pass
             invs = q.order_by(SalesInvoice.created_at.desc()).limit(1000).all()
             ids = [int(inv.id) for inv in invs]
-            paid_map = {}
-            if ids:
-                _rows = (db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
-                         .filter(Payment.invoice_type == 'sales', Payment.invoice_id.in_(ids))
-                         .group_by(Payment.invoice_id)
-                         .all())
-                for i, s in _rows:
-                    paid_map[int(i)] = float(s or 0.0)
+            paid_by_inv = paid_map('sales', ids, source='legacy')
             for inv in invs:
                 total = float(inv.total_after_tax_discount or 0.0)
-                paid = float(paid_map.get(int(inv.id), 0.0))
+                paid = float(paid_by_inv.get(int(inv.id), 0.0))
                 status_calc = compute_status(total, paid)
                 name = (inv.customer_name or '').strip() or 'Customer'
                 import re
@@ -1,8 +1,9 @@
 from flask import Blueprint, render_template, current_app, url_for, send_file
 from io import BytesIO
 import base64
-from models import SalesInvoice, SalesInvoiceItem, Settings, KSA_TZ, get_saudi_now  # عدّل حسب مشروعك
+from models import SalesInvoice, SalesInvoiceItem, KSA_TZ, get_saudi_now  # عدّل حسب مشروعك
 from utils.qr import generate_zatca_qr_from_invoice
+from utils.request_context import current_settings
 from datetime import datetime
 import pytz
 
@@ -12,7 +13,7 @@ bp = Blueprint('receipt', __name__)
 def show_receipt(invoice_id):
     """عرض الفاتورة مع دعم العملة كصورة و QR كود ZATCA"""
     invoice = SalesInvoice.query.get_or_404(invoice_id)
-    settings = Settings.query.first()
+    settings = current_settings()
 
     # تحديد الفرع
     branch_name = 'China Town' if invoice.branch == 'china_town' else 'Palace India'
@@ -24,6 +24,8 @@ from models import (
     get_saudi_now,
 )
 from forms import PurchaseInvoiceForm, MealForm, RawMaterialForm
+from services.stock_ledger import record_movement, record_revaluation, MOVEMENT_PURCHASE, MOVEMENT_ADJUSTMENT
+from services.recipe_costing import recompute_meal_costs
 from app.routes import (
     warmup_db_once,
     _pm_account,
@@ -268,6 +270,29 @@ def meals():
     all_meals = Meal.query.filter_by(active=True).all()
     return render_template('meals.html', form=form, meals=all_meals, materials_json=materials_json)
 
+@bp.route('/api/meals/recost', methods=['POST'], endpoint='api_meals_recost')
+@login_required
+def api_meals_recost():
+    # Recompute meal costs/prices from current raw material costs.
+    # Body: {"raw_material_ids": [..] (omit = all meals), "dry_run": true} — dry run only reports the margin impact.
+    payload = request.get_json(silent=True) or {}
+    dry_run = str(payload.get('dry_run', request.args.get('dry_run', '1'))).strip().lower() not in ('0', 'false', 'no')
+    rm_ids = payload.get('raw_material_ids')
+    try:
+        rm_ids = None if rm_ids is None else [int(x) for x in rm_ids]
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'invalid raw_material_ids'}), 400
+    try:
+        result = recompute_meal_costs(rm_ids, dry_run=dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        return jsonify({'ok': True, **result})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 500
+
 # -------- Meals import (Excel/CSV): Name, Name (Arabic), Selling Price --------
 
 @bp.route('/api/raw_materials/categories', methods=['GET'], endpoint='api_raw_materials_categories')
@@ -321,6 +346,7 @@ def raw_materials():
     if request.method == 'POST' and (request.form.get('action') or '') == 'bulk_update_quantities':
         try:
             mats = RawMaterial.query.filter_by(active=True).all()
+            changed_ids = []
             for m in mats:
                 qv = request.form.get(f'qty_{int(m.id)}')
                 cv = request.form.get(f'cost_{int(m.id)}')
@@ -333,9 +359,16 @@ def raw_materials():
                 except Exception:
                     c = 0.0
                 if q > 0:
-                    m.stock_quantity = float(m.stock_quantity or 0.0) + q
+                    record_movement(m, q, MOVEMENT_ADJUSTMENT, ref_type='manual', notes='Bulk quantity update',
+                                    user_id=getattr(current_user, 'id', None))
                 if c > 0:
-                    m.cost_per_unit = c
+                    # التكلفة المُدخلة تصحيح يضبط المتوسط، لا استلام يُمزج فيه
+                    record_revaluation(m, c, ref_type='manual', notes='Bulk cost update',
+                                       user_id=getattr(current_user, 'id', None))
+                    changed_ids.append(int(m.id))
+            if changed_ids:
+                # التكلفة فقط؛ أسعار البيع لا تتغير إلا عبر /api/meals/recost
+                recompute_meal_costs(changed_ids, reprice=False)
             db.session.commit()
             flash(_('تم تحديث الكميات بنجاح'), 'success')
         except Exception:
@@ -593,6 +626,7 @@ def purchases():
             total_tax_dec = Decimal('0')
             total_discount_dec = Decimal('0')
             items_saved = 0
+            received_rm_ids = set()
             VAT_RATE = Decimal('0.15') if inv_type == 'VAT' else Decimal('0')
             for i in sorted(idxs):
                 item_name = (request.form.get(f'items-{i}-item_name') or '').strip()
@@ -639,13 +673,10 @@ def purchases():
                     line_base = Decimal('0')
                 line_tax = (line_base * VAT_RATE) if VAT_RATE > 0 else Decimal('0')
                 line_total = line_base + line_tax
-                prev_qty = Decimal(str(raw_material.stock_quantity or 0))
-                prev_cost = Decimal(str(raw_material.cost_per_unit or 0))
-                new_total_qty = prev_qty + qty
-                if new_total_qty > 0:
-                    new_total_cost = (prev_cost * prev_qty) + (unit_price * qty)
-                    raw_material.cost_per_unit = (new_total_cost / new_total_qty).quantize(Decimal('0.0001'))
-                raw_material.stock_quantity = new_total_qty
+                # Stock receipt: append to the ledger and roll the weighted-average cost forward
+                record_movement(raw_material, qty, MOVEMENT_PURCHASE, unit_cost=unit_price, on_date=inv_date,
+                                ref_type='purchase', ref_id=inv.id, user_id=getattr(current_user, 'id', None))
+                received_rm_ids.add(int(raw_material.id))
                 display_name = getattr(raw_material, 'display_name', raw_material.name)
                 inv_item = PurchaseInvoiceItem(
                     invoice_id=inv.id,
@@ -671,6 +702,8 @@ def purchases():
                     inv.notes = ((inv.notes or '') + f" | ITEMS:{items_saved}").strip(' |')
                 except Exception:
                     pass
+                # New weighted-average costs flow into dependent meal costs; prices stay until an explicit recost
+                recompute_meal_costs(received_rm_ids, reprice=False)
         except Exception as e:
             try:
                 db.session.rollback()
@@ -21,13 +21,13 @@ from models import (
     ExpenseInvoice,
     ExpenseInvoiceItem,
     Payment,
-    Settings,
     Employee,
     Salary,
     JournalEntry,
     JournalLine,
     get_saudi_now,
 )
+from utils.request_context import current_settings
 from routes.common import BRANCH_LABELS
 
 bp = Blueprint("reports", __name__)
@@ -36,7 +36,7 @@ bp = Blueprint("reports", __name__)
 def _report_header_context():
     """ترويسة موحدة لجميع التقارير من الإعدادات: اسم المطعم، الرقم الضريبي، البيانات الرسمية."""
     try:
-        s = Settings.query.first()
+        s = current_settings()
         if not s:
             return {
                 "company_name": "Company",
@@ -246,7 +246,7 @@ def reports_print_payments():
             'PAID': sum(r.get('PAID',0.0) for r in rows),
             'REMAINING': sum(r.get('REMAINING',0.0) for r in rows),
         }
-        settings = Settings.query.first()
+        settings = current_settings()
         # Render with payment totals by method per the template optional block
         payment_totals = {}
         for r in rows:
@@ -482,7 +482,7 @@ def reports_print_expenses():
     data = _expenses_report_data(start_d, end_d, branch)
     branch_label = _('All') if not branch or branch == 'all' else _(BRANCH_LABELS.get(branch, branch))
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
         tax_number = (settings.tax_number or '').strip() if settings else ''
         address = (getattr(settings, 'address', None) or '').strip() if settings else ''
@@ -528,7 +528,7 @@ def reports_print_purchases():
     data = _purchases_report_data(start_d, end_d, branch)
     branch_label = _('All') if not branch or branch == 'all' else _(BRANCH_LABELS.get(branch, branch))
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
         company_name = (settings.company_name or 'Company').strip() if settings else 'Company'
         tax_number = (settings.tax_number or '').strip() if settings else ''
         address = (getattr(settings, 'address', None) or '').strip() if settings else ''
@@ -647,6 +647,7 @@ def api_reports_preview():
         from utils.cache_helpers import (
             get_cached_reports_preview,
             reports_preview_cache_key,
+            reports_preview_tags,
             REPORTS_PREVIEW_TTL,
         )
         inv_type = (request.args.get('type') or 'sales').strip().lower()
@@ -670,7 +671,7 @@ def api_reports_preview():
         def fetcher():
             return _reports_preview_fetch(inv_type, start_d, end_d, branch, pm)
 
-        data = get_cached_reports_preview(key, fetcher, REPORTS_PREVIEW_TTL)
+        data = get_cached_reports_preview(key, fetcher, REPORTS_PREVIEW_TTL, tags=reports_preview_tags(inv_type))
         if data is None:
             return jsonify({'ok': False, 'error': 'Failed to fetch preview'}), 500
         return jsonify(data)
@@ -694,28 +695,116 @@ def api_reports_customer_sales():
                 return None
         start_d = _parse(start_s)
         end_d = _parse(end_s)
-        q = db.session.query(SalesInvoice)
+        filters = []
         if start_d and end_d:
-            q = q.filter(SalesInvoice.date.between(start_d, end_d))
+            filters.append(SalesInvoice.date.between(start_d, end_d))
         if branch and branch != 'all':
-            q = q.filter(SalesInvoice.branch == branch)
+            filters.append(SalesInvoice.branch == branch)
         if groups:
-            q = q.filter(SalesInvoice.customer_name.in_(groups))
+            # Platform keys (keeta/hunger/configured) match the indexed channel column; anything else is a customer name
+            from services.sales_channel import channel_keys
+            keys = set(channel_keys())
+            chans = [g.lower() for g in groups if g.lower() in keys]
+            names = [g for g in groups if g.lower() not in keys]
+            conds = []
+            if chans:
+                conds.append(SalesInvoice.channel.in_(chans))
+            if names:
+                conds.append(SalesInvoice.customer_name.in_(names))
+            filters.append(or_(*conds))
+        q = db.session.query(SalesInvoice).filter(*filters)
         rows = []
         for r in q.order_by(SalesInvoice.date.asc()).limit(1000).all():
             rows.append({
                 'date': r.date.isoformat() if r.date else '',
                 'branch': BRANCH_LABELS.get(r.branch, r.branch),
                 'customer': (r.customer_name or ''),
+                'channel': (r.channel or ''),
                 'type': 'sales',
                 'payment': (r.payment_method or ''),
                 'total': float(r.total_after_tax_discount or 0.0),
             })
-        return jsonify({'ok': True, 'rows': rows})
+        summary = []
+        sq = (
+            db.session.query(
+                func.coalesce(SalesInvoice.channel, ''),
+                SalesInvoice.customer_name,
+                func.count(SalesInvoice.id),
+                func.coalesce(func.sum(SalesInvoice.total_after_tax_discount), 0),
+            )
+            .filter(*filters)
+            .group_by(func.coalesce(SalesInvoice.channel, ''), SalesInvoice.customer_name)
+            .order_by(func.coalesce(func.sum(SalesInvoice.total_after_tax_discount), 0).desc())
+        )
+        for ch, name, cnt, total in sq.all():
+            summary.append({'channel': ch or '', 'customer': name or '', 'count': int(cnt or 0), 'total': float(total or 0.0)})
+        return jsonify({'ok': True, 'rows': rows, 'summary': summary})
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 500
 
 
+def _aging_args():
+    kind = (request.args.get('kind') or 'ar').strip().lower()
+    as_of_s = (request.args.get('as_of') or '').strip()
+    try:
+        as_of = datetime.strptime(as_of_s, '%Y-%m-%d').date() if as_of_s else get_saudi_now().date()
+    except Exception:
+        as_of = get_saudi_now().date()
+    return kind, as_of
+
+
+@bp.route('/api/reports/aging', methods=['GET'], endpoint='api_reports_aging')
+@login_required
+def api_reports_aging():
+    """أعمار الذمم: kind=ar (منصات + عملاء آجلون) أو kind=ap (موردون)، as_of=YYYY-MM-DD."""
+    try:
+        from services.aging import AGING_KINDS, get_aging
+        kind, as_of = _aging_args()
+        if kind not in AGING_KINDS:
+            return jsonify({'ok': False, 'error': 'kind must be ar or ap'}), 400
+        data = get_aging(kind, as_of)
+        return jsonify(dict(data, ok=True))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 500
+
+
+@bp.route('/reports/print/aging', methods=['GET'], endpoint='reports_print_aging')
+@login_required
+def reports_print_aging():
+    from services.aging import AGING_KINDS, get_aging
+    kind, as_of = _aging_args()
+    if kind not in AGING_KINDS:
+        kind = 'ar'
+    try:
+        data = get_aging(kind, as_of)
+    except Exception:
+        db.session.rollback()
+        data = {'parties': [], 'totals': {}}
+    cols = {'0_30': '0-30', '31_60': '31-60', '61_90': '61-90', '90_plus': '90+'}
+    party_col = 'Customer' if kind == 'ar' else 'Supplier'
+    rows = []
+    for p in data.get('parties') or []:
+        row = {party_col: p['name'], 'Invoices': str(p['count'])}
+        for b, label in cols.items():
+            row[label] = p[b]
+        row['Total'] = p['total']
+        rows.append(row)
+    t = data.get('totals') or {}
+    totals = {label: t.get(b, 0.0) for b, label in cols.items()}
+    totals['Total'] = t.get('total', 0.0)
+    try:
+        settings = current_settings()
+    except Exception:
+        settings = None
+    title = ('Receivables Aging' if kind == 'ar' else 'Payables Aging') + f" — {as_of.isoformat()}"
+    return render_template('print_report.html', report_title=title, settings=settings,
+                           generated_at=get_saudi_now().strftime('%Y-%m-%d %H:%M'),
+                           start_date='', end_date=as_of.isoformat(), payment_method='all', branch='all',
+                           columns=[party_col, 'Invoices'] + list(cols.values()) + ['Total'], data=rows,
+                           totals=totals, totals_columns=list(cols.values()) + ['Total'], totals_colspan=2)
+
+
 @bp.route('/reports/monthly', methods=['GET'], endpoint='reports_monthly')
 @login_required
 def reports_monthly():
@@ -1013,14 +1102,16 @@ def reports_print_customer_sales():
         customers_list = []
         if customers_param:
             customers_list = [normalize_group(s) for s in customers_param.split(',') if s.strip()]
+        from services.sales_channel import channel_keys
+        keys = set(channel_keys())
         base_filters = []
-        if customers_list:
-            for base in customers_list:
-                if base:
-                    base_filters.append(SalesInvoice.customer_name.ilike(base + '%'))
-        elif customer:
-            base = normalize_group(customer)
-            if base:
+        bases = customers_list or ([normalize_group(customer)] if customer else [])
+        for base in bases:
+            if not base:
+                continue
+            if base in keys:
+                base_filters.append(SalesInvoice.channel == base)
+            else:
                 base_filters.append(SalesInvoice.customer_name.ilike(base + '%'))
         if base_filters:
             q = q.filter(or_(*base_filters))
@@ -1071,7 +1162,7 @@ def reports_print_customer_sales():
         pass
 
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
     title_customer = (normalize_group(customer) if customer else '')
@@ -1251,7 +1342,7 @@ def reports_print_all_invoices_sales():
 
     # Settings for header
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
 
@@ -1466,7 +1557,7 @@ def reports_print_daily_sales():
     except Exception:
         pass
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
     payment_totals = {}
@@ -1712,7 +1803,7 @@ def reports_print_all_invoices_purchases():
 
     # Settings & meta
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
     meta = {
@@ -1823,7 +1914,7 @@ def reports_print_daily_items_summary():
 
     # Settings & meta
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
     meta_title = f"Daily Items Summary — {target_date.isoformat()} ({'orders' if source=='orders' else 'sales'})"
@@ -1908,7 +1999,7 @@ def reports_print_all_invoices_expenses():
         pass
 
     try:
-        settings = Settings.query.first()
+        settings = current_settings()
     except Exception:
         settings = None
     meta = {
@@ -2060,15 +2151,21 @@ def print_payroll():
             pass
     employees = emp_q.order_by(Employee.full_name.asc()).all()
 
-    # Helper: defaults
+    # الرواتب الافتراضية وملخص الفترة: استعلامان بدل استعلام لكل موظف/شهر
+    emp_ids = [int(e.id) for e in employees]
+    defaults_map = {}
+    if emp_ids:
+        defaults_map = {
+            int(d.employee_id): (float(d.base_salary or 0.0), float(d.allowances or 0.0), float(d.deductions or 0.0))
+            for d in EmployeeSalaryDefault.query.filter(EmployeeSalaryDefault.employee_id.in_(emp_ids)).all()
+        }
+    from services.payroll_summary import ensure_payroll_summaries, summaries_in_range
+    if ensure_payroll_summaries():
+        db.session.commit()
+    summaries = summaries_in_range((y_from, m_from), (y_to, m_to), emp_ids)
+
     def get_defaults(emp_id):
-        try:
-            d = EmployeeSalaryDefault.query.filter_by(employee_id=emp_id).first()
-            if d:
-                return float(d.base_salary or 0.0), float(d.allowances or 0.0), float(d.deductions or 0.0)
-        except Exception:
-            pass
-        return 0.0, 0.0, 0.0
+        return defaults_map.get(int(emp_id), (0.0, 0.0, 0.0))
 
     employees_ctx = []
     try:
@@ -2078,29 +2175,23 @@ def print_payroll():
             months_rows = []
             unpaid_count = 0
             for (yy, mm) in iter_months(y_from, m_from, y_to, m_to):
-                s = Salary.query.filter_by(employee_id=emp.id, year=int(yy), month=int(mm)).first()
+                s = summaries.get((int(emp.id), int(yy), int(mm)))
                 if not s:
                     b, a, d = get_defaults(emp.id)
                     ex = ab = inc_val = 0.0
                     prev = 0.0
                     tot = float(b + ex - ab + inc_val + a - d + prev)
-                    sal_id = None
+                    paid = 0.0
                 else:
-                    b = float(s.basic_salary or 0.0)
-                    ex = float(getattr(s, 'extra', 0) or 0)
-                    ab = float(getattr(s, 'absence', 0) or 0)
-                    inc_val = float(getattr(s, 'incentive', 0) or 0)
+                    b = float(s.basic or 0.0)
+                    ex = float(s.extra or 0)
+                    ab = float(s.absence or 0)
+                    inc_val = float(s.incentive or 0)
                     a = float(s.allowances or 0.0)
                     d = float(s.deductions or 0.0)
-                    prev = float(s.previous_salary_due or 0.0)
-                    tot = float(s.total_salary or (b + ex - ab + inc_val + a - d + prev))
-                    sal_id = int(s.id)
-                # Paid for this month
-                if sal_id:
-                    paid = float(db.session.query(db.func.coalesce(db.func.sum(Payment.amount_paid), 0))
-                        .filter(Payment.invoice_type == 'salary', Payment.invoice_id == sal_id).scalar() or 0.0)
-                else:
-                    paid = 0.0
+                    prev = float(s.prev_due or 0.0)
+                    tot = float(s.gross or (b + ex - ab + inc_val + a - d + prev))
+                    paid = float(s.paid or 0.0)
                 remaining = max(tot - paid, 0.0)
                 status = 'paid' if remaining <= 0.01 and tot > 0 else ('partial' if paid > 0 else 'due')
                 if status != 'paid':
@@ -2125,23 +2216,20 @@ def print_payroll():
         # جدول واحد للطباعة: صف لكل موظف للشهر النهائي — فقط من لهم استحقاق أو مدفوع غير صفر
         payroll_table_rows = []
         for emp in employees:
-            s = Salary.query.filter_by(employee_id=emp.id, year=int(y_to), month=int(m_to)).first()
+            s = summaries.get((int(emp.id), int(y_to), int(m_to)))
             if not s:
                 b, a, d = get_defaults(emp.id)
                 ex = ab = inc_val = 0.0
                 tot = max(0.0, b + a - d)
             else:
-                b = float(s.basic_salary or 0.0)
-                ex = float(getattr(s, 'extra', 0) or 0)
-                ab = float(getattr(s, 'absence', 0) or 0)
-                inc_val = float(getattr(s, 'incentive', 0) or 0)
+                b = float(s.basic or 0.0)
+                ex = float(s.extra or 0)
+                ab = float(s.absence or 0)
+                inc_val = float(s.incentive or 0)
                 a = float(s.allowances or 0.0)
                 d = float(s.deductions or 0.0)
-                tot = float(s.total_salary or (b + ex - ab + inc_val + a - d))
-            paid_end = 0.0
-            if s:
-                paid_end = float(db.session.query(db.func.coalesce(db.func.sum(Payment.amount_paid), 0))
-                    .filter(Payment.invoice_type == 'salary', Payment.invoice_id == s.id).scalar() or 0.0)
+                tot = float(s.gross or (b + ex - ab + inc_val + a - d))
+            paid_end = float(s.paid or 0.0) if s else 0.0
             if tot != 0 or paid_end != 0:
                 payroll_table_rows.append({
                     'name': emp.full_name,
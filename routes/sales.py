@@ -22,13 +22,13 @@ from models import (
     MenuCategory,
     Customer,
     Payment,
-    Settings,
     LedgerEntry,
     JournalEntry,
     JournalLine,
     get_saudi_now,
 )
-from routes.common import BRANCH_LABELS, kv_get, kv_set, safe_table_number, user_can
+from utils.request_context import current_settings
+from routes.common import BRANCH_LABELS, kv_get, kv_get_many, kv_set, safe_table_number, user_can
 from services.gl_truth import can_create_invoice_on_date
 from app.routes import (
     _set_table_status_concurrent,
@@ -41,14 +41,6 @@ from app.routes import (
     _acc_override,
     SHORT_TO_NUMERIC,
 )
-# Import warmup_db_once directly from app.routes module
-try:
-    from app.routes import warmup_db_once
-except ImportError:
-    # Fallback: define a simple version if import fails
-    def warmup_db_once():
-        pass
-
 bp = Blueprint("sales", __name__)
 
 @bp.route('/sales', endpoint='sales')
@@ -99,11 +91,10 @@ def sales_tables(branch_code):
 
         # Build status map based on draft orders (occupied / available)
         status_map = {}
-        for assignment in assignments:
-            number = safe_table_number(assignment.table_number)
-            if number <= 0:
-                continue
-            draft = kv_get(f'draft:{branch_code}:{number}', {}) or {}
+        numbers = [n for n in (safe_table_number(a.table_number) for a in assignments) if n > 0]
+        drafts = kv_get_many(f'draft:{branch_code}:{n}' for n in numbers)
+        for number in numbers:
+            draft = drafts.get(f'draft:{branch_code}:{number}') or {}
             status_map[number] = 'occupied' if (draft.get('items') or []) else 'available'
 
         assignments_by_section = {}
@@ -173,8 +164,9 @@ def sales_tables(branch_code):
             count = int((settings.get('india') or {}).get('count', default_count))
         else:
             count = default_count
+        drafts = kv_get_many(f'draft:{branch_code}:{i}' for i in range(1, count + 1))
         for i in range(1, count + 1):
-            draft = kv_get(f'draft:{branch_code}:{i}', {}) or {}
+            draft = drafts.get(f'draft:{branch_code}:{i}') or {}
             status = 'occupied' if (draft.get('items') or []) else 'available'
             tables.append({'number': i, 'status': status})
 
@@ -234,11 +226,9 @@ def pos_table(branch_code, table_number):
     except Exception:
         init_tax_pct = float(vat_rate or 15)
     init_payment_method = (draft.get('payment_method') or '').strip().upper()
-    # Warmup DB (avoid heavy create_all/seed on every request)
-    warmup_db_once()
     # Settings once: for void password (instant POS) and template
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
     init_void_password = '1991'
@@ -283,16 +273,16 @@ def pos_table(branch_code, table_number):
         return None
     cat_image_map = {}
     try:
-        _def_cat_img = kv_get('menu:default_category_image', None) or kv_get('menu:default_image', None) or '/static/logo.svg'
+        img_kv = kv_get_many(['menu:default_category_image', 'menu:default_image']
+                             + [f"menu:category_image:{c.id}" for c in cats]
+                             + [f"menu:category_image_by_name:{_slug(c.name)}" for c in cats])
     except Exception:
-        _def_cat_img = '/static/logo.svg'
+        img_kv = {}
+    _def_cat_img = img_kv.get('menu:default_category_image') or img_kv.get('menu:default_image') or '/static/logo.svg'
     for c in cats:
         cat_map[c.name] = c.id
         cat_map[c.name.upper()] = c.id
-        try:
-            u = kv_get(f"menu:category_image:{c.id}", None) or kv_get(f"menu:category_image_by_name:{_slug(c.name)}", None)
-        except Exception:
-            u = None
+        u = img_kv.get(f"menu:category_image:{c.id}") or img_kv.get(f"menu:category_image_by_name:{_slug(c.name)}")
         if not u:
             sslug = _slug(c.name)
             u = _static_image_url(f"images/categories/{sslug}.webp", f"images/categories/{sslug}.jpg", f"images/categories/{sslug}.png") or _def_cat_img
@@ -470,8 +460,9 @@ def api_tables_status(branch_code):
             pass
     except Exception:
         db_status = {}
+    drafts = kv_get_many(f'draft:{branch_code}:{i}' for i in range(1, count + 1))
     for i in range(1, count+1):
-        draft = kv_get(f'draft:{branch_code}:{i}', {}) or {}
+        draft = drafts.get(f'draft:{branch_code}:{i}') or {}
         has_draft = bool(draft.get('items') or [])
         tbl_st = (db_status.get(str(i)) or 'available').lower()
         status = 'occupied' if (has_draft or tbl_st == 'occupied') else 'available'
@@ -484,7 +475,6 @@ def api_tables_status(branch_code):
 @login_required
 def api_menu_all_items():
     """Return all menu items in one request. POS loads once and filters locally (0ms per category)."""
-    warmup_db_once()
     try:
         all_items = MenuItem.query.order_by(MenuItem.category_id, MenuItem.display_order.asc().nulls_last(), MenuItem.name).all()
         out = []
@@ -506,8 +496,7 @@ def api_menu_all_items():
 @bp.route('/api/menu/<cat_id>/items', methods=['GET'], endpoint='api_menu_items')
 @login_required
 def api_menu_items(cat_id):
-    # Prefer DB; fallback to KV/demo — warm up once
-    warmup_db_once()
+    # Prefer DB; fallback to KV/demo
     cat = None
     try:
         cid = int(cat_id)
@@ -658,9 +647,8 @@ def api_menu_items(cat_id):
 @login_required
 def api_branch_settings(branch_code):
     try:
-        from models import Settings
         try:
-            s = Settings.query.first()
+            s = current_settings()
         except Exception:
             s = None
 
@@ -776,6 +764,21 @@ def _parse_draft_id(draft_id):
         return None, None
 
 
+def _deplete_ingredients(inv, lines):
+    """Consume recipe ingredients for a new sale inside the checkout transaction.
+    Runs in a savepoint so a stock failure never blocks the sale; missed invoices are
+    picked up later by scripts/deplete_sales_stock.py."""
+    try:
+        from services.recipe_depletion import deplete_for_invoice
+        with db.session.begin_nested():
+            deplete_for_invoice(inv.id, lines, on_date=inv.date or get_saudi_now().date(), user_id=inv.user_id)
+    except Exception as e:
+        try:
+            current_app.logger.warning('Recipe stock depletion skipped for %s: %s', inv.invoice_number, e)
+        except Exception:
+            pass
+
+
 
 @bp.route('/api/draft_orders/<draft_id>/update', methods=['POST'], endpoint='api_draft_update')
 @login_required
@@ -895,7 +898,6 @@ def api_draft_checkout():
     if not user_can('sales','view', branch):
         return jsonify({'success': False, 'error': 'forbidden'}), 403
 
-    warmup_db_once()
     draft = kv_get(f'draft:{branch}:{table}', {}) or {}
     items = draft.get('items') or []
     subtotal = 0.0
@@ -981,6 +983,7 @@ def api_draft_checkout():
             customer_id=customer_id,
             customer_name=customer_name,
             customer_phone=customer_phone,
+            channel=(_platform_group((payload.get('customer_name') or '').strip().lower()) or _platform_group(customer_name.lower())),
             payment_method=payment_method,
             total_before_tax=round(subtotal, 2),
             tax_amount=round(vat_amount, 2),
@@ -1007,6 +1010,10 @@ def api_draft_checkout():
                 discount=0,
                 total_price=round((price or 0.0) * qty, 2),
             ))
+        _deplete_ingredients(inv, [
+            {'meal_id': it.get('meal_id'), 'name': it.get('name'), 'qty': it.get('qty') or it.get('quantity') or 1}
+            for it in items
+        ])
         from models import Payment
         cust = (payload.get('customer_name') or '').strip().lower()
         grp = _platform_group(cust)
@@ -1049,7 +1056,6 @@ def api_draft_get(branch_code, table_number):
 @login_required
 def api_sales_checkout():
     payload = request.get_json(force=True) or {}
-    warmup_db_once()
     branch = (payload.get('branch_code') or '').strip() or 'unknown'
     table = int(payload.get('table_number') or 0)
     if not user_can('sales','view', branch):
@@ -1140,6 +1146,7 @@ def api_sales_checkout():
             customer_id=customer_id,
             customer_name=customer_name,
             customer_phone=customer_phone,
+            channel=(_platform_group((payload.get('customer_name') or '').strip().lower()) or _platform_group(customer_name.lower())),
             payment_method=payment_method,
             total_before_tax=round(subtotal, 2),
             tax_amount=round(vat_amount, 2),
@@ -1160,6 +1167,7 @@ def api_sales_checkout():
                 discount=0,
                 total_price=round(float(it.get('price') or 0.0) * float(it.get('qty') or 1), 2),
             ))
+        _deplete_ingredients(inv, resolved)
         use_adapter = False
         adapter_success = False
         try:
@@ -1348,47 +1356,26 @@ def api_invoice_confirm_print():
 @login_required
 def api_sales_mark_unpaid_paid():
     try:
-        from models import SalesInvoice, Payment
+        from models import SalesInvoice
         from sqlalchemy import func
+        from services.batch_settlement import settle_invoices
         q = SalesInvoice.query
         # Only consider invoices not marked as paid
         q = q.filter(func.lower(SalesInvoice.status) != 'paid') if hasattr(SalesInvoice, 'status') else q
         rows = q.order_by(SalesInvoice.date.desc()).limit(5000).all()
-        updated = 0
+        # One settlement (and one consolidated receipt journal) per payment method, all in one transaction
+        by_method = {}
         for inv in (rows or []):
-            try:
-                total = float(getattr(inv, 'total_after_tax_discount', 0) or 0)
-                paid_sum = float(db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0))
-                                 .filter(Payment.invoice_type == 'sales', Payment.invoice_id == inv.id)
-                                 .scalar() or 0.0)
-                remaining = max(total - paid_sum, 0.0)
-                if remaining <= 0:
-                    inv.status = 'paid'
-                    db.session.commit()
-                    updated += 1
-                    continue
-                pm = (getattr(inv, 'payment_method', '') or 'CASH').strip().upper()
-                db.session.add(Payment(
-                    invoice_id=inv.id,
-                    invoice_type='sales',
-                    amount_paid=remaining,
-                    payment_method=pm,
-                    payment_date=get_saudi_now()
-                ))
-                inv.status = 'paid'
-                db.session.commit()
-                # Post payment ledger: DR Cash/Bank, CR AR
-                try:
-                    ar_code = CHART_OF_ACCOUNTS.get('1141', {'code':'1141'}).get('code','1141')
-                    _create_receipt_journal(inv.date, remaining, inv.invoice_number, ar_code, pm or 'CASH', invoice_id=inv.id)
-                except Exception:
-                    pass
-                updated += 1
-            except Exception:
-                try:
-                    db.session.rollback()
-                except Exception:
-                    pass
+            by_method.setdefault((getattr(inv, 'payment_method', '') or 'CASH').strip().upper(), []).append(inv)
+        ar_code = CHART_OF_ACCOUNTS.get('1141', {'code':'1141'}).get('code','1141')
+        ar_acc = _account(ar_code, CHART_OF_ACCOUNTS.get(ar_code, {'name':'عملاء','type':'ASSET'}).get('name','عملاء'), 'ASSET')
+        updated = 0
+        for pm, invs in by_method.items():
+            res = settle_invoices('sales', invs, pm, cash_account=_pm_account(pm),
+                                  counter_account_for=lambda inv: ar_acc,
+                                  user_id=getattr(current_user, 'id', None))
+            updated += res['updated']
+        db.session.commit()
         return jsonify({'ok': True, 'updated': updated})
     except Exception as e:
         try:
@@ -1434,24 +1421,32 @@ def api_sales_mark_platform_unpaid():
         return jsonify({'ok': False, 'error': str(e)}), 400
 
 
+def _platform_ar_account(grp):
+    """حساب الذمم حسب المنصة (keeta/hunger) وإلا حساب العملاء العام."""
+    try:
+        if grp == 'keeta':
+            ar_code = _acc_override('AR_KEETA', SHORT_TO_NUMERIC['AR_KEETA'][0])
+        elif grp == 'hunger':
+            ar_code = _acc_override('AR_HUNGER', SHORT_TO_NUMERIC['AR_HUNGER'][0])
+        else:
+            ar_code = _acc_override('AR', CHART_OF_ACCOUNTS.get('1141', {'code':'1141'}).get('code','1141'))
+    except Exception:
+        ar_code = CHART_OF_ACCOUNTS.get('1141', {'code':'1141'}).get('code','1141')
+    return _account(ar_code, CHART_OF_ACCOUNTS.get(ar_code, {'name':'عملاء','type':'ASSET'}).get('name','عملاء'), 'ASSET')
+
+
 @bp.route('/api/sales/batch-pay', methods=['GET','POST'], endpoint='api_sales_batch_pay')
 
 @bp.route('/api/sales/batch-pay/', methods=['GET','POST'])
 @login_required
 def api_sales_batch_pay():
     try:
-        from models import SalesInvoice, Payment
+        from models import SalesInvoice
+        from services.batch_settlement import settle_invoices
         payload = request.get_json(silent=True) or {}
         customer = (request.form.get('customer') or payload.get('customer') or 'all').strip().lower()
         method = (request.form.get('payment_method') or payload.get('payment_method') or 'CASH').strip().upper()
         limit = int((request.form.get('limit') or payload.get('limit') or 3000))
-        def _norm_group(n: str):
-            s = (n or '').lower()
-            if ('hunger' in s) or ('هنقر' in s) or ('هونقر' in s):
-                return 'hunger'
-            if ('keeta' in s) or ('كيتا' in s) or ('كيت' in s):
-                return 'keeta'
-            return ''
         q = SalesInvoice.query
         # Consider only not-paid invoices
         try:
@@ -1459,59 +1454,20 @@ def api_sales_batch_pay():
         except Exception:
             pass
         rows = q.order_by(SalesInvoice.date.desc()).limit(limit).all()
-        updated = 0
-        for inv in (rows or []):
-            grp = _platform_group(getattr(inv, 'customer_name', '') or '')
-            if customer not in ('all','') and grp != customer:
-                continue
-            # Compute remaining
-            total = float(getattr(inv, 'total_after_tax_discount', 0.0) or 0.0)
-            paid = float(db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0))
-                         .filter(Payment.invoice_type == 'sales', Payment.invoice_id == inv.id)
-                         .scalar() or 0.0)
-            remaining = max(total - paid, 0.0)
-            if remaining <= 0:
-                try:
-                    inv.status = 'paid'
-                    db.session.commit()
-                except Exception:
-                    try: db.session.rollback()
-                    except Exception: pass
-                continue
-            try:
-                db.session.add(Payment(
-                    invoice_id=inv.id,
-                    invoice_type='sales',
-                    amount_paid=remaining,
-                    payment_method=method,
-                    payment_date=get_saudi_now()
-                ))
-                inv.status = 'paid'
-                db.session.commit()
-                # Post payment ledger: DR Cash/Bank, CR AR (platform-specific when applicable)
-                cash_acc = _pm_account(method)
-                try:
-                    cust = (getattr(inv, 'customer_name', '') or '').lower()
-                    grp = _platform_group(cust)
-                    if grp == 'keeta':
-                        ar_code = _acc_override('AR_KEETA', SHORT_TO_NUMERIC['AR_KEETA'][0])
-                    elif grp == 'hunger':
-                        ar_code = _acc_override('AR_HUNGER', SHORT_TO_NUMERIC['AR_HUNGER'][0])
-                    else:
-                        ar_code = _acc_override('AR', CHART_OF_ACCOUNTS.get('1141', {'code':'1141'}).get('code','1141'))
-                except Exception:
-                    ar_code = CHART_OF_ACCOUNTS.get('1141', {'code':'1141'}).get('code','1141')
-                try:
-                    _create_receipt_journal(inv.date, remaining, inv.invoice_number, ar_code, method or 'CASH', invoice_id=inv.id)
-                except Exception:
-                    pass
-                updated += 1
-            except Exception:
-                try:
-                    db.session.rollback()
-                except Exception:
-                    pass
-        return jsonify({'ok': True, 'updated': updated})
+        accounts = {}
+        def _ar_for(inv):
+            grp = (getattr(inv, 'channel', None) or _platform_group((getattr(inv, 'customer_name', '') or '').lower()))
+            if grp not in accounts:
+                accounts[grp] = _platform_ar_account(grp)
+            return accounts[grp]
+        if customer not in ('all', ''):
+            rows = [inv for inv in rows
+                    if (getattr(inv, 'channel', None) or _platform_group(getattr(inv, 'customer_name', '') or '')) == customer]
+        # Validate the whole set, then payments + statuses + one receipt journal with a line per invoice, one commit
+        res = settle_invoices('sales', rows, method, cash_account=_pm_account(method), counter_account_for=_ar_for,
+                              user_id=getattr(current_user, 'id', None))
+        db.session.commit()
+        return jsonify({'ok': True, 'updated': res['updated'], 'amount': res['amount'], 'journal_id': res['journal_id'], 'journal_ids': res['journal_ids']})
     except Exception as e:
         try:
             db.session.rollback()
@@ -1614,7 +1570,7 @@ def invoice_print(invoice_id):
     }
     
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
         
@@ -2080,7 +2036,7 @@ def print_receipt(invoice_number):
         'branch_code': getattr(inv, 'branch', None),
     }
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
     branch_code = getattr(inv, 'branch', None) or ''
@@ -2204,7 +2160,7 @@ def print_sales_receipt_by_id(invoice_id):
         'branch_code': getattr(inv, 'branch', None),
     }
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
     branch_code = getattr(inv, 'branch', None) or ''
@@ -2286,7 +2242,7 @@ def print_order_preview(branch, table):
         'branch_code': branch,
     }
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
     branch_name, _logo_url_preview = _receipt_branch_name_and_logo_url(branch, s)
@@ -2430,7 +2386,7 @@ def print_order_slip(branch, table):
     branch_name = BRANCH_LABELS.get(branch, branch)
     dt_str = get_saudi_now().strftime('%Y-%m-%d %H:%M:%S')
     try:
-        s = Settings.query.first()
+        s = current_settings()
     except Exception:
         s = None
     cust = rec.get('customer') or {}
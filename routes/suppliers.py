@@ -316,26 +316,9 @@ def supplier_statement(sid=None):
     ).order_by(PurchaseInvoice.date.asc(), PurchaseInvoice.invoice_number.asc()).all()
 
     acc_2111 = Account.query.filter_by(code='2111').first()
-    # المدفوع من القيود المرتبطة بفاتورة + استكمال من Payment للقديم
-    paid_per_inv = {}
-    for inv in invs:
-        paid = 0.0
-        if acc_2111:
-            s = db.session.query(func.coalesce(func.sum(JournalLine.debit), 0)).join(
-                JournalEntry, JournalLine.journal_id == JournalEntry.id
-            ).filter(
-                JournalLine.account_id == acc_2111.id,
-                JournalLine.invoice_id == inv.id,
-                JournalLine.invoice_type == 'purchase',
-                JournalEntry.status == 'posted'
-            ).scalar() or 0
-            paid = round(float(s), 2)
-        if paid < 0.01:
-            leg = db.session.query(func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
-                Payment.invoice_type == 'purchase', Payment.invoice_id == inv.id
-            ).scalar() or 0
-            paid = round(float(leg), 2)
-        paid_per_inv[inv.id] = paid
+    # المدفوع من فهرس السداد (القيود المرتبطة بفاتورة + استكمال من Payment للقديم)
+    from services.invoice_settlement import paid_map
+    paid_per_inv = paid_map('purchase', [inv.id for inv in invs])
 
     # لا نخصص قيوداً قديمة (2111 بدون invoice_id) لهذا المورد — قد تكون لمورد آخر وتُظهر مدفوعات زائدة.
 
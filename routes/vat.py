@@ -6,7 +6,8 @@ import io
 
 # Import db and models without circular imports
 from extensions import db
-from models import SalesInvoice, PurchaseInvoice, ExpenseInvoice, Settings, JournalLine, Account
+from models import SalesInvoice, PurchaseInvoice, ExpenseInvoice, JournalLine, Account
+from utils.request_context import current_settings
 
 bp = Blueprint('vat', __name__, url_prefix='/vat')
 
@@ -63,15 +64,15 @@ def vat_dashboard():
             start_date = date(today.year, today.month, 1)
             end_date = today
 
-    # Phase 3 – VAT cache (TTL 5 min): try hit first
+    # Phase 3 – VAT cache, tagged by period months (invalidated on posting): try hit first
+    vat_versions = None
     try:
-        from utils.cache_helpers import vat_cache_key, VAT_TTL, _cache
+        from utils.cache_helpers import vat_cache_key, vat_cache_tags, tag_versions, tagged_get
         key = vat_cache_key(start_date, end_date, branch)
-        c = _cache()
-        if c:
-            cached = c.get(key)
-            if isinstance(cached, dict) and cached.get('start_date') is not None:
-                return render_template('vat/vat_dashboard.html', data=cached)
+        cached = tagged_get(key)
+        if isinstance(cached, dict) and cached.get('start_date') is not None:
+            return render_template('vat/vat_dashboard.html', data=cached)
+        vat_versions = tag_versions(vat_cache_tags(start_date, end_date))
     except Exception:
         pass
 
@@ -83,83 +84,21 @@ def vat_dashboard():
     tax_number = s.tax_number if s and s.tax_number else ''
     currency = s.currency if s and s.currency else 'SAR'
 
-    # Helper to optionally filter branch
-    def branch_filter_sales(q):
-        if branch and branch != 'all' and hasattr(SalesInvoice, 'branch'):
-            return q.filter(SalesInvoice.branch == branch)
-        return q
-    def branch_filter_purchases(q):
-        return q  # purchases/expenses not per-branch in current schema
-
-    # Sales breakdown (bases)
-    sales_standard_base = float(branch_filter_sales(db.session.query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0))
-        .filter(SalesInvoice.date.between(start_date, end_date))
-        .filter((SalesInvoice.tax_amount > 0))).scalar() or 0.0)
-    sales_zero_base = float(branch_filter_sales(db.session.query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0))
-        .filter(SalesInvoice.date.between(start_date, end_date))
-        .filter((SalesInvoice.tax_amount == 0))).scalar() or 0.0)
-    # Exempt/Exports not tracked separately in schema → default to 0
-    sales_exempt_base = 0.0
-    sales_exports_base = 0.0
-
-    # Purchases breakdown (bases)
-    purchases_deductible_base = float(branch_filter_purchases(db.session.query(func.coalesce(func.sum(PurchaseInvoice.total_before_tax), 0))
-        .filter(PurchaseInvoice.date.between(start_date, end_date))
-        .filter((PurchaseInvoice.tax_amount > 0))).scalar() or 0.0)
-    purchases_non_deductible_base = float(branch_filter_purchases(db.session.query(func.coalesce(func.sum(PurchaseInvoice.total_before_tax), 0))
-        .filter(PurchaseInvoice.date.between(start_date, end_date))
-        .filter((PurchaseInvoice.tax_amount == 0))).scalar() or 0.0)
-
-    # Expenses breakdown (include into purchases buckets)
-    expenses_deductible_base = float(db.session.query(func.coalesce(func.sum(ExpenseInvoice.total_before_tax), 0))
-        .filter(ExpenseInvoice.date.between(start_date, end_date))
-        .filter((ExpenseInvoice.tax_amount > 0)).scalar() or 0.0)
-    expenses_non_deductible_base = float(db.session.query(func.coalesce(func.sum(ExpenseInvoice.total_before_tax), 0))
-        .filter(ExpenseInvoice.date.between(start_date, end_date))
-        .filter((ExpenseInvoice.tax_amount == 0)).scalar() or 0.0)
-
-    purchases_deductible_base += expenses_deductible_base
-    purchases_non_deductible_base += expenses_non_deductible_base
-
-    # VAT amounts from invoices
-    output_vat = float(branch_filter_sales(db.session.query(func.coalesce(func.sum(SalesInvoice.tax_amount), 0))
-        .filter(SalesInvoice.date.between(start_date, end_date)).scalar() or 0.0))
-    input_vat = float(db.session.query(func.coalesce(func.sum(PurchaseInvoice.tax_amount), 0)).filter(PurchaseInvoice.date.between(start_date, end_date)).scalar() or 0.0) \
-               + float(db.session.query(func.coalesce(func.sum(ExpenseInvoice.tax_amount), 0)).filter(ExpenseInvoice.date.between(start_date, end_date)).scalar() or 0.0)
-    net_vat = output_vat - input_vat
-    # Journals VAT reconciliation
-    try:
-        from models import JournalLine, Account
-        j_out = float(db.session.query(func.coalesce(func.sum(JournalLine.credit - JournalLine.debit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .filter(Account.code == '2141')
-            .filter(JournalLine.line_date.between(start_date, end_date)).scalar() or 0.0)
-    except Exception:
-        j_out = 0.0
-    try:
-        j_in = float(db.session.query(func.coalesce(func.sum(JournalLine.debit - JournalLine.credit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .filter(Account.code == '1170')
-            .filter(JournalLine.line_date.between(start_date, end_date)).scalar() or 0.0)
-    except Exception:
-        j_in = 0.0
-    j_net = j_out - j_in
-    # Journals VAT for reconciliation
-    try:
-        journal_vat_out = float(db.session.query(func.coalesce(func.sum(JournalLine.credit - JournalLine.debit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .filter(Account.code == '2141')
-            .filter(JournalLine.line_date.between(start_date, end_date)).scalar() or 0.0)
-    except Exception:
-        journal_vat_out = 0.0
-    try:
-        journal_vat_in = float(db.session.query(func.coalesce(func.sum(JournalLine.debit - JournalLine.credit), 0))
-            .join(Account, JournalLine.account_id == Account.id)
-            .filter(Account.code == '1170')
-            .filter(JournalLine.line_date.between(start_date, end_date)).scalar() or 0.0)
-    except Exception:
-        journal_vat_in = 0.0
-    journal_vat_net = journal_vat_out - journal_vat_in
+    # All return boxes in one CASE-bucketed pass per invoice table
+    from services.vat_return import get_vat_return
+    boxes = get_vat_return(start_date, end_date, branch)
+    sales_standard_base = boxes['sales_standard_base']
+    sales_zero_base = boxes['sales_zero_base']
+    sales_exempt_base = boxes['sales_exempt_base']
+    sales_exports_base = boxes['sales_exports_base']
+    purchases_deductible_base = boxes['purchases_deductible_base']
+    purchases_non_deductible_base = boxes['purchases_non_deductible_base']
+    output_vat = boxes['output_vat']
+    input_vat = boxes['input_vat']
+    net_vat = boxes['net_vat']
+    journal_vat_out = boxes['journal_vat_out']
+    journal_vat_in = boxes['journal_vat_in']
+    journal_vat_net = boxes['journal_vat_net']
 
     data = {
         'period': period,
@@ -188,14 +127,13 @@ def vat_dashboard():
 
     # Phase 3 – store VAT dashboard in cache (dates as isoformat for serialization)
     try:
-        from utils.cache_helpers import vat_cache_key, VAT_TTL, _cache
-        key = vat_cache_key(start_date, end_date, branch)
-        c = _cache()
-        if c:
+        from utils.cache_helpers import vat_cache_key, VAT_TTL, tagged_set, tagged_ttl
+        if vat_versions is not None:
+            key = vat_cache_key(start_date, end_date, branch)
             stub = dict(data)
             stub['start_date'] = start_date.isoformat() if hasattr(start_date, 'isoformat') else str(start_date)
             stub['end_date'] = end_date.isoformat() if hasattr(end_date, 'isoformat') else str(end_date)
-            c.set(key, stub, timeout=VAT_TTL)
+            tagged_set(key, stub, vat_versions, tagged_ttl(VAT_TTL))
     except Exception:
         pass
 
@@ -235,29 +173,23 @@ def vat_print():
             return redirect(url_for('vat.vat_dashboard'))
         start_date, end_date = quarter_start_end(year, quarter)
 
-    sales_place_india = db.session.query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0)) \
-        .filter(SalesInvoice.branch == 'place_india') \
-        .filter(SalesInvoice.date.between(start_date, end_date)).scalar()
-    sales_china_town = db.session.query(func.coalesce(func.sum(SalesInvoice.total_before_tax), 0)) \
-        .filter(SalesInvoice.branch == 'china_town') \
-        .filter(SalesInvoice.date.between(start_date, end_date)).scalar()
+    from services.vat_return import get_vat_return
+    boxes = get_vat_return(start_date, end_date, 'all')
+    sales_place_india = boxes['sales_place_india_base']
+    sales_china_town = boxes['sales_china_town_base']
     sales_total = (sales_place_india or 0) + (sales_china_town or 0)
 
-    purchases_total = db.session.query(func.coalesce(func.sum(PurchaseInvoice.total_before_tax), 0)) \
-        .filter(PurchaseInvoice.date.between(start_date, end_date)).scalar()
-    expenses_total = db.session.query(func.coalesce(func.sum(ExpenseInvoice.total_before_tax), 0)) \
-        .filter(ExpenseInvoice.date.between(start_date, end_date)).scalar()
+    purchases_total = boxes['purchases_total']
+    expenses_total = boxes['expenses_total']
 
-    s = Settings.query.first()
+    s = current_settings()
     VAT_RATE = float(s.vat_rate)/100.0 if s and s.vat_rate is not None else 0.15
-    # Prefer summing invoice tax amounts
-    output_vat = float(db.session.query(func.coalesce(func.sum(SalesInvoice.tax_amount), 0))
-        .filter(SalesInvoice.date.between(start_date, end_date)).scalar() or 0.0)
-    input_vat = float(db.session.query(func.coalesce(func.sum(PurchaseInvoice.tax_amount), 0))
-        .filter(PurchaseInvoice.date.between(start_date, end_date)).scalar() or 0.0) + \
-               float(db.session.query(func.coalesce(func.sum(ExpenseInvoice.tax_amount), 0))
-        .filter(ExpenseInvoice.date.between(start_date, end_date)).scalar() or 0.0)
+    output_vat = boxes['output_vat']
+    input_vat = boxes['input_vat']
     net_vat = output_vat - input_vat
+    j_out = boxes['journal_vat_out']
+    j_in = boxes['journal_vat_in']
+    j_net = boxes['journal_vat_net']
 
     # company/labels from settings if available
     company_name = s.company_name if s and getattr(s, 'company_name', None) else ''
@@ -24,6 +24,8 @@ def main():
         os.environ['LOCAL_SQLITE_PATH'] = db_file
         os.environ['DATABASE_URL'] = db_uri
         os.environ.setdefault('ENV', 'development')
+        # Local runner: create missing tables / legacy columns at startup (deploys run `flask ensure-schema`)
+        os.environ.setdefault('ENSURE_SCHEMA_ON_STARTUP', '1')
 
         # Import app (config reads LOCAL_SQLITE_PATH in dev)
         from app import create_app
@@ -5,13 +5,12 @@ import subprocess
 if __name__ == "__main__":
     port = os.getenv("PORT", "8000")  # Render sends PORT automatically
 
+    # العمال والخيوط وحجم pool من gunicorn.conf.py (WEB_CONCURRENCY / GUNICORN_THREADS)
+    os.environ["PORT"] = port
     cmd = [
         "gunicorn",
+        "-c", "gunicorn.conf.py",
         "wsgi:application",
-        "-k", "eventlet",
-        "--workers", "1",
-        "--timeout", "120",
-        f"--bind=0.0.0.0:{port}"
     ]
     
     try:
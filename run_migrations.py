@@ -53,5 +53,20 @@ def run_migrations():
         print("[run_migrations] ⚠️ Migration failed, but continuing startup...")
         # Don't exit - let the app start even if migrations fail
 
+def run_schema_fixups():
+    """One-shot schema fix-ups (missing tables, legacy columns) and data backfills — no longer run by every worker"""
+    try:
+        from app import create_app
+        from app.schema_fixups import backfill_data, ensure_schema
+        app = create_app()
+        with app.app_context():
+            for item in ensure_schema():
+                print(f"[run_migrations] ensure-schema: {item}")
+            for item in backfill_data():
+                print(f"[run_migrations] backfill-data: {item}")
+    except Exception as e:
+        print(f"[run_migrations] ⚠️ Schema fix-ups failed: {e}")
+
 if __name__ == '__main__':
     run_migrations()
+    run_schema_fixups()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""
+Seed the stock movement ledger with one 'opening' movement per raw material
+that has stock on hand but no movements yet, so stock-as-of-date queries
+start from the current quantities. Safe to run more than once.
+Run once after deploying the stock_movements table:
+    python scripts/backfill_stock_opening_balances.py [YYYY-MM-DD]
+"""
+from __future__ import print_function
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    from datetime import datetime
+    from app import create_app
+    from extensions import db
+    from services.stock_ledger import ensure_opening_balances
+
+    on_date = None
+    if len(sys.argv) > 1:
+        on_date = datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+    app = create_app()
+    with app.app_context():
+        added = ensure_opening_balances(on_date)
+        db.session.commit()
+        print("Opening movements added:", added)
+
+
+if __name__ == '__main__':
+    main()
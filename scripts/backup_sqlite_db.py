@@ -3,13 +3,14 @@
 """
 نسخة احتياطية يدوية لملف SQLite.
 يقرأ المسار من config (instance/accounting_app.db أو LOCAL_SQLITE_PATH)
-وينسخ الملف إلى backup/db_backup_YYYYMMDD_HHMMSS.sqlite.
+وينسخ الملف إلى backup/db_backup_YYYYMMDD_HHMMSS.sqlite عبر backup API الخاص بـ SQLite
+(يشمل الصفحات الملتزمة في ملف -wal عند SQLITE_PERFORMANCE=1، بخلاف نسخ الملف مباشرة).
 
 تشغيل: python scripts/backup_sqlite_db.py
 """
 import os
 import sys
-import shutil
+import sqlite3
 from datetime import datetime
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -31,7 +32,13 @@ def main():
     os.makedirs(backup_dir, exist_ok=True)
     stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     backup_path = os.path.join(backup_dir, f'db_backup_{stamp}.sqlite')
-    shutil.copy2(db_path, backup_path)
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(backup_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
     print(f"✅ تم النسخ الاحتياطي: {backup_path}")
     return 0
 
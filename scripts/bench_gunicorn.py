@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس الإنتاجية عبر gunicorn الحقيقي (gunicorn.conf.py) عند 1/2/4 عمال على نقاط البيع والتقارير.
+
+يعمل على نسخة من قاعدة SQLite المحلية (لا يلمس instance/) مع مستخدم قياس مؤقت، ويشغّل gunicorn لكل عدد عمال،
+ثم يرسل طلبات GET متوازية ويطبع الطلبات/ث و p50/p95 لكل نقطة.
+
+تشغيل: من جذر المشروع
+  python scripts/bench_gunicorn.py [--workers 1,2,4] [--threads 4] [--concurrency 16] [--seconds 10]
+"""
+from __future__ import annotations
+
+import argparse
+import http.cookiejar
+import os
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_USER = 'bench_admin'
+BENCH_PASSWORD = 'bench-pass-123'
+
+ENDPOINTS = (
+    ('pos', '/api/menu/all-items'),
+    ('pos', '/sales/china_town/tables'),
+    ('report', '/api/reports/monthly'),
+    ('report', '/api/reports/customer-sales'),
+    ('report', '/api/reports/aging?kind=ar'),
+)
+
+
+def _prepare_db(tmpdir: str) -> str:
+    src = os.getenv('LOCAL_SQLITE_PATH') or os.path.join(ROOT, 'instance', 'accounting_app.db')
+    dst = os.path.join(tmpdir, 'bench.db')
+    if os.path.exists(src):
+        shutil.copy2(src, dst)
+    os.environ['LOCAL_SQLITE_PATH'] = dst
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from app import create_app
+    from app.schema_fixups import warmup
+    from extensions import db
+    from models import User
+
+    app = create_app()
+    with app.app_context():
+        warmup()
+        u = User.query.filter_by(username=BENCH_USER).first()
+        if not u:
+            u = User(username=BENCH_USER, email='bench@example.com', role='admin', active=True)
+            db.session.add(u)
+        u.set_password(BENCH_PASSWORD)
+        db.session.commit()
+        db.engine.dispose()
+    return dst
+
+
+def _opener():
+    return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+
+def _login(base: str):
+    op = _opener()
+    html = op.open(base + '/login', timeout=30).read().decode('utf-8', 'ignore')
+    m = re.search(r'name="csrf_token" value="([^"]+)"', html)
+    data = urllib.parse.urlencode({
+        'username': BENCH_USER, 'password': BENCH_PASSWORD, 'csrf_token': m.group(1) if m else '',
+    }).encode()
+    op.open(base + '/login', data=data, timeout=30).read()
+    return op
+
+
+def _wait_ready(base: str, proc, limit_s: float = 60.0) -> None:
+    t0 = time.time()
+    while time.time() - t0 < limit_s:
+        if proc.poll() is not None:
+            raise RuntimeError('gunicorn exited with %s' % proc.returncode)
+        try:
+            urllib.request.urlopen(base + '/login', timeout=2).read()
+            return
+        except Exception:
+            time.sleep(0.3)
+    raise RuntimeError('gunicorn not ready after %.0fs' % limit_s)
+
+
+def _hammer(base: str, path: str, concurrency: int, seconds: float):
+    openers = [_login(base) for _ in range(concurrency)]
+    deadline = time.perf_counter() + seconds
+    latencies, errors = [], 0
+
+    def loop(op):
+        lat, err = [], 0
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            try:
+                resp = op.open(base + path, timeout=30)
+                resp.read()
+                # إعادة توجيه لصفحة الدخول = جلسة غير صالحة، لا تُحسب نجاحاً
+                if resp.status != 200 or '/login' in resp.geturl():
+                    err += 1
+            except Exception:
+                err += 1
+            lat.append(time.perf_counter() - t)
+        return lat, err
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        for lat, err in ex.map(loop, openers):
+            latencies.extend(lat)
+            errors += err
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        'requests': len(latencies), 'errors': errors, 'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0, 'p95_ms': p(0.95),
+    }
+
+
+def run(worker_counts, threads: int, concurrency: int, seconds: float, port: int):
+    rows = []
+    for w in worker_counts:
+        env = dict(os.environ, WEB_CONCURRENCY=str(w), GUNICORN_THREADS=str(threads), PORT=str(port),
+                   WARMUP_ON_START='0', ENSURE_SCHEMA_ON_STARTUP='0')
+        env.pop('GUNICORN_WORKER_CLASS', None)
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:application'],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        base = 'http://127.0.0.1:%d' % port
+        try:
+            _wait_ready(base, proc)
+            for kind, path in ENDPOINTS:
+                _hammer(base, path, 2, 1.0)  # تسخين كل عامل
+                r = _hammer(base, path, concurrency, seconds)
+                rows.append((w, kind, path, r))
+                print('workers=%d %-6s %-40s %7.1f req/s  p50=%6.1fms  p95=%7.1fms  errors=%d' % (
+                    w, kind, path, r['rps'], r['p50_ms'], r['p95_ms'], r['errors']), flush=True)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description='gunicorn throughput at several worker counts')
+    ap.add_argument('--workers', default='1,2,4')
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--concurrency', type=int, default=16)
+    ap.add_argument('--seconds', type=float, default=10.0)
+    ap.add_argument('--port', type=int, default=8765)
+    args = ap.parse_args()
+    os.chdir(ROOT)
+    tmpdir = tempfile.mkdtemp(prefix='bench_gunicorn_')
+    try:
+        _prepare_db(tmpdir)
+        print('cpus=%d threads=%d concurrency=%d seconds=%.0f' % (
+            os.cpu_count() or 1, args.threads, args.concurrency, args.seconds))
+        run([int(x) for x in args.workers.split(',') if x.strip()], args.threads, args.concurrency,
+            args.seconds, args.port)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
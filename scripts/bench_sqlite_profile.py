@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+مقارنة SQLite الافتراضي (NullPool، rollback journal) بوضع الأداء (SQLITE_PERFORMANCE=1: WAL + pool) على
+إنهاء البيع (checkout) وتقارير القراءة.
+
+كل وضع يعمل في عملية مستقلة (خيارات المحرك تُقرأ عند تحميل config) على نسخة مؤقتة من قاعدة SQLite المحلية؛
+لا يلمس instance/.
+
+تشغيل: من جذر المشروع
+  python scripts/bench_sqlite_profile.py [--checkouts 200] [--reports 200] [--threads 4]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPORTS = ('/api/reports/monthly', '/api/reports/customer-sales', '/api/reports/aging?kind=ar')
+
+
+def _child(checkouts: int, reports: int, threads: int) -> dict:
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from app.schema_fixups import warmup
+    from extensions import db
+    from models import MenuCategory, MenuItem, Meal, User
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        warmup()
+        u = User.query.filter_by(username='bench_admin').first()
+        if not u:
+            u = User(username='bench_admin', email='bench@example.com', role='admin', active=True)
+            db.session.add(u)
+        u.set_password('bench-pass-123')
+        db.session.flush()
+        item = MenuItem.query.first()
+        if item is None:
+            cat = MenuCategory.query.first() or MenuCategory(name='Bench', active=True)
+            meal = Meal(name='Bench meal', name_ar='وجبة', selling_price=25.0, active=True, user_id=u.id)
+            db.session.add_all([cat, meal])
+            db.session.flush()
+            item = MenuItem(category_id=cat.id, meal_id=meal.id, name='Bench meal', price=25.0)
+            db.session.add(item)
+        db.session.commit()
+        item_id = item.id
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    def client():
+        c = app.test_client()
+        c.post('/login', data={'username': 'bench_admin', 'password': 'bench-pass-123'})
+        return c
+
+    def run(n, fn):
+        clients = [client() for _ in range(threads)]
+        errors = [0]
+
+        def work(i):
+            if not fn(clients[i % threads], i):
+                errors[0] += 1
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as ex:
+            list(ex.map(work, range(n)))
+        elapsed = time.perf_counter() - t0
+        return {'n': n, 'seconds': round(elapsed, 3), 'per_s': round(n / elapsed, 1), 'errors': errors[0]}
+
+    def checkout(c, i):
+        r = c.post('/api/sales/checkout', json={
+            # رقم الفاتورة = الثانية + الطاولة: طاولة مختلفة لكل طلب حتى لا تتكرر الأرقام في نفس الثانية
+            'branch_code': 'china_town', 'table_number': i + 1, 'payment_method': 'CASH',
+            'items': [{'meal_id': item_id, 'qty': 1 + i % 3}],
+        })
+        return r.status_code == 200 and (r.get_json() or {}).get('success') is not False
+
+    def report(c, i):
+        return c.get(REPORTS[i % len(REPORTS)]).status_code == 200
+
+    out = {'journal_mode': journal_mode, 'checkout': run(checkouts, checkout), 'reports': run(reports, report)}
+    with app.app_context():
+        db.engine.dispose()
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description='SQLite default vs performance profile')
+    ap.add_argument('--checkouts', type=int, default=200)
+    ap.add_argument('--reports', type=int, default=200)
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        print(json.dumps(_child(args.checkouts, args.reports, args.threads)))
+        return
+
+    src = os.getenv('LOCAL_SQLITE_PATH') or os.path.join(ROOT, 'instance', 'accounting_app.db')
+    tmpdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+    try:
+        print('checkouts=%d reports=%d threads=%d' % (args.checkouts, args.reports, args.threads))
+        for label, flag in (('default', '0'), ('performance', '1')):
+            dst = os.path.join(tmpdir, '%s.db' % label)
+            if os.path.exists(src):
+                shutil.copy2(src, dst)
+            env = dict(os.environ, SQLITE_PERFORMANCE=flag, LOCAL_SQLITE_PATH=dst, GUNICORN_THREADS=str(args.threads),
+                       ENSURE_SCHEMA_ON_STARTUP='0')
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', '--checkouts', str(args.checkouts),
+                 '--reports', str(args.reports), '--threads', str(args.threads)],
+                cwd=ROOT, env=env, capture_output=True, text=True,
+            )
+            if out.returncode != 0:
+                print('%s failed:\n%s' % (label, out.stderr[-2000:]))
+                continue
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print('%-12s journal=%-8s checkout %7.1f/s (%.2fs, errors=%d)   reports %7.1f/s (%.2fs, errors=%d)' % (
+                label, r['journal_mode'], r['checkout']['per_s'], r['checkout']['seconds'], r['checkout']['errors'],
+                r['reports']['per_s'], r['reports']['seconds'], r['reports']['errors']))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""
+Post-commit batch job: consume recipe ingredients for sales invoices that have
+no stock movements yet (invoices created by other sale paths, or a checkout
+whose depletion savepoint failed). Each invoice is processed at most once, so
+the job is safe to schedule (e.g. every few minutes) or run by hand:
+    python scripts/deplete_sales_stock.py [START YYYY-MM-DD] [END YYYY-MM-DD]
+START defaults to today so historical sales are not replayed against current
+stock by accident.
+"""
+from __future__ import print_function
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    from datetime import datetime
+    from app import create_app
+    from extensions import db
+    from models import get_saudi_now
+    from services.recipe_depletion import deplete_pending_invoices
+
+    start = get_saudi_now().date()
+    end = None
+    if len(sys.argv) > 1:
+        start = datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+    if len(sys.argv) > 2:
+        end = datetime.strptime(sys.argv[2], '%Y-%m-%d').date()
+    app = create_app()
+    with app.app_context():
+        added = deplete_pending_invoices(start, end)
+        db.session.commit()
+        print("Sale movements added:", added)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""
+Rebuild the invoice_settlements index (paid / remaining per sales, purchase
+and expense invoice) from posted journal lines and the legacy payments table.
+Run after deploying the table, after bulk SQL fixes, or whenever a statement
+looks out of sync:
+    python scripts/rebuild_invoice_settlements.py [sales|purchase|expense]
+"""
+from __future__ import print_function
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    from app import create_app
+    from extensions import db
+    from services.invoice_settlement import rebuild_settlements, SETTLEMENT_TYPES
+
+    invoice_type = sys.argv[1].strip().lower() if len(sys.argv) > 1 else None
+    if invoice_type and invoice_type not in SETTLEMENT_TYPES:
+        print("Unknown invoice type:", invoice_type)
+        sys.exit(1)
+    app = create_app()
+    with app.app_context():
+        n = rebuild_settlements(invoice_type)
+        db.session.commit()
+        print("Settlement rows rebuilt:", n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Rebuild the payroll_month_summaries table (gross / paid / remaining per
+employee and month) from salaries and salary payments. Run after deploying
+the table, after bulk SQL fixes, or whenever a payroll statement looks out
+of sync:
+    python scripts/rebuild_payroll_summaries.py
+"""
+from __future__ import print_function
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    from app import create_app
+    from extensions import db
+    from services.payroll_summary import rebuild_payroll_summaries
+
+    app = create_app()
+    with app.app_context():
+        n = rebuild_payroll_summaries()
+        db.session.commit()
+        print("Payroll summary rows rebuilt:", n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+سجل الحسابات داخل العملية لبُناة القيود: رمز الحساب → (id, code, name, type)، وحساب الدفع من account_usage_map.
+
+- يُبنى باستعلامين (accounts + account_usage_map للدفع) ويُعاد استخدامه؛ _account و _pm_account في app.routes
+  يحلّان كل أسطر القيد دون أي استعلام (بدل func.lower(code) الذي لا يستخدم فهرس accounts.code لكل سطر).
+- مختوم برقم جيل: أي flush يمس Account أو AccountUsageMap يُسقط السجل المحلي فوراً، وcommit يرفع الجيل المشترك
+  في الكاش (acc_registry:gen) فتعيد العمال الأخرى البناء عند أول فحص (كل _GEN_CHECK_S ثانية على الأكثر).
+- كل واجهات التعديل في routes/financials.py تمر عبر ORM فيلتقطها المستمع؛ التعديل بـ SQL مباشر يستدعي
+  invalidate_account_registry يدوياً.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+REGISTRY_GEN_KEY = "acc_registry:gen"
+# أقصى عمر للسجل حتى مع كاش محلي لكل عملية (SimpleCache لا يشارك الجيل بين العمال)
+REGISTRY_MAX_AGE_S = 300
+_GEN_CHECK_S = 2.0
+PAY_MODULE, PAY_ACTION = 'Payments', 'PayExpense'
+_DIRTY_KEY = '_acc_registry_dirty'
+
+_listeners_registered = False
+_lock = threading.Lock()
+# مفتاح القاعدة (url المحرك) → السجل؛ حتى لا يختلط تطبيقان أو قاعدتا اختبار في عملية واحدة
+_registries: Dict[str, Dict] = {}
+
+
+class AccountRef:
+    """بديل خفيف لكائن Account: id/code/name/type بلا استعلام، وبقية الأعمدة تُحمَّل من ORM عند الطلب."""
+
+    __slots__ = ('id', 'code', 'name', 'type')
+
+    def __init__(self, id: int, code: str, name: str, type: str):
+        self.id = id
+        self.code = code
+        self.name = name
+        self.type = type
+
+    def __getattr__(self, attr):
+        from extensions import db
+        from models import Account
+        obj = db.session.get(Account, self.id)
+        if obj is None:
+            raise AttributeError(attr)
+        return getattr(obj, attr)
+
+    def __repr__(self) -> str:
+        return f"<AccountRef {self.code} #{self.id}>"
+
+
+def _shared_gen() -> int:
+    from utils.cache_helpers import _cache
+    c = _cache()
+    if c is None:
+        return 0
+    try:
+        return int(c.get(REGISTRY_GEN_KEY) or 0)
+    except Exception:
+        return 0
+
+
+def _db_key() -> str:
+    from extensions import db
+    return str(db.engine.url)
+
+
+def _build(gen: int) -> Dict:
+    from sqlalchemy import select
+    from extensions import db
+    from models import Account, AccountUsageMap
+
+    by_code: Dict[str, AccountRef] = {}
+    by_id: Dict[int, AccountRef] = {}
+    for aid, code, name, typ in db.session.execute(
+        select(Account.id, Account.code, Account.name, Account.type)
+    ).all():
+        if not code:
+            continue
+        ref = AccountRef(int(aid), code, name, typ)
+        by_code.setdefault(code.strip().lower(), ref)
+        by_id[ref.id] = ref
+    pay: Dict[str, int] = {}
+    try:
+        rows = db.session.execute(
+            select(AccountUsageMap.usage_group, AccountUsageMap.account_id)
+            .where(AccountUsageMap.module == PAY_MODULE, AccountUsageMap.action == PAY_ACTION,
+                   AccountUsageMap.active == True)  # noqa: E712
+            .order_by(AccountUsageMap.is_default.desc(), AccountUsageMap.id.asc())
+        ).all()
+        for grp, aid in rows:
+            if grp and aid and grp not in pay:
+                pay[grp] = int(aid)
+    except Exception:
+        # جدول account_usage_map غير موجود بعد (يُنشأ من شاشة الإعدادات)
+        pass
+    now = time.monotonic()
+    return {'gen': gen, 'built': now, 'checked': now, 'by_code': by_code, 'by_id': by_id, 'pay': pay}
+
+
+def _registry() -> Dict:
+    key = _db_key()
+    reg = _registries.get(key)
+    now = time.monotonic()
+    if reg is not None:
+        if now - reg['built'] > REGISTRY_MAX_AGE_S:
+            reg = None
+        elif now - reg['checked'] > _GEN_CHECK_S:
+            if _shared_gen() != reg['gen']:
+                reg = None
+            else:
+                reg['checked'] = now
+    if reg is None:
+        with _lock:
+            reg = _build(_shared_gen())
+            _registries[key] = reg
+    return reg
+
+
+def account_ref(code: str) -> Optional[AccountRef]:
+    """الحساب برمزه (دون حساسية لحالة الأحرف) أو None إن لم يكن موجوداً."""
+    if not code:
+        return None
+    return _registry()['by_code'].get(str(code).strip().lower())
+
+
+def pay_account_ref(usage_group: str) -> Optional[AccountRef]:
+    """حساب الدفع المهيأ لمجموعة الاستخدام (Cash/Bank) من account_usage_map، الافتراضي أولاً."""
+    reg = _registry()
+    aid = reg['pay'].get(usage_group)
+    return reg['by_id'].get(aid) if aid else None
+
+
+def registry_stats() -> Tuple[int, int]:
+    reg = _registry()
+    return len(reg['by_code']), len(reg['pay'])
+
+
+def _drop_local() -> None:
+    _registries.clear()
+    # فهرس الشجرة (services.coa_index) يضم الحسابات الفرعية من نفس الجدول
+    from services.coa_index import refresh_coa_index
+    refresh_coa_index()
+
+
+def invalidate_account_registry() -> None:
+    """إسقاط السجل المحلي ورفع الجيل المشترك (العمال الأخرى تعيد البناء عند الفحص التالي)."""
+    from utils.cache_helpers import _cache
+    _drop_local()
+    c = _cache()
+    if c is not None:
+        try:
+            c.set(REGISTRY_GEN_KEY, _shared_gen() + 1, timeout=0)
+        except Exception:
+            pass
+
+
+def _mark_after_flush(session, flush_context) -> None:
+    try:
+        from models import Account, AccountUsageMap
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, (Account, AccountUsageMap)):
+                # نفس المعاملة قد تقرأ السجل بعد التعديل: لا نُبقي نسخة قديمة حتى commit
+                _drop_local()
+                session.info[_DIRTY_KEY] = True
+                return
+    except Exception:
+        pass
+
+
+def _invalidate_after_commit(session) -> None:
+    if session.info.pop(_DIRTY_KEY, None):
+        invalidate_account_registry()
+
+
+def _clear_on_rollback(session, previous_transaction) -> None:
+    if session.info.get(_DIRTY_KEY):
+        # السجل ربما بُني من صفوف غير ملتزمة
+        _drop_local()
+        if previous_transaction.parent is None:
+            session.info.pop(_DIRTY_KEY, None)
+
+
+def register_account_registry_listeners() -> None:
+    """إبطال السجل عند أي تعديل على الحسابات أو خريطة الاستخدام (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _mark_after_flush)
+    event.listen(Session, 'after_commit', _invalidate_after_commit)
+    event.listen(Session, 'after_soft_rollback', _clear_on_rollback)
+    _listeners_registered = True
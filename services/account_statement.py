@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+كشف حساب من القيود المنشورة دون تحميل كل أسطر الفترة في الذاكرة.
+
+- opening_balance(): من تجميع الأرصدة (coa_rollup.gl_rollup حتى اليوم السابق للبداية، مخزن وموسوم ومشترك مع
+  ميزان المراجعة)، ومجموع حساب واحد لما ليس في الشجرة.
+- الرصيد المتراكم بدالة نافذة: SUM(±(debit−credit)) OVER (ORDER BY line_date, id) على أسطر الفترة.
+- statement_page(): ترقيم بالمفتاح (line_date, id) — after/before بدل OFFSET، والصفحة وحدها تصل لبايثون.
+- iter_statement(): مولد على دفعات (yield_per) للتصدير والطباعة المتدفقة.
+- SQLite أقدم من 3.25 (بدون دوال النافذة): رصيد ما قبل المؤشر بمجموع واحد ثم تراكم الصفحة في بايثون.
+
+الإشارة: دائن−مدين للالتزامات وحقوق الملكية ومدين−دائن لغيرها (coa_rollup.signed_balance)، حسب accounts.type.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_BATCH = 1000
+
+Cursor = Tuple[date, int]
+
+
+def _credit_nature(account) -> bool:
+    from services.coa_rollup import CREDIT_NATURE_TYPES
+    return (getattr(account, 'type', None) or '').upper() in CREDIT_NATURE_TYPES
+
+
+def _amount(account):
+    from models import JournalLine
+    if _credit_nature(account):
+        return JournalLine.credit - JournalLine.debit
+    return JournalLine.debit - JournalLine.credit
+
+
+def _base_filter(account, start: date, end: date) -> list:
+    from models import JournalEntry, JournalLine
+    return [
+        JournalEntry.status == 'posted',
+        JournalLine.account_id == account.id,
+        JournalLine.line_date.between(start, end),
+    ]
+
+
+def format_cursor(line_date: date, line_id: int) -> str:
+    return f"{line_date.isoformat()}_{int(line_id)}"
+
+
+def parse_cursor(value: Optional[str]) -> Optional[Cursor]:
+    """'YYYY-MM-DD_id' → (date, id)، أو None لأي قيمة غير صالحة."""
+    try:
+        d, i = (value or '').strip().split('_', 1)
+        return datetime.strptime(d, '%Y-%m-%d').date(), int(i)
+    except Exception:
+        return None
+
+
+def _after(cols, cursor: Cursor):
+    from sqlalchemy import and_, or_
+    d, i = cursor
+    return or_(cols.line_date > d, and_(cols.line_date == d, cols.id > i))
+
+
+def _before(cols, cursor: Cursor):
+    from sqlalchemy import and_, or_
+    d, i = cursor
+    return or_(cols.line_date < d, and_(cols.line_date == d, cols.id < i))
+
+
+def opening_balance(account, start: date) -> float:
+    """رصيد الحساب قبل start (بإشارة طبيعته)."""
+    from services.coa_rollup import gl_rollup, signed_balance
+    atype = getattr(account, 'type', None)
+    try:
+        for r in gl_rollup(start - timedelta(days=1))['rows']:
+            if r['code'] == account.code:
+                return signed_balance(atype, r['own_debit'], r['own_credit'])
+    except Exception:
+        pass
+    from sqlalchemy import func
+    from extensions import db
+    from models import JournalEntry, JournalLine
+    d, c = db.session.query(
+        func.coalesce(func.sum(JournalLine.debit), 0), func.coalesce(func.sum(JournalLine.credit), 0),
+    ).join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
+     .filter(JournalEntry.status == 'posted', JournalLine.account_id == account.id,
+             JournalLine.line_date < start).one()
+    return signed_balance(atype, float(d or 0), float(c or 0))
+
+
+def count_lines(account, start: date, end: date) -> int:
+    from sqlalchemy import func
+    from extensions import db
+    from models import JournalEntry, JournalLine
+    return int(db.session.query(func.count(JournalLine.id))
+               .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
+               .filter(*_base_filter(account, start, end)).scalar() or 0)
+
+
+def _line_columns():
+    from models import JournalEntry, JournalLine
+    return (
+        JournalLine.id, JournalLine.line_date, JournalLine.debit, JournalLine.credit,
+        JournalLine.description.label('line_description'),
+        JournalEntry.entry_number, JournalEntry.description.label('entry_description'),
+    )
+
+
+def _windowed(account, start: date, end: date):
+    """أسطر الفترة مع الرصيد المتراكم (بدون الافتتاحي) كاستعلام فرعي."""
+    from sqlalchemy import func, select
+    from models import JournalEntry, JournalLine
+    running = func.sum(_amount(account)).over(order_by=(JournalLine.line_date, JournalLine.id))
+    return (
+        select(*_line_columns(), running.label('running'))
+        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
+        .where(*_base_filter(account, start, end))
+        .subquery()
+    )
+
+
+def _row(r, balance: float) -> Dict[str, Any]:
+    return {
+        'id': r.id,
+        'line_date': r.line_date,
+        'entry_number': r.entry_number,
+        'description': r.entry_description,
+        'line_description': r.line_description,
+        'debit': float(r.debit or 0),
+        'credit': float(r.credit or 0),
+        'balance': balance,
+    }
+
+
+def _change(account, r) -> float:
+    d, c = float(r.debit or 0), float(r.credit or 0)
+    return c - d if _credit_nature(account) else d - c
+
+
+def _page_window(account, start, end, opening, after, before, limit) -> Tuple[List[Dict], bool]:
+    from sqlalchemy import select
+    from extensions import db
+    w = _windowed(account, start, end)
+    stmt = select(w)
+    if before is not None:
+        stmt = stmt.where(_before(w.c, before)).order_by(w.c.line_date.desc(), w.c.id.desc())
+    else:
+        if after is not None:
+            stmt = stmt.where(_after(w.c, after))
+        stmt = stmt.order_by(w.c.line_date.asc(), w.c.id.asc())
+    rows = db.session.execute(stmt.limit(limit + 1)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+    return [_row(r, opening + float(r.running or 0)) for r in rows], more
+
+
+def _page_python(account, start, end, opening, after, before, limit) -> Tuple[List[Dict], bool]:
+    from sqlalchemy import func
+    from extensions import db
+    from models import JournalEntry, JournalLine
+    q = db.session.query(*_line_columns()) \
+        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
+        .filter(*_base_filter(account, start, end))
+    if before is not None:
+        rows = q.filter(_before(JournalLine, before)) \
+            .order_by(JournalLine.line_date.desc(), JournalLine.id.desc()).limit(limit + 1).all()
+        more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+    else:
+        if after is not None:
+            q = q.filter(_after(JournalLine, after))
+        rows = q.order_by(JournalLine.line_date.asc(), JournalLine.id.asc()).limit(limit + 1).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+    if not rows:
+        return [], more
+    prior = db.session.query(func.coalesce(func.sum(_amount(account)), 0)) \
+        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
+        .filter(*_base_filter(account, start, end)) \
+        .filter(_before(JournalLine, (rows[0].line_date, rows[0].id))).scalar()
+    bal = opening + float(prior or 0)
+    out = []
+    for r in rows:
+        bal += _change(account, r)
+        out.append(_row(r, bal))
+    return out, more
+
+
+def _use_window() -> bool:
+    from extensions import db
+    from services.inventory_valuation import _supports_window_functions
+    return _supports_window_functions(db.session.connection())
+
+
+def statement_page(account, start: date, end: date, opening: float, after: Optional[Cursor] = None,
+                   before: Optional[Cursor] = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """صفحة من الكشف بعد after (أو قبل before) مع مؤشرات التالي والسابق.
+
+    {'lines', 'next', 'prev'} — next/prev مؤشرات نصية (format_cursor) أو None.
+    """
+    limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    fn = _page_window if _use_window() else _page_python
+    lines, more = fn(account, start, end, opening, after, before, limit)
+    if before is not None:
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+    first = lines[0] if lines else None
+    last = lines[-1] if lines else None
+    return {
+        'lines': lines,
+        'next': format_cursor(last['line_date'], last['id']) if has_next and last else None,
+        'prev': format_cursor(first['line_date'], first['id']) if has_prev and first else None,
+    }
+
+
+def iter_statement(account, start: date, end: date, opening: float,
+                   batch: int = STREAM_BATCH) -> Iterator[Dict[str, Any]]:
+    """كل أسطر الفترة بالترتيب مع الرصيد المتراكم، تُجلب على دفعات دون بناء قائمة."""
+    from sqlalchemy import select
+    from extensions import db
+    if _use_window():
+        w = _windowed(account, start, end)
+        stmt = select(w).order_by(w.c.line_date.asc(), w.c.id.asc()).execution_options(yield_per=batch)
+        for r in db.session.execute(stmt):
+            yield _row(r, opening + float(r.running or 0))
+        return
+    from models import JournalEntry, JournalLine
+    stmt = select(*_line_columns()) \
+        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
+        .where(*_base_filter(account, start, end)) \
+        .order_by(JournalLine.line_date.asc(), JournalLine.id.asc()).execution_options(yield_per=batch)
+    bal = opening
+    for r in db.session.execute(stmt):
+        bal += _change(account, r)
+        yield _row(r, bal)
@@ -33,18 +33,19 @@ ACCOUNT_TYPE_COGS = "COGS"
 ACCOUNT_TYPE_TAX = "TAX"
 
 
-def _get_leaf_codes() -> set:
+def _get_leaf_codes() -> frozenset:
     try:
-        from data.coa_new_tree import LEAF_CODES
-        return set(LEAF_CODES) if LEAF_CODES else set()
+        from services.coa_index import leaf_codes
+        return leaf_codes()
     except Exception:
-        return set()
+        return frozenset()
 
 
-def _get_coa_dict() -> dict:
+def _get_coa_dict():
+    """فهرس الشجرة المشترك للقراءة فقط (services.coa_index) بدل بناء القاموس في كل استدعاء."""
     try:
-        from data.coa_new_tree import build_coa_dict
-        return build_coa_dict() or {}
+        from services.coa_index import coa_dict
+        return coa_dict()
     except Exception:
         return {}
 
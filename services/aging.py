@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+أعمار الذمم: المدينون (منصات التوصيل keeta/hunger/المهيأة + العملاء الآجلون) والدائنون (الموردون).
+
+- استعلام واحد لكل نوع على الفواتير مع فهرس السداد invoice_settlements، والتوزيع على الفئات
+  0–30 / 31–60 / 61–90 / 90+ يوماً بـ SUM(CASE ...) في SQL مجمّعاً لكل طرف.
+- المتبقي لتاريخ اليوم من فهرس السداد (الحالي)؛ ولتاريخ سابق يُحسب من الإجمالي ناقص السداد المؤرخ حتى as_of فقط
+  (قيود السداد المنشورة بتاريخ السطر، وإلا الدفعات القديمة بتاريخ الدفع) — دفعة لاحقة لا تغيّر أعمار تاريخ سابق.
+- العمر من تاريخ الفاتورة حتى تاريخ as_of؛ الفواتير بعد as_of مستبعدة.
+- صفوف الفهرس للفواتير القديمة تُكمَّل عند النشر (backfill_data)، لا في طلب القراءة.
+- النتيجة تُخزَّن في الكاش لكل تاريخ as_of، وتُبطَل عند commit أي معاملة تغيّر صفوف فهرس السداد
+  (تسجيل دفعة/تحصيل، ترحيل قيد سداد، فاتورة جديدة).
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+AGING_KINDS = ('ar', 'ap')
+AGING_BUCKETS = ('0_30', '31_60', '61_90', '90_plus')
+AGING_TTL = 600  # 10 min
+AGING_CACHE_PREFIX = "aging:"
+AGING_GEN_KEY = "aging:gen"
+_DIRTY_KEY = '_aging_dirty'
+
+_listeners_registered = False
+
+
+def _bucket_sums(date_col, amount_col, as_of: date):
+    """أعمدة SUM(CASE) لكل فئة عمر (المقارنة على التاريخ مباشرة لتعمل على SQLite وPostgreSQL)."""
+    from sqlalchemy import case, func
+    d30, d60, d90 = as_of - timedelta(days=30), as_of - timedelta(days=60), as_of - timedelta(days=90)
+    conds = (
+        date_col >= d30,
+        (date_col < d30) & (date_col >= d60),
+        (date_col < d60) & (date_col >= d90),
+        date_col < d90,
+    )
+    return [func.coalesce(func.sum(case((c, amount_col), else_=0)), 0) for c in conds]
+
+
+def _remaining_as_of(invoice_type: str, model, as_of: date):
+    """
+    استعلام فرعي (invoice_id, remaining): من فهرس السداد لتاريخ اليوم فما بعد، وللتواريخ السابقة
+    الإجمالي ناقص المسدد حتى as_of بنفس قاعدة الفهرس (قيود GL إن وُجدت وإلا الدفعات، لا يُجمع الاثنان).
+    """
+    from sqlalchemy import case, false, func, select
+    from extensions import db
+    from models import Account, InvoiceSettlement, JournalEntry, JournalLine, Payment, get_saudi_now
+    from services.invoice_settlement import GL_SIDE
+
+    if as_of >= get_saudi_now().date():
+        return (
+            select(InvoiceSettlement.invoice_id.label('invoice_id'), InvoiceSettlement.remaining.label('remaining'))
+            .where(InvoiceSettlement.invoice_type == invoice_type)
+            .subquery()
+        )
+    code, side = GL_SIDE[invoice_type]
+    try:
+        from services.account_registry import account_ref
+        ref = account_ref(code)
+        acc_id = ref.id if ref is not None else None
+    except Exception:
+        acc_id = db.session.query(Account.id).filter(Account.code == code).scalar()
+    col = JournalLine.credit if side == 'credit' else JournalLine.debit
+    gl = (
+        select(JournalLine.invoice_id.label('invoice_id'), func.sum(col).label('paid'))
+        .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
+        .where(
+            (JournalLine.account_id == acc_id) if acc_id is not None else false(),
+            JournalLine.invoice_type == invoice_type,
+            JournalEntry.status == 'posted',
+            func.coalesce(JournalLine.line_date, JournalEntry.date) <= as_of,
+        )
+        .group_by(JournalLine.invoice_id)
+        .subquery()
+    )
+    legacy = (
+        select(Payment.invoice_id.label('invoice_id'), func.sum(Payment.amount_paid).label('paid'))
+        .where(Payment.invoice_type == invoice_type, Payment.payment_date < as_of + timedelta(days=1))
+        .group_by(Payment.invoice_id)
+        .subquery()
+    )
+    gl_paid = func.coalesce(gl.c.paid, 0)
+    paid = case((gl_paid >= 0.01, gl_paid), else_=func.coalesce(legacy.c.paid, 0))
+    return (
+        select(model.id.label('invoice_id'), (func.coalesce(model.total_after_tax_discount, 0) - paid).label('remaining'))
+        .outerjoin(gl, gl.c.invoice_id == model.id)
+        .outerjoin(legacy, legacy.c.invoice_id == model.id)
+        .where(model.date <= as_of)
+        .subquery()
+    )
+
+
+def _row(key: str, name: str, count, sums, **extra) -> Dict[str, Any]:
+    out = {'key': key, 'name': name, 'count': int(count or 0)}
+    out.update(extra)
+    total = 0.0
+    for b, v in zip(AGING_BUCKETS, sums):
+        out[b] = round(float(v or 0), 2)
+        total += out[b]
+    out['total'] = round(total, 2)
+    return out
+
+
+def _ar_aging(as_of: date) -> List[Dict[str, Any]]:
+    from sqlalchemy import and_, func, or_, select
+    from extensions import db
+    from models import Customer, SalesInvoice
+    from services.sales_channel import channel_keys
+
+    keys = channel_keys()
+    rem = _remaining_as_of('sales', SalesInvoice, as_of)
+    credit_ids = select(Customer.id).where(Customer.customer_type == 'credit')
+    is_platform = and_(SalesInvoice.channel.isnot(None), SalesInvoice.channel.in_(keys))
+    # الطرف: مفتاح المنصة إن وُجد وإلا رقم العميل الآجل
+    party_channel = func.coalesce(func.nullif(SalesInvoice.channel, ''), '')
+    party_customer = func.coalesce(SalesInvoice.customer_id, 0)
+    rows = (
+        db.session.query(
+            party_channel, party_customer, func.count(SalesInvoice.id),
+            *_bucket_sums(SalesInvoice.date, rem.c.remaining, as_of),
+        )
+        .join(rem, rem.c.invoice_id == SalesInvoice.id)
+        .filter(
+            SalesInvoice.date <= as_of,
+            rem.c.remaining > 0.005,
+            or_(is_platform, SalesInvoice.customer_id.in_(credit_ids)),
+        )
+        .group_by(party_channel, party_customer)
+        .all()
+    )
+    names = {}
+    cust_ids = {int(r[1]) for r in rows if not r[0] and r[1]}
+    if cust_ids:
+        names = dict(db.session.query(Customer.id, Customer.name).filter(Customer.id.in_(cust_ids)).all())
+    merged: Dict[str, Dict[str, Any]] = {}
+    for ch, cid, cnt, *sums in rows:
+        if ch and ch in keys:
+            key, name, extra = f'channel:{ch}', ch, {'channel': ch, 'customer_id': None}
+        else:
+            key, name, extra = f'customer:{int(cid)}', names.get(int(cid), f'#{int(cid)}'), {'channel': '', 'customer_id': int(cid)}
+        r = _row(key, name, cnt, sums, **extra)
+        prev = merged.get(key)
+        if prev is None:
+            merged[key] = r
+        else:
+            # المنصة تتكرر بعدد أرقام العملاء، والعميل الآجل بعدد القنوات غير المعرفة: تُدمج في صف الطرف
+            prev['count'] += r['count']
+            for b in AGING_BUCKETS + ('total',):
+                prev[b] = round(prev[b] + r[b], 2)
+    return sorted(merged.values(), key=lambda r: -r['total'])
+
+
+def _ap_aging(as_of: date) -> List[Dict[str, Any]]:
+    from sqlalchemy import case, func
+    from extensions import db
+    from models import PurchaseInvoice, Supplier
+
+    rem = _remaining_as_of('purchase', PurchaseInvoice, as_of)
+    party_id = func.coalesce(PurchaseInvoice.supplier_id, 0)
+    party_name = case((PurchaseInvoice.supplier_id.is_(None), func.coalesce(PurchaseInvoice.supplier_name, '')), else_='')
+    rows = (
+        db.session.query(
+            party_id, party_name, func.count(PurchaseInvoice.id),
+            *_bucket_sums(PurchaseInvoice.date, rem.c.remaining, as_of),
+        )
+        .join(rem, rem.c.invoice_id == PurchaseInvoice.id)
+        .filter(PurchaseInvoice.date <= as_of, rem.c.remaining > 0.005)
+        .group_by(party_id, party_name)
+        .all()
+    )
+    sup_ids = {int(r[0]) for r in rows if r[0]}
+    names = {}
+    if sup_ids:
+        names = dict(db.session.query(Supplier.id, Supplier.name).filter(Supplier.id.in_(sup_ids)).all())
+    out = []
+    for sid, sname, cnt, *sums in rows:
+        if sid:
+            out.append(_row(f'supplier:{int(sid)}', names.get(int(sid), f'#{int(sid)}'), cnt, sums, supplier_id=int(sid)))
+        else:
+            out.append(_row(f'supplier_name:{sname}', sname or '-', cnt, sums, supplier_id=None))
+    return sorted(out, key=lambda r: -r['total'])
+
+
+def compute_aging(kind: str, as_of: Optional[date] = None) -> Dict[str, Any]:
+    """أعمار الذمم لكل الأطراف في تمريرة واحدة. kind: 'ar' (مدينون) أو 'ap' (دائنون). للقراءة فقط."""
+    if kind not in AGING_KINDS:
+        raise ValueError(f'unknown aging kind: {kind}')
+    if as_of is None:
+        from models import get_saudi_now
+        as_of = get_saudi_now().date()
+    parties = _ar_aging(as_of) if kind == 'ar' else _ap_aging(as_of)
+    totals = {b: round(sum(p[b] for p in parties), 2) for b in AGING_BUCKETS + ('total',)}
+    totals['count'] = sum(p['count'] for p in parties)
+    return {'kind': kind, 'as_of': as_of.isoformat(), 'buckets': list(AGING_BUCKETS), 'parties': parties, 'totals': totals}
+
+
+def _generation(c) -> int:
+    try:
+        return int(c.get(AGING_GEN_KEY) or 0)
+    except Exception:
+        return 0
+
+
+def get_aging(kind: str, as_of: Optional[date] = None, ttl: int = AGING_TTL) -> Dict[str, Any]:
+    """compute_aging مع كاش لكل (نوع، تاريخ)."""
+    from utils.cache_helpers import _cache
+    if as_of is None:
+        from models import get_saudi_now
+        as_of = get_saudi_now().date()
+    c = _cache()
+    if c is None:
+        return compute_aging(kind, as_of)
+    key = f"{AGING_CACHE_PREFIX}{_generation(c)}:{kind}:{as_of.isoformat()}"
+    val = c.get(key)
+    if val is not None:
+        return val
+    val = compute_aging(kind, as_of)
+    try:
+        c.set(key, val, timeout=ttl)
+    except Exception:
+        pass
+    return val
+
+
+def invalidate_aging_cache() -> None:
+    """رفع رقم الجيل؛ كل مفاتيح الأعمار السابقة تصبح غير مستخدمة وتنتهي بمهلتها."""
+    from utils.cache_helpers import _cache
+    c = _cache()
+    if c is not None:
+        try:
+            c.set(AGING_GEN_KEY, _generation(c) + 1, timeout=0)
+        except Exception:
+            pass
+
+
+def _mark_after_flush(session, flush_context) -> None:
+    try:
+        from models import InvoiceSettlement
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, InvoiceSettlement):
+                session.info[_DIRTY_KEY] = True
+                return
+    except Exception:
+        pass
+
+
+def _invalidate_after_commit(session) -> None:
+    if session.info.pop(_DIRTY_KEY, None):
+        invalidate_aging_cache()
+
+
+def _clear_on_rollback(session, previous_transaction) -> None:
+    if previous_transaction.parent is None:
+        session.info.pop(_DIRTY_KEY, None)
+
+
+def register_aging_listeners() -> None:
+    """إبطال كاش الأعمار بعد commit أي معاملة غيّرت فهرس السداد (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _mark_after_flush)
+    event.listen(Session, 'after_commit', _invalidate_after_commit)
+    event.listen(Session, 'after_soft_rollback', _clear_on_rollback)
+    _listeners_registered = True
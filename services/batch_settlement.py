@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+تسوية جماعية للفواتير في معاملة واحدة (سداد منصات التوصيل، تسديد كل المتبقي).
+
+- المسدد لكل الفواتير باستعلام GROUP BY واحد، والتحقق من المجموعة قبل أي كتابة
+  (نوع معروف، فواتير موجودة بلا تكرار، طريقة دفع).
+- الدفعات تُدرج بـ INSERT جماعي واحد، والحالات بـ UPDATE واحد لكل 500 فاتورة (الفواتير المسددة فعلاً فقط).
+- قيد مجمّع لكل تاريخ فاتورة (نفس تاريخ قيد التحصيل الفردي): سطر نقدية/بنك بالإجمالي مقابل سطر لكل فاتورة
+  على حساب الطرف، مربوط بالفاتورة (invoice_id/invoice_type) ليُحتسب في فهرس السداد وكشوف الحساب.
+- فهرس السداد يُحدَّث صراحةً للفواتير المتأثرة (الإدراج الجماعي يتجاوز مستمعي الجلسة).
+- الدالة لا تنفّذ commit؛ المستدعي يثبّت أو يتراجع عن المجموعة كاملة.
+"""
+from __future__ import annotations
+
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+BATCH_TYPES = ('sales', 'purchase', 'expense')
+
+
+def _to_cents(v) -> Decimal:
+    try:
+        return Decimal(str(v if v is not None else 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except Exception:
+        return Decimal('0.00')
+
+
+def _next_entry_number(base: str) -> str:
+    from models import JournalEntry
+    en, suffix = base, 1
+    while JournalEntry.query.filter_by(entry_number=en).first():
+        en = f"{base}-{suffix}"
+        suffix += 1
+    return en
+
+
+def plan_settlement(invoice_type: str, invoices: Iterable[Any]) -> List[Dict[str, Any]]:
+    """المتبقي لكل فاتورة (الإجمالي − مجموع جدول الدفعات) باستعلام مجمّع واحد. يرفع ValueError لمجموعة غير صالحة."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import Payment
+
+    if invoice_type not in BATCH_TYPES:
+        raise ValueError(f'unsupported invoice type: {invoice_type}')
+    invs = list(invoices or [])
+    ids = [int(inv.id) for inv in invs]
+    if len(set(ids)) != len(ids):
+        raise ValueError('duplicate invoices in settlement batch')
+    paid = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        paid.update(
+            db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
+            .filter(Payment.invoice_type == invoice_type, Payment.invoice_id.in_(chunk))
+            .group_by(Payment.invoice_id)
+            .all()
+        )
+    plan = []
+    for inv in invs:
+        total = _to_cents(getattr(inv, 'total_after_tax_discount', 0))
+        remaining = max(Decimal('0.00'), total - _to_cents(paid.get(int(inv.id))))
+        plan.append({'invoice': inv, 'total': total, 'remaining': remaining})
+    return plan
+
+
+def settle_invoices(
+    invoice_type: str,
+    invoices: Iterable[Any],
+    payment_method: str,
+    cash_account=None,
+    counter_account_for: Optional[Callable[[Any], Any]] = None,
+    on_date: Optional[date] = None,
+    entry_prefix: str = 'JE-REC-BATCH',
+    user_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    تسديد المتبقي كاملاً لكل فاتورة في invoices.
+    cash_account + counter_account_for(inv) → قيد مجمّع لكل تاريخ فاتورة، أو قيد واحد بتاريخ on_date إن مُرِّر
+    (بدونهما: دفعات وحالات فقط). تعيد {'updated', 'paid_count', 'amount', 'items', 'journal_id', 'journal_ids'}.
+    """
+    from sqlalchemy import insert, update
+    from extensions import db
+    from models import JournalEntry, JournalLine, Payment, get_saudi_now
+    from services.invoice_settlement import _invoice_model, refresh_settlements
+
+    method = (payment_method or '').strip().upper()
+    if not method:
+        raise ValueError('payment method required')
+    plan = plan_settlement(invoice_type, invoices)
+    to_pay = [p for p in plan if p['remaining'] > Decimal('0.01')]
+    if cash_account is not None and counter_account_for is not None:
+        for p in to_pay:
+            p['account'] = counter_account_for(p['invoice'])
+            if p['account'] is None:
+                raise ValueError(f"no counter account for invoice {p['invoice'].id}")
+    now = get_saudi_now()
+    model = _invoice_model(invoice_type)
+    all_ids = [int(p['invoice'].id) for p in plan]
+    pay_ids = [int(p['invoice'].id) for p in to_pay]
+
+    if to_pay:
+        db.session.execute(insert(Payment), [
+            {'invoice_id': int(p['invoice'].id), 'invoice_type': invoice_type,
+             'amount_paid': p['remaining'], 'payment_method': method, 'payment_date': now}
+            for p in to_pay
+        ])
+        for i in range(0, len(pay_ids), 500):
+            db.session.execute(update(model).where(model.id.in_(pay_ids[i:i + 500])).values(status='paid'))
+        for p in to_pay:
+            p['invoice'].status = 'paid'
+
+    total_amt = sum((p['remaining'] for p in to_pay), Decimal('0.00'))
+    journal_ids = []
+    if to_pay and cash_account is not None and counter_account_for is not None:
+        # مبيعات: مدين نقدية / دائن ذمم كل فاتورة — مشتريات ومصروفات: مدين موردين لكل فاتورة / دائن نقدية
+        cash_debit = invoice_type == 'sales'
+        by_date: Dict[Any, List[Dict[str, Any]]] = {}
+        for p in to_pay:
+            by_date.setdefault(on_date or getattr(p['invoice'], 'date', None) or now.date(), []).append(p)
+        for je_date, group in sorted(by_date.items()):
+            group_amt = sum((p['remaining'] for p in group), Decimal('0.00'))
+            amt = float(group_amt)
+            single = group[0]['invoice'] if len(group) == 1 else None
+            je = JournalEntry(
+                entry_number=_next_entry_number(f"{entry_prefix}-{now.strftime('%Y%m%d%H%M%S')}"),
+                date=je_date, branch_code=None,
+                description=f"Batch {'receipt' if cash_debit else 'payment'} {invoice_type} ({len(group)} invoices)",
+                status='posted', total_debit=amt, total_credit=amt,
+                created_by=user_id, posted_by=user_id, invoice_type=f'{invoice_type}_payment',
+                invoice_id=int(single.id) if single is not None else None,
+            )
+            db.session.add(je)
+            db.session.flush()
+            lines = [{
+                'journal_id': je.id, 'line_no': 1, 'account_id': cash_account.id,
+                'debit': group_amt if cash_debit else 0, 'credit': 0 if cash_debit else group_amt,
+                'description': f"{'Receipt' if cash_debit else 'Payment'} batch {method}", 'line_date': je_date,
+            }]
+            for n, p in enumerate(group, start=2):
+                num = getattr(p['invoice'], 'invoice_number', None) or p['invoice'].id
+                lines.append({
+                    'journal_id': je.id, 'line_no': n, 'account_id': p['account'].id,
+                    'debit': 0 if cash_debit else p['remaining'], 'credit': p['remaining'] if cash_debit else 0,
+                    'description': f"{'Clear AR' if cash_debit else 'Pay AP'} {num}", 'line_date': je_date,
+                    'invoice_id': int(p['invoice'].id), 'invoice_type': invoice_type,
+                })
+            db.session.execute(insert(JournalLine), lines)
+            db.session.flush()
+            try:
+                from services.gl_truth import sync_ledger_from_journal
+                sync_ledger_from_journal(je)
+            except Exception:
+                pass
+            journal_ids.append(je.id)
+
+    if all_ids:
+        refresh_settlements(invoice_type, all_ids)
+    return {
+        'updated': len(to_pay),
+        'paid_count': len(plan),
+        'amount': float(total_amt),
+        'items': [{'id': int(p['invoice'].id), 'type': invoice_type, 'amount': float(p['remaining'])} for p in to_pay],
+        'journal_id': journal_ids[0] if journal_ids else None,
+        'journal_ids': journal_ids,
+    }
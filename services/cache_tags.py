@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+رفع إصدارات وسوم الكاش (utils.cache_helpers.bump_tags) عند commit أي تعديل يمس بيانات التقارير.
+
+    JournalEntry / JournalLine        gl + gl:YYYY-MM (الشهر القديم والجديد عند تغيير التاريخ)
+    Sales/Purchase/ExpenseInvoice     inv:sales|purchases|expenses + :YYYY-MM (وبنودها: الوسم العام)
+    Payment                           payments
+    Account / AccountUsageMap         coa
+    Settings / AppKV (غير المتطايرة)  settings
+
+- after_flush يجمع الوسوم في session.info، وdo_orm_execute يلتقط update/delete/insert الجماعية (الوسم العام
+  للجدول ووسم base:bulk الذي تحمله كل قوائم month_tags، لأن أشهرها غير معروفة)، وcommit يرفعها دفعة واحدة؛
+  التراجع الكامل يُسقطها دون رفع.
+- قيود/فواتير تُعدَّل بـ SQL نصي مباشر لا تمر هنا: تستدعي bump_tags يدوياً.
+"""
+from __future__ import annotations
+
+from typing import Dict, Optional, Set, Tuple
+
+_TAGS_KEY = '_cache_tags_pending'
+# اسم الصنف → (الوسم العام، عمود التاريخ لوسم الشهر)
+MODEL_TAGS: Dict[str, Tuple[str, Optional[str]]] = {
+    'JournalEntry': ('gl', 'date'),
+    'JournalLine': ('gl', 'line_date'),
+    'SalesInvoice': ('inv:sales', 'date'),
+    'SalesInvoiceItem': ('inv:sales', None),
+    'PurchaseInvoice': ('inv:purchases', 'date'),
+    'PurchaseInvoiceItem': ('inv:purchases', None),
+    'ExpenseInvoice': ('inv:expenses', 'date'),
+    'ExpenseInvoiceItem': ('inv:expenses', None),
+    'Payment': ('payments', None),
+    'Account': ('coa', None),
+    'AccountUsageMap': ('coa', None),
+    'Settings': ('settings', None),
+    'AppKV': ('settings', None),
+}
+
+_listeners_registered = False
+
+
+def _month_tag(base: str, d) -> Optional[str]:
+    if d is None or not hasattr(d, 'year'):
+        return None
+    return f"{base}:{d.year:04d}-{d.month:02d}"
+
+
+def tags_for(obj) -> Set[str]:
+    """وسوم كائن ORM معدَّل (فارغة إن لم يكن من جداول التقارير)."""
+    spec = MODEL_TAGS.get(type(obj).__name__)
+    if spec is None:
+        return set()
+    base, date_attr = spec
+    if base == 'settings' and type(obj).__name__ == 'AppKV':
+        from services.kv_store import _cacheable
+        if not _cacheable(getattr(obj, 'k', '') or ''):
+            return set()
+    out = {base}
+    if date_attr:
+        try:
+            from sqlalchemy import inspect
+            hist = inspect(obj).attrs[date_attr].history
+            for d in list(hist.added or ()) + list(hist.deleted or ()) + list(hist.unchanged or ()):
+                t = _month_tag(base, d)
+                if t:
+                    out.add(t)
+        except Exception:
+            pass
+    return out
+
+
+def _collect_after_flush(session, flush_context) -> None:
+    try:
+        tags: Set[str] = set()
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            tags |= tags_for(obj)
+        if tags:
+            session.info.setdefault(_TAGS_KEY, set()).update(tags)
+    except Exception:
+        pass
+
+
+def _collect_bulk(orm_execute_state) -> None:
+    try:
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+            return
+        mapper = orm_execute_state.bind_mapper
+        spec = MODEL_TAGS.get(mapper.class_.__name__) if mapper is not None else None
+        if spec is not None:
+            from utils.cache_helpers import bulk_tag
+            orm_execute_state.session.info.setdefault(_TAGS_KEY, set()).update((spec[0], bulk_tag(spec[0])))
+    except Exception:
+        pass
+
+
+def _bump_after_commit(session) -> None:
+    tags = session.info.pop(_TAGS_KEY, None)
+    if tags:
+        from utils.cache_helpers import bump_tags
+        bump_tags(*tags)
+
+
+def _clear_on_rollback(session, previous_transaction) -> None:
+    if previous_transaction.parent is None:
+        session.info.pop(_TAGS_KEY, None)
+
+
+def register_cache_tag_listeners() -> None:
+    """ربط جمع الوسوم ورفعها بكل الجلسات (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _collect_after_flush)
+    event.listen(Session, 'do_orm_execute', _collect_bulk)
+    event.listen(Session, 'after_commit', _bump_after_commit)
+    event.listen(Session, 'after_soft_rollback', _clear_on_rollback)
+    _listeners_registered = True
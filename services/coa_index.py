@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+فهرس شجرة الحسابات للقراءة فقط: الشجرة المعتمدة (data.coa_new_tree) + الحسابات الفرعية المُنشأة من الشاشة
+(accounts.parent_account_code)، يُبنى مرة واحدة ويُشارك بين كل الطلبات.
+
+- node(code): CoaNode ثابت (الأب، الأبناء، المستوى، النوع، متداول/غير متداول، نطاقات الأوراق) — بحث O(1)
+  بدل المرور على NEW_COA_TREE أو مطابقة البادئات في كل تقرير.
+- coa_dict(): نفس شكل build_coa_dict (MappingProxyType) شاملاً الحسابات الفرعية؛ leaf_codes(): frozenset.
+- leaf_ranges(code) / leaf_filter(column, code): أوراق الشجرة (أو فرع منها) كنطاقات رموز متصلة
+  (BETWEEN) محسوبة مقابل كل الرموز المعروفة (الشجرة + جدول accounts)، بدل IN بمئات الرموز في التقارير.
+  النطاق قد يلتقط رمزاً أُضيف بعد البناء؛ من يحتاج الدقة يصفّي النتيجة بـ leaf_codes() (مجموعة صغيرة).
+- مختوم بجيل سجل الحسابات (services.account_registry): أي تعديل على Account يُسقط الفهرس المحلي فوراً
+  ويعيد العمال الأخرى البناء عند الفحص التالي. refresh_coa_index() يُسقطه يدوياً.
+- خارج سياق التطبيق: الشجرة المعتمدة وحدها.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+COA_INDEX_MAX_AGE_S = 300
+_GEN_CHECK_S = 2.0
+# مجموعات المستوى الثاني التي تحدد تصنيف الميزانية لكل ما تحتها
+CURRENT_GROUPS = frozenset({'1100', '2100'})
+NONCURRENT_GROUPS = frozenset({'1200', '2200'})
+
+_lock = threading.Lock()
+_static: Optional[Dict] = None
+# مفتاح القاعدة (url المحرك) → الفهرس
+_indexes: Dict[str, Dict] = {}
+
+
+class CoaNode(NamedTuple):
+    code: str
+    name: str
+    name_en: str
+    type: str
+    parent: Optional[str]
+    level: int
+    children: Tuple[str, ...]
+    is_leaf: bool
+    bs_class: Optional[str]  # 'current' | 'noncurrent' | None (خارج الأصول والالتزامات)
+    leaf_ranges: Tuple[Tuple[str, str], ...]  # أوراق الفرع كنطاقات [lo, hi] ضمن الرموز المعروفة
+    from_db: bool
+
+
+def _ranges(members: Iterable[str], universe: List[str], pos: Dict[str, int]) -> Tuple[Tuple[str, str], ...]:
+    """تجميع الرموز في نطاقات متصلة بترتيب universe. الرموز غير الرقمية تبقى مفردة (ترتيبها يتبع collation القاعدة)."""
+    idx = sorted(pos[c] for c in members if c in pos)
+    out: List[Tuple[str, str]] = []
+    start = prev = None
+    for i in idx:
+        code = universe[i]
+        if not code.isdigit():
+            if start is not None:
+                out.append((universe[start], universe[prev]))
+                start = prev = None
+            out.append((code, code))
+            continue
+        if start is not None and i == prev + 1:
+            prev = i
+            continue
+        if start is not None:
+            out.append((universe[start], universe[prev]))
+        start = prev = i
+    if start is not None:
+        out.append((universe[start], universe[prev]))
+    return tuple(out)
+
+
+def _build(db_rows: Optional[list], gen: int = 0) -> Dict:
+    """db_rows: (code, name, name_en, type, parent_account_code) لكل حساب في الجدول، أو None بدون قاعدة."""
+    from data.coa_new_tree import LEAF_CODES, NEW_COA_TREE
+
+    meta: Dict[str, Dict] = {}
+    children: Dict[str, List[str]] = {}
+    roots: List[str] = []
+    for code, name_ar, name_en, atype, parent, level in NEW_COA_TREE:
+        meta[code] = {'name': name_ar, 'name_ar': name_ar, 'name_en': name_en, 'type': atype,
+                      'parent_account_code': parent, 'level': level, 'from_db': False}
+        children.setdefault(code, [])
+        if parent:
+            children.setdefault(parent, []).append(code)
+        else:
+            roots.append(code)
+    leaves = set(LEAF_CODES or ())
+
+    universe = set(meta) | leaves
+    if db_rows:
+        pending = []
+        for code, name, name_en, atype, parent in db_rows:
+            code = (code or '').strip()
+            if not code:
+                continue
+            universe.add(code)
+            parent = (parent or '').strip()
+            if parent and code not in meta:
+                pending.append((code, name, name_en, atype, parent))
+        # فرعي تحت فرعي: نكرر حتى لا يتبقى ما يمكن ربطه
+        while pending:
+            rest = []
+            for code, name, name_en, atype, parent in sorted(pending):
+                p = meta.get(parent)
+                if p is None:
+                    rest.append((code, name, name_en, atype, parent))
+                    continue
+                meta[code] = {'name': name or code, 'name_ar': name or code, 'name_en': name_en or '',
+                              'type': (atype or p['type'] or '').strip().upper(),
+                              'parent_account_code': parent, 'level': int(p['level'] or 0) + 1, 'from_db': True}
+                children.setdefault(code, [])
+                children[parent].append(code)
+            if len(rest) == len(pending):
+                break
+            pending = rest
+        # الحساب الفرعي ورقة ما لم يكن له أبناء؛ أوراق الشجرة المعتمدة تبقى قابلة للترحيل حتى لو أُضيف تحتها فرعي
+        leaves |= {c for c, m in meta.items() if m['from_db'] and not children.get(c)}
+
+    ordered = sorted(universe)
+    pos = {c: i for i, c in enumerate(ordered)}
+
+    nodes: Dict[str, CoaNode] = {}
+    codes: List[str] = []
+
+    def _walk(code: str, bs_class: Optional[str]) -> FrozenSet[str]:
+        if code in CURRENT_GROUPS:
+            bs_class = 'current'
+        elif code in NONCURRENT_GROUPS:
+            bs_class = 'noncurrent'
+        codes.append(code)
+        sub = {code} if code in leaves else set()
+        for ch in children.get(code, ()):
+            sub |= _walk(ch, bs_class)
+        m = meta[code]
+        nodes[code] = CoaNode(
+            code=code, name=m['name'], name_en=m['name_en'] or '', type=m['type'],
+            parent=m['parent_account_code'], level=int(m['level'] or 0),
+            children=tuple(children.get(code, ())), is_leaf=code in leaves,
+            bs_class=bs_class if m['type'] in ('ASSET', 'LIABILITY') else None,
+            leaf_ranges=_ranges(sub, ordered, pos), from_db=m['from_db'],
+        )
+        return frozenset(sub)
+
+    for r in roots:
+        _walk(r, None)
+
+    coa = {c: MappingProxyType({k: v for k, v in meta[c].items() if k != 'from_db'}) for c in codes}
+    now = time.monotonic()
+    return {
+        'gen': gen, 'built': now, 'checked': now,
+        'nodes': MappingProxyType(nodes),
+        'coa': MappingProxyType(coa),
+        'codes': tuple(codes),
+        'leaves': frozenset(leaves),
+        # LEAF_CODES قد يضم رموزاً ليست في NEW_COA_TREE: تبقى ضمن أوراق التقارير كما كانت
+        'leaf_ranges': _ranges(leaves, ordered, pos),
+    }
+
+
+def _db_key() -> Optional[str]:
+    """مفتاح القاعدة (url المحرك) أو None خارج سياق التطبيق."""
+    try:
+        from flask import has_app_context
+        if not has_app_context():
+            return None
+        from extensions import db
+        return str(db.engine.url)
+    except Exception:
+        return None
+
+
+def _shared_gen() -> int:
+    from services.account_registry import _shared_gen as registry_gen
+    return registry_gen()
+
+
+def _load_rows() -> list:
+    from sqlalchemy import select
+    from extensions import db
+    from models import Account
+    return db.session.execute(
+        select(Account.code, Account.name, Account.name_en, Account.type, Account.parent_account_code)
+    ).all()
+
+
+def _get() -> Dict:
+    global _static
+    key = _db_key()
+    if key is None:
+        idx = _static
+        if idx is None:
+            with _lock:
+                if _static is None:
+                    _static = _build(None)
+                idx = _static
+        return idx
+    idx = _indexes.get(key)
+    now = time.monotonic()
+    if idx is not None:
+        if now - idx['built'] > COA_INDEX_MAX_AGE_S:
+            idx = None
+        elif now - idx['checked'] > _GEN_CHECK_S:
+            if _shared_gen() != idx['gen']:
+                idx = None
+            else:
+                idx['checked'] = now
+    if idx is None:
+        gen = _shared_gen()
+        try:
+            rows = _load_rows()
+        except Exception:
+            # جدول accounts غير جاهز بعد: الشجرة المعتمدة وحدها دون حفظ
+            return _build(None, gen)
+        with _lock:
+            idx = _build(rows, gen)
+            _indexes[key] = idx
+    return idx
+
+
+def node(code: str) -> Optional[CoaNode]:
+    return _get()['nodes'].get((code or '').strip())
+
+
+def nodes() -> Mapping[str, CoaNode]:
+    return _get()['nodes']
+
+
+def coa_dict() -> Mapping[str, Mapping]:
+    """{code: {name, name_ar, name_en, type, parent_account_code, level}} للقراءة فقط."""
+    return _get()['coa']
+
+
+def coa_codes() -> Tuple[str, ...]:
+    """رموز الشجرة بترتيب شجري (NEW_COA_TREE، والحساب الفرعي بعد أشقائه تحت أبيه)."""
+    return _get()['codes']
+
+
+def leaf_codes() -> FrozenSet[str]:
+    return _get()['leaves']
+
+
+def ancestors(code: str) -> Tuple[str, ...]:
+    """الآباء من الأقرب إلى الجذر."""
+    ns = _get()['nodes']
+    out = []
+    n = ns.get((code or '').strip())
+    while n is not None and n.parent:
+        out.append(n.parent)
+        n = ns.get(n.parent)
+    return tuple(out)
+
+
+def bs_class(code: str) -> Optional[str]:
+    n = node(code)
+    return n.bs_class if n is not None else None
+
+
+def leaf_ranges(code: Optional[str] = None) -> Tuple[Tuple[str, str], ...]:
+    """أوراق الفرع code (أو كل الشجرة) كنطاقات [lo, hi]."""
+    if code is None:
+        return _get()['leaf_ranges']
+    n = node(code)
+    return n.leaf_ranges if n is not None else ()
+
+
+def leaf_filter(column, code: Optional[str] = None):
+    """شرط SQL: column ضمن أوراق الفرع code (أو كل الشجرة) — نطاقات BETWEEN والمفردة في IN واحد."""
+    from sqlalchemy import false, or_
+    singles = []
+    clauses = []
+    for lo, hi in leaf_ranges(code):
+        if lo == hi:
+            singles.append(lo)
+        else:
+            clauses.append(column.between(lo, hi))
+    if singles:
+        clauses.append(column.in_(singles))
+    if not clauses:
+        return false()
+    return or_(*clauses) if len(clauses) > 1 else clauses[0]
+
+
+def refresh_coa_index() -> None:
+    """إسقاط الفهرس المحلي؛ يُعاد بناؤه عند أول قراءة."""
+    with _lock:
+        _indexes.clear()
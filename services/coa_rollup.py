@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+تجميع أرصدة شجرة الحسابات (Rollup) من قيود اليومية المنشورة في مرور واحد.
+
+- gl_totals(): استعلام واحد GROUP BY رمز الحساب (مدين/دائن لكل حساب حتى التاريخ، مع الفرع اختيارياً).
+- rollup(): مرور واحد على فهرس الشجرة (services.coa_index) يُخرج كل المستويات بترتيب شجري:
+  لكل عقدة أرقامها الخاصة (own_*) ومجموعها مع كل ما تحتها (debit/credit/balance).
+- gl_rollup(): الاثنان معاً، محفوظ على الطلب الحالي ثم في الكاش الموسوم ('gl', 'coa') بمفتاح (التاريخ، الفرع)،
+  فيشترك فيه العرض والطباعة والتصدير و JSON لميزان المراجعة والميزانية ويسقط عند أي ترحيل.
+
+الرصيد: دائن−مدين للالتزامات وحقوق الملكية، ومدين−دائن لغيرها (نفس _tb_balance). النوع من الشجرة المعتمدة
+وليس من عمود accounts.type. رموز LEAF_CODES غير الموجودة في الشجرة تُلحق كجذور مستقلة.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+CREDIT_NATURE_TYPES = ('LIABILITY', 'EQUITY')
+ROLLUP_CACHE_TAGS = ('gl', 'coa')
+ROLLUP_CACHE_TTL = 300
+_REQ_ATTR = '_gl_rollups'
+
+
+def signed_balance(atype: Optional[str], debit: float, credit: float) -> float:
+    if (atype or '').upper() in CREDIT_NATURE_TYPES:
+        return credit - debit
+    return debit - credit
+
+
+def gl_totals(asof: date, branch: Optional[str] = None, start: Optional[date] = None) -> Dict[str, Tuple[float, float]]:
+    """{code: (debit, credit)} للقيود المنشورة حتى asof (ومن start إن وُجد)."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import Account, JournalEntry, JournalLine
+
+    q = db.session.query(
+        Account.code,
+        func.coalesce(func.sum(JournalLine.debit), 0),
+        func.coalesce(func.sum(JournalLine.credit), 0),
+    ).join(JournalLine, JournalLine.account_id == Account.id) \
+     .join(JournalEntry, JournalLine.journal_id == JournalEntry.id) \
+     .filter(JournalEntry.status == 'posted', JournalLine.line_date <= asof)
+    if start is not None:
+        q = q.filter(JournalLine.line_date >= start)
+    if branch:
+        q = q.filter(JournalEntry.branch_code == branch)
+    return {code: (float(d or 0), float(c or 0)) for code, d, c in q.group_by(Account.code).all()}
+
+
+def _account_ref(code: str):
+    try:
+        from services.account_registry import account_ref
+        return account_ref(code)
+    except Exception:
+        return None
+
+
+def rollup(amounts: Dict[str, Tuple[float, float]]) -> Dict:
+    """صفوف الشجرة كاملة بترتيب شجري مع مجاميع كل مستوى، وإجمالي الأوراق.
+
+    كل صف: code, name, type, parent, level, is_leaf, children, bs_class, has_account,
+    own_debit, own_credit, debit, credit, balance.
+    """
+    from data.coa_new_tree import get_account_display_name
+    from services.coa_index import coa_codes, leaf_codes, nodes
+
+    ns = nodes()
+    leaves = leaf_codes()
+    rows: List[Dict] = []
+
+    def _row(code, atype, parent, level, children, bs_class, tree_name):
+        ref = _account_ref(code)
+        d, c = amounts.get(code, (0.0, 0.0))
+        return {
+            'code': code,
+            'name': get_account_display_name(code, ref.name if ref is not None else tree_name),
+            'type': atype, 'parent': parent, 'level': level,
+            'is_leaf': code in leaves, 'children': len(children), 'bs_class': bs_class,
+            'has_account': ref is not None,
+            'own_debit': d, 'own_credit': c, 'debit': d, 'credit': c,
+        }
+
+    def _walk(code: str, level: int) -> Tuple[float, float]:
+        n = ns[code]
+        row = _row(code, n.type, n.parent, level, n.children, n.bs_class, n.name)
+        rows.append(row)
+        d, c = row['own_debit'], row['own_credit']
+        for ch in n.children:
+            cd, cc = _walk(ch, level + 1)
+            d += cd
+            c += cc
+        row['debit'], row['credit'] = d, c
+        row['balance'] = signed_balance(n.type, d, c)
+        return d, c
+
+    for code in coa_codes():
+        if ns[code].parent is None:
+            _walk(code, 1)
+    for code in sorted(leaves.difference(ns)):
+        ref = _account_ref(code)
+        atype = ((ref.type if ref is not None else '') or 'EXPENSE').upper()
+        row = _row(code, atype, None, 1, (), None, None)
+        row['balance'] = signed_balance(atype, row['debit'], row['credit'])
+        rows.append(row)
+
+    total_debit = sum(r['own_debit'] for r in rows if r['is_leaf'])
+    total_credit = sum(r['own_credit'] for r in rows if r['is_leaf'])
+    return {'rows': rows, 'total_debit': total_debit, 'total_credit': total_credit}
+
+
+def gl_rollup(asof: date, branch: Optional[str] = None) -> Dict:
+    """rollup(gl_totals(...)) محفوظ على الطلب الحالي وفي الكاش الموسوم (المفتاح: التاريخ والفرع)."""
+    key = (asof.isoformat(), branch or '')
+    memo = None
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            memo = getattr(request, _REQ_ATTR, None)
+            if memo is None:
+                memo = {}
+                setattr(request, _REQ_ATTR, memo)
+    except Exception:
+        memo = None
+    if memo is not None and key in memo:
+        return memo[key]
+    result = _cached_rollup(asof, branch)
+    if memo is not None:
+        memo[key] = result
+    return result
+
+
+def _cached_rollup(asof: date, branch: Optional[str]) -> Dict:
+    def _compute():
+        return rollup(gl_totals(asof, branch=branch))
+    try:
+        from extensions import cache
+        if not cache:
+            return _compute()
+        from utils.cache_helpers import cached_tagged, tagged_ttl
+    except Exception:
+        return _compute()
+    key = f"stmt:gl_rollup:{asof.isoformat()}:{branch or 'all'}"
+    return cached_tagged(key, ROLLUP_CACHE_TAGS, _compute, tagged_ttl(ROLLUP_CACHE_TTL))
+
+
+def subtree(rows: List[Dict], index: int) -> List[Dict]:
+    """الصف index وكل ما تحته في rows (بالترتيب الشجري)."""
+    level = rows[index]['level']
+    end = index + 1
+    while end < len(rows) and rows[end]['level'] > level:
+        end += 1
+    return rows[index:end]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+تقييم المخزون: آخر تكلفة ومتوسط التكلفة وآخر تاريخ شراء لكل المواد الخام باستعلام واحد.
+
+- ROW_NUMBER() OVER (PARTITION BY raw_material_id ORDER BY date DESC) لاختيار آخر بند شراء.
+- متوسط السعر AVG(price_before_tax) (كما في الشاشة سابقاً) محسوب بدالة نافذة في نفس الاستعلام.
+- SQLite أقدم من 3.25 لا يدعم دوال النافذة → مسار بايثون بمسح مرتب واستعلام تجميعي.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Dict, Iterable, Optional, Any
+
+
+def _supports_window_functions(conn) -> bool:
+    if conn.dialect.name != 'sqlite':
+        return True
+    try:
+        import sqlite3
+        return tuple(sqlite3.sqlite_version_info) >= (3, 25, 0)
+    except Exception:
+        return False
+
+
+def _stats_window(rm_ids: Optional[list]) -> Dict[int, Dict[str, Any]]:
+    from sqlalchemy import func
+    from extensions import db
+    from models import PurchaseInvoice, PurchaseInvoiceItem
+
+    pii = PurchaseInvoiceItem
+    part = pii.raw_material_id
+    inner = (
+        db.session.query(
+            pii.raw_material_id.label('rm_id'),
+            pii.price_before_tax.label('price'),
+            PurchaseInvoice.date.label('dt'),
+            func.row_number().over(
+                partition_by=part,
+                order_by=(PurchaseInvoice.date.desc(), pii.id.desc()),
+            ).label('rn'),
+            func.avg(pii.price_before_tax).over(partition_by=part).label('avg_price'),
+        )
+        .join(PurchaseInvoice, PurchaseInvoice.id == pii.invoice_id)
+    )
+    if rm_ids is not None:
+        inner = inner.filter(pii.raw_material_id.in_(rm_ids))
+    sq = inner.subquery()
+    rows = db.session.query(sq.c.rm_id, sq.c.price, sq.c.dt, sq.c.avg_price).filter(sq.c.rn == 1).all()
+    out = {}
+    for rid, price, dt, avg_price in rows:
+        if rid is None:
+            continue
+        out[int(rid)] = {
+            'latest_cost': (float(price) if price is not None else None),
+            'avg_cost': float(avg_price or 0),
+            'last_purchase_date': dt,
+            'has_purchases': True,
+        }
+    return out
+
+
+def _stats_python(rm_ids: Optional[list]) -> Dict[int, Dict[str, Any]]:
+    from sqlalchemy import func
+    from extensions import db
+    from models import PurchaseInvoice, PurchaseInvoiceItem
+
+    pii = PurchaseInvoiceItem
+    q = (
+        db.session.query(pii.raw_material_id, pii.price_before_tax, PurchaseInvoice.date)
+        .join(PurchaseInvoice, PurchaseInvoice.id == pii.invoice_id)
+        .order_by(pii.raw_material_id.asc(), PurchaseInvoice.date.desc(), pii.id.desc())
+    )
+    agg = db.session.query(
+        pii.raw_material_id,
+        func.coalesce(func.avg(pii.price_before_tax), 0),
+    ).group_by(pii.raw_material_id)
+    if rm_ids is not None:
+        q = q.filter(pii.raw_material_id.in_(rm_ids))
+        agg = agg.filter(pii.raw_material_id.in_(rm_ids))
+    out = {}
+    for rid, price, dt in q.all():
+        if rid is None or int(rid) in out:
+            continue
+        out[int(rid)] = {
+            'latest_cost': (float(price) if price is not None else None),
+            'avg_cost': 0.0,
+            'last_purchase_date': dt,
+            'has_purchases': True,
+        }
+    for rid, avg_price in agg.all():
+        if rid is None or int(rid) not in out:
+            continue
+        out[int(rid)]['avg_cost'] = float(avg_price or 0)
+    return out
+
+
+def material_cost_stats(rm_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    لكل مادة خام: latest_cost، avg_cost، last_purchase_date، has_purchases، و unit_cost
+    (آخر تكلفة ← المتوسط ← cost_per_unit من بطاقة المادة). rm_ids=None = كل المواد.
+    """
+    from extensions import db
+    from models import RawMaterial
+
+    ids = None if rm_ids is None else sorted({int(i) for i in rm_ids if i})
+    if ids is not None and not ids:
+        return {}
+    stats = None
+    if _supports_window_functions(db.session.connection()):
+        # نقطة حفظ: فشل الاستعلام يُلغى وحده دون العمل المعلّق للمستدعي (مسار الشراء/تحديث الكميات)
+        sp = db.session.begin_nested()
+        try:
+            stats = _stats_window(ids)
+            sp.commit()
+        except Exception:
+            sp.rollback()
+    if stats is None:
+        stats = _stats_python(ids)
+
+    q = db.session.query(RawMaterial.id, RawMaterial.cost_per_unit)
+    if ids is not None:
+        q = q.filter(RawMaterial.id.in_(ids))
+    for rid, card_cost in q.all():
+        st = stats.setdefault(int(rid), {'latest_cost': None, 'avg_cost': 0.0, 'last_purchase_date': None, 'has_purchases': False})
+        if st['latest_cost'] is not None:
+            st['unit_cost'] = st['latest_cost']
+        elif st['avg_cost'] > 0:
+            st['unit_cost'] = st['avg_cost']
+        else:
+            st['unit_cost'] = float(card_cost or 0)
+    for st in stats.values():
+        st.setdefault('unit_cost', st['latest_cost'] if st['latest_cost'] is not None else st['avg_cost'])
+    return stats
+
+
+def unit_cost_of(stats: Dict[int, Dict[str, Any]], rm_id: int) -> float:
+    st = stats.get(int(rm_id or 0))
+    return float(st['unit_cost'] or 0) if st else 0.0
+
+
+def last_purchase_date_of(stats: Dict[int, Dict[str, Any]], rm_id: int) -> Optional[date]:
+    st = stats.get(int(rm_id or 0))
+    return st['last_purchase_date'] if st else None
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+فهرس سداد الفواتير invoice_settlements: المسدد والمتبقي لكل فاتورة بقراءة مفهرسة واحدة.
+
+- paid_from_gl: من القيود المنشورة المرتبطة بالفاتورة (1141 دائن للمبيعات، 2111 مدين للمشتريات والمصروفات).
+- paid_legacy: من جدول الدفعات (payments) للقيود القديمة غير المربوطة.
+- المسدد الفعلي = paid_from_gl إن وُجد وإلا paid_legacy (لا يُجمع الاثنان) — نفس قاعدة كشوف الحساب.
+- يُحدَّث تلقائياً عند commit لأي معاملة تمس دفعة أو سطر/قيد مرتبط بفاتورة أو الفاتورة نفسها،
+  بتجميع GROUP BY invoice_id لكل نوع. rebuild_settlements يعيد البناء بالكامل (العمليات الجماعية تتجاوز المستمعين).
+- الفواتير السابقة للجدول: ensure_settlements من backfill_data (run_migrations.py / flask backfill-data)، والقراءة
+  تحفظ أي صف ناقص في معاملة مستقلة حتى لا يُعاد حسابه في كل تحميل صفحة.
+"""
+from __future__ import annotations
+
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+SETTLEMENT_TYPES = ('sales', 'purchase', 'expense')
+# الحساب وجهة السداد لكل نوع فاتورة
+GL_SIDE = {'sales': ('1141', 'credit'), 'purchase': ('2111', 'debit'), 'expense': ('2111', 'debit')}
+_CHUNK = 500
+_DIRTY_KEY = '_settlement_dirty'
+_BUSY_KEY = '_settlement_refreshing'
+
+_listeners_registered = False
+
+
+def _to_cents(v) -> Decimal:
+    try:
+        return Decimal(str(v if v is not None else 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except Exception:
+        return Decimal('0.00')
+
+
+def settlement_status(total, paid) -> str:
+    t, p = _to_cents(total), _to_cents(paid)
+    if (t - p) <= Decimal('0.01'):
+        return 'paid'
+    if p > Decimal('0.00'):
+        return 'partial'
+    return 'unpaid'
+
+
+def _invoice_model(invoice_type: str):
+    from models import SalesInvoice, PurchaseInvoice, ExpenseInvoice
+    return {'sales': SalesInvoice, 'purchase': PurchaseInvoice, 'expense': ExpenseInvoice}[invoice_type]
+
+
+def _chunks(ids):
+    ids = sorted({int(i) for i in ids if i is not None})
+    for i in range(0, len(ids), _CHUNK):
+        yield ids[i:i + _CHUNK]
+
+
+def refresh_settlements(invoice_type: str, invoice_ids: Iterable[int], session=None) -> int:
+    """إعادة حساب صفوف الفواتير المحددة (3 استعلامات مجمّعة لكل دفعة من 500 فاتورة). بدون commit."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import Account, InvoiceSettlement, JournalEntry, JournalLine, Payment
+
+    if invoice_type not in SETTLEMENT_TYPES:
+        return 0
+    sess = session or db.session
+    model = _invoice_model(invoice_type)
+    code, side = GL_SIDE[invoice_type]
+    try:
+        from services.account_registry import account_ref
+        ref = account_ref(code)
+        acc_id = ref.id if ref is not None else None
+    except Exception:
+        acc_id = sess.query(Account.id).filter(Account.code == code).scalar()
+    col = JournalLine.credit if side == 'credit' else JournalLine.debit
+    touched = 0
+    for chunk in _chunks(invoice_ids):
+        totals = dict(sess.query(model.id, model.total_after_tax_discount).filter(model.id.in_(chunk)).all())
+        gl = {}
+        if acc_id is not None:
+            gl = dict(
+                sess.query(JournalLine.invoice_id, func.coalesce(func.sum(col), 0))
+                .join(JournalEntry, JournalLine.journal_id == JournalEntry.id)
+                .filter(
+                    JournalLine.account_id == acc_id,
+                    JournalLine.invoice_type == invoice_type,
+                    JournalLine.invoice_id.in_(chunk),
+                    JournalEntry.status == 'posted',
+                )
+                .group_by(JournalLine.invoice_id)
+                .all()
+            )
+        legacy = dict(
+            sess.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0))
+            .filter(Payment.invoice_type == invoice_type, Payment.invoice_id.in_(chunk))
+            .group_by(Payment.invoice_id)
+            .all()
+        )
+        existing = {
+            int(r.invoice_id): r
+            for r in sess.query(InvoiceSettlement).filter(
+                InvoiceSettlement.invoice_type == invoice_type, InvoiceSettlement.invoice_id.in_(chunk)
+            ).all()
+        }
+        for inv_id in chunk:
+            row = existing.get(inv_id)
+            if inv_id not in totals:
+                if row is not None:
+                    sess.delete(row)
+                    touched += 1
+                continue
+            total = _to_cents(totals[inv_id])
+            p_gl = _to_cents(gl.get(inv_id))
+            p_leg = _to_cents(legacy.get(inv_id))
+            paid = p_gl if p_gl >= Decimal('0.01') else p_leg
+            if row is None:
+                row = InvoiceSettlement(invoice_type=invoice_type, invoice_id=inv_id)
+                sess.add(row)
+            row.total = total
+            row.paid_from_gl = p_gl
+            row.paid_legacy = p_leg
+            row.remaining = max(Decimal('0.00'), total - paid)
+            row.status = settlement_status(total, paid)
+            touched += 1
+    return touched
+
+
+def _persist_missing(invoice_type: str, invoice_ids) -> bool:
+    """حساب الصفوف الناقصة وحفظها في معاملة قصيرة مستقلة عن جلسة الطلب (صفحات GET لا تنفّذ commit)."""
+    from sqlalchemy.orm import Session
+    from extensions import db
+    try:
+        with Session(db.engine) as sess, sess.begin():
+            refresh_settlements(invoice_type, invoice_ids, session=sess)
+        return True
+    except Exception as e:
+        try:
+            from flask import current_app
+            current_app.logger.warning('invoice_settlements backfill deferred: %s', e)
+        except Exception:
+            pass
+        return False
+
+
+def get_settlements(invoice_type: str, invoice_ids: Iterable[int]) -> Dict[int, object]:
+    """صفوف السداد للفواتير باستعلام مفهرس واحد. الصفوف الناقصة تُحسب وتُحفظ في معاملة مستقلة
+    (وإن تعذّر ذلك تُضاف لجلسة المستدعي بـ flush دون commit)."""
+    from extensions import db
+    from models import InvoiceSettlement
+
+    ids = sorted({int(i) for i in invoice_ids if i is not None})
+    if not ids:
+        return {}
+    out = {}
+    for chunk in _chunks(ids):
+        for r in InvoiceSettlement.query.filter(
+            InvoiceSettlement.invoice_type == invoice_type, InvoiceSettlement.invoice_id.in_(chunk)
+        ).all():
+            out[int(r.invoice_id)] = r
+    missing = [i for i in ids if i not in out]
+    if missing:
+        if not _persist_missing(invoice_type, missing):
+            refresh_settlements(invoice_type, missing)
+            db.session.flush()
+        for chunk in _chunks(missing):
+            for r in InvoiceSettlement.query.filter(
+                InvoiceSettlement.invoice_type == invoice_type, InvoiceSettlement.invoice_id.in_(chunk)
+            ).all():
+                out[int(r.invoice_id)] = r
+    return out
+
+
+def paid_map(invoice_type: str, invoice_ids: Iterable[int], source: str = 'settled') -> Dict[int, float]:
+    """
+    المسدد لكل فاتورة. source: 'settled' (القيود وإلا الدفعات)، 'gl' (القيود فقط)، 'legacy' (جدول الدفعات فقط).
+    """
+    rows = get_settlements(invoice_type, invoice_ids)
+    out = {}
+    for inv_id, r in rows.items():
+        if source == 'gl':
+            out[inv_id] = round(float(r.paid_from_gl or 0), 2)
+        elif source == 'legacy':
+            out[inv_id] = round(float(r.paid_legacy or 0), 2)
+        else:
+            out[inv_id] = round(float(r.paid), 2)
+    return out
+
+
+def ensure_settlements(invoice_type: str) -> int:
+    """حساب صفوف الفواتير التي ليس لها صف في الفهرس بعد (استعلام anti-join واحد). بدون commit."""
+    from extensions import db
+    from models import InvoiceSettlement
+
+    model = _invoice_model(invoice_type)
+    missing = [
+        int(r[0]) for r in db.session.query(model.id)
+        .outerjoin(InvoiceSettlement, (InvoiceSettlement.invoice_type == invoice_type) & (InvoiceSettlement.invoice_id == model.id))
+        .filter(InvoiceSettlement.id.is_(None))
+        .all()
+    ]
+    if not missing:
+        return 0
+    n = refresh_settlements(invoice_type, missing)
+    db.session.flush()
+    return n
+
+
+def rebuild_settlements(invoice_type: Optional[str] = None) -> int:
+    """إعادة بناء الفهرس بالكامل لنوع أو لكل الأنواع (بدون commit). تعيد عدد الصفوف."""
+    from extensions import db
+    from models import InvoiceSettlement
+
+    types = [invoice_type] if invoice_type else list(SETTLEMENT_TYPES)
+    n = 0
+    for t in types:
+        InvoiceSettlement.query.filter(InvoiceSettlement.invoice_type == t).delete(synchronize_session=False)
+        model = _invoice_model(t)
+        ids = [int(r[0]) for r in db.session.query(model.id).all()]
+        n += refresh_settlements(t, ids)
+        db.session.flush()
+    return n
+
+
+# ---------- الصيانة التلقائية ----------
+
+def _dirty_keys_after_flush(session, flush_context) -> None:
+    try:
+        from sqlalchemy import select
+        from models import JournalEntry, JournalLine, Payment, SalesInvoice, PurchaseInvoice, ExpenseInvoice
+
+        keys: Set[Tuple[str, int]] = session.info.setdefault(_DIRTY_KEY, set())
+        inv_types = {SalesInvoice: 'sales', PurchaseInvoice: 'purchase', ExpenseInvoice: 'expense'}
+        je_ids = []
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, (Payment, JournalLine)):
+                t, i = getattr(obj, 'invoice_type', None), getattr(obj, 'invoice_id', None)
+                if t in SETTLEMENT_TYPES and i:
+                    keys.add((t, int(i)))
+            elif isinstance(obj, JournalEntry):
+                if obj.id is not None and obj not in session.new:
+                    je_ids.append(int(obj.id))
+            else:
+                t = inv_types.get(type(obj))
+                if t and getattr(obj, 'id', None):
+                    keys.add((t, int(obj.id)))
+        if je_ids:
+            # تغيّر حالة القيد (ترحيل/إلغاء) يغيّر المسدد لفواتير سطوره
+            rows = session.connection().execute(
+                select(JournalLine.invoice_type, JournalLine.invoice_id)
+                .where(JournalLine.journal_id.in_(je_ids), JournalLine.invoice_id.isnot(None))
+            ).all()
+            for t, i in rows:
+                if t in SETTLEMENT_TYPES:
+                    keys.add((t, int(i)))
+        if not keys:
+            session.info.pop(_DIRTY_KEY, None)
+    except Exception:
+        pass
+
+
+def _refresh_before_commit(session) -> None:
+    # commit نقطة حفظ داخلية يطلق الحدث أيضاً؛ التحديث مرة واحدة عند commit المعاملة الأم
+    if session.info.get(_BUSY_KEY) or session.in_nested_transaction():
+        return
+    # before_commit يسبق flush الخاص بـ commit؛ نفرّغ المعلّق أولاً ليلتقط after_flush مفاتيحه
+    if not session.info.get(_DIRTY_KEY) and not (session.new or session.dirty or session.deleted):
+        return
+    session.info[_BUSY_KEY] = True
+    try:
+        session.flush()
+        keys = session.info.pop(_DIRTY_KEY, None) or set()
+        if not keys:
+            return
+        by_type: Dict[str, Set[int]] = {}
+        for t, i in keys:
+            by_type.setdefault(t, set()).add(i)
+        with session.begin_nested():
+            for t, ids in by_type.items():
+                refresh_settlements(t, ids, session=session)
+    except Exception as e:
+        try:
+            from flask import current_app
+            current_app.logger.warning('invoice_settlements refresh skipped: %s', e)
+        except Exception:
+            pass
+    finally:
+        session.info.pop(_BUSY_KEY, None)
+        session.info.pop(_DIRTY_KEY, None)
+
+
+def _clear_on_rollback(session, previous_transaction) -> None:
+    if previous_transaction.parent is None:
+        session.info.pop(_DIRTY_KEY, None)
+
+
+def register_settlement_listeners() -> None:
+    """ربط تحديث الفهرس بـ commit لأي معاملة تمس الدفعات أو القيود المرتبطة بفواتير (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _dirty_keys_after_flush)
+    event.listen(Session, 'before_commit', _refresh_before_commit)
+    event.listen(Session, 'after_soft_rollback', _clear_on_rollback)
+    _listeners_registered = True
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+مخزن AppKV على طبقتين: LRU داخل العملية أمام جدول app_kv، مع قراءة/كتابة جماعية.
+
+- get_many / set_many / delete: استعلام واحد لقائمة مفاتيح (IN على فهرس k الفريد) بدل استعلام لكل مفتاح؛
+  شاشات POS والأرشيف تجلب كل المسودات/سجلات الطباعة دفعة واحدة.
+- commit=False: الكتابة تنضم إلى معاملة المستدعي (لا commit داخل الخدمة)؛ الافتراضي commit=True كما في kv_set.
+- scan_prefix: نطاق k >= prefix AND k < prefix + U+10FFFF فيستخدم الفهرس (LIKE في SQLite لا يستخدمه).
+- LRU يحفظ نص JSON الخام (كل قراءة تُرجع نسخة جديدة) ويحفظ غياب المفتاح أيضاً. المفاتيح المتطايرة
+  (مسودات الطاولات، سجلات الطباعة، مسارات PDF، عدّادات الترقيم) لا تمر عبره إطلاقاً.
+- الإبطال بنفس نمط aging/account_registry: after_flush على AppKV يُسقط المفاتيح محلياً ويعلّمها في الجلسة،
+  وcommit يرفع جيلاً مشتركاً في الكاش (app_kv:gen) فتُفرغ العمال الأخرى LRU عند الفحص التالي
+  (كل _GEN_CHECK_S ثانية على الأكثر)، مع أقصى عمر للمدخل حين لا يكون الكاش مشتركاً (SimpleCache).
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+KV_GEN_KEY = "app_kv:gen"
+LRU_MAX_ENTRIES = 1024
+LRU_MAX_AGE_S = 60
+_GEN_CHECK_S = 2.0
+_IN_CHUNK = 500
+VOLATILE_PREFIXES: Tuple[str, ...] = ('draft:', 'print_log:', 'pdf_path:', 'chart_code_seq:')
+_DIRTY_KEY = '_app_kv_dirty'
+_MISSING = object()
+
+_listeners_registered = False
+_lock = threading.Lock()
+# مفتاح القاعدة (url المحرك) → {'gen', 'checked', 'lru'}
+_states: Dict[str, Dict] = {}
+
+
+def _cacheable(key: str) -> bool:
+    return not key.startswith(VOLATILE_PREFIXES)
+
+
+def _shared_gen() -> int:
+    from utils.cache_helpers import _cache
+    c = _cache()
+    if c is None:
+        return 0
+    try:
+        return int(c.get(KV_GEN_KEY) or 0)
+    except Exception:
+        return 0
+
+
+def _state() -> Dict:
+    from extensions import db
+    key = str(db.engine.url)
+    st = _states.get(key)
+    now = time.monotonic()
+    if st is None:
+        with _lock:
+            st = _states.setdefault(key, {'gen': _shared_gen(), 'checked': now, 'epoch': 0, 'lru': OrderedDict()})
+    elif now - st['checked'] > _GEN_CHECK_S:
+        gen = _shared_gen()
+        if gen != st['gen']:
+            with _lock:
+                st['lru'].clear()
+                st['epoch'] += 1
+                st['gen'] = gen
+        st['checked'] = now
+    return st
+
+
+def _session_dirty():
+    from extensions import db
+    return db.session.info.get(_DIRTY_KEY) or ()
+
+
+def _flush_pending(keys: Iterable[str]) -> None:
+    # autoflush معطّل (extensions.py): نرسل كتابات commit=False المعلّقة لهذه المفاتيح قبل الاستعلام عنها
+    dirty = _session_dirty()
+    if dirty and any(k in dirty for k in keys):
+        from extensions import db
+        db.session.flush()
+
+
+def _decode(raw: Optional[str]):
+    if raw is None:
+        return _MISSING
+    try:
+        return json.loads(raw)
+    except Exception:
+        return _MISSING
+
+
+def _fetch(keys: List[str]) -> Dict[str, str]:
+    from sqlalchemy import select
+    from extensions import db
+    from app.models import AppKV
+    out: Dict[str, str] = {}
+    for i in range(0, len(keys), _IN_CHUNK):
+        chunk = keys[i:i + _IN_CHUNK]
+        for k, v in db.session.execute(select(AppKV.k, AppKV.v).where(AppKV.k.in_(chunk))).all():
+            out[k] = v
+    return out
+
+
+def _load_raw(keys: List[str]) -> Dict[str, Optional[str]]:
+    """النص الخام لكل مفتاح (None = غير موجود): من LRU أولاً ثم استعلام واحد للباقي."""
+    raw: Dict[str, Optional[str]] = {}
+    st = _state()
+    lru = st['lru']
+    dirty = _session_dirty()
+    now = time.monotonic()
+    missing: List[str] = []
+    with _lock:
+        # القراءة وتحديث الترتيب معاً تحت القفل: _drop_local من خيط آخر قد يحذف المفتاح بينهما
+        for k in keys:
+            if k in raw:
+                continue
+            hit = lru.get(k) if (_cacheable(k) and k not in dirty) else None
+            if hit is not None and now - hit[1] <= LRU_MAX_AGE_S:
+                lru.move_to_end(k)
+                raw[k] = hit[0]
+            else:
+                missing.append(k)
+                raw[k] = None
+    if missing:
+        _flush_pending(missing)
+        epoch = st['epoch']
+        fetched = _fetch(missing)
+        with _lock:
+            for k in missing:
+                v = fetched.get(k)
+                raw[k] = v
+                # لا نحفظ ما عدّلته الجلسة الحالية قبل commit، ولا ما قُرئ قبل إبطال حدث أثناء الاستعلام
+                if _cacheable(k) and k not in dirty and st['epoch'] == epoch:
+                    lru[k] = (v, now)
+                    lru.move_to_end(k)
+            while len(lru) > LRU_MAX_ENTRIES:
+                lru.popitem(last=False)
+    return raw
+
+
+def get(key: str, default: Any = None) -> Any:
+    """قيمة المفتاح (JSON مفكوك) أو default إن لم يوجد أو تعذّر فكّه."""
+    val = _decode(_load_raw([key])[key])
+    return default if val is _MISSING else val
+
+
+def get_many(keys: Iterable[str]) -> Dict[str, Any]:
+    """{المفتاح: القيمة} للمفاتيح الموجودة فقط، باستعلام واحد لكل ما ليس في LRU."""
+    out: Dict[str, Any] = {}
+    for k, raw in _load_raw([str(k) for k in keys]).items():
+        val = _decode(raw)
+        if val is not _MISSING:
+            out[k] = val
+    return out
+
+
+def scan_prefix(prefix: str, limit: Optional[int] = None) -> List[Tuple[str, Any]]:
+    """[(المفتاح، القيمة)] لكل المفاتيح التي تبدأ بـ prefix مرتبة بالمفتاح (بلا LRU)."""
+    from sqlalchemy import select
+    from extensions import db
+    from app.models import AppKV
+    q = select(AppKV.k, AppKV.v).where(AppKV.k >= prefix, AppKV.k < prefix + '\U0010ffff').order_by(AppKV.k.asc())
+    out: List[Tuple[str, Any]] = []
+    for k, raw in db.session.execute(q).all():
+        # ترتيب النصوص في بعض collations قد يُدخل مفاتيح لا تبدأ بالبادئة حرفياً
+        if not k.startswith(prefix):
+            continue
+        val = _decode(raw)
+        if val is not _MISSING:
+            out.append((k, val))
+            if limit is not None and len(out) >= limit:
+                break
+    return out
+
+
+def _mark_dirty(keys: Iterable[str]) -> None:
+    from extensions import db
+    keys = list(keys)
+    if not keys:
+        return
+    db.session.info.setdefault(_DIRTY_KEY, set()).update(keys)
+    _drop_local(keys)
+
+
+def set_many(values: Dict[str, Any], commit: bool = True) -> None:
+    """كتابة عدة مفاتيح باستعلام قراءة واحد. commit=False: تبقى ضمن معاملة المستدعي."""
+    from extensions import db
+    from app.models import AppKV
+    if not values:
+        return
+    data = {str(k): json.dumps(v) for k, v in values.items()}
+    keys = list(data)
+    _flush_pending(keys)
+    existing = {}
+    for i in range(0, len(keys), _IN_CHUNK):
+        for rec in AppKV.query.filter(AppKV.k.in_(keys[i:i + _IN_CHUNK])).all():
+            existing[rec.k] = rec
+    for k, v in data.items():
+        rec = existing.get(k)
+        if rec is not None:
+            if rec.v != v:
+                rec.v = v
+        else:
+            db.session.add(AppKV(k=k, v=v))
+    _mark_dirty(keys)
+    if commit:
+        db.session.commit()
+
+
+def put(key: str, value: Any, commit: bool = True) -> None:
+    set_many({key: value}, commit=commit)
+
+
+def delete(keys: Iterable[str], commit: bool = True) -> int:
+    """حذف المفاتيح عبر ORM (يلتقطها مستمع الإبطال). يُرجع عدد الصفوف المحذوفة."""
+    from extensions import db
+    from app.models import AppKV
+    keys = [str(k) for k in keys]
+    _flush_pending(keys)
+    n = 0
+    for i in range(0, len(keys), _IN_CHUNK):
+        for rec in AppKV.query.filter(AppKV.k.in_(keys[i:i + _IN_CHUNK])).all():
+            db.session.delete(rec)
+            n += 1
+    _mark_dirty(keys)
+    if commit:
+        db.session.commit()
+    return n
+
+
+def _drop_local(keys: Optional[Iterable[str]] = None) -> None:
+    with _lock:
+        for st in _states.values():
+            st['epoch'] += 1
+            if keys is None:
+                st['lru'].clear()
+            else:
+                for k in keys:
+                    st['lru'].pop(k, None)
+
+
+def _bump_shared_gen() -> None:
+    from utils.cache_helpers import _cache
+    c = _cache()
+    if c is not None:
+        try:
+            c.set(KV_GEN_KEY, _shared_gen() + 1, timeout=0)
+        except Exception:
+            pass
+
+
+def invalidate_kv(keys: Optional[Iterable[str]] = None) -> None:
+    """إسقاط المفاتيح (أو كل LRU) محلياً ورفع الجيل المشترك. لتعديلات app_kv بـ SQL مباشر."""
+    _drop_local(keys)
+    _bump_shared_gen()
+
+
+def lru_size() -> int:
+    return sum(len(st['lru']) for st in _states.values())
+
+
+def _mark_after_flush(session, flush_context) -> None:
+    try:
+        from app.models import AppKV
+        keys = [obj.k for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+                if isinstance(obj, AppKV) and obj.k]
+        if keys:
+            session.info.setdefault(_DIRTY_KEY, set()).update(keys)
+            _drop_local(keys)
+    except Exception:
+        pass
+
+
+def _invalidate_after_commit(session) -> None:
+    keys = session.info.pop(_DIRTY_KEY, None)
+    if not keys:
+        return
+    shared = [k for k in keys if _cacheable(k)]
+    if shared:
+        invalidate_kv(shared)
+
+
+def _clear_on_rollback(session, previous_transaction) -> None:
+    keys = session.info.get(_DIRTY_KEY)
+    if keys:
+        _drop_local(keys)
+        if previous_transaction.parent is None:
+            session.info.pop(_DIRTY_KEY, None)
+
+
+def register_kv_listeners() -> None:
+    """إبطال LRU عند أي flush يمس AppKV (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _mark_after_flush)
+    event.listen(Session, 'after_commit', _invalidate_after_commit)
+    event.listen(Session, 'after_soft_rollback', _clear_on_rollback)
+    _listeners_registered = True
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+محرك الرواتب الجماعي: مسير الشهر وسداد الرواتب لعدة موظفين بعدد ثابت من الاستعلامات.
+
+- load_payroll_context: الموظفون، الرواتب الافتراضية، الساعات، أسعار الأقسام، إعدادات الموظف (AppKV)،
+  مسيرات الفترة، ومجموع المدفوع لكل مسير — استعلام واحد لكل نوع مهما كان عدد الموظفين.
+- الحساب في الذاكرة، ثم الكتابة دفعة واحدة: مسيرات ناقصة (flush واحد)، دفعات، وقيود السداد
+  (قيد لكل مسير مرتبط بـ salary_id كما تتوقعه شاشات الحذف والتدقيق، تُكتب في flush واحد للقيود وآخر للسطور).
+- الدوال لا تنفّذ commit؛ المستدعي يثبّت المجموعة كاملة.
+"""
+from __future__ import annotations
+
+import json
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MAX_FIFO_MONTHS = 240
+
+
+def _period_key(y: int, m: int) -> int:
+    return int(y) * 100 + int(m)
+
+
+def _next_month(y: int, m: int) -> Tuple[int, int]:
+    return (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def salary_status(total, paid) -> str:
+    total, paid = float(total or 0), float(paid or 0)
+    if total > 0 and paid >= total:
+        return 'paid'
+    if paid > 0:
+        return 'partial'
+    return 'due'
+
+
+def load_payroll_context(emp_ids: Iterable[int], start: Tuple[int, int], end: Tuple[int, int]) -> Dict[str, Any]:
+    """كل ما يلزم لحساب رواتب employees بين الشهرين start و end (شاملين) باستعلام واحد لكل جدول."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import DepartmentRate, Employee, EmployeeHours, EmployeeSalaryDefault, Payment, Salary
+    from app.models import AppKV
+
+    ids = sorted({int(i) for i in emp_ids})
+    lo, hi = _period_key(*start), _period_key(*end)
+    ctx: Dict[str, Any] = {
+        'employees': {}, 'defaults': {}, 'hours': {}, 'dept_rates': {}, 'emp_settings': {},
+        'salaries': {}, 'paid': {},
+    }
+    if not ids:
+        return ctx
+    ctx['employees'] = {int(e.id): e for e in Employee.query.filter(Employee.id.in_(ids)).all()}
+    for d in EmployeeSalaryDefault.query.filter(EmployeeSalaryDefault.employee_id.in_(ids)).all():
+        ctx['defaults'][int(d.employee_id)] = (
+            float(d.base_salary or 0), float(d.allowances or 0), float(d.deductions or 0)
+        )
+    period = EmployeeHours.year * 100 + EmployeeHours.month
+    for eid, y, m, h in db.session.query(EmployeeHours.employee_id, EmployeeHours.year, EmployeeHours.month, EmployeeHours.hours).filter(
+        EmployeeHours.employee_id.in_(ids), period >= lo, period <= hi
+    ).all():
+        ctx['hours'][(int(eid), int(y), int(m))] = float(h or 0)
+    ctx['dept_rates'] = {
+        (name or '').lower(): float(rate or 0)
+        for name, rate in db.session.query(DepartmentRate.name, DepartmentRate.hourly_rate).all()
+    }
+    for k, v in db.session.query(AppKV.k, AppKV.v).filter(AppKV.k.in_([f"emp_settings:{i}" for i in ids])).all():
+        try:
+            ctx['emp_settings'][int(k.split(':', 1)[1])] = json.loads(v) or {}
+        except Exception:
+            pass
+    speriod = Salary.year * 100 + Salary.month
+    for s in Salary.query.filter(Salary.employee_id.in_(ids), speriod >= lo, speriod <= hi).all():
+        ctx['salaries'][(int(s.employee_id), int(s.year), int(s.month))] = s
+    sal_ids = [int(s.id) for s in ctx['salaries'].values()]
+    for i in range(0, len(sal_ids), 500):
+        ctx['paid'].update({
+            int(sid): float(total or 0)
+            for sid, total in db.session.query(Payment.invoice_id, func.coalesce(func.sum(Payment.amount_paid), 0)).filter(
+                Payment.invoice_type == 'salary', Payment.invoice_id.in_(sal_ids[i:i + 500])
+            ).group_by(Payment.invoice_id).all()
+        })
+    return ctx
+
+
+def default_components(ctx: Dict[str, Any], emp_id: int, y: int, m: int, hourly: bool = True) -> Tuple[float, float, float]:
+    """(أساسي، بدلات، استقطاعات) لشهر بلا مسير: من الراتب الافتراضي، أو الساعات × السعر للموظف بالساعة."""
+    base, allow, ded = ctx['defaults'].get(int(emp_id), (0.0, 0.0, 0.0))
+    if not hourly:
+        return base, allow, ded
+    emp = ctx['employees'].get(int(emp_id))
+    rate = ctx['dept_rates'].get((getattr(emp, 'department', '') or '').lower(), 0.0)
+    kv = ctx['emp_settings'].get(int(emp_id)) or {}
+    try:
+        kv_rate = float(kv.get('hourly_rate') or 0.0)
+    except Exception:
+        kv_rate = 0.0
+    if kv_rate > 0:
+        rate = kv_rate
+    if str(kv.get('salary_type', '') or '').lower() == 'hourly':
+        base = ctx['hours'].get((int(emp_id), int(y), int(m)), 0.0) * rate
+    return base, allow, ded
+
+
+def _new_salary(ctx, emp_id, y, m, base, allow, ded, status='due'):
+    from extensions import db
+    from models import Salary
+    s = Salary(employee_id=int(emp_id), year=int(y), month=int(m), basic_salary=base, allowances=allow,
+               deductions=ded, previous_salary_due=0.0, total_salary=max(0.0, base + allow - ded), status=status)
+    db.session.add(s)
+    ctx['salaries'][(int(emp_id), int(y), int(m))] = s
+    return s
+
+
+def ensure_month_salaries(ctx: Dict[str, Any], emp_ids: Iterable[int], year: int, month: int) -> int:
+    """مسيرات الشهر الناقصة من الراتب الافتراضي (نفس قاعدة _ensure_salary: لا أشهر مستقبلية ولا موظف بلا افتراضي)."""
+    from extensions import db
+    from models import get_saudi_now
+    today = get_saudi_now().date()
+    if (year > today.year) or (year == today.year and month > today.month):
+        return 0
+    created = 0
+    for eid in emp_ids:
+        if (int(eid), year, month) in ctx['salaries'] or int(eid) not in ctx['defaults']:
+            continue
+        base, allow, ded = ctx['defaults'][int(eid)]
+        if max(0.0, base + allow - ded) <= 0 and base <= 0 and allow <= 0 and ded <= 0:
+            continue
+        _new_salary(ctx, eid, year, month, base, allow, ded)
+        created += 1
+    if created:
+        db.session.flush()
+    return created
+
+
+def _unique_entry_numbers(bases: List[str]) -> List[str]:
+    """أرقام قيود فريدة لقائمة أساسية (استعلام واحد للموجود بدل فحص كل رقم)."""
+    from sqlalchemy import or_
+    from extensions import db
+    from models import JournalEntry
+    prefixes = sorted(set(bases))
+    taken = set()
+    for i in range(0, len(prefixes), 200):
+        taken.update(r[0] for r in db.session.query(JournalEntry.entry_number).filter(
+            or_(*[JournalEntry.entry_number.like(f"{p}%") for p in prefixes[i:i + 200]])
+        ).all())
+    out = []
+    for base in bases:
+        en, n = base, 2
+        while en in taken:
+            en = f"{base}-{n}"
+            n += 1
+        taken.add(en)
+        out.append(en)
+    return out
+
+
+def record_salary_payments(
+    ctx: Dict[str, Any],
+    allocations: List[Tuple[Any, float, str]],
+    method: str,
+    user_id: Optional[int] = None,
+    on_date: Optional[date] = None,
+) -> List[Any]:
+    """
+    allocations: [(salary, amount, 'salary'|'advance')]. دفعات + قيد لكل مسير (سداد: مدين رواتب مستحقة،
+    سلفة: مدين سلف موظفين / دائن نقدية) + تحديث الحالات. تعيد كائنات Payment (بمعرفاتها).
+    """
+    from extensions import db
+    from models import JournalEntry, JournalLine, Payment, get_saudi_now
+    from app.routes import SHORT_TO_NUMERIC, _account, _pm_account
+
+    allocations = [a for a in allocations if float(a[1] or 0) > 0]
+    if not allocations:
+        return []
+    now = get_saudi_now()
+    on_date = on_date or now.date()
+    payments = [
+        Payment(invoice_id=int(sal.id), invoice_type='salary', amount_paid=amt, payment_method=method, payment_date=now)
+        for sal, amt, _kind in allocations
+    ]
+    db.session.add_all(payments)
+
+    cash_acc = _pm_account(method)
+    liab_acc = _account(*SHORT_TO_NUMERIC['PAYROLL_LIAB'])
+    adv_acc = _account(*SHORT_TO_NUMERIC['EMP_ADV'])
+    bases = [
+        f"JE-SALPAY-{sal.id}" if kind == 'salary' else f"JE-ADV-{sal.employee_id}-{sal.year}{int(sal.month):02d}"
+        for sal, _amt, kind in allocations
+    ]
+    entries = []
+    for (sal, amt, kind), en in zip(allocations, _unique_entry_numbers(bases)):
+        desc = (f"Salary payment {sal.year}-{sal.month} EMP {sal.employee_id}" if kind == 'salary'
+                else f"Employee advance {sal.employee_id} {sal.year}-{sal.month}")
+        entries.append(JournalEntry(entry_number=en, date=on_date, branch_code=None, description=desc, status='posted',
+                                    total_debit=amt, total_credit=amt, created_by=user_id, posted_by=user_id,
+                                    salary_id=int(sal.id)))
+    db.session.add_all(entries)
+    db.session.flush()
+    lines = []
+    for (sal, amt, kind), je in zip(allocations, entries):
+        dr_acc = liab_acc if kind == 'salary' else adv_acc
+        if dr_acc is not None:
+            lines.append(JournalLine(journal_id=je.id, line_no=1, account_id=dr_acc.id, debit=amt, credit=0,
+                                     description='Payroll liability' if kind == 'salary' else 'Employee advance',
+                                     line_date=on_date, employee_id=sal.employee_id))
+        if cash_acc is not None:
+            lines.append(JournalLine(journal_id=je.id, line_no=2, account_id=cash_acc.id, debit=0, credit=amt,
+                                     description='Cash/Bank', line_date=on_date, employee_id=sal.employee_id))
+    db.session.add_all(lines)
+    for sal, amt, _kind in allocations:
+        ctx['paid'][int(sal.id)] = ctx['paid'].get(int(sal.id), 0.0) + float(amt)
+        sal.status = salary_status(sal.total_salary, ctx['paid'][int(sal.id)])
+    db.session.flush()
+    return payments
+
+
+def pay_month_bulk(
+    emp_ids: List[int], year: int, month: int, amount_per: float, method: str, user_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """سداد مبلغ ثابت لكل موظف عن شهر واحد (شاشة السداد الجماعي). تعيد success/failed."""
+    ctx = load_payroll_context(emp_ids, (year, month), (year, month))
+    ensure_month_salaries(ctx, emp_ids, year, month)
+    allocations = []
+    failed = 0
+    for eid in emp_ids:
+        sal = ctx['salaries'].get((int(eid), year, month))
+        if sal is None:
+            failed += 1
+            continue
+        remaining = max(0.0, float(sal.total_salary or 0.0) - ctx['paid'].get(int(sal.id), 0.0))
+        pay_val = amount_per if remaining <= 0 or amount_per <= remaining else remaining
+        if pay_val <= 0:
+            failed += 1
+            continue
+        allocations.append((sal, pay_val, 'salary'))
+    payments = record_salary_payments(ctx, allocations, method, user_id=user_id)
+    return {'success_count': len(allocations), 'failed_count': failed, 'payments': payments}
+
+
+def pay_fifo(
+    emp_ids: List[int], year: int, month: int, amount: float, method: str, user_id: Optional[int] = None,
+) -> List[Any]:
+    """
+    توزيع مبلغ لكل موظف على المتأخرات من شهر التعيين حتى الشهر المحدد (الأقدم أولاً)، والباقي سلفة على الشهر التالي.
+    المسيرات الناقصة تُنشأ من الراتب الافتراضي أو الساعات. تعيد الدفعات المنشأة.
+    """
+    from extensions import db
+    from models import Employee
+
+    hires = dict(db.session.query(Employee.id, Employee.hire_date).filter(Employee.id.in_(list(emp_ids))).all()) if emp_ids else {}
+    starts = {}
+    for eid in emp_ids:
+        hd = hires.get(int(eid))
+        starts[int(eid)] = (int(hd.year), int(hd.month)) if hd else (year, month)
+    first = min(starts.values()) if starts else (year, month)
+    ctx = load_payroll_context(emp_ids, first, _next_month(year, month))
+    allocations = []
+    end_key = _period_key(year, month)
+    for eid in emp_ids:
+        eid = int(eid)
+        remaining_payment = float(amount or 0)
+        y, m = starts[eid]
+        for _ in range(MAX_FIFO_MONTHS + 1):
+            if _period_key(y, m) > end_key:
+                break
+            row = ctx['salaries'].get((eid, y, m))
+            if row is None:
+                base, allow, ded = default_components(ctx, eid, y, m)
+                row = _new_salary(ctx, eid, y, m, base, allow, ded)
+            paid = ctx['paid'].get(int(row.id), 0.0) if row.id is not None else 0.0
+            month_due = max(0.0, float(row.total_salary or 0) - paid)
+            if month_due <= 0:
+                row.status = 'paid'
+            elif remaining_payment <= 0:
+                break
+            else:
+                pay_amount = min(remaining_payment, month_due)
+                allocations.append((row, pay_amount, 'salary'))
+                remaining_payment -= pay_amount
+            y, m = _next_month(y, m)
+        if remaining_payment > 0:
+            ay, am = _next_month(year, month)
+            adv = ctx['salaries'].get((eid, ay, am))
+            if adv is None:
+                base, allow, ded = default_components(ctx, eid, ay, am, hourly=False)
+                adv = _new_salary(ctx, eid, ay, am, base, allow, ded, status='partial')
+            allocations.append((adv, remaining_payment, 'advance'))
+    db.session.flush()
+    payments = record_salary_payments(ctx, [a for a in allocations if a[2] == 'salary'], method, user_id=user_id)
+    advances = [a for a in allocations if a[2] == 'advance']
+    payments += record_salary_payments(ctx, advances, method, user_id=user_id)
+    return payments
+
+
+def apply_payroll_run(year: int, month: int, details: List[Dict[str, Any]]) -> int:
+    """
+    حفظ مسير الشهر: تحديث/إنشاء مسير لكل موظف محدد (استعلام واحد للموجود)، وحذف مسيرات غير المحددين
+    التي لا دفعات لها (استعلام واحد للمدفوع). تعيد عدد المسيرات المحفوظة.
+    """
+    from extensions import db
+    from models import Payment, Salary
+
+    existing = {int(s.employee_id): s for s in Salary.query.filter_by(year=year, month=month).all()}
+    selected = set()
+    for d in details:
+        eid = int(d['employee_id'])
+        selected.add(eid)
+        basic = round(float(d.get('basic') or 0), 2)
+        extra = round(float(d.get('extra') or 0), 2)
+        absence = round(float(d.get('absence') or 0), 2)
+        incentive = round(float(d.get('incentive') or 0), 2)
+        allow = round(float(d.get('allowances') or 0), 2)
+        ded = round(float(d.get('deductions') or 0), 2)
+        sal = round(float(d.get('salary') or 0), 2)
+        if sal <= 0:
+            sal = max(0, basic + extra - absence + incentive + allow - ded)
+        s = existing.get(eid)
+        if s is None:
+            s = Salary(employee_id=eid, year=year, month=month, status='due')
+            db.session.add(s)
+            existing[eid] = s
+        s.basic_salary = basic
+        s.extra = extra
+        s.absence = absence
+        s.incentive = incentive
+        s.allowances = allow
+        s.deductions = ded
+        s.previous_salary_due = 0.0
+        s.total_salary = sal
+    stale = [int(s.id) for eid, s in existing.items() if eid not in selected and s.id is not None]
+    if stale:
+        with_payments = {
+            int(r[0]) for r in db.session.query(Payment.invoice_id).filter(
+                Payment.invoice_type == 'salary', Payment.invoice_id.in_(stale)
+            ).distinct().all()
+        }
+        for eid in [e for e, s in existing.items() if s.id in stale and int(s.id) not in with_payments]:
+            db.session.delete(existing.pop(eid))
+    db.session.flush()
+    return len(selected)
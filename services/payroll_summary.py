@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+ملخص الرواتب الشهري payroll_month_summaries: الاستحقاق والمدفوع والمتبقي لكل موظف/شهر بقراءة مفهرسة واحدة.
+
+- صف لكل مسير (Salary) مع مجموع دفعاته ومعرّفاتها وآخر طريقة دفع؛ period = YYYYMM.
+- يُحدَّث تلقائياً عند commit لأي معاملة تمس مسيراً أو دفعة راتب (invoice_type='salary').
+- الحذف الجماعي (query.delete) يتجاوز مستمعي الجلسة: المستدعي يسجّل المسيرات بـ mark_payroll_dirty.
+- rebuild_payroll_summaries يعيد البناء بالكامل.
+- شاشات الكشوف وسجل المسيرات وطباعة الرواتب تقرأ بـ summaries_in_range (مسح مدى على الفهرس المركّب).
+"""
+from __future__ import annotations
+
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_CHUNK = 500
+_DIRTY_KEY = '_payroll_summary_dirty'
+_BUSY_KEY = '_payroll_summary_refreshing'
+
+_listeners_registered = False
+
+
+def _to_cents(v) -> Decimal:
+    try:
+        return Decimal(str(v if v is not None else 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except Exception:
+        return Decimal('0.00')
+
+
+def period_of(year: int, month: int) -> int:
+    return int(year) * 100 + int(month)
+
+
+def summary_status(gross, paid) -> str:
+    g, p = _to_cents(gross), _to_cents(paid)
+    if g > Decimal('0.00') and (g - p) <= Decimal('0.01'):
+        return 'paid'
+    if p > Decimal('0.00'):
+        return 'partial'
+    return 'due'
+
+
+def _chunks(ids):
+    ids = sorted({int(i) for i in ids if i is not None})
+    for i in range(0, len(ids), _CHUNK):
+        yield ids[i:i + _CHUNK]
+
+
+def refresh_payroll_summaries(salary_ids: Iterable[int], session=None) -> int:
+    """إعادة حساب صفوف المسيرات المحددة (مسير محذوف → حذف صفه). 3 استعلامات لكل 500 مسير، بدون commit."""
+    from sqlalchemy import and_, or_
+    from extensions import db
+    from models import Payment, PayrollMonthSummary, Salary
+
+    sess = session or db.session
+    touched = 0
+    for chunk in _chunks(salary_ids):
+        salaries = {int(s.id): s for s in sess.query(Salary).filter(Salary.id.in_(chunk)).all()}
+        pays: Dict[int, List] = {}
+        for pid, sid, amt, method in (
+            sess.query(Payment.id, Payment.invoice_id, Payment.amount_paid, Payment.payment_method)
+            .filter(Payment.invoice_type == 'salary', Payment.invoice_id.in_(chunk))
+            .order_by(Payment.payment_date.asc(), Payment.id.asc())
+            .all()
+        ):
+            pays.setdefault(int(sid), []).append((int(pid), amt, method))
+        # الصف يُطابَق بالمسير أو بالفترة (صف قد يبقى من مسير حُذف وأُعيد إنشاؤه)
+        cond = PayrollMonthSummary.salary_id.in_(chunk)
+        if salaries:
+            cond = or_(cond, and_(
+                PayrollMonthSummary.employee_id.in_({int(s.employee_id) for s in salaries.values()}),
+                PayrollMonthSummary.period.in_({period_of(s.year, s.month) for s in salaries.values()}),
+            ))
+        by_sid, by_period = {}, {}
+        for r in sess.query(PayrollMonthSummary).filter(cond).all():
+            if r.salary_id is not None:
+                by_sid[int(r.salary_id)] = r
+            by_period[(int(r.employee_id), int(r.period))] = r
+        for sid in chunk:
+            s = salaries.get(sid)
+            if s is None:
+                row = by_sid.get(sid)
+                if row is not None:
+                    by_period.pop((int(row.employee_id), int(row.period)), None)
+                    sess.delete(row)
+                    touched += 1
+                continue
+            key = (int(s.employee_id), period_of(s.year, s.month))
+            row = by_sid.get(sid) or by_period.get(key)
+            if row is None:
+                row = PayrollMonthSummary(employee_id=int(s.employee_id), year=int(s.year), month=int(s.month))
+                sess.add(row)
+            by_period[key] = row
+            plist = pays.get(sid, [])
+            paid = sum((_to_cents(a) for _p, a, _m in plist), Decimal('0.00'))
+            basic, extra, absence = _to_cents(s.basic_salary), _to_cents(s.extra), _to_cents(s.absence)
+            incentive, allow, ded = _to_cents(s.incentive), _to_cents(s.allowances), _to_cents(s.deductions)
+            prev = _to_cents(s.previous_salary_due)
+            gross = _to_cents(s.total_salary) if s.total_salary is not None else (
+                basic + extra - absence + incentive + allow - ded + prev
+            )
+            row.employee_id, row.year, row.month = int(s.employee_id), int(s.year), int(s.month)
+            row.period = period_of(s.year, s.month)
+            row.salary_id = sid
+            row.basic, row.extra, row.absence, row.incentive = basic, extra, absence, incentive
+            row.allowances, row.deductions, row.prev_due = allow, ded, prev
+            row.gross = gross
+            row.paid = paid
+            row.remaining = max(Decimal('0.00'), gross - paid)
+            row.status = summary_status(gross, paid)
+            row.payment_ids = ','.join(str(p) for p, _a, _m in plist) or None
+            row.last_payment_method = ((plist[-1][2] or '').strip().upper() or None) if plist else None
+            touched += 1
+    return touched
+
+
+def rebuild_payroll_summaries() -> int:
+    """إعادة بناء الملخص بالكامل (بدون commit). تعيد عدد الصفوف."""
+    from extensions import db
+    from models import PayrollMonthSummary, Salary
+
+    PayrollMonthSummary.query.delete(synchronize_session=False)
+    n = refresh_payroll_summaries([int(r[0]) for r in db.session.query(Salary.id).all()])
+    db.session.flush()
+    return n
+
+
+def ensure_payroll_summaries() -> int:
+    """حساب صفوف المسيرات التي ليس لها صف بعد (anti-join واحد). بدون commit."""
+    from extensions import db
+    from models import PayrollMonthSummary, Salary
+
+    missing = [
+        int(r[0]) for r in db.session.query(Salary.id)
+        .outerjoin(PayrollMonthSummary, PayrollMonthSummary.salary_id == Salary.id)
+        .filter(PayrollMonthSummary.id.is_(None))
+        .all()
+    ]
+    if not missing:
+        return 0
+    n = refresh_payroll_summaries(missing)
+    db.session.flush()
+    return n
+
+
+def summaries_in_range(
+    start: Tuple[int, int],
+    end: Tuple[int, int],
+    employee_ids: Optional[Iterable[int]] = None,
+) -> Dict[Tuple[int, int, int], object]:
+    """صفوف الملخص بين شهرين (شاملين) مفهرسة بـ (employee_id, year, month) — استعلام مدى واحد."""
+    from models import PayrollMonthSummary
+
+    q = PayrollMonthSummary.query.filter(
+        PayrollMonthSummary.period >= period_of(*start), PayrollMonthSummary.period <= period_of(*end)
+    )
+    if employee_ids is not None:
+        ids = sorted({int(i) for i in employee_ids})
+        if not ids:
+            return {}
+        q = q.filter(PayrollMonthSummary.employee_id.in_(ids))
+    return {(int(r.employee_id), int(r.year), int(r.month)): r for r in q.all()}
+
+
+def _iter_months(y0: int, m0: int, y1: int, m1: int, limit: int = 240):
+    y, m, n = y0, m0, 0
+    while (y, m) <= (y1, m1) and n <= limit:
+        yield y, m
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        n += 1
+
+
+def salary_statement_rows(year: int, month: int, department: str = '', employee_id: Optional[int] = None) -> List[Dict]:
+    """
+    كشف رواتب الشهر لكل موظف: استحقاق الشهر + متأخرات ما قبله بعد توزيع كل المدفوع FIFO من شهر التعيين.
+    ثلاثة استعلامات (الموظفون، الرواتب الافتراضية، مسح مدى للملخص) بدل استعلام لكل موظف/شهر.
+    الشهر بلا مسير يُحسب من الراتب الافتراضي.
+    """
+    from sqlalchemy import func
+    from models import Employee, EmployeeSalaryDefault
+
+    q = Employee.query.order_by(Employee.full_name.asc())
+    if department:
+        q = q.filter(func.lower(Employee.department) == department.lower())
+    if employee_id:
+        q = q.filter(Employee.id == int(employee_id))
+    employees = q.all()
+    if not employees:
+        return []
+    ids = [int(e.id) for e in employees]
+    defaults = {
+        int(d.employee_id): (float(d.base_salary or 0), float(d.allowances or 0), float(d.deductions or 0))
+        for d in EmployeeSalaryDefault.query.filter(EmployeeSalaryDefault.employee_id.in_(ids)).all()
+    }
+    starts = {
+        int(e.id): ((int(e.hire_date.year), int(e.hire_date.month)) if getattr(e, 'hire_date', None) else (year, month))
+        for e in employees
+    }
+    summaries = summaries_in_range(min(starts.values()), (year, month), ids)
+    rows = []
+    for emp in employees:
+        eid = int(emp.id)
+        dues = []
+        total_paid_all = 0.0
+        for yy, mm in _iter_months(*starts[eid], year, month):
+            r = summaries.get((eid, yy, mm))
+            if r is not None:
+                base, allow, ded = float(r.basic or 0), float(r.allowances or 0), float(r.deductions or 0)
+                total_paid_all += float(r.paid or 0)
+            else:
+                base, allow, ded = defaults.get(eid, (0.0, 0.0, 0.0))
+            dues.append((base, allow, ded, max(0.0, base + allow - ded)))
+        if not dues:
+            continue
+        remaining_payment = total_paid_all
+        prev_due_sum = prev_paid_alloc = 0.0
+        for _b, _a, _d, due_amt in dues[:-1]:
+            prev_due_sum += due_amt
+            if remaining_payment <= 0:
+                continue
+            pay = min(due_amt, remaining_payment)
+            prev_paid_alloc += pay
+            remaining_payment -= pay
+        c_base, c_allow, c_ded, c_due = dues[-1]
+        c_paid = min(c_due, remaining_payment) if remaining_payment > 0 and c_due > 0 else 0.0
+        prev_remaining = max(0.0, prev_due_sum - prev_paid_alloc)
+        total = max(0.0, c_due + prev_remaining)
+        remaining_total = max(0.0, total - c_paid)
+        status = 'paid' if (total > 0 and remaining_total <= 0.01) else ('partial' if c_paid > 0 else ('paid' if total == 0 else 'due'))
+        rows.append({
+            'employee_id': eid,
+            'employee_name': emp.full_name,
+            'month_label': f"{year:04d}-{month:02d}",
+            'year': year,
+            'month': month,
+            'basic': c_base,
+            'allow': c_allow,
+            'ded': c_ded,
+            'prev': prev_remaining,
+            'total': total,
+            'paid': c_paid,
+            'remaining': remaining_total,
+            'status': status,
+        })
+    return rows
+
+
+def statement_totals(rows: List[Dict]) -> Dict[str, float]:
+    return {k: sum(float(r.get(k) or 0) for r in rows) for k in ('basic', 'allow', 'ded', 'prev', 'total', 'paid', 'remaining')}
+
+
+# ---------- الصيانة التلقائية ----------
+
+def mark_payroll_dirty(salary_ids: Iterable[int], session=None) -> None:
+    """تسجيل مسيرات لإعادة حساب ملخصها عند commit (بعد query.delete/update الجماعي)."""
+    from extensions import db
+    sess = session or db.session
+    sess.info.setdefault(_DIRTY_KEY, set()).update(int(i) for i in salary_ids if i is not None)
+
+
+def _dirty_keys_after_flush(session, flush_context) -> None:
+    try:
+        from models import Payment, Salary
+
+        keys: Set[int] = session.info.setdefault(_DIRTY_KEY, set())
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Salary):
+                if obj.id is not None:
+                    keys.add(int(obj.id))
+            elif isinstance(obj, Payment):
+                if getattr(obj, 'invoice_type', None) == 'salary' and getattr(obj, 'invoice_id', None):
+                    keys.add(int(obj.invoice_id))
+        if not keys:
+            session.info.pop(_DIRTY_KEY, None)
+    except Exception:
+        pass
+
+
+def _refresh_before_commit(session) -> None:
+    if session.info.get(_BUSY_KEY) or session.in_nested_transaction():
+        return
+    if not session.info.get(_DIRTY_KEY) and not (session.new or session.dirty or session.deleted):
+        return
+    session.info[_BUSY_KEY] = True
+    try:
+        session.flush()
+        keys = session.info.pop(_DIRTY_KEY, None) or set()
+        if not keys:
+            return
+        with session.begin_nested():
+            refresh_payroll_summaries(keys, session=session)
+    except Exception as e:
+        try:
+            from flask import current_app
+            current_app.logger.warning('payroll_month_summaries refresh skipped: %s', e)
+        except Exception:
+            pass
+    finally:
+        session.info.pop(_BUSY_KEY, None)
+        session.info.pop(_DIRTY_KEY, None)
+
+
+def _clear_on_rollback(session, previous_transaction) -> None:
+    if previous_transaction.parent is None:
+        session.info.pop(_DIRTY_KEY, None)
+
+
+def register_payroll_summary_listeners() -> None:
+    """ربط تحديث الملخص بـ commit لأي معاملة تمس المسيرات أو دفعات الرواتب (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _dirty_keys_after_flush)
+    event.listen(Session, 'before_commit', _refresh_before_commit)
+    event.listen(Session, 'after_soft_rollback', _clear_on_rollback)
+    _listeners_registered = True
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+كاش إعدادات المنصات وتجاوزات الحسابات فوق AppKV: platforms_map و acc_map.
+
+- تُقرأ من AppKV مرة واحدة وتُحفظ في العملية مع مطابِقات كلمات مفتاحية مُجمَّعة مسبقاً (regex لكل منصة بنفس
+  ترتيب القائمة، ثم hunger/keeta المدمجتان)، فتصنيف القناة وتجاوز الحساب بحث في قاموس/regex دون أي استعلام.
+- أسماء العملاء المصنَّفة تُحفظ في قاموس محدود الحجم (نفس الاسم يتكرر في كل فاتورة منصة).
+- مهلة قصيرة (CONFIG_TTL) ورقم جيل مشترك في الكاش: شاشات حفظ الإعدادات تستدعي invalidate_platform_config
+  بعد kv_set، فيُعاد التحميل فوراً في هذا العامل وعند الفحص التالي في العمال الأخرى.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Pattern, Tuple
+
+CONFIG_TTL = 30
+CONFIG_GEN_KEY = "platform_cfg:gen"
+_GEN_CHECK_S = 2.0
+_NAME_MEMO_MAX = 4096
+# نفس ترتيب classify_channel: المنصات المهيأة أولاً ثم المدمجة
+BUILTIN_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ('hunger', ('hunger', 'هنقر', 'هونقر')),
+    ('keeta', ('keeta', 'كيتا', 'كيت')),
+)
+
+_lock = threading.Lock()
+_state: Dict[str, Dict] = {}
+
+
+def _compile(keywords) -> Optional[Pattern]:
+    kws = sorted({(k or '').strip().lower() for k in keywords or [] if (k or '').strip()}, key=len, reverse=True)
+    if not kws:
+        return None
+    return re.compile('|'.join(re.escape(k) for k in kws))
+
+
+def build_matchers(platforms) -> List[Tuple[str, Pattern]]:
+    """[(مفتاح القناة، regex)] بترتيب الأولوية: المنصات المهيأة ثم hunger/keeta."""
+    out: List[Tuple[str, Pattern]] = []
+    for p in platforms or []:
+        key = (p.get('key') or '').strip().lower()
+        rx = _compile(p.get('keywords'))
+        if key and rx is not None:
+            out.append((key, rx))
+    for key, kws in BUILTIN_KEYWORDS:
+        out.append((key, _compile(kws)))
+    return out
+
+
+def match_channel(name: Optional[str], matchers: List[Tuple[str, Pattern]]) -> str:
+    s = (name or '').strip().lower()
+    if not s:
+        return ''
+    for key, rx in matchers:
+        if rx.search(s):
+            return key
+    return ''
+
+
+def _shared_gen() -> int:
+    from utils.cache_helpers import _cache
+    c = _cache()
+    if c is None:
+        return 0
+    try:
+        return int(c.get(CONFIG_GEN_KEY) or 0)
+    except Exception:
+        return 0
+
+
+def _load(gen: int) -> Dict:
+    from routes.common import kv_get
+    try:
+        platforms = kv_get('platforms_map', []) or []
+    except Exception:
+        platforms = []
+    try:
+        acc_map = kv_get('acc_map', {}) or {}
+    except Exception:
+        acc_map = {}
+    if not isinstance(platforms, list):
+        platforms = []
+    if not isinstance(acc_map, dict):
+        acc_map = {}
+    now = time.monotonic()
+    return {
+        'gen': gen, 'loaded': now, 'checked': now,
+        'platforms': platforms,
+        'acc_map': {str(k): str(v).strip() for k, v in acc_map.items() if v is not None and str(v).strip()},
+        'matchers': build_matchers(platforms),
+        'names': {},
+    }
+
+
+def _config() -> Dict:
+    from extensions import db
+    key = str(db.engine.url)
+    cfg = _state.get(key)
+    now = time.monotonic()
+    if cfg is not None:
+        if now - cfg['loaded'] > CONFIG_TTL:
+            cfg = None
+        elif now - cfg['checked'] > _GEN_CHECK_S:
+            if _shared_gen() != cfg['gen']:
+                cfg = None
+            else:
+                cfg['checked'] = now
+    if cfg is None:
+        with _lock:
+            cfg = _load(_shared_gen())
+            _state[key] = cfg
+    return cfg
+
+
+def platforms() -> List[dict]:
+    """platforms_map كما هو مخزَّن (للقراءة فقط)."""
+    return _config()['platforms']
+
+
+def classify(name: Optional[str]) -> str:
+    """قناة اسم العميل ('' = مباشر) من المطابِقات المُجمَّعة، مع حفظ النتيجة لكل اسم."""
+    cfg = _config()
+    memo = cfg['names']
+    s = (name or '').strip().lower()
+    hit = memo.get(s)
+    if hit is not None:
+        return hit
+    ch = match_channel(s, cfg['matchers'])
+    if len(memo) >= _NAME_MEMO_MAX:
+        memo.clear()
+    memo[s] = ch
+    return ch
+
+
+def acc_override(name: str, default_code: str) -> str:
+    """رمز الحساب المهيأ في acc_map للاسم المستعار (AR_KEETA, REV_CT, ...) وإلا default_code."""
+    return _config()['acc_map'].get(name) or default_code
+
+
+def invalidate_platform_config() -> None:
+    """يُستدعى بعد kv_set('platforms_map' | 'acc_map'): إسقاط النسخة المحلية ورفع الجيل المشترك."""
+    from utils.cache_helpers import _cache
+    _state.clear()
+    c = _cache()
+    if c is not None:
+        try:
+            c.set(CONFIG_GEN_KEY, _shared_gen() + 1, timeout=0)
+        except Exception:
+            pass
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+إعادة حساب تكلفة الوجبات جماعياً عند تغيّر أسعار المواد الخام.
+
+- المواد المتغيرة → الوجبات المتأثرة عبر فهرس meal_ingredients.raw_material_id.
+- تكلفة كل مكوّن (quantity × cost_per_unit) تُحسب داخل استعلام واحد لكل الوجبات المتأثرة
+  وتُجمَّع لكل وجبة، بدلاً من المرور على علاقات ORM وجبةً وجبة.
+- النتائج تُكتب بتحديث جماعي واحد (bulk UPDATE بالمفتاح) لكل جدول.
+- dry_run: لا كتابة؛ تعيد أثر التغيير على التكلفة وسعر البيع وهامش الربح بالسعر الحالي.
+- الدوال لا تنفّذ commit.
+"""
+from __future__ import annotations
+
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional
+
+_Q2 = Decimal('0.01')
+_Q4 = Decimal('0.0001')
+
+
+def _dec(v) -> Decimal:
+    try:
+        return Decimal(str(v if v is not None else 0))
+    except Exception:
+        return Decimal('0')
+
+
+def _margin_pct(price: Decimal, cost: Decimal) -> Optional[float]:
+    if price <= 0:
+        return None
+    return float(((price - cost) / price * 100).quantize(_Q2, rounding=ROUND_HALF_UP))
+
+
+def affected_meal_ids(rm_ids: Iterable[int]) -> List[int]:
+    from extensions import db
+    from models import MealIngredient
+
+    ids = sorted({int(i) for i in rm_ids if i})
+    if not ids:
+        return []
+    rows = (
+        db.session.query(MealIngredient.meal_id)
+        .filter(MealIngredient.raw_material_id.in_(ids))
+        .distinct()
+        .all()
+    )
+    return sorted(int(r[0]) for r in rows)
+
+
+def recompute_meal_costs(rm_ids: Optional[Iterable[int]] = None, dry_run: bool = False,
+                         reprice: bool = True) -> Dict[str, Any]:
+    """
+    إعادة حساب total_cost و selling_price للوجبات التي تستخدم المواد rm_ids (None = كل الوجبات).
+    selling_price = التكلفة × (1 + profit_margin_percent/100) كما في Meal.calculate_selling_price.
+    reprice=False: التكلفة وتكلفة المكوّنات فقط، وسعر البيع يبقى كما هو (المسارات التلقائية: استلام مشتريات،
+    تعديل أسعار المواد). إعادة التسعير صريحة عبر POST /api/meals/recost مع إمكان dry_run.
+    Returns {'dry_run', 'count', 'meals': [أثر كل وجبة]}.
+    """
+    from sqlalchemy import func, update
+    from extensions import db
+    from models import Meal, MealIngredient, RawMaterial
+
+    # حركات المخزون تحدّث cost_per_unit في الذاكرة؛ autoflush معطّل لذا نرسلها قبل التجميع
+    db.session.flush()
+    meal_ids = None if rm_ids is None else affected_meal_ids(rm_ids)
+    if meal_ids is not None and not meal_ids:
+        return {'dry_run': bool(dry_run), 'count': 0, 'meals': []}
+
+    line_cost = MealIngredient.quantity * func.coalesce(RawMaterial.cost_per_unit, 0)
+    ing_q = (
+        db.session.query(MealIngredient.id, MealIngredient.meal_id, MealIngredient.total_cost, line_cost)
+        .join(RawMaterial, RawMaterial.id == MealIngredient.raw_material_id)
+    )
+    meal_q = db.session.query(Meal.id, Meal.name, Meal.total_cost, Meal.selling_price, Meal.profit_margin_percent)
+    if meal_ids is not None:
+        ing_q = ing_q.filter(MealIngredient.meal_id.in_(meal_ids))
+        meal_q = meal_q.filter(Meal.id.in_(meal_ids))
+
+    ing_updates = []
+    cost_by_meal: Dict[int, Decimal] = {}
+    for ing_id, meal_id, old, cost in ing_q.all():
+        c = _dec(cost).quantize(_Q4, rounding=ROUND_HALF_UP)
+        if c != _dec(old):
+            ing_updates.append({'id': int(ing_id), 'total_cost': c})
+        cost_by_meal[int(meal_id)] = cost_by_meal.get(int(meal_id), Decimal('0')) + c
+
+    impact = []
+    meal_updates = []
+    for mid, name, old_cost, old_price, margin in meal_q.all():
+        if int(mid) not in cost_by_meal:
+            # وجبة بلا مكوّنات (مثلاً مستوردة بسعر بيع فقط): لا تكلفة محسوبة ولا نلمس سعرها
+            continue
+        old_cost, old_price = _dec(old_cost), _dec(old_price)
+        new_cost = cost_by_meal[int(mid)].quantize(_Q2, rounding=ROUND_HALF_UP)
+        if reprice:
+            new_price = (new_cost * (1 + _dec(margin) / 100)).quantize(_Q2, rounding=ROUND_HALF_UP)
+        else:
+            new_price = old_price
+        if new_cost == old_cost and new_price == old_price:
+            continue
+        upd = {'id': int(mid), 'total_cost': new_cost}
+        if reprice:
+            upd['selling_price'] = new_price
+        meal_updates.append(upd)
+        impact.append({
+            'meal_id': int(mid),
+            'name': name,
+            'old_cost': float(old_cost),
+            'new_cost': float(new_cost),
+            'cost_delta': float(new_cost - old_cost),
+            'old_price': float(old_price),
+            'new_price': float(new_price),
+            'margin_before_pct': _margin_pct(old_price, old_cost),
+            'margin_at_current_price_pct': _margin_pct(old_price, new_cost),
+        })
+
+    if not dry_run:
+        if ing_updates:
+            db.session.execute(update(MealIngredient), ing_updates)
+        if meal_updates:
+            db.session.execute(update(Meal), meal_updates)
+    impact.sort(key=lambda r: r['cost_delta'], reverse=True)
+    return {'dry_run': bool(dry_run), 'count': len(impact), 'meals': impact}
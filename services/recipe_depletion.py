@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+استهلاك المخزون من الوصفات عند البيع.
+
+- خريطة الوصفات (صنف القائمة/اسم الوجبة → مكوّنات) تُبنى باستعلامين وتُخزَّن في الكاش،
+  وتُبطَل عند أي flush يمس Meal أو MealIngredient أو MenuItem، ثم مرة أخرى بعد commit (أو rollback)
+  حتى لا يبقى في الكاش ما بناه طلب متزامن بين الـ flush والـ commit.
+- بنود الفاتورة تُفكَّك إلى كميات مواد خام مجمّعة لكل مادة، ثم تُكتب حركات stock_movements
+  بإدراج جماعي واحد، مع تحديث الكمية والمتوسط المرجّح مرة واحدة لكل مادة.
+- deplete_pending_invoices: مهمة دفعية لفواتير أُنشئت من مسارات أخرى أو قبل تفعيل الاستهلاك.
+- reverse_depletion: حذف فاتورة بيع يعيد موادها بحركة عكسية بنفس التكلفة والتاريخ.
+- الدوال لا تنفّذ commit؛ الحركات تنضم لمعاملة المستدعي.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple, Any
+
+RECIPE_MAP_CACHE_KEY = "recipe_map"
+RECIPE_MAP_TTL = 900  # 15 min
+SALES_REF_TYPE = 'sales'
+_DIRTY_KEY = '_recipe_map_dirty'
+
+_listeners_registered = False
+
+
+def _norm(name) -> str:
+    return ' '.join(str(name or '').split()).lower()
+
+
+def _fetch_recipe_map() -> Dict[str, Any]:
+    from extensions import db
+    from models import Meal, MealIngredient, MenuItem
+
+    recipes: Dict[int, List[Tuple[int, float]]] = defaultdict(list)
+    rows = (
+        db.session.query(MealIngredient.meal_id, MealIngredient.raw_material_id, MealIngredient.quantity)
+        .join(Meal, Meal.id == MealIngredient.meal_id)
+        .filter(Meal.active == True)  # noqa: E712
+        .all()
+    )
+    for meal_id, rm_id, qty in rows:
+        if rm_id and qty:
+            recipes[int(meal_id)].append((int(rm_id), float(qty)))
+
+    by_name: Dict[str, int] = {}
+    for mid, name, name_ar in db.session.query(Meal.id, Meal.name, Meal.name_ar).filter(Meal.active == True).all():  # noqa: E712
+        if int(mid) not in recipes:
+            continue
+        for key in (name, name_ar, (f'{name} / {name_ar}' if name_ar else None)):
+            if key:
+                by_name.setdefault(_norm(key), int(mid))
+
+    by_menu_item: Dict[int, int] = {}
+    # أصناف غير مربوطة بوجبة: نقطة البيع ترسل معرّفها نفسه في meal_id، فقد يطابق رقم وجبة أخرى
+    unlinked: Dict[int, str] = {}
+    for item_id, meal_id, item_name in db.session.query(MenuItem.id, MenuItem.meal_id, MenuItem.name).all():
+        if not meal_id:
+            unlinked[int(item_id)] = _norm(item_name)
+        elif int(meal_id) in recipes:
+            by_menu_item[int(item_id)] = int(meal_id)
+            if item_name:
+                by_name.setdefault(_norm(item_name), int(meal_id))
+
+    return {'recipes': dict(recipes), 'by_name': by_name, 'by_menu_item': by_menu_item, 'unlinked': unlinked}
+
+
+def get_recipe_map(ttl: int = RECIPE_MAP_TTL) -> Dict[str, Any]:
+    from utils.cache_helpers import _cache
+    c = _cache()
+    if c is None:
+        return _fetch_recipe_map()
+    val = c.get(RECIPE_MAP_CACHE_KEY)
+    if val is not None:
+        return val
+    val = _fetch_recipe_map()
+    try:
+        c.set(RECIPE_MAP_CACHE_KEY, val, timeout=ttl)
+    except Exception:
+        pass
+    return val
+
+
+def invalidate_recipe_map() -> None:
+    from utils.cache_helpers import _cache
+    c = _cache()
+    if c is not None:
+        try:
+            c.delete(RECIPE_MAP_CACHE_KEY)
+        except Exception:
+            pass
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _resolve_meal(ln: dict, recipes: Dict[int, Any], by_menu_item: Dict[int, int],
+                  unlinked: Dict[int, str]) -> Optional[int]:
+    item_id = _int_or_none(ln.get('menu_item_id'))
+    if item_id is not None and item_id in by_menu_item:
+        return by_menu_item[item_id]
+    mid = _int_or_none(ln.get('meal_id'))
+    if mid is None:
+        return None
+    if mid in recipes:
+        # نفس الرقم لصنف غير مربوط بنفس الاسم: نقطة البيع أرسلت معرّف الصنف لا الوجبة
+        name = _norm(ln.get('name'))
+        if mid in unlinked and name and unlinked[mid] == name:
+            return None
+        return mid
+    return by_menu_item.get(mid)
+
+
+def explode_lines(lines: Iterable[dict], recipe_map: Optional[Dict[str, Any]] = None) -> Dict[int, float]:
+    """
+    تفكيك بنود البيع إلى كمية مطلوبة لكل مادة خام.
+    كل بند: {'meal_id': ..., 'menu_item_id': ..., 'name': اسم المنتج، 'qty': الكمية}.
+    meal_id كما ترسله نقطة البيع (api_menu_all_items): معرّف الوجبة Meal.id إن كان الصنف مربوطاً بوجبة،
+    وإلا معرّف صنف القائمة نفسه؛ لذا يُطابق أولاً مع الوصفات ثم مع أصناف القائمة. menu_item_id (إن وُجد) صريح.
+    البند بلا وصفة معروفة يُتجاهل.
+    """
+    rmap = recipe_map if recipe_map is not None else get_recipe_map()
+    recipes = rmap.get('recipes') or {}
+    by_menu_item = rmap.get('by_menu_item') or {}
+    by_name = rmap.get('by_name') or {}
+    unlinked = rmap.get('unlinked') or {}
+    need: Dict[int, float] = defaultdict(float)
+    for ln in lines or []:
+        try:
+            qty = float(ln.get('qty') or 0)
+        except (TypeError, ValueError):
+            qty = 0.0
+        if qty <= 0:
+            continue
+        meal_id = _resolve_meal(ln, recipes, by_menu_item, unlinked)
+        if meal_id is None:
+            meal_id = by_name.get(_norm(ln.get('name')))
+        for rm_id, per_unit in recipes.get(meal_id, ()) if meal_id is not None else ():
+            need[rm_id] += per_unit * qty
+    return dict(need)
+
+
+def _write_depletion(need_by_ref: Dict[int, Tuple[date, Dict[int, float]]], user_id: Optional[int] = None) -> int:
+    """إدراج جماعي لحركات الاستهلاك لعدة فواتير؛ المواد تُحمَّل باستعلام واحد وتُحدَّث في الذاكرة."""
+    from sqlalchemy import insert
+    from extensions import db
+    from models import RawMaterial, StockMovement
+    from services.stock_ledger import MOVEMENT_SALE, apply_movement, _Q4
+
+    rm_ids = {rid for _d, need in need_by_ref.values() for rid in need}
+    if not rm_ids:
+        return 0
+    materials = {int(rm.id): rm for rm in RawMaterial.query.filter(RawMaterial.id.in_(rm_ids)).all()}
+    rows = []
+    for ref_id in sorted(need_by_ref):
+        on_date, need = need_by_ref[ref_id]
+        for rm_id in sorted(need):
+            rm = materials.get(rm_id)
+            if rm is None:
+                continue
+            qty = -Decimal(str(need[rm_id])).quantize(_Q4)
+            if qty == 0:
+                continue
+            cost, balance, avg = apply_movement(rm, qty)
+            rows.append({
+                'raw_material_id': rm_id,
+                'date': on_date,
+                'movement_type': MOVEMENT_SALE,
+                'quantity': qty,
+                'unit_cost': cost,
+                'total_cost': (qty * cost).quantize(_Q4),
+                'balance_qty': balance,
+                'avg_cost': avg,
+                'ref_type': SALES_REF_TYPE,
+                'ref_id': int(ref_id),
+                'user_id': user_id,
+            })
+    if rows:
+        db.session.execute(insert(StockMovement), rows)
+    return len(rows)
+
+
+def deplete_for_invoice(invoice_id: int, lines: Iterable[dict], on_date: Optional[date] = None,
+                        user_id: Optional[int] = None) -> int:
+    """استهلاك مكوّنات فاتورة بيع واحدة (بدون commit). تعيد عدد الحركات المُدرجة."""
+    from models import get_saudi_now
+    need = explode_lines(lines)
+    if not need:
+        return 0
+    return _write_depletion({int(invoice_id): (on_date or get_saudi_now().date(), need)}, user_id=user_id)
+
+
+def deplete_pending_invoices(start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+    """
+    استهلاك مكوّنات فواتير البيع التي ليس لها حركات بعد (مرة واحدة لكل فاتورة).
+    البنود تُجمَّع (فاتورة، منتج) باستعلام واحد. تعيد عدد الحركات المُدرجة (بدون commit).
+    """
+    from sqlalchemy import func
+    from extensions import db
+    from models import SalesInvoice, SalesInvoiceItem, StockMovement
+
+    # فاتورة لها حركات صافيها غير صفري؛ الحركات المعكوسة بالكامل (فاتورة محذوفة) لا تحجز رقمها
+    done = (
+        db.session.query(StockMovement.ref_id)
+        .filter(StockMovement.ref_type == SALES_REF_TYPE)
+        .filter(StockMovement.ref_id.isnot(None))
+        .group_by(StockMovement.ref_id)
+        .having(func.sum(StockMovement.quantity) != 0)
+    )
+    q = (
+        db.session.query(SalesInvoice.id, SalesInvoice.date, SalesInvoiceItem.product_name,
+                         func.coalesce(func.sum(SalesInvoiceItem.quantity), 0))
+        .join(SalesInvoiceItem, SalesInvoiceItem.invoice_id == SalesInvoice.id)
+        .filter(SalesInvoice.id.notin_(done))
+        .group_by(SalesInvoice.id, SalesInvoice.date, SalesInvoiceItem.product_name)
+    )
+    if start_date is not None:
+        q = q.filter(SalesInvoice.date >= start_date)
+    if end_date is not None:
+        q = q.filter(SalesInvoice.date <= end_date)
+    lines_by_inv: Dict[int, Tuple[date, List[dict]]] = {}
+    for inv_id, inv_date, name, qty in q.all():
+        lines_by_inv.setdefault(int(inv_id), (inv_date, []))[1].append({'name': name, 'qty': float(qty or 0)})
+    if not lines_by_inv:
+        return 0
+    rmap = get_recipe_map()
+    need_by_ref = {}
+    for inv_id, (inv_date, lines) in lines_by_inv.items():
+        need = explode_lines(lines, rmap)
+        if need:
+            need_by_ref[inv_id] = (inv_date, need)
+    return _write_depletion(need_by_ref)
+
+
+def reverse_depletion(invoice_id: int, user_id: Optional[int] = None) -> int:
+    """
+    عكس استهلاك فاتورة بيع محذوفة (بدون commit): حركة موجبة لكل (مادة، تاريخ) بصافي ما خرج،
+    بتكلفة الخروج نفسها وبتاريخ الحركة الأصلية. استدعاء ثانٍ لا يضيف شيئاً. تعيد عدد الحركات.
+    """
+    from sqlalchemy import func
+    from extensions import db
+    from models import RawMaterial, StockMovement
+    from services.stock_ledger import MOVEMENT_SALE, record_movement
+
+    rows = (
+        db.session.query(StockMovement.raw_material_id, StockMovement.date,
+                         func.sum(StockMovement.quantity), func.sum(StockMovement.total_cost))
+        .filter(StockMovement.ref_type == SALES_REF_TYPE, StockMovement.ref_id == int(invoice_id))
+        .group_by(StockMovement.raw_material_id, StockMovement.date)
+        .all()
+    )
+    rows = [(int(rid), d, Decimal(str(q or 0)), Decimal(str(c or 0))) for rid, d, q, c in rows]
+    rows = [r for r in rows if r[2] < 0]
+    if not rows:
+        return 0
+    materials = {int(rm.id): rm for rm in RawMaterial.query.filter(RawMaterial.id.in_({r[0] for r in rows})).all()}
+    added = 0
+    for rid, on_date, qty, cost in sorted(rows, key=lambda r: (r[1], r[0])):
+        rm = materials.get(rid)
+        if rm is None:
+            continue
+        record_movement(rm, -qty, MOVEMENT_SALE, unit_cost=cost / qty, on_date=on_date,
+                        ref_type=SALES_REF_TYPE, ref_id=int(invoice_id), notes='Sale deleted', user_id=user_id)
+        added += 1
+    return added
+
+
+def _on_before_flush(session, flush_context, instances) -> None:
+    try:
+        from models import Meal, MealIngredient, MenuItem
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, (Meal, MealIngredient, MenuItem)):
+                # نفس المعاملة قد تقرأ الخريطة بعد التعديل؛ والإبطال يتكرر بعد commit
+                invalidate_recipe_map()
+                session.info[_DIRTY_KEY] = True
+                return
+    except Exception:
+        pass
+
+
+def _invalidate_after_commit(session) -> None:
+    if session.info.pop(_DIRTY_KEY, None):
+        invalidate_recipe_map()
+
+
+def _clear_on_rollback(session, previous_transaction) -> None:
+    if session.info.get(_DIRTY_KEY):
+        # الخريطة ربما بُنيت من صفوف غير ملتزمة
+        invalidate_recipe_map()
+        if previous_transaction.parent is None:
+            session.info.pop(_DIRTY_KEY, None)
+
+
+def register_recipe_listeners() -> None:
+    """إبطال خريطة الوصفات عند أي flush يمس وجبة أو مكوّن أو صنف قائمة وبعد commit (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'before_flush', _on_before_flush)
+    event.listen(Session, 'after_commit', _invalidate_after_commit)
+    event.listen(Session, 'after_soft_rollback', _clear_on_rollback)
+    _listeners_registered = True
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+قناة البيع (منصات التوصيل keeta / hunger / منصات مهيأة في platforms_map).
+
+- تُحدَّد القناة مرة واحدة عند إصدار الفاتورة وتُخزَّن في sales_invoices.channel (مفهرس)،
+  فتتجمع التقارير على العمود بدل مطابقة نصوص customer_name في كل طلب.
+- '' = عميل مباشر، NULL = لم تُصنَّف بعد (فواتير قديمة قبل العمود).
+- عند تعديل platforms_map يُعاد تصنيف الفواتير بتحديث واحد لكل اسم عميل مميز.
+- platforms_map يُقرأ من كاش services/platform_config (مطابِقات مُجمَّعة) لا من AppKV في كل استدعاء.
+"""
+from __future__ import annotations
+
+from typing import Iterable, List, Optional
+
+
+def classify_channel(name: Optional[str], platforms: Optional[Iterable[dict]] = None) -> str:
+    """تصنيف اسم العميل إلى مفتاح قناة أو '' (نفس قواعد _platform_group)."""
+    s = (name or '').strip().lower()
+    for p in platforms or []:
+        key = (p.get('key') or '').strip().lower()
+        for kw in p.get('keywords') or []:
+            k = (kw or '').strip().lower()
+            if key and k and (k in s):
+                return key
+    if ('hunger' in s) or ('هنقر' in s) or ('هونقر' in s):
+        return 'hunger'
+    if ('keeta' in s) or ('كيتا' in s) or ('كيت' in s):
+        return 'keeta'
+    return ''
+
+
+def _platforms() -> List[dict]:
+    try:
+        from services.platform_config import platforms
+        return platforms()
+    except Exception:
+        return []
+
+
+def resolve_channel(name: Optional[str]) -> str:
+    try:
+        from services.platform_config import classify
+        return classify(name)
+    except Exception:
+        return ''
+
+
+def channel_keys() -> List[str]:
+    """مفاتيح القنوات المعروفة: المدمجة + المهيأة."""
+    keys = ['keeta', 'hunger']
+    for p in _platforms():
+        k = (p.get('key') or '').strip().lower()
+        if k and k not in keys:
+            keys.append(k)
+    return keys
+
+
+def reclassify_channels(only_missing: bool = False) -> int:
+    """
+    إعادة حساب channel للفواتير بتحديث واحد لكل اسم عميل مميز (بدون commit).
+    only_missing=True: الفواتير التي channel فيها NULL فقط. تعيد عدد الأسماء التي تغيّرت قناتها.
+    """
+    from sqlalchemy import update
+    from extensions import db
+    from models import SalesInvoice
+    from services.platform_config import build_matchers, match_channel
+
+    matchers = build_matchers(_platforms())
+    q = db.session.query(SalesInvoice.customer_name, SalesInvoice.channel).distinct()
+    if only_missing:
+        q = q.filter(SalesInvoice.channel.is_(None))
+    changed = 0
+    for name, current in q.all():
+        ch = match_channel(name, matchers)
+        if current == ch:
+            continue
+        cond = SalesInvoice.customer_name.is_(None) if name is None else (SalesInvoice.customer_name == name)
+        stmt = update(SalesInvoice).where(cond)
+        stmt = stmt.where(SalesInvoice.channel.is_(None)) if current is None else stmt.where(SalesInvoice.channel == current)
+        db.session.execute(stmt.values(channel=ch).execution_options(synchronize_session=False))
+        changed += 1
+    return changed
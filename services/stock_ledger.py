@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+دفتر المخزون الدائم (Perpetual inventory).
+
+- كل حركة (استلام مشتريات، استهلاك مبيعات، تسوية) تُلحق بجدول stock_movements ولا تُعدّل.
+- RawMaterial.stock_quantity و RawMaterial.cost_per_unit (متوسط مرجّح) يُحدَّثان بعمليات ثابتة O(1) لكل حركة.
+- تصحيح التكلفة يدوياً حركة إعادة تقييم (revaluation) بكمية صفر تضبط المتوسط على التكلفة المُدخلة ولا تُمزج كاستلام.
+- التقييم وتكلفة المبيعات من الأعمدة الجارية أو من الدفتر — بدون إعادة مسح تاريخ المشتريات
+  (شاشة المخزون ولوحة ذكاء المخزون وواجهتها تقرأ inventory_value/cogs_between/quantities_as_of).
+- الدوال لا تنفّذ commit؛ الحركة تنضم لمعاملة المستدعي.
+"""
+from __future__ import annotations
+
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+MOVEMENT_OPENING = 'opening'
+MOVEMENT_PURCHASE = 'purchase'
+MOVEMENT_SALE = 'sale'
+MOVEMENT_ADJUSTMENT = 'adjustment'
+MOVEMENT_REVALUATION = 'revaluation'
+
+_Q4 = Decimal('0.0001')
+
+
+def _dec(v) -> Decimal:
+    try:
+        return Decimal(str(v if v is not None else 0))
+    except Exception:
+        return Decimal('0')
+
+
+def apply_movement(rm, quantity, unit_cost=None):
+    """
+    تحديث الكمية والمتوسط المرجّح للمادة في الذاكرة.
+    الوارد بتكلفة معروفة يعيد حساب المتوسط؛ الصادر والتسويات بدون تكلفة تُقيَّم بالمتوسط الحالي.
+    Returns (unit_cost, balance_qty, avg_cost) كـ Decimal.
+    """
+    qty = _dec(quantity)
+    prev_qty = _dec(rm.stock_quantity)
+    prev_avg = _dec(rm.cost_per_unit)
+    new_qty = prev_qty + qty
+    new_avg = prev_avg
+    if qty > 0 and unit_cost is not None:
+        cost = _dec(unit_cost)
+        base_qty = prev_qty if prev_qty > 0 else Decimal('0')
+        if base_qty + qty > 0:
+            new_avg = ((prev_avg * base_qty) + (cost * qty)) / (base_qty + qty)
+    else:
+        cost = prev_avg
+    new_avg = new_avg.quantize(_Q4)
+    rm.stock_quantity = new_qty
+    rm.cost_per_unit = new_avg
+    return cost.quantize(_Q4), new_qty, new_avg
+
+
+def record_movement(rm, quantity, movement_type: str, unit_cost=None, on_date: Optional[date] = None,
+                    ref_type: Optional[str] = None, ref_id: Optional[int] = None,
+                    notes: Optional[str] = None, user_id: Optional[int] = None):
+    """إلحاق حركة مخزون وتحديث المادة (بدون commit)."""
+    from extensions import db
+    from models import StockMovement, get_saudi_now
+
+    cost, balance, avg = apply_movement(rm, quantity, unit_cost)
+    qty = _dec(quantity)
+    mv = StockMovement(
+        raw_material_id=rm.id,
+        date=on_date or get_saudi_now().date(),
+        movement_type=movement_type,
+        quantity=qty,
+        unit_cost=cost,
+        total_cost=(qty * cost).quantize(_Q4),
+        balance_qty=balance,
+        avg_cost=avg,
+        ref_type=ref_type,
+        ref_id=ref_id,
+        notes=(notes or None) and str(notes)[:300],
+        user_id=user_id,
+    )
+    db.session.add(mv)
+    return mv
+
+
+def record_revaluation(rm, unit_cost, on_date: Optional[date] = None, ref_type: Optional[str] = None,
+                       ref_id: Optional[int] = None, notes: Optional[str] = None, user_id: Optional[int] = None):
+    """
+    ضبط المتوسط المرجّح على unit_cost مباشرة (تصحيح تكلفة) مع حركة بكمية صفر (بدون commit).
+    total_cost = فرق قيمة الرصيد الحالي بين المتوسط القديم والجديد.
+    """
+    from extensions import db
+    from models import StockMovement, get_saudi_now
+
+    balance = _dec(rm.stock_quantity)
+    prev_avg = _dec(rm.cost_per_unit)
+    new_avg = _dec(unit_cost).quantize(_Q4)
+    rm.cost_per_unit = new_avg
+    mv = StockMovement(
+        raw_material_id=rm.id,
+        date=on_date or get_saudi_now().date(),
+        movement_type=MOVEMENT_REVALUATION,
+        quantity=Decimal('0'),
+        unit_cost=new_avg,
+        total_cost=(balance * (new_avg - prev_avg)).quantize(_Q4),
+        balance_qty=balance,
+        avg_cost=new_avg,
+        ref_type=ref_type,
+        ref_id=ref_id,
+        notes=(notes or None) and str(notes)[:300],
+        user_id=user_id,
+    )
+    db.session.add(mv)
+    return mv
+
+
+def stock_as_of(on_date: date, rm_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+    """الكمية لكل مادة حتى تاريخ معيّن (شاملاً) — SUM على فهرس (raw_material_id, date)."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import StockMovement
+
+    q = (
+        db.session.query(StockMovement.raw_material_id, func.coalesce(func.sum(StockMovement.quantity), 0))
+        .filter(StockMovement.date <= on_date)
+        .group_by(StockMovement.raw_material_id)
+    )
+    if rm_ids is not None:
+        q = q.filter(StockMovement.raw_material_id.in_([int(i) for i in rm_ids]))
+    return {int(rid): float(qty or 0) for rid, qty in q.all()}
+
+
+def quantities_as_of(on_date: date, materials) -> Dict[int, float]:
+    """
+    الكمية لكل مادة في materials حتى on_date: من الدفتر للمواد التي لها حركات،
+    ومن الرصيد الجاري لغيرها (لم تتحرك منذ تفعيل الدفتر).
+    """
+    from extensions import db
+    from models import StockMovement
+
+    ids = [int(m.id) for m in (materials or [])]
+    if not ids:
+        return {}
+    moved = {int(r[0]) for r in db.session.query(StockMovement.raw_material_id)
+             .filter(StockMovement.raw_material_id.in_(ids)).distinct().all()}
+    upto = stock_as_of(on_date, moved) if moved else {}
+    return {
+        int(m.id): (float(upto.get(int(m.id), 0.0)) if int(m.id) in moved else float(m.stock_quantity or 0))
+        for m in materials
+    }
+
+
+def inventory_value() -> float:
+    """قيمة المخزون الحالية = Σ الكمية × المتوسط المرجّح الجاري."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import RawMaterial
+
+    v = (
+        db.session.query(func.coalesce(func.sum(RawMaterial.stock_quantity * RawMaterial.cost_per_unit), 0))
+        .filter(RawMaterial.active == True)  # noqa: E712
+        .scalar()
+    )
+    return float(v or 0)
+
+
+def cogs_between(start_date: date, end_date: date) -> float:
+    """تكلفة المبيعات من حركات الاستهلاك في الفترة (موجبة)."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import StockMovement
+
+    v = (
+        db.session.query(func.coalesce(func.sum(StockMovement.total_cost), 0))
+        .filter(StockMovement.movement_type == MOVEMENT_SALE)
+        .filter(StockMovement.date.between(start_date, end_date))
+        .scalar()
+    )
+    return -float(v or 0)
+
+
+def ensure_opening_balances(on_date: Optional[date] = None) -> int:
+    """
+    حركة رصيد افتتاحي لكل مادة ليس لها حركات ولها كمية — لتبدأ الأرصدة التاريخية من الدفتر.
+    لا تغيّر الكمية أو المتوسط. تعيد عدد الحركات المُضافة (بدون commit).
+    """
+    from extensions import db
+    from models import RawMaterial, StockMovement, get_saudi_now
+
+    d = on_date or get_saudi_now().date()
+    has_moves = {int(r[0]) for r in db.session.query(StockMovement.raw_material_id).distinct().all()}
+    added = 0
+    for rm in RawMaterial.query.all():
+        if int(rm.id) in has_moves:
+            continue
+        qty = _dec(rm.stock_quantity)
+        if qty == 0:
+            continue
+        avg = _dec(rm.cost_per_unit).quantize(_Q4)
+        db.session.add(StockMovement(
+            raw_material_id=rm.id, date=d, movement_type=MOVEMENT_OPENING,
+            quantity=qty, unit_cost=avg, total_cost=(qty * avg).quantize(_Q4),
+            balance_qty=qty, avg_cost=avg, ref_type='manual', notes='Opening balance',
+        ))
+        added += 1
+    return added
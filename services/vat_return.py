@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+إقرار ضريبة القيمة المضافة — تجميع بمرور واحد لكل جدول فواتير.
+
+- كل جدول (مبيعات، بنود مشتريات، مصروفات، قيود) يُقرأ باستعلام واحد بـ CASE لكل خانة.
+- الأرباع المنتهية تُحفظ في vat_return_snapshots ولا يُعاد حسابها إلا عند تعديل فاتورة في الربع؛
+  مطابقة القيود (2141/1170) لا تُحفظ وتُقرأ مباشرة في كل طلب.
+"""
+from __future__ import annotations
+
+import json
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+_BRANCHES = ('place_india', 'china_town')
+_INVOICE_MODELS = ('SalesInvoice', 'PurchaseInvoice', 'ExpenseInvoice')
+_ITEM_MODELS = ('SalesInvoiceItem', 'PurchaseInvoiceItem', 'ExpenseInvoiceItem')
+_listeners_registered = False
+_snapshot_table_ready: Optional[bool] = None
+
+
+def quarter_bounds(year: int, quarter: int) -> Tuple[date, date]:
+    """بداية ونهاية الربع."""
+    if quarter not in (1, 2, 3, 4):
+        raise ValueError("quarter must be 1..4")
+    start = date(year, 3 * (quarter - 1) + 1, 1)
+    end_month = 3 * quarter
+    next_first = date(year + (1 if end_month == 12 else 0), 1 if end_month == 12 else end_month + 1, 1)
+    return start, next_first - timedelta(days=1)
+
+
+def quarter_of(d: date) -> Tuple[int, int]:
+    return d.year, (d.month - 1) // 3 + 1
+
+
+def _today() -> date:
+    try:
+        from models import get_saudi_now
+        return get_saudi_now().date()
+    except Exception:
+        return date.today()
+
+
+def _normalize_branch(branch: Optional[str]) -> str:
+    b = (branch or '').strip()
+    return b if b in _BRANCHES else 'all'
+
+
+def _closed_quarter(start_date: date, end_date: date) -> Optional[Tuple[int, int]]:
+    """(سنة، ربع) إن كانت الفترة ربعاً كاملاً منتهياً، وإلا None."""
+    y, q = quarter_of(start_date)
+    qs, qe = quarter_bounds(y, q)
+    if start_date != qs or end_date != qe:
+        return None
+    if qe >= _today():
+        return None
+    return y, q
+
+
+def _sum_when(cond, col):
+    from sqlalchemy import case, func
+    return func.coalesce(func.sum(case((cond, col), else_=0)), 0)
+
+
+def _vat_keywords() -> Dict[str, list]:
+    try:
+        from routes.common import kv_get
+        m = kv_get('vat_category_map', {}) or {}
+    except Exception:
+        m = {}
+    out = {}
+    for k in ('exempt_keywords', 'exports_keywords'):
+        out[k] = [str(x).strip().lower() for x in (m.get(k) or []) if str(x).strip()]
+    return out
+
+
+def journal_vat(start_date: date, end_date: date) -> Dict[str, float]:
+    """مطابقة القيود: 2141 ضريبة مخرجات، 1170 ضريبة مدخلات. تُحسب دائماً مباشرة (لا تُحفظ في اللقطة)."""
+    from extensions import db
+    from models import Account, JournalLine
+    try:
+        jl = JournalLine
+        r = (
+            db.session.query(
+                _sum_when(Account.code == '2141', jl.credit - jl.debit),
+                _sum_when(Account.code == '1170', jl.debit - jl.credit),
+            )
+            .join(Account, jl.account_id == Account.id)
+            .filter(Account.code.in_(('2141', '1170')))
+            .filter(jl.line_date.between(start_date, end_date))
+            .one()
+        )
+        vat_out, vat_in = float(r[0] or 0), float(r[1] or 0)
+    except Exception:
+        vat_out = vat_in = 0.0
+    return {'journal_vat_out': vat_out, 'journal_vat_in': vat_in, 'journal_vat_net': vat_out - vat_in}
+
+
+def compute_vat_return(start_date: date, end_date: date, branch: str = 'all') -> Dict[str, Any]:
+    """كل خانات الإقرار للفترة: استعلام CASE واحد لكل جدول بدل SUM منفصل لكل خانة."""
+    from sqlalchemy import func
+    from extensions import db
+    from models import (SalesInvoice, SalesInvoiceItem, PurchaseInvoice, PurchaseInvoiceItem,
+                        ExpenseInvoice)
+
+    branch = _normalize_branch(branch)
+    out: Dict[str, Any] = {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'branch': branch,
+    }
+
+    # المبيعات: خاضعة (ضريبة > 0) / صفرية، مع تقسيم الفروع
+    si = SalesInvoice
+    taxed = si.tax_amount > 0
+    zero = si.tax_amount == 0
+    q_sales = db.session.query(
+        _sum_when(taxed, si.total_before_tax),
+        _sum_when(taxed, si.tax_amount),
+        _sum_when(taxed, si.total_after_tax_discount),
+        _sum_when(zero, si.total_before_tax),
+        _sum_when(zero, si.total_after_tax_discount),
+        _sum_when(si.branch == 'place_india', si.total_before_tax),
+        _sum_when(si.branch == 'china_town', si.total_before_tax),
+    ).filter(si.date.between(start_date, end_date))
+    if branch != 'all':
+        q_sales = q_sales.filter(si.branch == branch)
+    r = q_sales.one()
+    out['sales_standard_base'] = float(r[0] or 0)
+    out['sales_standard_vat'] = float(r[1] or 0)
+    out['sales_standard_total'] = float(r[2] or 0)
+    out['sales_zero_base'] = float(r[3] or 0)
+    out['sales_zero_vat'] = 0.0
+    out['sales_zero_total'] = float(r[4] or 0)
+    out['sales_place_india_base'] = float(r[5] or 0)
+    out['sales_china_town_base'] = float(r[6] or 0)
+    for cat in ('exempt', 'exports'):
+        out[f'sales_{cat}_base'] = 0.0
+        out[f'sales_{cat}_vat'] = 0.0
+        out[f'sales_{cat}_total'] = 0.0
+
+    # تصنيف اختياري للمبيعات الصفرية إلى معفاة/تصدير حسب كلمات vat_category_map
+    kw = _vat_keywords()
+    if kw['exempt_keywords'] or kw['exports_keywords']:
+        q_items = (
+            db.session.query(SalesInvoiceItem.product_name, SalesInvoiceItem.quantity,
+                             SalesInvoiceItem.price_before_tax, SalesInvoiceItem.discount)
+            .join(si, SalesInvoiceItem.invoice_id == si.id)
+            .filter(si.date.between(start_date, end_date))
+            .filter(zero)
+        )
+        if branch != 'all':
+            q_items = q_items.filter(si.branch == branch)
+        for name, qty, price, disc in q_items.all():
+            n = (name or '').strip().lower()
+            if not n:
+                continue
+            if any(k in n for k in kw['exports_keywords']):
+                cat = 'exports'
+            elif any(k in n for k in kw['exempt_keywords']):
+                cat = 'exempt'
+            else:
+                continue
+            base = max(0.0, float(price or 0) * float(qty or 0) - float(disc or 0))
+            out[f'sales_{cat}_base'] += base
+            out[f'sales_{cat}_total'] += base
+            out['sales_zero_base'] -= base
+            out['sales_zero_total'] -= base
+        out['sales_zero_base'] = max(0.0, out['sales_zero_base'])
+        out['sales_zero_total'] = max(0.0, out['sales_zero_total'])
+
+    # المشتريات على مستوى البنود: قابلة للخصم (ضريبة > 0) / غير قابلة
+    pii = PurchaseInvoiceItem
+    ded = pii.tax > 0
+    r = (
+        db.session.query(
+            _sum_when(ded, pii.total_price - pii.tax),
+            _sum_when(ded, pii.tax),
+            _sum_when(pii.tax == 0, pii.total_price),
+            func.coalesce(func.sum(pii.total_price), 0),
+        )
+        .join(PurchaseInvoice, pii.invoice_id == PurchaseInvoice.id)
+        .filter(PurchaseInvoice.date.between(start_date, end_date))
+        .one()
+    )
+    p_ded_base, p_ded_vat, p_nd_base = float(r[0] or 0), float(r[1] or 0), float(r[2] or 0)
+    out['purchases_total'] = float(r[3] or 0)
+
+    # المصروفات
+    ei = ExpenseInvoice
+    e_ded = ei.tax_amount > 0
+    r = db.session.query(
+        _sum_when(e_ded, ei.total_before_tax),
+        _sum_when(e_ded, ei.tax_amount),
+        _sum_when(ei.tax_amount == 0, ei.total_before_tax),
+        func.coalesce(func.sum(ei.total_after_tax_discount), 0),
+    ).filter(ei.date.between(start_date, end_date)).one()
+    out['expenses_deductible_base'] = float(r[0] or 0)
+    out['expenses_deductible_vat'] = float(r[1] or 0)
+    out['expenses_non_deductible_base'] = float(r[2] or 0)
+    out['expenses_total'] = float(r[3] or 0)
+
+    out['purchases_deductible_base'] = p_ded_base + out['expenses_deductible_base']
+    out['purchases_deductible_vat'] = p_ded_vat + out['expenses_deductible_vat']
+    out['purchases_deductible_total'] = out['purchases_deductible_base'] + out['purchases_deductible_vat']
+    out['purchases_non_deductible_base'] = p_nd_base + out['expenses_non_deductible_base']
+    out['purchases_non_deductible_vat'] = 0.0
+    out['purchases_non_deductible_total'] = out['purchases_non_deductible_base']
+
+    out.update(journal_vat(start_date, end_date))
+
+    out['output_vat'] = out['sales_standard_vat']
+    out['input_vat'] = out['purchases_deductible_vat']
+    out['net_vat'] = out['output_vat'] - out['input_vat']
+    return out
+
+
+def _load_snapshot(year: int, quarter: int, branch: str) -> Optional[Dict[str, Any]]:
+    from sqlalchemy.orm import Session
+    from extensions import db
+    from models import VatReturnSnapshot
+    try:
+        with Session(db.engine) as sess:
+            row = sess.query(VatReturnSnapshot.data_json).filter_by(year=year, quarter=quarter, branch=branch).first()
+            return json.loads(row[0]) if row else None
+    except Exception:
+        return None
+
+
+def _store_snapshot(year: int, quarter: int, branch: str, data: Dict[str, Any]) -> None:
+    """حفظ اللقطة في معاملة قصيرة مستقلة: لا commit ولا rollback على جلسة المستدعي."""
+    from sqlalchemy.orm import Session
+    from extensions import db
+    from models import VatReturnSnapshot
+    stored = {k: v for k, v in data.items() if not k.startswith('journal_')}
+    try:
+        with Session(db.engine) as sess, sess.begin():
+            sess.add(VatReturnSnapshot(year=year, quarter=quarter, branch=branch, data_json=json.dumps(stored)))
+    except Exception:
+        pass
+
+
+def get_vat_return(start_date: date, end_date: date, branch: str = 'all') -> Dict[str, Any]:
+    """الإقرار للفترة: الربع المنتهي يُقرأ من اللقطة (ويُنشأ عند أول طلب)، وغيره يُحسب مباشرة.
+    أرقام القيود (journal_vat_*) لا تُحفظ في اللقطة وتُحسب في كل طلب."""
+    branch = _normalize_branch(branch)
+    yq = _closed_quarter(start_date, end_date)
+    if yq is None:
+        return compute_vat_return(start_date, end_date, branch)
+    year, quarter = yq
+    data = _load_snapshot(year, quarter, branch)
+    if data is not None:
+        data.update(journal_vat(start_date, end_date))
+        return data
+    data = compute_vat_return(start_date, end_date, branch)
+    _store_snapshot(year, quarter, branch, data)
+    return data
+
+
+def invalidate_vat_snapshots(periods: Optional[Iterable[Tuple[int, int]]] = None) -> None:
+    """حذف لقطات الأرباع المحددة (أو كلها عند None) — مثلاً بعد تغيير vat_category_map."""
+    try:
+        from extensions import db
+        from models import VatReturnSnapshot
+        q = VatReturnSnapshot.query
+        if periods is not None:
+            periods = list(periods)
+            if not periods:
+                return
+            from sqlalchemy import and_, or_
+            q = q.filter(or_(*[and_(VatReturnSnapshot.year == y, VatReturnSnapshot.quarter == qq) for y, qq in periods]))
+        q.delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        try:
+            from extensions import db
+            db.session.rollback()
+        except Exception:
+            pass
+
+
+def _closed_periods_touched(session) -> set:
+    """الأرباع المنتهية التي تمسّها الفواتير الجديدة/المعدلة/المحذوفة في هذا الـ flush."""
+    from sqlalchemy import inspect as sa_inspect
+    horizon = quarter_bounds(*quarter_of(_today()))[0]
+    periods = set()
+
+    def _add(d):
+        if isinstance(d, date) and d < horizon:
+            periods.add(quarter_of(d))
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        name = type(obj).__name__
+        if name in _INVOICE_MODELS:
+            _add(getattr(obj, 'date', None))
+            try:
+                for d in sa_inspect(obj).attrs.date.history.deleted or ():
+                    _add(d)
+            except Exception:
+                pass
+        elif name in _ITEM_MODELS:
+            inv = getattr(obj, 'invoice', None)
+            if inv is not None and inv not in session.new:
+                _add(getattr(inv, 'date', None))
+    return periods
+
+
+def _on_before_flush(session, flush_context, instances):
+    global _snapshot_table_ready
+    try:
+        periods = _closed_periods_touched(session)
+        if not periods:
+            return
+        from sqlalchemy import and_, delete, inspect as sa_inspect, or_
+        from models import VatReturnSnapshot
+        conn = session.connection()
+        if _snapshot_table_ready is None:
+            _snapshot_table_ready = sa_inspect(conn).has_table(VatReturnSnapshot.__tablename__)
+        if not _snapshot_table_ready:
+            return
+        t = VatReturnSnapshot.__table__
+        conn.execute(delete(t).where(or_(*[and_(t.c.year == y, t.c.quarter == q) for y, q in periods])))
+    except Exception:
+        pass
+
+
+def register_snapshot_listeners() -> None:
+    """ربط إبطال اللقطات بأي flush يمس فاتورة في ربع منتهٍ (مرة واحدة لكل عملية)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'before_flush', _on_before_flush)
+    _listeners_registered = True
@@ -61,3 +61,30 @@ def test_app():
 def client(test_app):
     return test_app.test_client()
 
+
+
+@pytest.fixture()
+def app_context(test_app):
+    with test_app.app_context():
+        yield test_app
+
+
+@pytest.fixture()
+def admin_id(app_context):
+    """معرّف مستخدم admin (يُنشأ عند أول طلب)."""
+    from models import User
+    u = User.query.filter_by(username='admin').first()
+    if not u:
+        u = User(username='admin', email='admin@test.com', role='admin', active=True)
+        u.set_password('admin123')
+        db.session.add(u)
+        db.session.commit()
+    return u.id
+
+
+@pytest.fixture()
+def admin_client(app_context, admin_id):
+    """عميل اختبار مسجّل الدخول بحساب admin."""
+    c = app_context.test_client()
+    c.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return c
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+سجل الحسابات لبُناة القيود: قيد المبيعات يحل كل حساباته دون استعلام على accounts/account_usage_map،
+والسجل يُبطَل عند تعديل الحسابات أو حساب الدفع الافتراضي.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+@pytest.fixture
+def app_context(test_app):
+    with test_app.test_request_context():
+        yield test_app
+
+
+def _account_queries(fn):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    seen = []
+
+    def _count(conn, cursor, statement, params, context, executemany):
+        low = statement.lower()
+        if low.lstrip().startswith('select') and ('from accounts' in low or 'account_usage_map' in low):
+            seen.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', _count)
+    try:
+        fn()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _count)
+    return seen
+
+
+def test_sale_journal_resolves_accounts_without_queries(app_context, admin_id):
+    from app import db
+    from app.routes import _account, _create_sale_journal
+    from models import JournalLine, SalesInvoice
+
+    for code, name, kind in (('1111', 'صندوق', 'ASSET'), ('4111', 'مبيعات', 'REVENUE'),
+                             ('2141', 'ضريبة', 'LIABILITY'), ('5540', 'خصم', 'EXPENSE')):
+        _account(code, name, kind)
+    db.session.commit()
+    inv = SalesInvoice(
+        invoice_number="REG-SAL-1", date=date(2025, 3, 1), payment_method="CASH", branch="china_town",
+        customer_name="walk-in", total_before_tax=100, tax_amount=15, discount_amount=10,
+        total_after_tax_discount=105, status="paid", user_id=admin_id,
+    )
+    db.session.add(inv)
+    db.session.commit()
+    _account('1111', '', 'ASSET')  # بناء السجل قبل القياس
+
+    seen = _account_queries(lambda: _create_sale_journal(inv))
+    assert seen == []
+    lines = JournalLine.query.filter_by(journal_id=inv.journal_entry_id).all()
+    assert len(lines) == 4
+    assert round(sum(float(l.debit) for l in lines), 2) == round(sum(float(l.credit) for l in lines), 2)
+
+
+def test_registry_follows_account_and_usage_map_changes(app_context):
+    from app import db
+    from app.routes import _account, _pm_account
+    from models import Account, AccountUsageMap
+
+    bank_a = _account('1121', 'بنك أ', 'ASSET')
+    db.session.commit()
+    bank_b = Account(code='1129', name='بنك ب', type='ASSET')
+    db.session.add(bank_b)
+    db.session.commit()
+    assert _account('1129', '', 'ASSET').id == bank_b.id
+
+    m = AccountUsageMap(module='Payments', action='PayExpense', usage_group='Bank', account_id=bank_a.id,
+                        is_default=True, active=True)
+    db.session.add(m)
+    db.session.commit()
+    assert _pm_account('CARD').id == bank_a.id
+
+    m.account_id = bank_b.id
+    db.session.commit()
+    assert _pm_account('CARD').id == bank_b.id
+
+    # إعادة تسمية الرمز: الرمز القديم لم يعد موجوداً في السجل
+    bank_b.code = '1128'
+    db.session.commit()
+    from services.account_registry import account_ref
+    assert account_ref('1129') is None
+    assert account_ref('1128').id == bank_b.id
+
+    # rollback لا يترك حساباً غير ملتزم في السجل
+    db.session.add(Account(code='9999', name='مؤقت', type='EXPENSE'))
+    db.session.flush()
+    assert account_ref('9999') is not None
+    db.session.rollback()
+    assert account_ref('9999') is None
+    db.session.delete(m)
+    db.session.commit()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+كشف الحساب: الرصيد المتراكم من دالة النافذة يطابق التراكم اليدوي عبر صفحات المفتاح (للأمام والخلف)،
+ومسار بايثون (SQLite قديم) يعطي نفس النتيجة، والتصدير/الطباعة المتدفقة يغطيان كل الأسطر.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import uuid
+from datetime import date
+
+
+def _account(code, typ):
+    from app import db
+    from models import Account
+    a = Account.query.filter_by(code=code).first()
+    if not a:
+        a = Account(code=code, name=code, type=typ)
+        db.session.add(a)
+        db.session.flush()
+    return a
+
+
+def _post(d, lines):
+    from app import db
+    from models import JournalEntry, JournalLine
+    total = sum(dr for _, dr, _ in lines)
+    je = JournalEntry(entry_number=f"AST-{uuid.uuid4().hex[:10]}", date=d, description='statement',
+                      status='posted', total_debit=total, total_credit=total)
+    db.session.add(je)
+    db.session.flush()
+    for i, (acc, dr, cr) in enumerate(lines, 1):
+        db.session.add(JournalLine(journal_id=je.id, line_no=i, account_id=acc.id, debit=dr, credit=cr,
+                                   description='x', line_date=d))
+    db.session.commit()
+
+
+def _seed():
+    liab = _account('2121', 'LIABILITY')
+    cash = _account('1111', 'ASSET')
+    _post(date(2036, 1, 20), [(cash, 40, 0), (liab, 0, 40)])
+    amounts = [(10, 0), (0, 25), (0, 5), (7, 0), (0, 12), (3, 0), (0, 30)]
+    for i, (dr, cr) in enumerate(amounts):
+        d = date(2036, 2, 1 + i // 2)
+        _post(d, [(liab, dr, cr), (cash, cr, dr)])
+    return liab, amounts
+
+
+def _pages(liab, opening, start, end, per_page):
+    from services.account_statement import parse_cursor, statement_page
+    out, after, pages = [], None, []
+    while True:
+        page = statement_page(liab, start, end, opening, after=parse_cursor(after), limit=per_page)
+        out.extend(page['lines'])
+        pages.append(page)
+        if not page['next']:
+            return out, pages
+        after = page['next']
+
+
+def test_window_running_balance_and_keyset_pages(app_context, monkeypatch):
+    from services import account_statement as st
+    liab, amounts = _seed()
+    start, end = date(2036, 2, 1), date(2036, 2, 28)
+    opening = st.opening_balance(liab, start)
+    assert opening >= 40
+
+    lines, pages = _pages(liab, opening, start, end, 3)
+    assert [(l['debit'], l['credit']) for l in lines] == [(float(d), float(c)) for d, c in amounts]
+    bal = opening
+    for l, (d, c) in zip(lines, amounts):
+        bal += c - d
+        assert abs(l['balance'] - bal) < 0.005
+    assert len(pages) == 3 and pages[0]['prev'] is None
+
+    back = st.statement_page(liab, start, end, opening, before=st.parse_cursor(pages[2]['prev']), limit=3)
+    assert [l['id'] for l in back['lines']] == [l['id'] for l in pages[1]['lines']]
+    assert back['next'] and back['prev']
+
+    streamed = list(st.iter_statement(liab, start, end, opening, batch=2))
+    assert [l['balance'] for l in streamed] == [l['balance'] for l in lines]
+
+    monkeypatch.setattr(st, '_use_window', lambda: False)
+    py_lines, _ = _pages(liab, opening, start, end, 3)
+    assert [round(l['balance'], 2) for l in py_lines] == [round(l['balance'], 2) for l in lines]
+    assert [round(l['balance'], 2) for l in st.iter_statement(liab, start, end, opening)] == \
+        [round(l['balance'], 2) for l in lines]
+
+
+def test_statement_routes_stream_all_lines(admin_client):
+    qs = "code=2121&start_date=2036-02-01&end_date=2036-02-28"
+
+    r = admin_client.get(f"/financials/account_statement?{qs}&per_page=3")
+    assert r.status_code == 200
+    assert 'after=' in r.get_data(as_text=True)
+
+    j = admin_client.get(f"/financials/api/account_ledger_json?{qs}").get_json()
+    assert j['ok'] and len(j['lines']) >= 7
+
+    rows = list(csv.reader(io.StringIO(admin_client.get(f"/financials/export/account_statement?{qs}").get_data(as_text=True))))
+    assert rows[0][0] == 'Date' and rows[1][2] == 'Opening Balance'
+    assert len(rows) - 2 == len(j['lines'])
+    assert abs(float(rows[-1][5]) - j['final_balance']) < 0.005
+
+    r = admin_client.get(f"/financials/print/account_statement?{qs}")
+    assert r.status_code == 200
+    assert '{:,.2f}'.format(j['final_balance']) in r.get_data(as_text=True)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات أعمار الذمم: توزيع المتبقي على الفئات لكل طرف، والكاش لكل تاريخ مع الإبطال عند تسجيل دفعة،
+ودفعة بعد as_of لا تغيّر أعمار تاريخ سابق.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+
+import pytest
+
+
+def _purchase(uid, number, supplier_id, on, total):
+    from models import PurchaseInvoice
+    return PurchaseInvoice(
+        invoice_number=number, date=on, supplier_id=supplier_id, supplier_name="Aging Supplier",
+        payment_method="CREDIT", total_before_tax=total, tax_amount=0, discount_amount=0,
+        total_after_tax_discount=total, status="unpaid", user_id=uid,
+    )
+
+
+def _sale(uid, number, on, total, channel="", customer_id=None):
+    from models import SalesInvoice
+    return SalesInvoice(
+        invoice_number=number, date=on, payment_method="CREDIT", branch="china_town",
+        customer_id=customer_id, customer_name="Aging Customer", channel=channel,
+        total_before_tax=total, tax_amount=0, discount_amount=0, total_after_tax_discount=total,
+        status="unpaid", user_id=uid,
+    )
+
+
+def test_ap_aging_buckets_and_cache(app_context, admin_id):
+    from app import db
+    from models import Payment, Supplier
+    from services.aging import get_aging
+
+    s = Supplier(name="Aging Supplier")
+    db.session.add(s)
+    db.session.flush()
+    as_of = date(2017, 6, 30)
+    recent = _purchase(admin_id, "AG-T-P01", s.id, date(2017, 6, 20), 100)
+    db.session.add_all([recent, _purchase(admin_id, "AG-T-P02", s.id, date(2017, 5, 15), 50),
+                        _purchase(admin_id, "AG-T-P03", s.id, date(2017, 1, 1), 25),
+                        _purchase(admin_id, "AG-T-P04", s.id, date(2017, 7, 5), 999)])
+    db.session.commit()
+
+    data = get_aging("ap", as_of)
+    row = next(p for p in data["parties"] if p["supplier_id"] == s.id)
+    assert (row["0_30"], row["31_60"], row["61_90"], row["90_plus"]) == (100, 50, 0, 25)
+    assert row["total"] == pytest.approx(175)
+    assert get_aging("ap", as_of) == data
+
+    db.session.add(Payment(invoice_id=recent.id, invoice_type="purchase", amount_paid=60, payment_method="CASH",
+                           payment_date=datetime(2017, 6, 25, 12, 0)))
+    db.session.commit()
+    row = next(p for p in get_aging("ap", as_of)["parties"] if p["supplier_id"] == s.id)
+    assert row["0_30"] == pytest.approx(40)
+
+    # دفعة بعد as_of: تخفض المتبقي الحالي ولا تمس أعمار 2017-06-30
+    db.session.add(Payment(invoice_id=recent.id, invoice_type="purchase", amount_paid=40, payment_method="CASH",
+                           payment_date=datetime(2017, 8, 1, 12, 0)))
+    db.session.commit()
+    row = next(p for p in get_aging("ap", as_of)["parties"] if p["supplier_id"] == s.id)
+    assert row["0_30"] == pytest.approx(40)
+    assert row["total"] == pytest.approx(115)
+    row = next(p for p in get_aging("ap")["parties"] if p["supplier_id"] == s.id)
+    assert row["total"] == pytest.approx(75 + 999)
+
+
+def test_ar_aging_platforms_and_credit_customers(app_context, admin_id):
+    from app import db
+    from models import Customer
+    from services.aging import compute_aging
+
+    credit = Customer(name="Aging Credit Co", customer_type="credit", active=True)
+    cash = Customer(name="Aging Cash Co", customer_type="cash", active=True)
+    db.session.add_all([credit, cash])
+    db.session.flush()
+    as_of = date(2016, 12, 31)
+    db.session.add_all([
+        _sale(admin_id, "AG-T-S01", date(2016, 12, 1), 80, channel="keeta"),
+        _sale(admin_id, "AG-T-S02", date(2016, 10, 15), 20, channel="keeta"),
+        _sale(admin_id, "AG-T-S03", date(2016, 11, 20), 45, customer_id=credit.id),
+        _sale(admin_id, "AG-T-S04", date(2016, 11, 20), 70, customer_id=cash.id),
+    ])
+    db.session.commit()
+
+    data = compute_aging("ar", as_of)
+    by_key = {p["key"]: p for p in data["parties"]}
+    assert by_key["channel:keeta"]["0_30"] == pytest.approx(80)
+    assert by_key["channel:keeta"]["61_90"] == pytest.approx(20)
+    assert by_key[f"customer:{credit.id}"]["31_60"] == pytest.approx(45)
+    assert f"customer:{cash.id}" not in by_key
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات التسوية الجماعية: دفعات وحالات في معاملة واحدة، وقيد تحصيل مجمّع لكل تاريخ فاتورة بسطر مربوط بكل فاتورة.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _sale(uid, number, total, on=date(2015, 5, 10)):
+    from models import SalesInvoice
+    return SalesInvoice(
+        invoice_number=number, date=on, payment_method="CREDIT", branch="china_town",
+        customer_name="Keeta", channel="keeta", total_before_tax=total, tax_amount=0, discount_amount=0,
+        total_after_tax_discount=total, status="unpaid", user_id=uid,
+    )
+
+
+def test_settle_invoices_consolidated_journal(app_context, admin_id):
+    from app import db
+    from models import Account, InvoiceSettlement, JournalEntry, JournalLine, Payment, SalesInvoice
+    from services.batch_settlement import settle_invoices
+
+    invs = [_sale(admin_id, "BS-T-0001", 100), _sale(admin_id, "BS-T-0002", 50), _sale(admin_id, "BS-T-0003", 20),
+            _sale(admin_id, "BS-T-0004", 40, on=date(2015, 5, 11))]
+    db.session.add_all(invs)
+    db.session.flush()
+    db.session.add(Payment(invoice_id=invs[1].id, invoice_type="sales", amount_paid=30, payment_method="CASH"))
+    db.session.add(Payment(invoice_id=invs[2].id, invoice_type="sales", amount_paid=20, payment_method="CASH"))
+    cash = Account(code="BS-CASH", name="Batch Cash", type="ASSET")
+    ar = Account(code="BS-AR", name="Batch AR", type="ASSET")
+    db.session.add_all([cash, ar])
+    db.session.commit()
+
+    res = settle_invoices("sales", invs, "cash", cash_account=cash, counter_account_for=lambda inv: ar)
+    db.session.commit()
+
+    assert res["updated"] == 3
+    assert res["amount"] == pytest.approx(160)
+    ids = [i.id for i in invs]
+    statuses = dict(db.session.query(SalesInvoice.id, SalesInvoice.status).filter(SalesInvoice.id.in_(ids)).all())
+    # المسددة سابقاً بالكامل لا تُمس حالتها
+    assert statuses[invs[2].id] == "unpaid"
+    assert {statuses[i.id] for i in (invs[0], invs[1], invs[3])} == {"paid"}
+
+    # قيد لكل تاريخ فاتورة، وسطر الذمم مربوط بالفاتورة
+    assert len(res["journal_ids"]) == 2
+    first, second = (db.session.get(JournalEntry, j) for j in res["journal_ids"])
+    assert (first.date, second.date) == (date(2015, 5, 10), date(2015, 5, 11))
+    assert first.invoice_id is None and second.invoice_id == invs[3].id
+    assert second.invoice_type == "sales_payment"
+    lines = JournalLine.query.filter_by(journal_id=first.id).order_by(JournalLine.line_no).all()
+    assert len(lines) == 3
+    assert float(lines[0].debit) == pytest.approx(120)
+    assert lines[0].line_date == date(2015, 5, 10)
+    assert sorted((l.invoice_id, float(l.credit)) for l in lines[1:]) == sorted([(invs[0].id, 100), (invs[1].id, 20)])
+    assert {l.invoice_type for l in lines[1:]} == {"sales"}
+    remaining = db.session.query(InvoiceSettlement.remaining).filter(
+        InvoiceSettlement.invoice_type == "sales", InvoiceSettlement.invoice_id.in_(ids)
+    ).all()
+    assert [float(r[0]) for r in remaining] == [0, 0, 0, 0]
+
+    with pytest.raises(ValueError):
+        settle_invoices("sales", [invs[0], invs[0]], "CASH")
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+كاش موسوم: الإدخال يسقط فور رفع أي من وسومه، والقيود/الإعدادات ترفع وسومها عند commit فقط؛ ميزان المراجعة
+المخزَّن يعكس القيد الجديد مباشرة دون انتظار انتهاء المهلة.
+"""
+from __future__ import annotations
+
+import uuid
+from datetime import date
+
+
+def _accounts():
+    from app import db
+    from models import Account
+    out = []
+    for code, name, typ in (('1113', 'Tag cash', 'ASSET'), ('4120', 'Tag revenue', 'REVENUE')):
+        a = Account.query.filter_by(code=code).first()
+        if not a:
+            a = Account(code=code, name=name, type=typ)
+            db.session.add(a)
+            db.session.flush()
+        out.append(a)
+    db.session.commit()
+    return out
+
+
+def _post(amount, d, commit=True):
+    from app import db
+    from models import JournalEntry, JournalLine
+    cash, rev = _accounts()
+    je = JournalEntry(entry_number=f"TAG-{uuid.uuid4().hex[:10]}", date=d, description='tag test',
+                      status='posted', total_debit=amount, total_credit=amount)
+    db.session.add(je)
+    db.session.flush()
+    db.session.add_all([
+        JournalLine(journal_id=je.id, line_no=1, account_id=cash.id, debit=amount, credit=0, description='d', line_date=d),
+        JournalLine(journal_id=je.id, line_no=2, account_id=rev.id, debit=0, credit=amount, description='c', line_date=d),
+    ])
+    if commit:
+        db.session.commit()
+    return je
+
+
+def test_month_tags():
+    from utils.cache_helpers import month_tags
+    assert month_tags('gl', date(2025, 11, 5), date(2026, 1, 2)) == ['gl:2025-11', 'gl:2025-12', 'gl:2026-01', 'gl:bulk']
+    assert month_tags('gl', None, date(2026, 1, 2)) == ['gl']
+    assert month_tags('gl', date(2020, 1, 1), date(2026, 1, 1)) == ['gl']
+
+
+def test_bump_invalidates_tagged_entry(app_context):
+    from utils.cache_helpers import bump_tags, cached_tagged, tagged_get
+    key = f"t:{uuid.uuid4().hex}"
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'n': len(calls)}
+
+    assert cached_tagged(key, ['coa', 'gl:2031-01'], fetch) == {'n': 1}
+    assert cached_tagged(key, ['coa', 'gl:2031-01'], fetch) == {'n': 1}
+    bump_tags('gl:2031-02')
+    assert tagged_get(key) == {'n': 1}
+    bump_tags('gl:2031-01')
+    assert tagged_get(key) is None
+    assert cached_tagged(key, ['coa', 'gl:2031-01'], fetch) == {'n': 2}
+
+
+def test_commit_bumps_journal_tags_rollback_does_not(app_context, admin_id):
+    from app import db
+    from utils.cache_helpers import tag_versions
+    tags = ['gl', 'gl:2031-03', 'gl:2031-04']
+    before = tag_versions(tags)
+
+    _post(10, date(2031, 3, 9), commit=False)
+    db.session.rollback()
+    assert tag_versions(tags) == before
+
+    _post(10, date(2031, 3, 9))
+    after = tag_versions(tags)
+    assert after['gl'] != before['gl'] and after['gl:2031-03'] != before['gl:2031-03']
+    assert after['gl:2031-04'] == before['gl:2031-04']
+
+
+def test_bulk_delete_bumps_broad_tag(app_context):
+    from app import db
+    from models import JournalLine
+    from utils.cache_helpers import tag_versions
+    je = _post(5, date(2031, 5, 1))
+    before = tag_versions(['gl'])
+    JournalLine.query.filter(JournalLine.journal_id == je.id).delete(synchronize_session=False)
+    db.session.commit()
+    assert tag_versions(['gl']) != before
+
+
+def test_bulk_writes_drop_month_scoped_entries(app_context):
+    from sqlalchemy import insert
+    from app import db
+    from models import JournalLine, Payment
+    from utils.cache_helpers import cached_tagged, month_tags, tagged_get
+    je = _post(5, date(2031, 7, 1))
+    key = f"t:{uuid.uuid4().hex}"
+    tags = month_tags('gl', date(2031, 7, 1), date(2031, 7, 31)) + month_tags('payments', date(2031, 7, 1), date(2031, 7, 31))
+    cached_tagged(key, tags, lambda: {'n': 1})
+
+    JournalLine.query.filter(JournalLine.journal_id == je.id).update({'description': 'bulk'}, synchronize_session=False)
+    db.session.commit()
+    assert tagged_get(key) is None
+    Payment.query.filter_by(invoice_id=0, invoice_type='sales').delete(synchronize_session=False)
+    db.session.commit()
+
+    cached_tagged(key, tags, lambda: {'n': 2})
+    db.session.execute(insert(Payment), [{'invoice_id': 0, 'invoice_type': 'sales', 'amount_paid': 1, 'payment_method': 'CASH'}])
+    db.session.rollback()
+    assert tagged_get(key) == {'n': 2}
+    db.session.execute(insert(Payment), [{'invoice_id': 0, 'invoice_type': 'sales', 'amount_paid': 1, 'payment_method': 'CASH'}])
+    db.session.commit()
+    assert tagged_get(key) is None
+    Payment.query.filter_by(invoice_id=0, invoice_type='sales').delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_trial_balance_cache_reflects_new_posting(admin_client):
+    url = "/financials/trial_balance?embed=1&date=2031-12-31&hide_zero=1"
+
+    r1 = admin_client.get(url)
+    assert r1.status_code == 200
+    assert admin_client.get(url).data == r1.data
+    _post(1234.5, date(2031, 6, 1))
+    r2 = admin_client.get(url)
+    assert r2.status_code == 200 and r2.data != r1.data
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+فهرس الشجرة: الأب/الأبناء/التصنيف بحث مباشر، ونطاقات الأوراق تغطي أوراق الفرع بالضبط؛ الحساب الفرعي
+المُنشأ من الشاشة يدخل الفهرس فوراً ويظهر في ميزان المراجعة.
+"""
+from __future__ import annotations
+
+import uuid
+from datetime import date
+
+
+def _in_ranges(code, ranges):
+    return any(lo <= code <= hi for lo, hi in ranges)
+
+
+def test_tree_lookups_and_leaf_ranges():
+    from data.coa_new_tree import LEAF_CODES, NEW_COA_TREE
+    from services import coa_index
+
+    n = coa_index.node('1111')
+    assert n.parent == '1110' and n.is_leaf and n.bs_class == 'current' and n.type == 'ASSET'
+    assert coa_index.node('1110').children == ('1111', '1112', '1113')
+    assert coa_index.ancestors('1111') == ('1110', '1100', '1000')
+    assert coa_index.bs_class('1211') == 'noncurrent' and coa_index.bs_class('2211') == 'noncurrent'
+    assert coa_index.bs_class('2111') == 'current' and coa_index.bs_class('4111') is None
+
+    tree_codes = {r[0] for r in NEW_COA_TREE} | set(LEAF_CODES)
+    under_1100 = {c for c in LEAF_CODES if '1100' in coa_index.ancestors(c)}
+    ranges = coa_index.leaf_ranges('1100')
+    assert {c for c in tree_codes if _in_ranges(c, ranges)} == under_1100
+    all_ranges = coa_index.leaf_ranges()
+    assert {c for c in tree_codes if _in_ranges(c, all_ranges)} == set(LEAF_CODES)
+    assert len(all_ranges) < len(LEAF_CODES) // 2
+
+
+def test_sub_account_joins_index_and_trial_balance(admin_client):
+    from app import db
+    from models import Account, JournalEntry, JournalLine
+    from services import coa_index
+
+    r = admin_client.post("/financials/api/accounts/add_sub", json={'parent_code': '5310', 'name_ar': 'فرعي اختبار'})
+    assert r.status_code == 200, r.data
+    code = r.get_json()['code']
+
+    n = coa_index.node(code)
+    assert n is not None and n.parent == '5310' and n.from_db and n.type == 'EXPENSE'
+    assert code in coa_index.node('5310').children and code in coa_index.leaf_codes()
+    assert _in_ranges(code, coa_index.leaf_ranges('5300'))
+    assert db.session.query(Account.code).filter(coa_index.leaf_filter(Account.code)) \
+        .filter(Account.code == code).count() == 1
+
+    sub = Account.query.filter_by(code=code).first()
+    cash = Account.query.filter_by(code='1111').first()
+    if cash is None:
+        cash = Account(code='1111', name='Main cash', type='ASSET')
+        db.session.add(cash)
+        db.session.flush()
+    d = date(2032, 2, 1)
+    je = JournalEntry(entry_number=f"COA-{uuid.uuid4().hex[:10]}", date=d, description='coa idx',
+                      status='posted', total_debit=77, total_credit=77)
+    db.session.add(je)
+    db.session.flush()
+    db.session.add_all([
+        JournalLine(journal_id=je.id, line_no=1, account_id=sub.id, debit=77, credit=0, description='d', line_date=d),
+        JournalLine(journal_id=je.id, line_no=2, account_id=cash.id, debit=0, credit=77, description='c', line_date=d),
+    ])
+    db.session.commit()
+
+    csv_text = admin_client.get("/financials/export/trial_balance?date=2032-12-31").get_data(as_text=True)
+    assert code in csv_text
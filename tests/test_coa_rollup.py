@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+تجميع الشجرة: كل مستوى يحمل مجموع ما تحته في مرور واحد، وميزان المراجعة (JSON) يعرض مجاميع الآباء؛
+نتيجة التجميع تُحسب مرة واحدة لكل طلب.
+"""
+from __future__ import annotations
+
+import uuid
+from datetime import date
+
+
+def _account(code, typ):
+    from app import db
+    from models import Account
+    a = Account.query.filter_by(code=code).first()
+    if not a:
+        a = Account(code=code, name=code, type=typ)
+        db.session.add(a)
+        db.session.flush()
+    return a
+
+
+def _post(d, lines):
+    from app import db
+    from models import JournalEntry, JournalLine
+    total = sum(dr for _, dr, _ in lines)
+    je = JournalEntry(entry_number=f"RUP-{uuid.uuid4().hex[:10]}", date=d, description='rollup test',
+                      status='posted', total_debit=total, total_credit=total)
+    db.session.add(je)
+    db.session.flush()
+    for i, (acc, dr, cr) in enumerate(lines, 1):
+        db.session.add(JournalLine(journal_id=je.id, line_no=i, account_id=acc.id, debit=dr, credit=cr,
+                                   description='x', line_date=d))
+    db.session.commit()
+
+
+def test_rollup_subtotals_every_level(app_context):
+    from services.coa_rollup import gl_totals, rollup
+    d = date(2033, 1, 5)
+    _post(d, [(_account('1111', 'ASSET'), 100, 0), (_account('4120', 'REVENUE'), 0, 100)])
+    _post(d, [(_account('1112', 'ASSET'), 50, 0), (_account('2111', 'LIABILITY'), 0, 50)])
+
+    result = rollup(gl_totals(date(2033, 12, 31), start=date(2033, 1, 1)))
+    by_code = {r['code']: r for r in result['rows']}
+    assert by_code['1111']['debit'] == 100 and by_code['1111']['is_leaf']
+    for code in ('1110', '1100', '1000'):
+        assert by_code[code]['debit'] == 150 and by_code[code]['balance'] == 150
+    assert by_code['2000']['credit'] == 50 and by_code['2000']['balance'] == 50
+    assert by_code['4000']['balance'] == -100
+    assert by_code['1110']['level'] == by_code['1111']['level'] - 1
+    assert result['total_debit'] == result['total_credit'] == 150
+
+
+def test_trial_balance_json_carries_parent_subtotals(admin_client):
+    j = admin_client.get("/financials/api/trial_balance_json?date=2033-12-31&hide_zero=1").get_json()
+    assert j['ok']
+    assets = j['grouped']['ASSET']
+    row_1110 = next(r for r in assets if r['code'] == '1110')
+    kids = [r for r in assets if r['parent'] == '1110']
+    assert row_1110['has_children'] and row_1110['debit'] >= 150
+    assert abs(row_1110['debit'] - sum(r['debit'] for r in kids)) < 0.005
+    assert round(j['total_debit'], 2) == round(j['total_credit'], 2)
+
+
+def test_rollup_is_computed_once_per_request(test_app):
+    from services.coa_rollup import gl_rollup
+    with test_app.test_request_context('/'):
+        assert gl_rollup(date(2033, 12, 31)) is gl_rollup(date(2033, 12, 31))
+        assert gl_rollup(date(2033, 12, 31)) is not gl_rollup(date(2033, 12, 30))
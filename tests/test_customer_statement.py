@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+اختبار كشف حساب العميل: الرصيد الافتتاحي من مجاميع SQL وعدد استعلامات ثابت مهما كثرت الفواتير.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+
+import pytest
+
+
+def _sale(uid, cid, number, on, total):
+    from models import SalesInvoice
+    return SalesInvoice(
+        invoice_number=number, date=on, payment_method="CREDIT", branch="china_town",
+        customer_id=cid, customer_name="Statement Co", total_before_tax=total, tax_amount=0,
+        discount_amount=0, total_after_tax_discount=total, status="unpaid", user_id=uid,
+    )
+
+
+def test_customer_statement_opening_and_query_count(app_context, admin_client, admin_id):
+    from flask import template_rendered
+    from sqlalchemy import event
+    from app import db
+    from models import Customer, Payment
+
+    c = Customer(name="Statement Co", customer_type="credit", active=True)
+    db.session.add(c)
+    db.session.flush()
+    old = _sale(admin_id, c.id, "CS-T-0001", date(2019, 1, 10), 100)
+    db.session.add(old)
+    db.session.flush()
+    db.session.add(Payment(invoice_id=old.id, invoice_type="sales", amount_paid=30,
+                           payment_method="CASH", payment_date=datetime(2019, 1, 20, 10, 0)))
+    db.session.add_all([_sale(admin_id, c.id, f"CS-T-1{i:03d}", date(2019, 2, 5), 10) for i in range(40)])
+    db.session.commit()
+
+    captured = []
+
+    def _capture(sender, template, context, **extra):
+        captured.append(context)
+
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    template_rendered.connect(_capture, app_context)
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        admin_client.get(f"/customers/{c.id}/statement?start_date=2019-02-01&end_date=2019-02-28")
+        baseline = len(statements)
+        db.session.add_all([_sale(admin_id, c.id, f"CS-T-2{i:03d}", date(2019, 2, 6), 10) for i in range(40)])
+        db.session.commit()
+        statements.clear()
+        admin_client.get(f"/customers/{c.id}/statement?start_date=2019-02-01&end_date=2019-02-28")
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+        template_rendered.disconnect(_capture, app_context)
+
+    ctx = captured[-1]
+    assert ctx["opening_balance"] == pytest.approx(70)
+    assert ctx["total_invoices"] == pytest.approx(800)
+    # الاستعلامات لا تنمو مع عدد الفواتير (فقط صفوف فهرس السداد الجديدة تُحسب بدفعة واحدة)
+    assert len(statements) <= baseline + 6
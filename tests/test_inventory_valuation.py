@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات تقييم المخزون: استعلام النافذة ومسار بايثون يعطيان نفس النتيجة.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _purchase(number, d, rm, qty, price, user_id):
+    from app import db
+    from models import PurchaseInvoice, PurchaseInvoiceItem
+    inv = PurchaseInvoice(
+        invoice_number=number, date=d, payment_method="CASH",
+        total_before_tax=qty * price, tax_amount=0, discount_amount=0,
+        total_after_tax_discount=qty * price, status="paid", user_id=user_id,
+    )
+    db.session.add(inv)
+    db.session.flush()
+    db.session.add(PurchaseInvoiceItem(
+        invoice_id=inv.id, raw_material_id=rm.id, raw_material_name=rm.name,
+        quantity=qty, price_before_tax=price, tax=0, discount=0, total_price=qty * price,
+    ))
+    db.session.commit()
+
+
+def test_material_cost_stats(app_context, admin_id):
+    from app import db
+    from models import RawMaterial
+    from services.inventory_valuation import material_cost_stats, _stats_python, _stats_window
+
+    rm = RawMaterial(name="Valuation Rice", unit="kg", cost_per_unit=3)
+    idle = RawMaterial(name="Valuation Salt", unit="kg", cost_per_unit=1.5)
+    db.session.add_all([rm, idle])
+    db.session.commit()
+    _purchase("INV-VAL-1", date(2024, 1, 5), rm, 10, 4, admin_id)
+    _purchase("INV-VAL-2", date(2024, 2, 5), rm, 30, 6, admin_id)
+
+    stats = material_cost_stats([rm.id, idle.id])
+    assert stats[rm.id]["latest_cost"] == pytest.approx(6)
+    assert stats[rm.id]["avg_cost"] == pytest.approx((4 + 6) / 2)
+    assert stats[rm.id]["last_purchase_date"] == date(2024, 2, 5)
+    assert stats[rm.id]["unit_cost"] == pytest.approx(6)
+    assert stats[idle.id]["has_purchases"] is False
+    assert stats[idle.id]["unit_cost"] == pytest.approx(1.5)
+
+    assert _stats_window([rm.id]) == _stats_python([rm.id])
+
+
+def test_failed_window_query_keeps_callers_pending_work(app_context, monkeypatch):
+    from app import db
+    from models import RawMaterial
+    from services import inventory_valuation as iv
+
+    def _boom(ids):
+        db.session.execute(db.text("SELECT * FROM no_such_table"))
+
+    monkeypatch.setattr(iv, '_stats_window', _boom)
+    monkeypatch.setattr(iv, '_supports_window_functions', lambda conn: True)
+    rm = RawMaterial(name="Valuation Pending", unit="kg", cost_per_unit=2)
+    db.session.add(rm)
+    stats = iv.material_cost_stats([1])
+    assert isinstance(stats, dict)
+    db.session.commit()
+    assert RawMaterial.query.filter_by(name="Valuation Pending").count() == 1
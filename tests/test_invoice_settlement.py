@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات فهرس سداد الفواتير: التحديث عند commit، أولوية القيود على جدول الدفعات، وإعادة البناء.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _settlement(inv_id):
+    from app import db
+    from models import InvoiceSettlement
+    db.session.expire_all()
+    return InvoiceSettlement.query.filter_by(invoice_type="purchase", invoice_id=inv_id).first()
+
+
+def test_settlement_index_follows_payments_and_gl(app_context, admin_id):
+    from app import db
+    from models import Account, JournalEntry, JournalLine, Payment, PurchaseInvoice, InvoiceSettlement
+    from services.invoice_settlement import paid_map, rebuild_settlements
+
+    inv = PurchaseInvoice(
+        invoice_number="SET-T-0001", date=date(2018, 4, 2), supplier_name="Settle Supplier",
+        payment_method="CASH", total_before_tax=100, tax_amount=0,
+        discount_amount=0, total_after_tax_discount=100, status="unpaid", user_id=admin_id,
+    )
+    db.session.add(inv)
+    db.session.commit()
+    row = _settlement(inv.id)
+    assert row is not None and row.status == "unpaid"
+
+    db.session.add(Payment(invoice_id=inv.id, invoice_type="purchase", amount_paid=40, payment_method="CASH"))
+    db.session.commit()
+    row = _settlement(inv.id)
+    assert float(row.paid_legacy) == pytest.approx(40)
+    assert float(row.remaining) == pytest.approx(60)
+    assert row.status == "partial"
+
+    acc = Account.query.filter_by(code="2111").first()
+    if not acc:
+        acc = Account(code="2111", name="Suppliers", type="LIABILITY")
+        db.session.add(acc)
+        db.session.flush()
+    je = JournalEntry(entry_number="JE-SET-T-0001", date=date(2018, 4, 3), branch_code="china_town",
+                      description="Settle test", status="posted", total_debit=100, total_credit=100, created_by=admin_id)
+    db.session.add(je)
+    db.session.flush()
+    db.session.add(JournalLine(journal_id=je.id, line_no=1, account_id=acc.id, debit=100, credit=0,
+                               description="Pay supplier", line_date=date(2018, 4, 3),
+                               invoice_id=inv.id, invoice_type="purchase"))
+    db.session.commit()
+    row = _settlement(inv.id)
+    assert float(row.paid_from_gl) == pytest.approx(100)
+    assert row.status == "paid"
+    # القيود لها الأولوية ولا تُجمع مع جدول الدفعات
+    assert paid_map("purchase", [inv.id]) == {inv.id: 100.0}
+    assert paid_map("purchase", [inv.id], source="legacy") == {inv.id: 40.0}
+
+    InvoiceSettlement.query.filter_by(invoice_type="purchase", invoice_id=inv.id).delete()
+    db.session.commit()
+    rebuild_settlements("purchase")
+    db.session.commit()
+    row = _settlement(inv.id)
+    assert row is not None and float(row.remaining) == pytest.approx(0)
+
+
+def test_missing_rows_are_persisted_on_read(app_context, admin_id):
+    from sqlalchemy import text
+    from app import db
+    from models import PurchaseInvoice
+    from services.invoice_settlement import paid_map
+
+    inv = PurchaseInvoice(
+        invoice_number="SET-T-0002", date=date(2018, 5, 2), supplier_name="Settle Supplier",
+        payment_method="CASH", total_before_tax=70, tax_amount=0,
+        discount_amount=0, total_after_tax_discount=70, status="unpaid", user_id=admin_id,
+    )
+    db.session.add(inv)
+    db.session.commit()
+    # فاتورة سابقة للفهرس: الصف غير موجود (SQL مباشر يتجاوز المستمعين)
+    db.session.execute(text("DELETE FROM invoice_settlements WHERE invoice_type='purchase' AND invoice_id=:i"),
+                       {'i': inv.id})
+    db.session.commit()
+    assert _settlement(inv.id) is None
+
+    # صفحة GET: تقرأ ولا تنفّذ commit
+    assert paid_map("purchase", [inv.id]) == {inv.id: 0.0}
+    db.session.rollback()
+    row = _settlement(inv.id)
+    assert row is not None and float(row.remaining) == 70
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+مخزن AppKV على طبقتين: get_many باستعلام واحد، LRU للمفاتيح غير المتطايرة، الكتابة دون commit ضمن معاملة
+المستدعي مع التراجع، الإبطال عبر الجيل المشترك، و scan_prefix.
+"""
+from __future__ import annotations
+
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def ns(app_context):
+    """بادئة فريدة لكل اختبار، وحذف مفاتيحها في النهاية."""
+    from extensions import db
+    from services import kv_store
+    prefix = f"t{uuid.uuid4().hex[:8]}"
+    yield prefix
+    db.session.rollback()
+    kv_store.delete([k for k, _ in kv_store.scan_prefix(prefix)] +
+                    [k for k, _ in kv_store.scan_prefix(f"draft:{prefix}")])
+
+
+def _count_selects(fn):
+    from sqlalchemy import event
+    from extensions import db
+    seen = []
+
+    def _before(conn, cursor, statement, params, context, executemany):
+        if 'app_kv' in statement.lower():
+            seen.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _before)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _before)
+    return result, len(seen)
+
+
+def test_get_many_single_query_and_lru(ns):
+    from services import kv_store
+    kv_store.set_many({f"{ns}:a": {'x': 1}, f"{ns}:b": [1, 2], f"draft:{ns}:1": {'items': [1]}})
+    keys = [f"{ns}:a", f"{ns}:b", f"{ns}:missing", f"draft:{ns}:1"]
+
+    got, n = _count_selects(lambda: kv_store.get_many(keys))
+    assert got == {f"{ns}:a": {'x': 1}, f"{ns}:b": [1, 2], f"draft:{ns}:1": {'items': [1]}}
+    assert n == 1
+
+    # الإعدادات (والمفتاح الغائب) من LRU؛ المسودة متطايرة فتُقرأ دائماً من القاعدة
+    got, n = _count_selects(lambda: kv_store.get_many(keys[:3]))
+    assert n == 0 and got[f"{ns}:a"] == {'x': 1}
+    _, n = _count_selects(lambda: kv_store.get(f"draft:{ns}:1"))
+    assert n == 1
+
+    # كل قراءة نسخة مستقلة: تعديل الناتج لا يلوّث LRU
+    kv_store.get(f"{ns}:a")['x'] = 99
+    assert kv_store.get(f"{ns}:a") == {'x': 1}
+
+
+def test_uncommitted_write_and_rollback(ns):
+    from extensions import db
+    from routes.common import kv_get, kv_set
+    kv_set(f"{ns}:cfg", {'v': 1})
+    assert kv_get(f"{ns}:cfg") == {'v': 1}
+
+    kv_set(f"{ns}:cfg", {'v': 2}, commit=False)
+    assert kv_get(f"{ns}:cfg") == {'v': 2}
+    db.session.rollback()
+    assert kv_get(f"{ns}:cfg") == {'v': 1}
+
+    kv_set(f"{ns}:cfg", {'v': 3}, commit=False)
+    db.session.commit()
+    assert kv_get(f"{ns}:cfg") == {'v': 3}
+
+
+def test_shared_generation_drops_other_worker_lru(ns, monkeypatch):
+    from extensions import db
+    from services import kv_store
+    kv_store.put(f"{ns}:cfg", {'v': 1})
+    assert kv_store.get(f"{ns}:cfg") == {'v': 1}
+
+    # عامل آخر عدّل القيمة (هنا بـ SQL مباشر لا يراه المستمع) ورفع الجيل المشترك
+    db.session.execute(db.text("UPDATE app_kv SET v = :v WHERE k = :k"), {'v': '{"v": 2}', 'k': f"{ns}:cfg"})
+    db.session.commit()
+    assert kv_store.get(f"{ns}:cfg") == {'v': 1}
+
+    monkeypatch.setattr(kv_store, '_GEN_CHECK_S', 0.0)
+    kv_store._bump_shared_gen()
+    assert kv_store.get(f"{ns}:cfg") == {'v': 2}
+
+
+def test_scan_prefix_and_delete(ns):
+    from services import kv_store
+    kv_store.set_many({f"{ns}:p:1": 1, f"{ns}:p:2": 2, f"{ns}:q:1": 3})
+    assert kv_store.scan_prefix(f"{ns}:p:") == [(f"{ns}:p:1", 1), (f"{ns}:p:2", 2)]
+    assert kv_store.scan_prefix(f"{ns}:", limit=2) == [(f"{ns}:p:1", 1), (f"{ns}:p:2", 2)]
+    assert kv_store.delete([f"{ns}:p:1", f"{ns}:nope"]) == 1
+    assert kv_store.get(f"{ns}:p:1", 'gone') == 'gone'
+
+
+def test_repeated_uncommitted_writes_same_key(ns):
+    from extensions import db
+    from services import kv_store
+    kv_store.put(f"{ns}:new", 1, commit=False)
+    kv_store.put(f"{ns}:new", 2, commit=False)
+    db.session.commit()
+    assert kv_store.get(f"{ns}:new") == 2
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات محرك الرواتب الجماعي: سداد شهر لعدة موظفين، توزيع FIFO مع السلفة، وحفظ مسير الشهر.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _employee(code, base, hire=date(2014, 1, 1), dept="hall"):
+    from app import db
+    from models import Employee, EmployeeSalaryDefault
+    e = Employee(employee_code=code, full_name=f"Payroll {code}", national_id=f"NID-{code}",
+                 department=dept, position="staff", hire_date=hire, status="active")
+    db.session.add(e)
+    db.session.flush()
+    db.session.add(EmployeeSalaryDefault(employee_id=e.id, base_salary=base, allowances=0, deductions=0))
+    return e
+
+
+def test_pay_month_bulk_creates_salaries_payments_and_journals(app_context):
+    from app import db
+    from models import JournalEntry, JournalLine, Payment, Salary
+    from services.payroll_engine import pay_month_bulk
+
+    emps = [_employee("PE-T-01", 1000), _employee("PE-T-02", 400)]
+    db.session.commit()
+    ids = [e.id for e in emps]
+
+    res = pay_month_bulk(ids, 2014, 3, 600, "cash")
+    db.session.commit()
+
+    assert (res["success_count"], res["failed_count"]) == (2, 0)
+    sals = {s.employee_id: s for s in Salary.query.filter(Salary.employee_id.in_(ids), Salary.year == 2014, Salary.month == 3)}
+    assert sals[ids[0]].status == "partial"
+    assert sals[ids[1]].status == "paid"
+    paid = dict(db.session.query(Payment.invoice_id, Payment.amount_paid).filter(
+        Payment.invoice_type == "salary", Payment.invoice_id.in_([s.id for s in sals.values()])).all())
+    assert float(paid[sals[ids[0]].id]) == pytest.approx(600)
+    assert float(paid[sals[ids[1]].id]) == pytest.approx(400)
+    je = JournalEntry.query.filter_by(salary_id=sals[ids[0]].id).one()
+    assert je.entry_number == f"JE-SALPAY-{sals[ids[0]].id}"
+    assert JournalLine.query.filter_by(journal_id=je.id).count() == 2
+
+    # دفعة ثانية لنفس المسير تأخذ رقم قيد فريداً
+    pay_month_bulk([ids[0]], 2014, 3, 400, "cash")
+    db.session.commit()
+    nums = sorted(j.entry_number for j in JournalEntry.query.filter_by(salary_id=sals[ids[0]].id))
+    assert nums == [f"JE-SALPAY-{sals[ids[0]].id}", f"JE-SALPAY-{sals[ids[0]].id}-2"]
+    assert db.session.get(Salary, sals[ids[0]].id).status == "paid"
+
+
+def test_pay_fifo_settles_arrears_then_advance(app_context):
+    from app import db
+    from models import JournalEntry, Salary
+    from services.payroll_engine import pay_fifo
+
+    e = _employee("PE-T-03", 500, hire=date(2013, 11, 1))
+    db.session.commit()
+
+    payments = pay_fifo([e.id], 2013, 12, 1200, "cash")
+    db.session.commit()
+
+    assert [float(p.amount_paid) for p in payments] == [500, 500, 200]
+    rows = {(s.year, s.month): s for s in Salary.query.filter_by(employee_id=e.id)}
+    assert rows[(2013, 11)].status == "paid"
+    assert rows[(2013, 12)].status == "paid"
+    assert rows[(2014, 1)].status == "partial"
+    adv = JournalEntry.query.filter_by(salary_id=rows[(2014, 1)].id).one()
+    assert adv.entry_number.startswith(f"JE-ADV-{e.id}-201401")
+
+
+def test_apply_payroll_run_updates_and_drops_unselected(app_context):
+    from app import db
+    from models import Payment, Salary
+    from services.payroll_engine import apply_payroll_run
+
+    a, b, c = _employee("PE-T-04", 100), _employee("PE-T-05", 100), _employee("PE-T-06", 100)
+    db.session.flush()
+    sb = Salary(employee_id=b.id, year=2012, month=5, basic_salary=100, total_salary=100, status="due")
+    sc = Salary(employee_id=c.id, year=2012, month=5, basic_salary=100, total_salary=100, status="due")
+    db.session.add_all([sb, sc])
+    db.session.flush()
+    db.session.add(Payment(invoice_id=sc.id, invoice_type="salary", amount_paid=10, payment_method="cash"))
+    db.session.commit()
+
+    n = apply_payroll_run(2012, 5, [{"employee_id": a.id, "basic": 120, "salary": 0}])
+    db.session.commit()
+
+    assert n == 1
+    left = {s.employee_id: s for s in Salary.query.filter_by(year=2012, month=5)}
+    assert float(left[a.id].total_salary) == pytest.approx(120)
+    assert b.id not in left
+    assert c.id in left
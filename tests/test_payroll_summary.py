@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات ملخص الرواتب الشهري: التحديث عند commit المسيرات والدفعات، والحذف، وكشف الشهر مع توزيع FIFO.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _employee(code, base, hire):
+    from app import db
+    from models import Employee, EmployeeSalaryDefault
+    e = Employee(employee_code=code, full_name=f"Summary {code}", national_id=f"NID-{code}",
+                 department="kitchen", position="staff", hire_date=hire, status="active")
+    db.session.add(e)
+    db.session.flush()
+    db.session.add(EmployeeSalaryDefault(employee_id=e.id, base_salary=base, allowances=0, deductions=0))
+    return e
+
+
+def test_summary_follows_salaries_and_payments(app_context):
+    from app import db
+    from models import Payment, PayrollMonthSummary, Salary
+    from services.payroll_summary import summaries_in_range
+
+    e = _employee("PS-T-01", 300, date(2011, 1, 1))
+    s = Salary(employee_id=e.id, year=2011, month=2, basic_salary=300, total_salary=300, status="due")
+    db.session.add(s)
+    db.session.commit()
+
+    row = PayrollMonthSummary.query.filter_by(salary_id=s.id).one()
+    assert (row.period, float(row.gross), float(row.remaining), row.status) == (201102, 300, 300, "due")
+
+    p = Payment(invoice_id=s.id, invoice_type="salary", amount_paid=120, payment_method="bank")
+    db.session.add(p)
+    db.session.commit()
+    row = summaries_in_range((2011, 1), (2011, 12), [e.id])[(e.id, 2011, 2)]
+    assert (float(row.paid), float(row.remaining), row.status) == (120, 180, "partial")
+    assert row.payment_ids == str(p.id)
+    assert row.last_payment_method == "BANK"
+
+    db.session.delete(p)
+    db.session.delete(s)
+    db.session.commit()
+    assert PayrollMonthSummary.query.filter_by(employee_id=e.id).count() == 0
+
+
+def test_statement_rows_allocate_payments_fifo(app_context):
+    from app import db
+    from models import Payment, Salary
+    from services.payroll_summary import salary_statement_rows
+
+    e = _employee("PS-T-02", 100, date(2010, 1, 1))
+    jan = Salary(employee_id=e.id, year=2010, month=1, basic_salary=100, total_salary=100, status="due")
+    db.session.add(jan)
+    db.session.flush()
+    db.session.add(Payment(invoice_id=jan.id, invoice_type="salary", amount_paid=150, payment_method="cash"))
+    db.session.commit()
+
+    # فبراير ومارس بلا مسير: من الراتب الافتراضي؛ الفائض 50 يغطي نصف فبراير
+    row = next(r for r in salary_statement_rows(2010, 3, department="kitchen") if r["employee_id"] == e.id)
+    assert row["prev"] == pytest.approx(50)
+    assert row["total"] == pytest.approx(150)
+    assert row["paid"] == pytest.approx(0)
+    assert row["status"] == "due"
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+كاش platforms_map و acc_map: تصنيف القناة وتجاوز الحساب بلا استعلام AppKV، ونفس نتائج classify_channel،
+وإعادة التحميل بعد invalidate_platform_config.
+"""
+from __future__ import annotations
+
+
+import pytest
+
+
+PLATFORMS = [
+    {'key': 'jahez', 'keywords': ['jahez', 'جاهز']},
+    {'key': 'ninja', 'keywords': ['ninja', 'keeta ninja']},
+]
+
+
+@pytest.fixture
+def configured(app_context):
+    from routes.common import kv_get, kv_set
+    from services.platform_config import invalidate_platform_config
+    saved = (kv_get('platforms_map', None), kv_get('acc_map', None))
+    kv_set('platforms_map', PLATFORMS)
+    kv_set('acc_map', {'REV_CT': '4119', 'AR': ' '})
+    invalidate_platform_config()
+    yield
+    kv_set('platforms_map', saved[0] or [])
+    kv_set('acc_map', saved[1] or {})
+    invalidate_platform_config()
+
+
+def _kv_selects(fn):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    seen = []
+
+    def _count(conn, cursor, statement, params, context, executemany):
+        if 'app_kv' in statement.lower():
+            seen.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', _count)
+    try:
+        fn()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _count)
+    return seen
+
+
+def test_classify_matches_reference_without_kv_reads(configured):
+    from app.routes import _acc_override, _platform_group
+    from services.sales_channel import classify_channel
+
+    names = ['Jahez 123', 'طلب جاهز', 'Keeta Ninja', 'keeta', 'هنقر ستيشن', 'HungerStation', 'walk-in', '', None]
+    _platform_group('warm')
+    out = {}
+    seen = _kv_selects(lambda: out.update(
+        {n: _platform_group(n) for n in names},
+        rev=_acc_override('REV_CT', '4111'), ar=_acc_override('AR', '1141'),
+    ))
+    assert seen == []
+    for n in names:
+        assert out[n] == classify_channel(n, PLATFORMS), n
+    # المنصات المهيأة قبل المدمجة (keeta ninja → ninja)
+    assert out['Keeta Ninja'] == 'ninja'
+    assert (out['rev'], out['ar']) == ('4119', '1141')
+
+
+def test_invalidate_reloads_new_map(configured):
+    from routes.common import kv_set
+    from services.platform_config import classify, invalidate_platform_config
+    from services.sales_channel import channel_keys
+
+    assert classify('Mrsool driver') == ''
+    kv_set('platforms_map', PLATFORMS + [{'key': 'mrsool', 'keywords': ['mrsool']}])
+    invalidate_platform_config()
+    assert classify('Mrsool driver') == 'mrsool'
+    assert 'mrsool' in channel_keys()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+حجم pool قاعدة PostgreSQL يُشتق من عدد عمال gunicorn وخيوطهم، وSQLite يبقى NullPool.
+"""
+from __future__ import annotations
+
+
+PG = 'postgresql://u:p@localhost/db'
+
+
+def _clear(monkeypatch):
+    for k in ('WEB_CONCURRENCY', 'GUNICORN_THREADS', 'DB_MAX_CONNECTIONS', 'DB_POOL_SIZE', 'DB_MAX_OVERFLOW',
+              'DB_POOL_RECYCLE'):
+        monkeypatch.delenv(k, raising=False)
+
+
+def test_pool_budget_is_split_across_workers(monkeypatch):
+    from config import _engine_options_for
+    _clear(monkeypatch)
+    monkeypatch.setenv('DB_MAX_CONNECTIONS', '20')
+    monkeypatch.setenv('GUNICORN_THREADS', '4')
+
+    monkeypatch.setenv('WEB_CONCURRENCY', '1')
+    one = _engine_options_for(PG)
+    assert (one['pool_size'], one['max_overflow']) == (4, 16)
+
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    four = _engine_options_for(PG)
+    assert (four['pool_size'], four['max_overflow']) == (4, 1)
+    assert 4 * (four['pool_size'] + four['max_overflow']) <= 20
+    assert four['pool_pre_ping'] is True and four['pool_recycle'] == 1800
+
+
+def test_pool_overrides_and_sqlite(monkeypatch):
+    from sqlalchemy.pool import NullPool
+    from config import _engine_options_for
+    _clear(monkeypatch)
+    monkeypatch.setenv('WEB_CONCURRENCY', '8')
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '0')
+    opts = _engine_options_for(PG)
+    assert (opts['pool_size'], opts['max_overflow']) == (3, 0)
+
+    lite = _engine_options_for('sqlite:///x.db')
+    assert lite['poolclass'] is NullPool and 'pool_size' not in lite
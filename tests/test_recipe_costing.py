@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات إعادة حساب تكلفة الوجبات جماعياً: الوجبات المتأثرة فقط، والمعاينة بدون كتابة.
+"""
+from __future__ import annotations
+
+
+import pytest
+
+
+def test_recompute_meal_costs(app_context, admin_id):
+    from app import db
+    from models import Meal, MealIngredient, RawMaterial
+    from services.recipe_costing import recompute_meal_costs
+
+    chicken = RawMaterial(name="Recost Chicken", unit="kg", cost_per_unit=20)
+    flour = RawMaterial(name="Recost Flour", unit="kg", cost_per_unit=2)
+    db.session.add_all([chicken, flour])
+    db.session.flush()
+    curry = Meal(name="Recost Curry", user_id=admin_id, total_cost=10, profit_margin_percent=50, selling_price=15)
+    bread = Meal(name="Recost Bread", user_id=admin_id, total_cost=1, profit_margin_percent=100, selling_price=2)
+    db.session.add_all([curry, bread])
+    db.session.flush()
+    db.session.add_all([
+        MealIngredient(meal_id=curry.id, raw_material_id=chicken.id, quantity=0.5, total_cost=10),
+        MealIngredient(meal_id=bread.id, raw_material_id=flour.id, quantity=0.5, total_cost=1),
+    ])
+    db.session.commit()
+
+    chicken.cost_per_unit = 30
+    db.session.commit()
+
+    preview = recompute_meal_costs([chicken.id], dry_run=True)
+    assert preview["count"] == 1
+    row = preview["meals"][0]
+    assert row["meal_id"] == curry.id
+    assert row["new_cost"] == pytest.approx(15)
+    assert row["new_price"] == pytest.approx(22.5)
+    assert row["margin_at_current_price_pct"] == pytest.approx(0)
+    db.session.rollback()
+    assert float(db.session.query(Meal.total_cost).filter(Meal.id == curry.id).scalar()) == pytest.approx(10)
+
+    result = recompute_meal_costs([chicken.id])
+    db.session.commit()
+    assert result["count"] == 1
+    costs = dict(db.session.query(Meal.id, Meal.selling_price).filter(Meal.id.in_([curry.id, bread.id])).all())
+    assert float(costs[curry.id]) == pytest.approx(22.5)
+    assert float(costs[bread.id]) == pytest.approx(2)
+    ing_cost = db.session.query(MealIngredient.total_cost).filter(MealIngredient.meal_id == curry.id).scalar()
+    assert float(ing_cost) == pytest.approx(15)
+
+
+def test_recompute_all_skips_meals_without_ingredients(app_context, admin_id):
+    from app import db
+    from models import Meal
+    from services.recipe_costing import recompute_meal_costs
+
+    imported = Meal(name="Recost Imported", user_id=admin_id, total_cost=4, profit_margin_percent=30, selling_price=12)
+    db.session.add(imported)
+    db.session.commit()
+
+    result = recompute_meal_costs(None)
+    db.session.commit()
+    assert imported.id not in {r['meal_id'] for r in result['meals']}
+    price, cost = db.session.query(Meal.selling_price, Meal.total_cost).filter(Meal.id == imported.id).one()
+    assert float(price) == pytest.approx(12) and float(cost) == pytest.approx(4)
+
+
+def test_cost_only_recompute_keeps_selling_price(app_context, admin_id):
+    from app import db
+    from models import Meal, MealIngredient, RawMaterial
+    from services.recipe_costing import recompute_meal_costs
+
+    lamb = RawMaterial(name="Recost Lamb", unit="kg", cost_per_unit=40)
+    db.session.add(lamb)
+    db.session.flush()
+    kebab = Meal(name="Recost Kebab", user_id=admin_id, total_cost=8, profit_margin_percent=100, selling_price=19.5)
+    db.session.add(kebab)
+    db.session.flush()
+    db.session.add(MealIngredient(meal_id=kebab.id, raw_material_id=lamb.id, quantity=0.2, total_cost=8))
+    db.session.commit()
+
+    lamb.cost_per_unit = 50
+    recompute_meal_costs([lamb.id], reprice=False)
+    db.session.commit()
+    cost, price = db.session.query(Meal.total_cost, Meal.selling_price).filter(Meal.id == kebab.id).one()
+    assert float(cost) == pytest.approx(10) and float(price) == pytest.approx(19.5)
+
+    # إعادة التسعير الصريحة (api_meals_recost) ما زالت تطبّق الهامش
+    preview = recompute_meal_costs([lamb.id], dry_run=True)
+    assert preview['meals'][0]['new_price'] == pytest.approx(20)
+    db.session.rollback()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات استهلاك المخزون من الوصفات: تفكيك البنود، الإدراج الجماعي، إبطال الكاش، والمهمة الدفعية.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _sale(uid, number, d, lines):
+    from app import db
+    from models import SalesInvoice, SalesInvoiceItem
+    inv = SalesInvoice(
+        invoice_number=number, date=d, payment_method="CASH", branch="china_town",
+        total_before_tax=0, tax_amount=0, discount_amount=0,
+        total_after_tax_discount=0, status="paid", user_id=uid,
+    )
+    db.session.add(inv)
+    db.session.flush()
+    for name, qty in lines:
+        db.session.add(SalesInvoiceItem(
+            invoice_id=inv.id, product_name=name, quantity=qty,
+            price_before_tax=10, tax=0, discount=0, total_price=10 * qty,
+        ))
+    db.session.commit()
+    return inv
+
+
+def test_checkout_depletion_and_batch(app_context, admin_id):
+    from app import db
+    from models import Meal, MealIngredient, MenuCategory, MenuItem, RawMaterial, StockMovement
+    from services.recipe_depletion import (
+        deplete_for_invoice, deplete_pending_invoices, explode_lines, get_recipe_map,
+    )
+
+    rice = RawMaterial(name="Depletion Rice", unit="kg", cost_per_unit=4, stock_quantity=10)
+    oil = RawMaterial(name="Depletion Oil", unit="l", cost_per_unit=8, stock_quantity=5)
+    db.session.add_all([rice, oil])
+    db.session.flush()
+    meal = Meal(name="Depletion Biryani", name_ar="برياني", user_id=admin_id, total_cost=0, selling_price=20)
+    db.session.add(meal)
+    db.session.flush()
+    db.session.add_all([
+        MealIngredient(meal_id=meal.id, raw_material_id=rice.id, quantity=0.25, total_cost=1),
+        MealIngredient(meal_id=meal.id, raw_material_id=oil.id, quantity=0.05, total_cost=0.4),
+    ])
+    cat = MenuCategory(name="Depletion Cat")
+    db.session.add(cat)
+    db.session.flush()
+    item = MenuItem(name="Biryani Plate", category_id=cat.id, meal_id=meal.id, price=20)
+    db.session.add(item)
+    db.session.commit()
+
+    rmap = get_recipe_map()
+    need = explode_lines([{'meal_id': meal.id, 'name': 'x', 'qty': 2}, {'name': 'برياني', 'qty': 2}, {'name': 'Tea', 'qty': 1}], rmap)
+    assert need[rice.id] == pytest.approx(1.0)
+    assert need[oil.id] == pytest.approx(0.2)
+
+    inv = _sale(admin_id, "DEP-T-0001", date.today(), [("Biryani Plate", 4)])
+    assert deplete_for_invoice(inv.id, [{'menu_item_id': item.id, 'name': 'Biryani Plate', 'qty': 4}], on_date=inv.date) == 2
+    db.session.commit()
+    assert float(rice.stock_quantity) == pytest.approx(9)
+    assert float(oil.stock_quantity) == pytest.approx(4.8)
+    mv = StockMovement.query.filter_by(ref_type='sales', ref_id=inv.id, raw_material_id=rice.id).one()
+    assert float(mv.total_cost) == pytest.approx(-4)
+
+    # تعديل الوصفة يبطل الكاش
+    ing = MealIngredient.query.filter_by(meal_id=meal.id, raw_material_id=rice.id).one()
+    ing.quantity = 0.5
+    db.session.commit()
+    assert explode_lines([{'name': 'Depletion Biryani', 'qty': 1}])[rice.id] == pytest.approx(0.5)
+
+    # المهمة الدفعية تلتقط الفواتير بلا حركات مرة واحدة فقط
+    inv2 = _sale(admin_id, "DEP-T-0002", date.today(), [("Depletion Biryani", 1), ("Depletion Biryani", 1)])
+    deplete_pending_invoices(date.today(), date.today())
+    db.session.commit()
+    assert float(rice.stock_quantity) == pytest.approx(8)
+    assert StockMovement.query.filter_by(ref_type='sales', ref_id=inv2.id).count() == 2
+    assert deplete_pending_invoices(date.today(), date.today()) == 0
+
+
+def test_pos_meal_id_resolves_to_meal_not_menu_item(app_context, admin_id):
+    """نقطة البيع ترسل Meal.id للصنف المربوط؛ صنف قائمة يحمل نفس الرقم لا يغيّر الوصفة المستهلكة."""
+    from app import db
+    from models import Meal, MealIngredient, MenuCategory, MenuItem, RawMaterial
+    from services.recipe_depletion import explode_lines, get_recipe_map
+
+    flour = RawMaterial(name="Collision Flour", unit="kg", cost_per_unit=2, stock_quantity=10)
+    sugar = RawMaterial(name="Collision Sugar", unit="kg", cost_per_unit=3, stock_quantity=10)
+    salt = RawMaterial(name="Collision Salt", unit="kg", cost_per_unit=1, stock_quantity=10)
+    db.session.add_all([flour, sugar, salt])
+    db.session.flush()
+    bread = Meal(id=9101, name="Collision Bread", user_id=admin_id, total_cost=0, selling_price=5)
+    cake = Meal(id=9102, name="Collision Cake", user_id=admin_id, total_cost=0, selling_price=9)
+    soup = Meal(id=9103, name="Collision Soup", user_id=admin_id, total_cost=0, selling_price=7)
+    db.session.add_all([bread, cake, soup])
+    db.session.flush()
+    db.session.add_all([
+        MealIngredient(meal_id=bread.id, raw_material_id=flour.id, quantity=0.5, total_cost=1),
+        MealIngredient(meal_id=cake.id, raw_material_id=sugar.id, quantity=0.2, total_cost=0.6),
+        MealIngredient(meal_id=soup.id, raw_material_id=salt.id, quantity=0.1, total_cost=0.1),
+    ])
+    cat = MenuCategory(name="Collision Cat")
+    db.session.add(cat)
+    db.session.flush()
+    db.session.add_all([
+        # الصنف 9102 مربوط بالخبز (9101)، والصنف 9101 مربوط بالكعك: الأرقام متقاطعة عمداً
+        MenuItem(id=9102, name="Bread Item", category_id=cat.id, meal_id=bread.id, price=5),
+        MenuItem(id=9101, name="Cake Item", category_id=cat.id, meal_id=cake.id, price=9),
+        # صنف غير مربوط برقم يساوي وجبة الشوربة: نقطة البيع ترسل 9103 وهو معرّف الصنف
+        MenuItem(id=9103, name="Plain Tea", category_id=cat.id, meal_id=None, price=2),
+    ])
+    db.session.commit()
+
+    rmap = get_recipe_map()
+    # ما ترسله نقطة البيع (api_menu_all_items) لصنف الخبز: meal_id = Meal.id
+    need = explode_lines([{'meal_id': bread.id, 'name': 'Bread Item', 'qty': 2}], rmap)
+    assert need == {flour.id: pytest.approx(1.0)}
+    assert explode_lines([{'menu_item_id': 9101, 'name': 'x', 'qty': 1}], rmap) == {sugar.id: pytest.approx(0.2)}
+    assert explode_lines([{'meal_id': 9103, 'name': 'Plain Tea', 'qty': 1}], rmap) == {}
+    assert explode_lines([{'meal_id': 9103, 'name': 'Collision Soup', 'qty': 1}], rmap) == {salt.id: pytest.approx(0.1)}
+
+
+def test_recipe_map_dropped_again_after_commit(app_context, admin_id):
+    from app import db
+    from models import Meal
+    from services.recipe_depletion import RECIPE_MAP_CACHE_KEY, get_recipe_map
+    from utils.cache_helpers import _cache
+
+    c = _cache()
+    if c is None:
+        pytest.skip("no cache configured")
+    db.session.add(Meal(name="Stale Map Meal", user_id=admin_id, total_cost=0, selling_price=3))
+    db.session.flush()
+    # طلب متزامن يعيد بناء الخريطة بين الـ flush والـ commit
+    c.set(RECIPE_MAP_CACHE_KEY, {'stale': True})
+    db.session.commit()
+    assert c.get(RECIPE_MAP_CACHE_KEY) is None
+    assert 'stale' not in get_recipe_map()
+
+
+def test_deleting_sale_reverses_depletion(admin_client, admin_id):
+    from app import db
+    from models import Meal, MealIngredient, RawMaterial, SalesInvoice, StockMovement
+    from services.recipe_depletion import deplete_for_invoice, deplete_pending_invoices, reverse_depletion
+
+    flour = RawMaterial(name="Reversal Flour", unit="kg", cost_per_unit=2, stock_quantity=10)
+    db.session.add(flour)
+    db.session.flush()
+    meal = Meal(name="Reversal Pie", user_id=admin_id, total_cost=0, selling_price=9)
+    db.session.add(meal)
+    db.session.flush()
+    db.session.add(MealIngredient(meal_id=meal.id, raw_material_id=flour.id, quantity=0.5, total_cost=1))
+    db.session.commit()
+
+    inv = _sale(admin_id, "DEP-T-REV1", date(2022, 4, 3), [("Reversal Pie", 4)])
+    deplete_for_invoice(inv.id, [{'meal_id': meal.id, 'name': 'Reversal Pie', 'qty': 4}], on_date=inv.date)
+    db.session.commit()
+    assert float(flour.stock_quantity) == pytest.approx(8)
+
+    r = admin_client.post("/invoices/delete", data={'invoice_type': 'sales', 'scope': 'selected',
+                                                    'invoice_ids': [str(inv.id)]})
+    assert r.status_code in (200, 302)
+    db.session.expire_all()
+    assert db.session.get(SalesInvoice, inv.id) is None
+    assert float(db.session.get(RawMaterial, flour.id).stock_quantity) == pytest.approx(10)
+    back = StockMovement.query.filter_by(ref_type='sales', ref_id=inv.id).filter(StockMovement.quantity > 0).one()
+    assert back.date == date(2022, 4, 3)
+    assert float(back.total_cost) == pytest.approx(4)
+    assert reverse_depletion(inv.id) == 0
+    assert deplete_pending_invoices(date(2022, 4, 3), date(2022, 4, 3)) == 0
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+سياق الطلب: الإعدادات تُقرأ مرة واحدة لكل طلب (ومن الكاش الموسوم بين الطلبات) وتتحدث بعد حفظها؛
+فهرس الشجرة مشترك وغير قابل للتعديل.
+"""
+from __future__ import annotations
+
+
+import pytest
+
+
+def _settings_queries(fn):
+    from sqlalchemy import event
+    from extensions import db
+    seen = []
+
+    def _before(conn, cursor, statement, params, context, executemany):
+        if 'from settings' in statement.lower():
+            seen.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _before)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _before)
+    return result, len(seen)
+
+
+def _ensure_settings(name):
+    from extensions import db
+    from models import Settings
+    s = Settings.query.first()
+    if s is None:
+        s = Settings()
+        db.session.add(s)
+    s.company_name = name
+    db.session.commit()
+
+
+def test_settings_read_once_per_request_and_refreshed_after_save(test_app):
+    from utils.request_context import current_settings
+    with test_app.app_context():
+        _ensure_settings('Ctx Co')
+
+    with test_app.test_request_context('/'):
+        (a, b, c), n = _settings_queries(lambda: (current_settings(), current_settings(), current_settings()))
+        assert a is b is c
+        assert a.company_name == 'Ctx Co'
+        assert n <= 1
+
+    with test_app.test_request_context('/'):
+        s, n = _settings_queries(current_settings)
+        assert s.company_name == 'Ctx Co' and n == 0
+        _ensure_settings('Ctx Co 2')
+
+    with test_app.test_request_context('/'):
+        assert current_settings().company_name == 'Ctx Co 2'
+
+
+def test_coa_index_is_shared_and_read_only(app_context):
+    from data.coa_new_tree import build_coa_dict, get_account_display_name
+    from services.account_validation import get_account_type, is_leaf_account
+    from services.coa_index import coa_dict, leaf_codes
+    from utils.request_context import current_coa
+
+    assert coa_dict() is current_coa()
+    assert dict(coa_dict()['1111']) == build_coa_dict()['1111']
+    with pytest.raises(TypeError):
+        coa_dict()['1111']['name'] = 'x'
+    assert '1111' in leaf_codes() and '1110' not in leaf_codes()
+    assert is_leaf_account('1111') and not is_leaf_account('1100')
+    assert get_account_type('2111') == 'LIABILITY'
+    assert get_account_display_name('1111') == 'صندوق رئيسي'
+    assert get_account_display_name('1111', 'Custom') == 'Custom'
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات قناة البيع: التصنيف، تعبئة الفواتير القديمة، وتقرير العملاء المجمّع على العمود.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _sale(uid, number, name, total, channel=None):
+    from app import db
+    from models import SalesInvoice
+    inv = SalesInvoice(
+        invoice_number=number, date=date(2018, 3, 5), payment_method="CASH", branch="china_town",
+        customer_name=name, channel=channel, total_before_tax=total, tax_amount=0, discount_amount=0,
+        total_after_tax_discount=total, status="paid", user_id=uid,
+    )
+    db.session.add(inv)
+    db.session.commit()
+    return inv
+
+
+def test_classify_channel():
+    from services.sales_channel import classify_channel
+    assert classify_channel("KEETA Delivery") == "keeta"
+    assert classify_channel("هنقر ستيشن") == "hunger"
+    assert classify_channel("Ahmed") == ""
+    assert classify_channel("Noon Food", [{"key": "noon", "keywords": ["noon"]}]) == "noon"
+
+
+def test_reclassify_and_grouped_report(app_context, admin_id):
+    from app import db
+    from models import SalesInvoice
+    from services.sales_channel import reclassify_channels
+
+    a = _sale(admin_id, "CH-T-0001", "Keeta", 50)
+    b = _sale(admin_id, "CH-T-0002", "كيتا", 30)
+    c = _sale(admin_id, "CH-T-0003", "Walk-in Ali", 20, channel="")
+    reclassify_channels(only_missing=True)
+    db.session.commit()
+    got = dict(db.session.query(SalesInvoice.id, SalesInvoice.channel).filter(SalesInvoice.id.in_([a.id, b.id, c.id])).all())
+    assert got == {a.id: "keeta", b.id: "keeta", c.id: ""}
+
+    client = app_context.test_client()
+    res = client.get("/api/reports/customer-sales?customers=keeta&start_date=2018-03-01&end_date=2018-03-31").get_json()
+    assert res["ok"] is True
+    assert {r["customer"] for r in res["rows"]} == {"Keeta", "كيتا"}
+    assert sum(s["total"] for s in res["summary"]) == pytest.approx(80)
+    assert {s["channel"] for s in res["summary"]} == {"keeta"}
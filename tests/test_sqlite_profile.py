@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+وضع أداء SQLite: اختياري عبر SQLITE_PERFORMANCE، pool قابل لإعادة الاستخدام، وPRAGMAs (WAL, synchronous=NORMAL, ...)
+تُطبَّق على كل اتصال جديد.
+"""
+from __future__ import annotations
+
+
+def test_profile_is_opt_in(monkeypatch):
+    from sqlalchemy.pool import NullPool, QueuePool
+    from config import _engine_options_for
+
+    monkeypatch.delenv('SQLITE_PERFORMANCE', raising=False)
+    assert _engine_options_for('sqlite:///x.db')['poolclass'] is NullPool
+
+    monkeypatch.setenv('SQLITE_PERFORMANCE', '1')
+    monkeypatch.setenv('GUNICORN_THREADS', '4')
+    monkeypatch.setenv('SQLITE_BUSY_TIMEOUT_MS', '2500')
+    opts = _engine_options_for('sqlite:///x.db')
+    assert opts['poolclass'] is QueuePool and opts['pool_size'] == 4
+    assert opts['connect_args'] == {'check_same_thread': False, 'timeout': 2.5}
+    assert _engine_options_for('sqlite:///:memory:')['poolclass'] is NullPool
+
+
+def test_pragmas_applied_on_connect(tmp_path, monkeypatch):
+    from flask import Flask
+    from sqlalchemy import text
+    from config import _engine_options_for, _sqlite_pragmas
+    from extensions import db
+    from app.sqlite_tuning import register_sqlite_tuning
+
+    monkeypatch.setenv('SQLITE_PERFORMANCE', '1')
+    monkeypatch.setenv('SQLITE_CACHE_SIZE_KB', '8192')
+    uri = 'sqlite:///' + str(tmp_path / 'perf.db')
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=uri, SQLALCHEMY_ENGINE_OPTIONS=_engine_options_for(uri),
+        SQLITE_PERFORMANCE=True, SQLITE_PRAGMAS=_sqlite_pragmas(),
+    )
+    db.init_app(app)
+    assert register_sqlite_tuning(app) is True
+    assert register_sqlite_tuning(app) is True  # لا تسجيل مكرر
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            got = {name: conn.execute(text(f'PRAGMA {name}')).scalar()
+                   for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'temp_store')}
+        db.engine.dispose()
+    # synchronous: NORMAL=1؛ temp_store: MEMORY=2
+    assert got == {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'cache_size': -8192,
+                   'temp_store': 2}
+
+
+def test_tuning_skipped_when_disabled(tmp_path):
+    from flask import Flask
+    from extensions import db
+    from app.sqlite_tuning import register_sqlite_tuning
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'plain.db'), SQLITE_PERFORMANCE=False)
+    db.init_app(app)
+    assert register_sqlite_tuning(app) is False
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+ميزانية بدء التطبيق: create_app لا يلمس قاعدة البيانات (لا DDL ولا استعلامات)، ويبقى ضمن زمن محدد،
+واستيراد الحزمة app لا يبني تطبيقاً ما لم يُطلب app.app صراحةً.
+"""
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# بعد تحميل الوحدات: بناء التطبيق (إعداد + تسجيل Blueprints) فقط
+CREATE_APP_BUDGET_S = 1.5
+# عملية جديدة: استيراد المكتبات والوحدات + create_app
+COLD_START_BUDGET_S = 8.0
+
+
+def test_create_app_runs_no_sql_and_fits_budget(test_app):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import create_app
+
+    statements = []
+
+    def _count(conn, cursor, statement, params, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', _count)
+    try:
+        t0 = time.perf_counter()
+        app2 = create_app()
+        elapsed = time.perf_counter() - t0
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _count)
+
+    assert statements == []
+    assert elapsed < CREATE_APP_BUDGET_S, f"create_app took {elapsed:.2f}s"
+    assert 'ensure-schema' in app2.cli.commands
+
+
+def test_package_import_does_not_build_app():
+    code = (
+        "import sys, time; sys.path.insert(0, %r); t = time.perf_counter(); "
+        "import app, app.routes; assert app._default_app is None; "
+        "a = app.create_app(); print(time.perf_counter() - t)" % ROOT
+    )
+    env = dict(os.environ, ENSURE_SCHEMA_ON_STARTUP='0')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=120, env=env, cwd=ROOT)
+    assert out.returncode == 0, out.stderr[-2000:]
+    elapsed = float(out.stdout.strip().splitlines()[-1])
+    assert elapsed < COLD_START_BUDGET_S, f"cold start took {elapsed:.2f}s"
+
+
+def test_ensure_schema_creates_missing_tables(test_app):
+    from sqlalchemy import inspect
+    from app import db
+    from app.schema_fixups import ensure_schema
+
+    with test_app.app_context():
+        db.session.remove()
+        from models import PayrollMonthSummary
+        PayrollMonthSummary.__table__.drop(db.engine)
+        assert 'payroll_month_summaries' not in inspect(db.engine).get_table_names()
+        done = ensure_schema()
+        assert 'create_all' in done
+        assert not [d for d in done if 'failed' in d]
+        assert 'payroll_month_summaries' in inspect(db.engine).get_table_names()
+
+
+def test_ensure_schema_leaves_data_backfills_to_their_own_step(test_app, monkeypatch):
+    import app.schema_fixups as fixups
+
+    calls = []
+    monkeypatch.setattr(fixups, '_reclassify_sales_channels', lambda done: calls.append('channels'))
+    monkeypatch.setattr(fixups, '_backfill_settlements', lambda done: calls.append('settlements'))
+    with test_app.app_context():
+        fixups.ensure_schema()
+        assert calls == []
+        assert fixups.backfill_data() == []
+    assert calls == ['channels', 'settlements']
+
+
+def test_pos_endpoints_skip_warmup_and_admin_warmup_runs(admin_client):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import app.routes as routes
+
+    routes._DB_WARMED_UP = False
+
+    statements = []
+
+    def _count(conn, cursor, statement, params, context, executemany):
+        statements.append(statement.strip().split()[0].upper())
+
+    event.listen(Engine, 'before_cursor_execute', _count)
+    try:
+        assert admin_client.get('/api/menu/all-items').status_code == 200
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _count)
+    assert not {'CREATE', 'ALTER', 'PRAGMA'} & set(statements)
+    assert routes._DB_WARMED_UP is False
+
+    r = admin_client.post('/admin/warmup')
+    assert r.status_code == 200
+    assert 'create_all' in r.get_json()['steps']
+    assert routes._DB_WARMED_UP is True
+
+
+def test_page_fallback_is_a_flag_check(test_app, monkeypatch):
+    import app.routes as routes
+    import app.schema_fixups as fixups
+
+    calls = []
+    monkeypatch.setattr(fixups, 'ensure_schema', lambda: calls.append('schema') or [])
+    monkeypatch.setattr(fixups, 'backfill_data', lambda: calls.append('backfill') or [])
+    monkeypatch.setattr(routes, 'seed_chart_of_accounts', lambda: calls.append('coa'))
+    monkeypatch.setattr(routes, 'seed_menu_if_empty', lambda: calls.append('menu'))
+    monkeypatch.setattr(routes, '_DB_WARMED_UP', False)
+    with test_app.app_context():
+        routes.warmup_db_once()
+        routes.warmup_db_once()
+        assert calls == []
+        fixups.warmup()
+    assert calls == ['schema', 'backfill', 'menu', 'coa']
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+كاش القوائم المحسوبة: العرض والطباعة والتصدير لنفس (القائمة، الفترة، الفرع) تشترك في حساب واحد
+ولا تعيد الاستعلام عن القيود، وأي ترحيل جديد يُسقط النتيجة.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import uuid
+from datetime import date
+
+
+def _account(code, typ):
+    from app import db
+    from models import Account
+    a = Account.query.filter_by(code=code).first()
+    if not a:
+        a = Account(code=code, name=code, type=typ)
+        db.session.add(a)
+        db.session.flush()
+    return a
+
+
+def _post(d, lines):
+    from app import db
+    from models import JournalEntry, JournalLine
+    total = sum(dr for _, dr, _ in lines)
+    je = JournalEntry(entry_number=f"STC-{uuid.uuid4().hex[:10]}", date=d, description='statement cache',
+                      status='posted', total_debit=total, total_credit=total)
+    db.session.add(je)
+    db.session.flush()
+    for i, (acc, dr, cr) in enumerate(lines, 1):
+        db.session.add(JournalLine(journal_id=je.id, line_no=i, account_id=acc.id, debit=dr, credit=cr,
+                                   description='x', line_date=d))
+    db.session.commit()
+
+
+def _gl_queries(fn):
+    from sqlalchemy import event
+    from extensions import db
+    seen = []
+
+    def _before(conn, cursor, statement, params, context, executemany):
+        if statement.lstrip().lower().startswith('select') and 'journal_lines' in statement.lower():
+            seen.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _before)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _before)
+    return result, len(seen)
+
+
+def _csv_value(text, label):
+    for row in csv.reader(io.StringIO(text)):
+        if row and row[0] == label:
+            return float(row[1])
+    raise AssertionError(label)
+
+
+def test_income_statement_variants_share_one_computation(admin_client):
+    d = date(2034, 3, 10)
+    _post(d, [(_account('1111', 'ASSET'), 300, 0), (_account('4120', 'REVENUE'), 0, 300)])
+    qs = "period=custom&start_date=2034-03-01&end_date=2034-03-31"
+
+    r, n = _gl_queries(lambda: admin_client.get(f"/financials/income_statement?embed=1&{qs}"))
+    assert r.status_code == 200 and n > 0
+    r, n = _gl_queries(lambda: admin_client.get(f"/financials/print/income_statement?{qs}"))
+    assert r.status_code == 200 and n == 0
+    r, n = _gl_queries(lambda: admin_client.get(f"/financials/export/income_statement?{qs}"))
+    assert r.status_code == 200 and n == 0
+    assert _csv_value(r.get_data(as_text=True), 'Revenue') == 300
+
+    _post(d, [(_account('1111', 'ASSET'), 45, 0), (_account('4120', 'REVENUE'), 0, 45)])
+    r = admin_client.get(f"/financials/export/income_statement?{qs}")
+    assert _csv_value(r.get_data(as_text=True), 'Revenue') == 345
+
+
+def test_trial_balance_variants_share_one_rollup(admin_client):
+    _post(date(2034, 5, 2), [(_account('1112', 'ASSET'), 80, 0), (_account('2111', 'LIABILITY'), 0, 80)])
+
+    r, n = _gl_queries(lambda: admin_client.get("/financials/api/trial_balance_json?date=2034-12-31"))
+    assert r.status_code == 200 and n > 0
+    for url in ("/financials/print/trial_balance?date=2034-12-31",
+                "/financials/export/trial_balance?date=2034-12-31",
+                "/financials/trial_balance?embed=1&date=2034-12-31"):
+        r, n = _gl_queries(lambda: admin_client.get(url))
+        assert r.status_code == 200 and n == 0, url
+
+    before = admin_client.get("/financials/api/trial_balance_json?date=2034-12-31").get_json()['total_debit']
+    _post(date(2034, 5, 3), [(_account('1112', 'ASSET'), 20, 0), (_account('2111', 'LIABILITY'), 0, 20)])
+    after = admin_client.get("/financials/api/trial_balance_json?date=2034-12-31").get_json()['total_debit']
+    assert round(after - before, 2) == 20
+
+
+def test_income_statement_channels_from_stored_column(app_context, admin_id):
+    from app import db
+    from models import SalesInvoice
+    from routes.financials import _compute_income_statement
+
+    on = date(2032, 4, 10)
+    for n, (name, ch, total) in enumerate((("Walk-in", "keeta", 100), ("Keeta rider", "", 40), ("Legacy", None, 10))):
+        db.session.add(SalesInvoice(
+            invoice_number=f"STC-CH-{n}", date=on, payment_method="CASH", branch="china_town", customer_name=name,
+            channel=ch, total_before_tax=total, tax_amount=0, discount_amount=0, total_after_tax_discount=total,
+            status="paid", user_id=admin_id,
+        ))
+    db.session.commit()
+
+    data = _compute_income_statement(on, on, 'china_town')
+    chans = data['branch_channels']['china_town']
+    assert (chans['keeta']['gross'], chans['keeta']['count']) == (100, 1)
+    assert (chans['offline']['gross'], chans['offline']['count']) == (50, 2)
+    assert data['branch_totals']['china_town']['gross'] == 150
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات دفتر المخزون: المتوسط المرجّح الجاري، الرصيد حتى تاريخ، وتكلفة المبيعات.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def test_weighted_average_and_stock_as_of(app_context):
+    from app import db
+    from models import RawMaterial, StockMovement
+    from services.stock_ledger import (record_movement, stock_as_of, cogs_between,
+                                       MOVEMENT_PURCHASE, MOVEMENT_SALE)
+
+    rm = RawMaterial(name="Ledger Oil", unit="liter", cost_per_unit=0, stock_quantity=0)
+    db.session.add(rm)
+    db.session.flush()
+    record_movement(rm, 10, MOVEMENT_PURCHASE, unit_cost=5, on_date=date(2023, 3, 1), ref_type='purchase', ref_id=1)
+    record_movement(rm, 10, MOVEMENT_PURCHASE, unit_cost=7, on_date=date(2023, 3, 10), ref_type='purchase', ref_id=2)
+    assert float(rm.cost_per_unit) == pytest.approx(6)
+    mv = record_movement(rm, -4, MOVEMENT_SALE, on_date=date(2023, 3, 15), ref_type='sales', ref_id=3)
+    db.session.commit()
+
+    assert float(rm.stock_quantity) == pytest.approx(16)
+    assert float(rm.cost_per_unit) == pytest.approx(6)
+    assert float(mv.total_cost) == pytest.approx(-24)
+    assert stock_as_of(date(2023, 3, 5), [rm.id]) == {rm.id: pytest.approx(10)}
+    assert stock_as_of(date(2023, 3, 31), [rm.id]) == {rm.id: pytest.approx(16)}
+    assert cogs_between(date(2023, 3, 1), date(2023, 3, 31)) >= 24
+    assert StockMovement.query.filter_by(raw_material_id=rm.id).count() == 3
+
+
+def test_cost_edit_sets_average_instead_of_blending(admin_client):
+    from app import db
+    from models import RawMaterial, StockMovement
+    from services.stock_ledger import MOVEMENT_REVALUATION
+
+    rm = RawMaterial(name="Ledger Flour", unit="kg", cost_per_unit=4, stock_quantity=10, active=True)
+    db.session.add(rm)
+    db.session.commit()
+
+    r = admin_client.post("/raw-materials", data={'action': 'bulk_update_quantities',
+                                                  f'qty_{rm.id}': '5', f'cost_{rm.id}': '6'})
+    assert r.status_code in (200, 302)
+    db.session.refresh(rm)
+    assert float(rm.stock_quantity) == pytest.approx(15)
+    assert float(rm.cost_per_unit) == pytest.approx(6)
+    mv = StockMovement.query.filter_by(raw_material_id=rm.id, movement_type=MOVEMENT_REVALUATION).one()
+    assert float(mv.quantity) == 0
+    assert float(mv.total_cost) == pytest.approx(30)
+
+    admin_client.post("/raw-materials", data={'action': 'bulk_update_quantities', f'cost_{rm.id}': '5'})
+    db.session.refresh(rm)
+    assert float(rm.stock_quantity) == pytest.approx(15)
+    assert float(rm.cost_per_unit) == pytest.approx(5)
+
+
+def test_quantities_as_of_and_intelligence_screen(admin_client):
+    from app import db
+    from models import RawMaterial
+    from services.stock_ledger import record_movement, quantities_as_of, MOVEMENT_PURCHASE, MOVEMENT_SALE
+
+    moved = RawMaterial(name="Ledger Sugar", unit="kg", cost_per_unit=0, stock_quantity=0, active=True)
+    still = RawMaterial(name="Ledger Salt", unit="kg", cost_per_unit=1, stock_quantity=7, active=True)
+    db.session.add_all([moved, still])
+    db.session.flush()
+    record_movement(moved, 12, MOVEMENT_PURCHASE, unit_cost=2, on_date=date(2023, 5, 1))
+    record_movement(moved, -5, MOVEMENT_SALE, on_date=date(2023, 6, 2))
+    db.session.commit()
+
+    assert quantities_as_of(date(2023, 4, 30), [moved, still]) == {moved.id: 0.0, still.id: 7.0}
+    assert quantities_as_of(date(2023, 5, 31), [moved, still]) == {moved.id: 12.0, still.id: 7.0}
+    assert quantities_as_of(date(2023, 6, 30), [moved])[moved.id] == pytest.approx(7)
+
+    r = admin_client.get("/inventory-intelligence")
+    assert r.status_code == 200
+    assert 'COGS' in r.get_data(as_text=True)
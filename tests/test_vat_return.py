@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات إقرار الضريبة: التجميع بمرور واحد، ولقطات الأرباع المنتهية وإبطالها.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+
+def _add_sale(uid, number, d, base, tax, branch="china_town"):
+    from app import db
+    from models import SalesInvoice
+    inv = SalesInvoice(
+        invoice_number=number, date=d, payment_method="CASH", branch=branch,
+        total_before_tax=base, tax_amount=tax, discount_amount=0,
+        total_after_tax_discount=base + tax, status="paid", user_id=uid,
+    )
+    db.session.add(inv)
+    db.session.commit()
+    return inv
+
+
+def test_vat_return_buckets_and_snapshot(app_context, admin_id):
+    from models import VatReturnSnapshot
+    from services.vat_return import compute_vat_return, get_vat_return, quarter_bounds
+
+    start, end = quarter_bounds(2019, 2)
+    before = compute_vat_return(start, end)
+    _add_sale(admin_id, "VAT-T-0001", date(2019, 5, 10), 100, 15)
+    _add_sale(admin_id, "VAT-T-0002", date(2019, 5, 11), 40, 0, branch="place_india")
+
+    first = get_vat_return(start, end)
+    assert first["sales_standard_base"] - before["sales_standard_base"] == pytest.approx(100)
+    assert first["sales_standard_vat"] - before["sales_standard_vat"] == pytest.approx(15)
+    assert first["sales_zero_base"] - before["sales_zero_base"] == pytest.approx(40)
+    assert first["sales_place_india_base"] - before["sales_place_india_base"] == pytest.approx(40)
+    assert first["output_vat"] == first["sales_standard_vat"]
+    assert VatReturnSnapshot.query.filter_by(year=2019, quarter=2, branch="all").count() == 1
+
+    # فاتورة جديدة في الربع المنتهي تحذف اللقطة، والطلب التالي يعيد الحساب
+    _add_sale(admin_id, "VAT-T-0003", date(2019, 6, 1), 200, 30)
+    assert VatReturnSnapshot.query.filter_by(year=2019, quarter=2).count() == 0
+    second = get_vat_return(start, end)
+    assert second["sales_standard_base"] - first["sales_standard_base"] == pytest.approx(200)
+
+
+def test_vat_return_open_period_not_snapshotted(app_context):
+    from models import VatReturnSnapshot
+    from services.vat_return import get_vat_return, quarter_bounds, quarter_of
+
+    today = date.today()
+    start, end = quarter_bounds(*quarter_of(today))
+    get_vat_return(start, end)
+    y, q = quarter_of(today)
+    assert VatReturnSnapshot.query.filter_by(year=y, quarter=q).count() == 0
+
+
+def test_snapshot_leaves_caller_session_alone_and_journal_is_live(app_context):
+    import uuid
+    from app import db
+    from models import Account, JournalEntry, JournalLine, VatReturnSnapshot
+    from services.vat_return import get_vat_return, quarter_bounds
+
+    start, end = quarter_bounds(2019, 3)
+    # تعديل معلّق لدى المستدعي لا يُحفظ ولا يُلغى بقراءة الإقرار
+    pending = Account(code='T-VAT-PENDING', name='pending', type='ASSET')
+    db.session.add(pending)
+    first = get_vat_return(start, end)
+    assert pending in db.session.new
+    db.session.rollback()
+    assert Account.query.filter_by(code='T-VAT-PENDING').count() == 0
+    assert VatReturnSnapshot.query.filter_by(year=2019, quarter=3, branch="all").count() == 1
+
+    vat = Account.query.filter_by(code='2141').first()
+    if vat is None:
+        vat = Account(code='2141', name='Output VAT', type='LIABILITY')
+        db.session.add(vat)
+        db.session.flush()
+    cash = Account.query.filter_by(code='1111').first()
+    if cash is None:
+        cash = Account(code='1111', name='Cash', type='ASSET')
+        db.session.add(cash)
+        db.session.flush()
+    d = date(2019, 8, 3)
+    je = JournalEntry(entry_number=f"VAT-J-{uuid.uuid4().hex[:8]}", date=d, description='vat adj',
+                      status='posted', total_debit=12, total_credit=12)
+    db.session.add(je)
+    db.session.flush()
+    db.session.add_all([
+        JournalLine(journal_id=je.id, line_no=1, account_id=cash.id, debit=12, credit=0, description='d', line_date=d),
+        JournalLine(journal_id=je.id, line_no=2, account_id=vat.id, debit=0, credit=12, description='c', line_date=d),
+    ])
+    db.session.commit()
+
+    second = get_vat_return(start, end)
+    assert second["journal_vat_out"] - first["journal_vat_out"] == pytest.approx(12)
+    assert second["sales_standard_base"] == first["sales_standard_base"]
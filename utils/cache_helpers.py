@@ -1,7 +1,12 @@
 # Phase 3 – Cache helpers. TTLs: settings 10min, COA 15min, VAT 5min, reports preview 2min.
+# Tagged entries (tagged_get/tagged_set): each entry stores the versions of its tags; writers bump tag
+# versions (services/cache_tags.py on commit) so entries are stale immediately and TTLs can be hours.
 from __future__ import annotations
 
 import json
+import os
+import time
+from datetime import date
 from types import SimpleNamespace
 
 SETTINGS_TTL = 600       # 10 min
@@ -14,6 +19,23 @@ COA_CACHE_KEY = "coa"
 VAT_CACHE_KEY_PREFIX = "vat:"
 REPORTS_PREVIEW_KEY_PREFIX = "rprev:"
 
+# Tagged entries live until a tag is bumped; the TTL only bounds memory
+TAGGED_TTL = 6 * 3600    # 6 h
+TAG_VERSION_PREFIX = "tagv:"
+MONTH_TAGS_MAX = 36
+
+# Tags bumped by services/cache_tags.py
+TAG_GL = "gl"                  # + "gl:YYYY-MM" per journal month
+TAG_COA = "coa"
+TAG_SETTINGS = "settings"
+TAG_PAYMENTS = "payments"
+TAG_INV_SALES = "inv:sales"    # + "inv:sales:YYYY-MM" per invoice month
+TAG_INV_PURCHASES = "inv:purchases"
+TAG_INV_EXPENSES = "inv:expenses"
+# "<base>:bulk": bumped with <base> by bulk query.update()/delete()/insert(), which cannot tell which months
+# they touched; month_tags() always includes it so month-scoped entries still drop on a bulk write
+BULK_TAG_SUFFIX = ":bulk"
+
 
 def _cache():
     """Use the Cache instance from extensions (Flask-Caching stores backends in extensions['cache'] dict)."""
@@ -26,22 +48,151 @@ def _cache():
         return None
 
 
+def cache_is_shared() -> bool:
+    """True when tag bumps reach every process: shared backend (redis) or a single worker."""
+    try:
+        from flask import current_app
+        ctype = str(current_app.config.get("CACHE_TYPE") or "").lower()
+    except Exception:
+        ctype = ""
+    if "redis" in ctype or "memcache" in ctype:
+        return True
+    try:
+        return int(os.getenv("WEB_CONCURRENCY") or 1) <= 1
+    except ValueError:
+        return False
+
+
+def tagged_ttl(fallback: int) -> int:
+    """TAGGED_TTL when invalidation is reliable, otherwise keep the old short TTL (per-process SimpleCache)."""
+    return TAGGED_TTL if cache_is_shared() else fallback
+
+
+def bulk_tag(base: str) -> str:
+    return base + BULK_TAG_SUFFIX
+
+
+def month_tags(base: str, start, end, max_months: int = MONTH_TAGS_MAX) -> list:
+    """["base:YYYY-MM", ..., "base:bulk"] for the months of [start, end]; [base] when open-ended or too long."""
+    if not isinstance(start, date) or not isinstance(end, date) or end < start:
+        return [base]
+    y, m = start.year, start.month
+    out = []
+    while (y, m) <= (end.year, end.month):
+        out.append(f"{base}:{y:04d}-{m:02d}")
+        if len(out) > max_months:
+            return [base]
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    out.append(bulk_tag(base))
+    return out
+
+
+def _new_version() -> int:
+    return time.time_ns()
+
+
+def tag_versions(tags) -> dict:
+    """Current version of each tag. Take it BEFORE computing the value that tagged_set will store.
+    A missing version (never bumped or evicted) gets a fresh one, so an old entry can never match it."""
+    c = _cache()
+    tags = sorted(set(tags or ()))
+    if c is None or not tags:
+        return {t: 0 for t in tags}
+    keys = [TAG_VERSION_PREFIX + t for t in tags]
+    try:
+        vals = c.get_many(*keys)
+    except Exception:
+        vals = [None] * len(keys)
+    out = {}
+    fresh = {}
+    for t, k, v in zip(tags, keys, vals):
+        if v is None:
+            v = _new_version()
+            fresh[k] = v
+        out[t] = v
+    if fresh:
+        try:
+            c.set_many(fresh, timeout=0)
+        except Exception:
+            pass
+    return out
+
+
+def bump_tags(*tags) -> None:
+    """Invalidate every tagged entry carrying any of these tags."""
+    c = _cache()
+    tags = {t for t in tags if t}
+    if c is None or not tags:
+        return
+    v = _new_version()
+    try:
+        c.set_many({TAG_VERSION_PREFIX + t: v for t in tags}, timeout=0)
+    except Exception:
+        pass
+
+
+def tagged_get(key: str):
+    """Cached value, or None if missing or any of its tags was bumped since it was stored."""
+    c = _cache()
+    if c is None:
+        return None
+    try:
+        entry = c.get(key)
+    except Exception:
+        return None
+    if not isinstance(entry, dict) or "tags" not in entry:
+        return None
+    if tag_versions(entry["tags"]) != entry["tags"]:
+        return None
+    return entry.get("data")
+
+
+def tagged_set(key: str, data, versions: dict, ttl: int = TAGGED_TTL) -> None:
+    """Store data with the tag versions read (tag_versions) before it was computed."""
+    c = _cache()
+    if c is None or data is None:
+        return
+    try:
+        c.set(key, {"tags": dict(versions), "data": data}, timeout=ttl)
+    except Exception:
+        pass
+
+
+def cached_tagged(key: str, tags, fetcher, ttl: int = TAGGED_TTL):
+    hit = tagged_get(key)
+    if hit is not None:
+        return hit
+    versions = tag_versions(tags)
+    data = fetcher()
+    tagged_set(key, data, versions, ttl)
+    return data
+
+
+_SETTINGS_FIELDS = ("id", "company_name", "tax_number", "address", "phone", "email",
+                    "vat_rate", "place_india_label", "china_town_label", "currency",
+                    "default_theme", "printer_type", "currency_image", "footer_message",
+                    "china_town_void_password", "china_town_vat_rate", "china_town_discount_rate",
+                    "china_town_phone1", "china_town_phone2", "china_town_logo_url",
+                    "place_india_void_password", "place_india_vat_rate", "place_india_discount_rate",
+                    "place_india_phone1", "place_india_phone2", "place_india_logo_url",
+                    "receipt_paper_width", "receipt_margin_top_mm", "receipt_margin_bottom_mm",
+                    "receipt_margin_left_mm", "receipt_margin_right_mm", "receipt_font_size",
+                    "receipt_show_logo", "receipt_show_tax_number", "receipt_footer_text",
+                    "receipt_logo_height", "receipt_extra_bottom_mm", "logo_url",
+                    "receipt_high_contrast", "receipt_bold_totals", "receipt_border_style", "receipt_font_bump")
+
+
 def _settings_to_dict(s):
     if s is None:
         return None
     out = {}
-    for k in ("id", "company_name", "tax_number", "address", "phone", "email",
-              "vat_rate", "place_india_label", "china_town_label", "currency",
-              "default_theme", "printer_type", "currency_image", "footer_message",
-              "china_town_void_password", "china_town_vat_rate", "china_town_discount_rate",
-              "china_town_phone1", "china_town_phone2", "china_town_logo_url",
-              "place_india_void_password", "place_india_vat_rate", "place_india_discount_rate",
-              "place_india_phone1", "place_india_phone2", "place_india_logo_url",
-              "receipt_paper_width", "receipt_margin_top_mm", "receipt_margin_bottom_mm",
-              "receipt_margin_left_mm", "receipt_margin_right_mm", "receipt_font_size",
-              "receipt_show_logo", "receipt_show_tax_number", "receipt_footer_text",
-              "receipt_logo_height", "receipt_extra_bottom_mm", "logo_url",
-              "receipt_high_contrast", "receipt_bold_totals", "receipt_border_style", "receipt_font_bump"):
+    # Every column, so the cached namespace can stand in for the row in templates and print headers
+    try:
+        cols = tuple(c.key for c in s.__table__.columns)
+    except Exception:
+        cols = ()
+    fields = cols + tuple(f for f in _SETTINGS_FIELDS if f not in cols)
+    for k in fields:
         v = getattr(s, k, None)
         if hasattr(v, "isoformat"):
             v = v.isoformat() if v else None
@@ -64,12 +215,13 @@ def get_cached_settings(ttl: int = SETTINGS_TTL):
     c = _cache()
     if c is None:
         return _fetch_settings()
-    val = c.get(SETTINGS_CACHE_KEY)
+    val = tagged_get(SETTINGS_CACHE_KEY)
     if val is not None:
         return _dict_to_settings_ns(val)
+    versions = tag_versions([TAG_SETTINGS])
     s = _fetch_settings()
     if s is not None:
-        c.set(SETTINGS_CACHE_KEY, _settings_to_dict(s), timeout=ttl)
+        tagged_set(SETTINGS_CACHE_KEY, _settings_to_dict(s), versions, tagged_ttl(ttl))
     return s
 
 
@@ -83,6 +235,11 @@ def _fetch_settings():
 
 
 def invalidate_settings_cache():
+    try:
+        from utils.request_context import clear_request_settings
+        clear_request_settings()
+    except Exception:
+        pass
     c = _cache()
     if c is not None:
         try:
@@ -95,13 +252,7 @@ def get_cached_coa(ttl: int = COA_TTL):
     c = _cache()
     if c is None:
         return _fetch_coa()
-    val = c.get(COA_CACHE_KEY)
-    if val is not None:
-        return val
-    out = _fetch_coa()
-    if out is not None:
-        c.set(COA_CACHE_KEY, out, timeout=ttl)
-    return out
+    return cached_tagged(COA_CACHE_KEY, [TAG_COA], _fetch_coa, tagged_ttl(ttl))
 
 
 def _fetch_coa():
@@ -145,37 +296,33 @@ def vat_cache_key(start_date, end_date, branch: str) -> str:
     return f"{VAT_CACHE_KEY_PREFIX}{s}:{e}:{branch or 'all'}"
 
 
-def get_cached_vat_data(key: str, fetcher, ttl: int = VAT_TTL):
+def vat_cache_tags(start_date, end_date) -> list:
+    """VAT figures come from the journal and the three invoice tables of the period, plus the VAT rate."""
+    tags = [TAG_SETTINGS]
+    for base in (TAG_GL, TAG_INV_SALES, TAG_INV_PURCHASES, TAG_INV_EXPENSES):
+        tags += month_tags(base, start_date, end_date)
+    return tags
+
+
+def get_cached_vat_data(key: str, fetcher, ttl: int = VAT_TTL, tags=None):
     c = _cache()
     if c is None:
         return fetcher()
-    val = c.get(key)
-    if val is not None:
-        return val
-    data = fetcher()
-    if data is not None:
-        try:
-            c.set(key, data, timeout=ttl)
-        except Exception:
-            pass
-    return data
+    return cached_tagged(key, tags or [TAG_GL, TAG_INV_SALES, TAG_INV_PURCHASES, TAG_INV_EXPENSES, TAG_SETTINGS],
+                         fetcher, tagged_ttl(ttl))
 
 
 def reports_preview_cache_key(inv_type: str, start_s: str, end_s: str, branch: str, pm: str) -> str:
     return f"{REPORTS_PREVIEW_KEY_PREFIX}{inv_type}:{start_s}:{end_s}:{branch or 'all'}:{pm or 'all'}"
 
 
-def get_cached_reports_preview(key: str, fetcher, ttl: int = REPORTS_PREVIEW_TTL):
+def reports_preview_tags(inv_type: str) -> list:
+    base = {"sales": TAG_INV_SALES, "purchases": TAG_INV_PURCHASES, "expenses": TAG_INV_EXPENSES}.get(inv_type)
+    return [base, TAG_PAYMENTS] if base else [TAG_INV_SALES, TAG_INV_PURCHASES, TAG_INV_EXPENSES, TAG_PAYMENTS]
+
+
+def get_cached_reports_preview(key: str, fetcher, ttl: int = REPORTS_PREVIEW_TTL, tags=None):
     c = _cache()
     if c is None:
         return fetcher()
-    val = c.get(key)
-    if val is not None:
-        return val
-    data = fetcher()
-    if data is not None:
-        try:
-            c.set(key, data, timeout=ttl)
-        except Exception:
-            pass
-    return data
+    return cached_tagged(key, tags or reports_preview_tags(""), fetcher, tagged_ttl(ttl))
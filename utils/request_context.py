@@ -0,0 +1,45 @@
+# Request-local context on flask.g: settings and the COA index are read once per request.
+# Settings come from get_cached_settings (tagged cache, dropped when Settings is committed); the COA
+# index is the process-wide immutable one from services.coa_index. Outside an app context both fall
+# back to a direct read.
+from __future__ import annotations
+
+_SETTINGS_ATTR = "_req_settings"
+_UNSET = object()
+
+
+def _g():
+    try:
+        from flask import g, has_app_context
+        return g if has_app_context() else None
+    except Exception:
+        return None
+
+
+def current_settings():
+    """Settings for this request (read-only snapshot; may be a SimpleNamespace). None if no row."""
+    g = _g()
+    if g is not None:
+        s = getattr(g, _SETTINGS_ATTR, _UNSET)
+        if s is not _UNSET:
+            return s
+    try:
+        from utils.cache_helpers import get_cached_settings
+        s = get_cached_settings()
+    except Exception:
+        s = None
+    if g is not None:
+        setattr(g, _SETTINGS_ATTR, s)
+    return s
+
+
+def clear_request_settings():
+    g = _g()
+    if g is not None:
+        g.pop(_SETTINGS_ATTR, None)
+
+
+def current_coa():
+    """Immutable {code: node} of the approved chart (services.coa_index.coa_dict)."""
+    from services.coa_index import coa_dict
+    return coa_dict()